@@ -26,6 +26,7 @@ from ZODB.POSException import ReadOnlyError
 from pyramid_zodbconn import get_connection
 
 from karl.bootstrap.interfaces import IBootstrapper
+from karl.models.catalog import report_permission_filter
 from karl.models.site import get_weighted_textrepr
 from karl.textindex import KarlPGTextIndex
 from karl.utils import find_users
@@ -33,6 +34,8 @@ from karl.utils import asbool
 from karl.utils import get_egg_rev
 from karl import renderers
 from karl.request import Request
+from karl.request import report_request_cache
+from karl.security.policy import CachingACLAuthorizationPolicy
 from karl.resources import Resources
 from karl.resources import JavaScriptResource
 import karl.includes
@@ -98,7 +101,11 @@ def configure_karl(config, load_zcml=True):
         max_age=int(settings.get('auth_max_age', 172800)),
         secure=settings.get('auth_secure', 'false') in (True, 'true', 'True')
     )
-    config.set_authorization_policy(ACLAuthorizationPolicy())
+    if asbool(settings.get('acl_cache', 'false')):
+        authorization_policy = CachingACLAuthorizationPolicy()
+    else:
+        authorization_policy = ACLAuthorizationPolicy()
+    config.set_authorization_policy(authorization_policy)
     config.set_authentication_policy(authentication_policy)
     # Static tree revisions routing
 
@@ -138,6 +145,8 @@ def configure_karl(config, load_zcml=True):
 
     if perfmetrics is not None:
         config.include(perfmetrics)
+        config.add_subscriber(report_permission_filter, NewResponse)
+        config.add_subscriber(report_request_cache, NewResponse)
 
     if isinstance(config, Configurator):
         # define css only if config is correct instance type
@@ -0,0 +1,189 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Find the events shown in the layers of a calendar.
+
+The events of all layers are found with a single catalog search, sorted on
+the ``start_date`` index, and are resolved lazily in that order, so a view
+showing only the first events of a long list loads only those.
+"""
+
+import datetime
+import heapq
+import itertools
+
+from pyramid.security import effective_principals
+from zope.component import queryAdapter
+
+from karl.content.calendar.utils import is_all_day_event
+from karl.content.interfaces import ICalendarEvent
+from karl.models.interfaces import ICatalogSearch
+from karl.models.interfaces import IVirtualData
+from karl.utils import coarse_datetime_repr
+from karl.utils import find_catalog
+
+DEFAULT_LAYER = '_default_layer_'
+
+
+class LayerEvent(object):
+    """ A calendar event as shown in one layer of a calendar.
+
+    Carries the color and title of the layer, and for the days of a
+    multi-day event in list views, the start of that day; any other
+    attribute is read from the event itself.
+    """
+    _followup = False
+
+    def __init__(self, event, layer, startDate=None):
+        self.event = event
+        self._layer = layer
+        if startDate is None:
+            startDate = event.startDate
+        self.startDate = startDate
+        self._v_layer_color = layer.color.strip()
+        self._v_layer_title = layer.title
+
+    def __getattr__(self, name):
+        return getattr(self.event, name)
+
+
+def find_layer_events(calendar, request, layers, first_moment, last_moment,
+                      in_list_view=False):
+    """ Yield a LayerEvent for each event to show in ``layers``, in order of
+    start date.
+
+    An event in several layers is shown in each of them if it is an all-day
+    event, or in list views; other events are only shown in the first of
+    their layers.  The default layer of the calendar only shows the events
+    which are in no other layer.  In list views, all-day and multi-day
+    events are split into an event for each of their days.
+    """
+    # The default layer comes last, whatever the order of the calendar.
+    layers = sorted(layers, key=lambda layer: layer.__name__ == DEFAULT_LAYER)
+    by_path = {}
+    for layer in layers:
+        for path in layer.paths:
+            path_layers = by_path.setdefault(path, [])
+            if layer not in path_layers:
+                path_layers.append(layer)
+    if not by_path:
+        return iter(())
+
+    searcher = ICatalogSearch(calendar)
+    search_params = dict(
+        allowed={'query': effective_principals(request), 'operator': 'or'},
+        interfaces=[ICalendarEvent],
+        virtual={'query': sorted(by_path), 'operator': 'or'},
+        sort_index='start_date',
+        reverse=False,
+        )
+    if first_moment or last_moment:
+        # events overlapping the period
+        begin = end = None
+        if first_moment:
+            begin = coarse_datetime_repr(first_moment)
+        if last_moment:
+            end = coarse_datetime_repr(last_moment)
+        search_params['date_range'] = (begin, end)
+    total, docids, resolver = searcher(**search_params)
+
+    events = _layer_events(docids, resolver, _get_virtual(calendar), by_path,
+                           in_list_view)
+    if in_list_view:
+        return _start_order(_split_days(events, first_moment, last_moment))
+    return itertools.chain.from_iterable(events)
+
+
+def _get_virtual(calendar):
+    # The layers of an event follow from the calendar category it is in,
+    # which is indexed as 'virtual'.
+    catalog = find_catalog(calendar)
+    index = None
+    if catalog is not None:
+        index = catalog.get('virtual')
+    rev_index = getattr(index, '_rev_index', None)
+
+    def get_virtual(docid, event):
+        if rev_index is not None:
+            virtual = rev_index.get(docid)
+            if virtual is not None:
+                return virtual
+        adapter = queryAdapter(event, IVirtualData)
+        if adapter is not None:
+            return adapter()
+
+    return get_virtual
+
+
+def _layer_events(docids, resolver, get_virtual, by_path, in_list_view):
+    # Yields a list of LayerEvents for each event, in order of start date.
+    for docid in docids:
+        event = resolver(docid)
+        if event is None:
+            continue
+        layers = by_path.get(get_virtual(docid, event), ())
+        shown = [layer for layer in layers if layer.__name__ != DEFAULT_LAYER]
+        if not shown:
+            shown = layers
+        elif not in_list_view and not is_all_day_event(event):
+            shown = shown[:1]
+        if shown:
+            yield [LayerEvent(event, layer) for layer in shown]
+
+
+def _split_days(events, first_moment, last_moment):
+    # Yields (start date, LayerEvents) for each event, with a LayerEvent for
+    # each day of the all-day and multi-day events.
+    plusone = datetime.timedelta(days=1)
+    for layer_events in events:
+        event = layer_events[0].event
+        all_day = is_all_day_event(event)
+        multi_day = event.startDate.date() != event.endDate.date()
+        if not (all_day or multi_day):
+            yield event.startDate, layer_events
+            continue
+        days = []
+        for layer_event in layer_events:
+            new_startdate = max(event.startDate, first_moment)
+            new_enddate = min(event.endDate, last_moment)
+            followup = False
+            while new_startdate < new_enddate:
+                day_event = LayerEvent(
+                    event, layer_event._layer, new_startdate)
+                day_event._followup = followup
+                days.append(day_event)
+                new_startdate += plusone
+                new_startdate = datetime.datetime.combine(
+                    new_startdate.date(), datetime.time())   # force to 0:00
+                followup = True
+        yield event.startDate, days
+
+
+def _start_order(groups):
+    # Merge the LayerEvents of events coming in order of start date into
+    # order of their own start date.  None of the events to come start
+    # before the event just seen, so anything starting by then can go.
+    heap = []
+    counter = itertools.count()
+    for start, layer_events in groups:
+        while heap and heap[0][0] <= start:
+            yield heapq.heappop(heap)[2]
+        for layer_event in layer_events:
+            heapq.heappush(
+                heap, (layer_event.startDate, next(counter), layer_event))
+    while heap:
+        yield heapq.heappop(heap)[2]
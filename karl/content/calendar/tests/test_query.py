@@ -0,0 +1,187 @@
+import datetime
+import unittest
+
+from pyramid import testing
+
+import karl.testing
+
+
+class Test_find_layer_events(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _callFUT(self, calendar, layers, first_moment=None, last_moment=None,
+                 in_list_view=False):
+        from karl.content.calendar.query import find_layer_events
+        request = testing.DummyRequest()
+        return find_layer_events(calendar, request, layers,
+                                 first_moment, last_moment, in_list_view)
+
+    def _makeCalendar(self, events):
+        # events: list of (docid, category path, start, end), by start date
+        from karl.models.interfaces import ICatalogSearch
+        from zope.interface import Interface
+        calendar = testing.DummyModel()
+        virtual = DummyIndex()
+        calendar.catalog = {'virtual': virtual}
+        objects = {}
+        for docid, path, start, end in events:
+            virtual._rev_index[docid] = path
+            objects[docid] = DummyEvent(start, end, name='event%d' % docid)
+        self.search = DummySearch([docid for docid, p, s, e in events],
+                                  objects)
+        karl.testing.registerAdapter(lambda context: self.search,
+                                     (Interface,), ICatalogSearch)
+        return calendar
+
+    def test_no_paths(self):
+        calendar = self._makeCalendar([])
+        events = self._callFUT(calendar, [DummyLayer('one', [])])
+        self.assertEqual(list(events), [])
+        self.assertEqual(self.search.kw, None)
+
+    def test_single_search(self):
+        from karl.content.interfaces import ICalendarEvent
+        calendar = self._makeCalendar([])
+        layers = [DummyLayer('one', ['/a', '/b']), DummyLayer('two', ['/a'])]
+        list(self._callFUT(calendar, layers,
+                           datetime.datetime(2010, 1, 1),
+                           datetime.datetime(2010, 2, 1)))
+        from karl.utils import coarse_datetime_repr
+        kw = self.search.kw
+        self.assertEqual(kw['virtual'], {'query': ['/a', '/b'],
+                                         'operator': 'or'})
+        self.assertEqual(kw['interfaces'], [ICalendarEvent])
+        self.assertEqual(kw['sort_index'], 'start_date')
+        self.assertEqual(kw['date_range'], (
+            coarse_datetime_repr(datetime.datetime(2010, 1, 1)),
+            coarse_datetime_repr(datetime.datetime(2010, 2, 1))))
+
+    def test_event_in_several_layers(self):
+        timed = (datetime.datetime(2010, 1, 1, 10),
+                 datetime.datetime(2010, 1, 1, 11))
+        all_day = (datetime.datetime(2010, 1, 2),
+                   datetime.datetime(2010, 1, 3))
+        calendar = self._makeCalendar([(1, '/a') + timed,
+                                       (2, '/a') + all_day])
+        layers = [DummyLayer('one', ['/a']), DummyLayer('two', ['/a'])]
+        found = [(e.__name__, e._v_layer_title)
+                 for e in self._callFUT(calendar, layers)]
+        self.assertEqual(found, [('event1', 'one'),
+                                 ('event2', 'one'), ('event2', 'two')])
+
+    def test_default_layer_last(self):
+        calendar = self._makeCalendar([
+            (1, '/a', datetime.datetime(2010, 1, 1, 10),
+                      datetime.datetime(2010, 1, 1, 11)),
+            (2, '/default', datetime.datetime(2010, 1, 1, 12),
+                            datetime.datetime(2010, 1, 1, 13)),
+        ])
+        default = DummyLayer('default', ['/a', '/default'],
+                             name='_default_layer_')
+        layers = [default, DummyLayer('one', ['/a'])]
+        found = [(e.__name__, e._v_layer_title)
+                 for e in self._callFUT(calendar, layers)]
+        self.assertEqual(found, [('event1', 'one'), ('event2', 'default')])
+
+    def test_list_view_splits_days(self):
+        calendar = self._makeCalendar([
+            (1, '/a', datetime.datetime(2009, 12, 31, 10),
+                      datetime.datetime(2010, 1, 3, 11)),
+            (2, '/a', datetime.datetime(2010, 1, 1, 12),
+                      datetime.datetime(2010, 1, 1, 13)),
+        ])
+        layers = [DummyLayer('one', ['/a'])]
+        found = [(e.__name__, e.startDate, e._followup)
+                 for e in self._callFUT(calendar, layers,
+                                        datetime.datetime(2010, 1, 1),
+                                        datetime.datetime(2010, 1, 31),
+                                        in_list_view=True)]
+        self.assertEqual(found, [
+            ('event1', datetime.datetime(2010, 1, 1), False),
+            ('event2', datetime.datetime(2010, 1, 1, 12), False),
+            ('event1', datetime.datetime(2010, 1, 2), True),
+            ('event1', datetime.datetime(2010, 1, 3), True),
+        ])
+
+    def test_resolves_lazily(self):
+        events = []
+        for i in range(10):
+            start = datetime.datetime(2010, 1, i + 1, 10)
+            events.append((i, '/a', start, start + datetime.timedelta(hours=1)))
+        calendar = self._makeCalendar(events)
+        found = self._callFUT(calendar, [DummyLayer('one', ['/a'])],
+                              in_list_view=True)
+        found.next()
+        found.next()
+        self.assertEqual(self.search.resolved, [0, 1, 2])
+
+
+class LayerEventTests(unittest.TestCase):
+
+    def _makeOne(self, event, layer, startDate=None):
+        from karl.content.calendar.query import LayerEvent
+        return LayerEvent(event, layer, startDate)
+
+    def test_it(self):
+        event = DummyEvent(datetime.datetime(2010, 1, 1),
+                           datetime.datetime(2010, 1, 2), name='event')
+        event.title = 'Title'
+        layer_event = self._makeOne(event, DummyLayer('Layer', []))
+        self.assertEqual(layer_event.title, 'Title')
+        self.assertEqual(layer_event.__name__, 'event')
+        self.assertEqual(layer_event.startDate, event.startDate)
+        self.assertEqual(layer_event._v_layer_color, 'red')
+        self.assertEqual(layer_event._v_layer_title, 'Layer')
+        self.assertEqual(layer_event._followup, False)
+
+    def test_start_date(self):
+        event = DummyEvent(datetime.datetime(2010, 1, 1),
+                           datetime.datetime(2010, 1, 3))
+        layer_event = self._makeOne(event, DummyLayer('Layer', []),
+                                    datetime.datetime(2010, 1, 2))
+        self.assertEqual(layer_event.startDate, datetime.datetime(2010, 1, 2))
+        self.assertEqual(event.startDate, datetime.datetime(2010, 1, 1))
+
+
+class DummyEvent(testing.DummyModel):
+    def __init__(self, startDate, endDate, name=None):
+        testing.DummyModel.__init__(self)
+        self.startDate = startDate
+        self.endDate = endDate
+        self.__name__ = name
+
+
+class DummyLayer(testing.DummyModel):
+    def __init__(self, title, paths, name=None):
+        testing.DummyModel.__init__(self)
+        self.title = title
+        self.color = ' red '
+        self.paths = paths
+        self.__name__ = name or title
+
+
+class DummyIndex(object):
+    def __init__(self):
+        self._rev_index = {}
+
+
+class DummySearch(object):
+    kw = None
+
+    def __init__(self, docids, objects):
+        self.docids = docids
+        self.objects = objects
+        self.resolved = []
+
+    def __call__(self, **kw):
+        self.kw = kw
+        return len(self.docids), iter(self.docids), self.resolve
+
+    def resolve(self, docid):
+        self.resolved.append(docid)
+        return self.objects[docid]
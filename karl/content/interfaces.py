@@ -197,7 +197,13 @@ class IImage(Interface):
     def thumbnail(size):
         """
         Returns resized image bound by size, which is a tuple of
-        (width, height).
+        (width, height), or None if it hasn't been rendered yet.
+        """
+
+    def render_thumbnail(size):
+        """
+        Renders and stores the resized image bound by size, unless it
+        exists already, and returns it.
         """
 
     def image():
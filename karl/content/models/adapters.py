@@ -15,9 +15,14 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import hashlib
 import re
+import time
 import zlib
 
+from BTrees.Length import Length
+from BTrees.LOBTree import LOBTree
+from BTrees.OOBTree import OOBTree
 from persistent import Persistent
 from zope.interface import implements
 from zope.component import queryUtility
@@ -32,6 +37,7 @@ from karl.content.interfaces import ICalendar
 from karl.utilities.converters.interfaces import IConverter
 from karl.utilities.converters.entities import convert_entities
 from karl.utilities.converters.stripogram import html2text
+from karl.utils import find_site
 
 
 import logging
@@ -102,32 +108,170 @@ class _CachedData(Persistent):
             data = data.decode('utf8')
         return data
 
-_MAX_CACHE_SIZE = 1 << 18  # 256kb
+# Compressed bytes of extracted text kept by the site's ExtractedTextStore.
+TEXT_STORE_MAX_BYTES = 1 << 30  # 1GB
+# An entry read again after this many seconds is moved to the back of the
+# eviction order; doing so on every read would write on every reindex.
+TEXT_STORE_TOUCH_INTERVAL = 24 * 3600
+
+
+class ExtractedTextStore(Persistent):
+    """ The text extracted from files, keyed by the hash of their content.
+
+    Kept as the ``extracted_texts`` attribute of the site, so that copies
+    and reverted versions of a file share its text, and reindexing a file
+    doesn't run its converter again.  When the compressed texts take more
+    than ``maxbytes``, the least recently used are dropped.
+    """
+
+    def __init__(self, maxbytes=TEXT_STORE_MAX_BYTES):
+        self.maxbytes = maxbytes
+        # hash -> (stamp, compressed size, _CachedData)
+        self._texts = OOBTree()
+        # stamp -> hash, least recently used first
+        self._stamps = LOBTree()
+        self._bytes = Length(0)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def bytes(self):
+        return self._bytes()
+
+    def get(self, key):
+        entry = self._texts.get(key)
+        if entry is None:
+            return None
+        stamp, size, cached = entry
+        if _now_stamp() - stamp > TEXT_STORE_TOUCH_INTERVAL * 1000000:
+            del self._stamps[stamp]
+            stamp = self._new_stamp(key)
+            self._texts[key] = (stamp, size, cached)
+        return cached.get()
+
+    def set(self, key, data):
+        self.remove(key)
+        cached = _CachedData(data)
+        size = len(cached.data)
+        self._texts[key] = (self._new_stamp(key), size, cached)
+        self._bytes.change(size)
+        while self._bytes() > self.maxbytes and self._stamps:
+            self.remove(self._stamps[self._stamps.minKey()])
+
+    def remove(self, key):
+        entry = self._texts.get(key)
+        if entry is not None:
+            stamp, size, cached = entry
+            del self._texts[key]
+            del self._stamps[stamp]
+            self._bytes.change(-size)
+
+    def _new_stamp(self, key):
+        stamp = _now_stamp()
+        while stamp in self._stamps:
+            stamp += 1
+        self._stamps[stamp] = key
+        return stamp
+
+
+def _now_stamp():
+    return long(time.time() * 1000000)
+
+
+def find_extracted_texts(context, create=False):
+    site = find_site(context)
+    texts = getattr(site, 'extracted_texts', None)
+    if texts is None and create:
+        texts = site.extracted_texts = ExtractedTextStore()
+    return texts
 
 
 def _extract_and_cache_file_data(context):
-    cached_data = getattr(context, '_extracted_data', None)
-    if isinstance(cached_data, _CachedData):
-        return cached_data.get()
+    extracted = getattr(context, '_v_extracted_data', None)
+    if extracted is not None:
+        # Set by the text extraction worker while it reindexes the file.
+        return extracted
+
+    if queryUtility(IConverter, context.mimetype) is None:
+        return ''
 
-    if not cached_data:
+    key = _content_hash(context)
+    if key is not None:
+        texts = find_extracted_texts(context)
+        if texts is not None:
+            data = texts.get(key)
+            if data is not None:
+                return data
+
+    data = _legacy_cached_data(context)
+    if data is None:
+        from karl.content.models.extraction import queue_text_extraction
+        if queue_text_extraction(context):
+            # Indexed again once the text has been extracted.
+            return ''
         data = _extract_file_data(context)
-    else:
-        # Sorry, persistence.  We were storing this as directly as a string
-        # attribute, but we'd prefer not to load it into memory if we don't
-        # have to, so we're changing these to Persistent objects.
-        data = cached_data
-        del context._extracted_data
-
-    if data and len(data) <= _MAX_CACHE_SIZE:
-        context._extracted_data = cached_data = _CachedData(data)
+
+    if data and key is not None:
+        _store_extracted_text(context, key, data)
     return data
 
 
+def _store_extracted_text(context, key, data):
+    find_extracted_texts(context, create=True).set(key, data)
+    if getattr(context, '_extracted_data', None) is not None:
+        # Moved to the store.
+        context._extracted_data = None
+
+
+def _legacy_cached_data(context):
+    # Sorry, persistence.  Text used to be cached on each file, first as a
+    # string attribute, then as a _CachedData.
+    cached_data = getattr(context, '_extracted_data', None)
+    if isinstance(cached_data, _CachedData):
+        return cached_data.get()
+    return cached_data or None
+
+
+def _content_hash(context):
+    """ Return the SHA-1 of a file's content, computing it for files
+    uploaded before it was recorded.  None if the blob can't be read.
+    """
+    key = getattr(context, 'content_hash', None)
+    if key is None:
+        filename = _blob_filename(context)
+        if not filename:
+            return None
+        digest = hashlib.sha1()
+        try:
+            with open(filename, 'rb') as f:
+                while True:
+                    data = f.read(1 << 21)
+                    if not data:
+                        break
+                    digest.update(data)
+        except IOError:
+            return None
+        key = context.content_hash = digest.hexdigest()
+    return key
+
+
 def _extract_file_data(context):
     converter = queryUtility(IConverter, context.mimetype)
     if converter is None:
         return ''
+    filename = _blob_filename(context)
+    if not filename:
+        return ''
+
+    try:
+        return _convert_file_data(converter, filename, context.mimetype)
+    except Exception:
+        # Just won't get indexed
+        log.exception("Error converting file %s" % filename)
+        return ''
+
+
+def _blob_filename(context):
     try:
         blobfile = context.blobfile
         if hasattr(blobfile, '_current_filename'):
@@ -140,19 +284,17 @@ def _extract_file_data(context):
                 filename = blobfile._p_blob_committed
             if not filename:
                 # Blob file does not exist on filesystem
-                return ''
+                return None
     except POSKeyError, why:
         if why[0] != 'No blob file':
             raise
-        return ''
+        return None
+    return filename
 
-    try:
-        stream, encoding = converter.convert(filename, encoding=None,
-                                             mimetype=context.mimetype)
-    except Exception:
-        # Just won't get indexed
-        log.exception("Error converting file %s" % filename)
-        return ''
+
+def _convert_file_data(converter, filename, mimetype):
+    stream, encoding = converter.convert(filename, encoding=None,
+                                         mimetype=mimetype)
 
     datum = stream.read(1 << 21)  # XXX dont read too much into RAM
     if encoding is not None:
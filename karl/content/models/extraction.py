@@ -0,0 +1,199 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Extract the text of uploaded files outside of the upload request.
+
+With the ``async_text_extraction`` setting on, indexing a file whose text
+hasn't been extracted yet only queues its docid; the file is indexed by
+its title until the ``extract_text`` worker has run the converter and
+reindexed its text.
+"""
+
+import logging
+import time
+
+from BTrees.IOBTree import IOBTree
+from persistent import Persistent
+from pyramid.traversal import find_resource
+from zope.component import queryUtility
+
+from karl.content.models.adapters import _blob_filename
+from karl.content.models.adapters import _content_hash
+from karl.content.models.adapters import _convert_file_data
+from karl.content.models.adapters import _store_extracted_text
+from karl.utilities.converters.interfaces import IConverter
+from karl.utils import asbool
+from karl.utils import find_catalog
+from karl.utils import find_site
+from karl.utils import get_config_setting
+
+log = logging.getLogger(__name__)
+
+# A file whose extraction failed this many times is left for an
+# administrator to requeue.
+MAX_ATTEMPTS = 5
+# Seconds to wait before the first retry; doubled for each further one.
+RETRY_DELAY = 60
+
+
+class TextExtractionQueue(Persistent):
+    """ The files waiting for their text to be extracted, by docid.
+
+    Kept as the ``text_extraction_queue`` attribute of the site.  Uploads
+    add to it concurrently with the worker removing from it; as both only
+    touch their own keys, the BTrees resolve such conflicts.
+    """
+
+    def __init__(self):
+        # docid -> (attempts, time of next attempt, last error)
+        self._pending = IOBTree()
+        # docid -> (attempts, time of last attempt, last error)
+        self._failed = IOBTree()
+
+    def add(self, docid):
+        if docid in self._failed:
+            del self._failed[docid]
+        if self._pending.get(docid) != (0, 0, None):
+            self._pending[docid] = (0, 0, None)
+
+    def due(self, now, limit=None):
+        """ Return the docids to try at time ``now``, oldest first. """
+        docids = []
+        for docid, (attempts, when, error) in self._pending.items():
+            if when <= now:
+                docids.append(docid)
+                if len(docids) == limit:
+                    break
+        return docids
+
+    def done(self, docid):
+        if docid in self._pending:
+            del self._pending[docid]
+
+    def retry_later(self, docid, error, now):
+        """ Record a failed attempt, backing off exponentially. """
+        attempts = self._pending.get(docid, (0, 0, None))[0] + 1
+        if attempts >= MAX_ATTEMPTS:
+            self.done(docid)
+            self._failed[docid] = (attempts, now, error)
+        else:
+            when = now + RETRY_DELAY * 2 ** (attempts - 1)
+            self._pending[docid] = (attempts, when, error)
+
+    def requeue(self, docid=None):
+        """ Requeue a failed docid, or all of them if ``docid`` is None. """
+        if docid is None:
+            docids = list(self._failed.keys())
+        else:
+            docids = [docid]
+        for docid in docids:
+            self.add(docid)
+
+    def pending(self):
+        return self._pending.items()
+
+    def failed(self):
+        return self._failed.items()
+
+
+def find_extraction_queue(context, create=False):
+    site = find_site(context)
+    queue = getattr(site, 'text_extraction_queue', None)
+    if queue is None and create:
+        queue = site.text_extraction_queue = TextExtractionQueue()
+    return queue
+
+
+def queue_text_extraction(context):
+    """ Queue the text extraction of a file, if extracting text is done
+    asynchronously and there is a converter for the file.
+
+    Returns True if the file was queued.
+    """
+    if not asbool(get_config_setting('async_text_extraction', 'false')):
+        return False
+    docid = getattr(context, 'docid', None)
+    if docid is None:
+        return False
+    if queryUtility(IConverter, context.mimetype) is None:
+        return False
+    find_extraction_queue(context, create=True).add(docid)
+    return True
+
+
+def extract_queued_text(site, map=map, batch_size=20, now=time.time):
+    """ Extract the text of a batch of queued files and reindex it.
+
+    ``map`` runs the conversions, e.g. the ``map`` of a thread pool to run
+    converters in parallel.  Only the ``texts`` index is updated.  Returns
+    the number of queued files handled.  The caller commits.
+    """
+    queue = find_extraction_queue(site)
+    if queue is None:
+        return 0
+    catalog = find_catalog(site)
+
+    docids = queue.due(now(), batch_size)
+    jobs = []
+    for docid in docids:
+        doc = _resolve(site, catalog, docid)
+        converter = filename = None
+        if doc is not None:
+            converter = queryUtility(IConverter, doc.mimetype)
+            filename = _blob_filename(doc)
+        if converter is None or not filename:
+            queue.done(docid)
+            continue
+        jobs.append((docid, doc, (converter, filename, doc.mimetype)))
+
+    results = map(_convert, [args for docid, doc, args in jobs])
+
+    for (docid, doc, args), (data, error) in zip(jobs, results):
+        if error is not None:
+            log.warn("Error extracting text of %s: %s", args[1], error)
+            queue.retry_later(docid, error, now())
+            continue
+        key = _content_hash(doc)
+        if data and key is not None:
+            _store_extracted_text(doc, key, data)
+        doc._v_extracted_data = data
+        try:
+            catalog.reindex_doc(docid, doc, names=('texts',))
+        finally:
+            del doc._v_extracted_data
+        queue.done(docid)
+
+    return len(docids)
+
+
+def _resolve(site, catalog, docid):
+    path = catalog.document_map.address_for_docid(docid)
+    if path is None:
+        return None
+    try:
+        return find_resource(site, path)
+    except KeyError:
+        return None
+
+
+def _convert(args):
+    # Returns (text, None) or (None, error message); runs in a pool thread.
+    converter, filename, mimetype = args
+    try:
+        return _convert_file_data(converter, filename, mimetype), None
+    except Exception, e:
+        return None, '%s: %s' % (e.__class__.__name__, e)
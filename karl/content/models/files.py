@@ -15,6 +15,7 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import hashlib
 import os
 from cStringIO import StringIO
 
@@ -103,6 +104,7 @@ class CommunityFile(Folder):
     implements(ICommunityFile)
     modified_by = None  # Sorry, persistence
     is_image = False    # Sorry, persistence
+    content_hash = None  # SHA-1 of the blob; computed on demand if None
 
     def __init__(self,
                  title=u'',
@@ -126,6 +128,10 @@ class CommunityFile(Folder):
         return PIL.Image.open(self.blobfile.open())
 
     def thumbnail(self, size):
+        assert self.is_image, "Not an image."
+        return self._thumbs.get('%dx%d' % size, None)
+
+    def render_thumbnail(self, size):
         assert self.is_image, "Not an image."
         key = '%dx%d' % size
         thumbnail = self._thumbs.get(key, None)
@@ -149,11 +155,23 @@ class CommunityFile(Folder):
 
     def upload(self, stream):
         f = self.blobfile.open('w')
-        size = upload_stream(stream, f)
+        digest = hashlib.sha1()
+        size = upload_stream(stream, f, digest)
         f.close()
         self.size = size
+        self.content_hash = digest.hexdigest()
         self._init_image()
 
+    def append(self, stream):
+        """ Append ``stream`` to the blob, e.g. a later chunk of a chunked
+        upload.  The content hash is recomputed on demand.
+        """
+        f = self.blobfile.open('a')
+        upload_stream(stream, f)
+        self.size = f.tell()
+        f.close()
+        self.content_hash = None
+
     def _check_image(self):
         if not self.mimetype.startswith('image'):
             return
@@ -195,7 +213,7 @@ class CommunityFile(Folder):
         self._extracted_data = None
 
 
-def upload_stream(stream, file):
+def upload_stream(stream, file, digest=None):
     size = 0
     while 1:
         data = stream.read(1 << 21)
@@ -203,6 +221,8 @@ def upload_stream(stream, file):
             break
         size += len(data)
         file.write(data)
+        if digest is not None:
+            digest.update(data)
     return size
 
 
@@ -283,40 +283,38 @@ class TestFileTextIndexData(unittest.TestCase):
         adapter = self._makeOne(context)
         self.assertEqual(adapter(), ('Some Title', ''))
 
-    def test_with_converter(self):
+    def _makeContext(self, data='stuff'):
         from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
+        self.converter = DummyConverter(data)
+        karl.testing.registerUtility(self.converter, IConverter, 'mimetype')
+        site = testing.DummyModel()
+        site['file'] = context = testing.DummyModel()
         context.title = 'Some Title'
         context.mimetype = 'mimetype'
         context.blobfile = DummyBlobFile()
+        context.content_hash = 'hash'
+        return context
+
+    def test_with_converter(self):
+        context = self._makeContext()
         adapter = self._makeOne(context)
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
 
     def test_cache_with_converter(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
+        context = self._makeContext()
+        converter = self.converter
         adapter = self._makeOne(context)
         self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
         self.assertEqual(converter.called, 1)
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
         self.assertEqual(converter.called, 1) # Didn't call converter again
+        texts = context.__parent__.extracted_texts
+        self.assertEqual(texts.get('hash'), 'stuff')
 
     def test_cache_with_converter_unicode(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('Per carit\xc3\xa0')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
+        context = self._makeContext('Per carit\xc3\xa0')
+        converter = self.converter
         adapter = self._makeOne(context)
         self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', u'Per carit\xe0'))
@@ -324,87 +322,181 @@ class TestFileTextIndexData(unittest.TestCase):
         self.assertEqual(adapter(), ('Some Title', u'Per carit\xe0'))
         self.assertEqual(converter.called, 1) # Didn't call converter again
 
-    @mock.patch('karl.content.models.adapters._MAX_CACHE_SIZE', 4)
-    def test_cache_with_converter_too_big(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
+    def test_cache_with_converter_large(self):
+        # No size limit on what is cached, besides the store's budget.
+        context = self._makeContext('stuff' * 100000)
+        converter = self.converter
         adapter = self._makeOne(context)
-        self.assertEqual(converter.called, 0)
-        self.assertEqual(adapter(), ('Some Title', 'stuff'))
+        self.assertEqual(adapter(), ('Some Title', 'stuff' * 100000))
+        self.assertEqual(adapter(), ('Some Title', 'stuff' * 100000))
         self.assertEqual(converter.called, 1)
+
+    def test_cache_shared_by_copies(self):
+        context = self._makeContext()
+        copy = context.__parent__['copy'] = testing.DummyModel()
+        copy.title = 'Copy'
+        copy.mimetype = 'mimetype'
+        copy.content_hash = 'hash'
+        self.assertEqual(self._makeOne(context)(), ('Some Title', 'stuff'))
+        self.assertEqual(self._makeOne(copy)(), ('Copy', 'stuff'))
+        self.assertEqual(self.converter.called, 1)
+
+    def test_cache_computes_content_hash(self):
+        import hashlib
+        import os
+        import tempfile
+        context = self._makeContext()
+        del context.content_hash
+        fd, filename = tempfile.mkstemp()
+        try:
+            os.write(fd, 'content')
+            os.close(fd)
+            context.blobfile = DummyBlobFile(filename)
+            adapter = self._makeOne(context)
+            self.assertEqual(adapter(), ('Some Title', 'stuff'))
+        finally:
+            os.remove(filename)
+        key = hashlib.sha1('content').hexdigest()
+        self.assertEqual(context.content_hash, key)
+        self.assertEqual(context.__parent__.extracted_texts.get(key),
+                         'stuff')
+
+    def test_cache_wo_content_hash(self):
+        context = self._makeContext()
+        del context.content_hash   # and the blob file can't be read
+        adapter = self._makeOne(context)
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
-        self.assertEqual(converter.called, 2) # Did call converter again
+        self.assertEqual(adapter(), ('Some Title', 'stuff'))
+        self.assertEqual(self.converter.called, 2)
+        self.failIf(hasattr(context.__parent__, 'extracted_texts'))
 
     def test_cache_with_converter_migrate(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
+        context = self._makeContext()
+        converter = self.converter
         context._extracted_data = 'somestuff'
         adapter = self._makeOne(context)
         self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', 'somestuff'))
         self.assertEqual(converter.called, 0) # Didn't call converter
-        self.assertTrue(context._extracted_data != 'somestuff')
+        self.assertEqual(context._extracted_data, None)
         self.assertEqual(adapter(), ('Some Title', 'somestuff'))
         self.assertEqual(converter.called, 0) # Still didn't call converter
 
-    def test_cache_with_converter_migrate_unicode(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
-        context._extracted_data = u'Per carit\xe0'
+    def test_cache_with_converter_migrate_cached_data(self):
+        from karl.content.models.adapters import _CachedData
+        context = self._makeContext()
+        converter = self.converter
+        context._extracted_data = _CachedData(u'Per carit\xe0')
         adapter = self._makeOne(context)
-        self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', u'Per carit\xe0'))
-        self.assertEqual(converter.called, 0) # Didn't call converter
-        self.assertTrue(context._extracted_data != u'Per carit\xe0')
+        self.assertEqual(context._extracted_data, None)
         self.assertEqual(adapter(), ('Some Title', u'Per carit\xe0'))
-        self.assertEqual(converter.called, 0) # Still didn't call converter
+        self.assertEqual(converter.called, 0) # Didn't call converter
 
-    def test_cache_with_converter_context_edited(self):
-        from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('stuff')
-        karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
-        context.title = 'Some Title'
-        context.mimetype = 'mimetype'
-        context.blobfile = DummyBlobFile()
+    def test_cache_with_converter_content_changed(self):
+        context = self._makeContext()
+        converter = self.converter
         adapter = self._makeOne(context)
         self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
         self.assertEqual(converter.called, 1)
-        # simulate file field edited
+        # simulate a new file uploaded
         context._extracted_data = None
+        context.content_hash = 'newhash'
         self.assertEqual(adapter(), ('Some Title', 'stuff'))
         self.assertEqual(converter.called, 2)
 
     def test_cache_with_converter_empty_string(self):
+        context = self._makeContext('')
+        converter = self.converter
+        adapter = self._makeOne(context)
+        self.assertEqual(converter.called, 0)
+        self.assertEqual(adapter(), ('Some Title', ''))
+        self.assertEqual(converter.called, 1)
+        self.assertEqual(adapter(), ('Some Title', ''))
+        self.assertEqual(converter.called, 2)
+
+    def test_async_queues_extraction(self):
+        from pyramid.interfaces import ISettings
         from karl.utilities.converters.interfaces import IConverter
-        converter = DummyConverter('')
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(async_text_extraction='true'),
+            ISettings)
+        converter = DummyConverter('stuff')
         karl.testing.registerUtility(converter, IConverter, 'mimetype')
-        context = testing.DummyModel()
+        site = testing.DummyModel()
+        site['file'] = context = testing.DummyModel(docid=1)
         context.title = 'Some Title'
         context.mimetype = 'mimetype'
         context.blobfile = DummyBlobFile()
         adapter = self._makeOne(context)
-        self.assertEqual(converter.called, 0)
         self.assertEqual(adapter(), ('Some Title', ''))
-        self.assertEqual(converter.called, 1)
-        self.assertEqual(adapter(), ('Some Title', ''))
-        self.assertEqual(converter.called, 2)
+        self.assertEqual(converter.called, 0)
+        self.assertEqual(site.text_extraction_queue.due(0), [1])
+
+    def test_extracted_by_worker(self):
+        context = testing.DummyModel()
+        context.title = 'Some Title'
+        context._v_extracted_data = 'stuff'
+        adapter = self._makeOne(context)
+        self.assertEqual(adapter(), ('Some Title', 'stuff'))
+
+class ExtractedTextStoreTests(unittest.TestCase):
+
+    def _makeOne(self, maxbytes=1000):
+        from karl.content.models.adapters import ExtractedTextStore
+        return ExtractedTextStore(maxbytes)
+
+    def test_get_and_set(self):
+        store = self._makeOne()
+        self.assertEqual(store.get('a'), None)
+        store.set('a', 'text')
+        store.set('b', u'Per carit\xe0')
+        self.assertEqual(store.get('a'), 'text')
+        self.assertEqual(store.get('b'), u'Per carit\xe0')
+        self.assertEqual(len(store), 2)
+
+    def test_set_replaces(self):
+        store = self._makeOne()
+        store.set('a', 'text')
+        size = store.bytes()
+        store.set('a', 'other text')
+        self.assertEqual(store.get('a'), 'other text')
+        self.assertEqual(len(store), 1)
+        self.assertEqual(len(store._stamps), 1)
+        self.failIf(store.bytes() == size)
+
+    def test_remove(self):
+        store = self._makeOne()
+        store.set('a', 'text')
+        store.remove('a')
+        store.remove('b')
+        self.assertEqual(store.get('a'), None)
+        self.assertEqual(store.bytes(), 0)
+        self.assertEqual(len(store._stamps), 0)
+
+    def test_evicts_least_recently_used(self):
+        import os
+        store = self._makeOne(maxbytes=2500)
+        for key in 'abc':
+            store.set(key, os.urandom(1000))   # incompressible
+        self.assertEqual(store.get('a'), None)
+        self.failIf(store.get('b') is None)
+        self.failIf(store.get('c') is None)
+        self.failUnless(store.bytes() <= 2500)
+
+    def test_get_touches_old_entries(self):
+        import os
+        store = self._makeOne(maxbytes=2500)
+        store.set('a', os.urandom(1000))
+        store.set('b', os.urandom(1000))
+        later = 'karl.content.models.adapters._now_stamp'
+        with mock.patch(later, lambda: 10 ** 18):
+            store.get('a')
+            store.set('c', os.urandom(1000))
+        self.failIf(store.get('a') is None)
+        self.assertEqual(store.get('b'), None)
+
 
 class TestCalendarEventCategoryData(unittest.TestCase):
     def setUp(self):
@@ -481,7 +573,10 @@ class DummyConverter:
         return StringIO.StringIO(self.data), 'utf8'
 
 class DummyBlobFile:
+    def __init__(self, filename='blobfile'):
+        self.filename = filename
+
     def _current_filename(self):
-        return None
+        return self.filename
 
 
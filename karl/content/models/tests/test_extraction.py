@@ -0,0 +1,208 @@
+import unittest
+
+from pyramid import testing
+
+import karl.testing
+
+
+class TextExtractionQueueTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from karl.content.models.extraction import TextExtractionQueue
+        return TextExtractionQueue()
+
+    def test_add_and_due(self):
+        queue = self._makeOne()
+        queue.add(2)
+        queue.add(1)
+        self.assertEqual(queue.due(0), [1, 2])
+        self.assertEqual(queue.due(0, limit=1), [1])
+        self.assertEqual(list(queue.pending()),
+                         [(1, (0, 0, None)), (2, (0, 0, None))])
+
+    def test_done(self):
+        queue = self._makeOne()
+        queue.add(1)
+        queue.done(1)
+        queue.done(2)
+        self.assertEqual(queue.due(0), [])
+
+    def test_retry_later_backs_off(self):
+        from karl.content.models.extraction import RETRY_DELAY
+        queue = self._makeOne()
+        queue.add(1)
+        queue.retry_later(1, 'Error', 1000)
+        self.assertEqual(queue.due(1000), [])
+        self.assertEqual(queue.due(1000 + RETRY_DELAY), [1])
+        queue.retry_later(1, 'Error again', 2000)
+        self.assertEqual(list(queue.pending()),
+                         [(1, (2, 2000 + 2 * RETRY_DELAY, 'Error again'))])
+
+    def test_retry_later_gives_up(self):
+        from karl.content.models.extraction import MAX_ATTEMPTS
+        queue = self._makeOne()
+        queue.add(1)
+        for i in range(MAX_ATTEMPTS):
+            queue.retry_later(1, 'Error', 1000)
+        self.assertEqual(list(queue.pending()), [])
+        self.assertEqual(list(queue.failed()),
+                         [(1, (MAX_ATTEMPTS, 1000, 'Error'))])
+        queue.add(1)
+        self.assertEqual(list(queue.failed()), [])
+        self.assertEqual(queue.due(0), [1])
+
+    def test_requeue(self):
+        from karl.content.models.extraction import MAX_ATTEMPTS
+        queue = self._makeOne()
+        for docid in (1, 2, 3):
+            queue.add(docid)
+            for i in range(MAX_ATTEMPTS):
+                queue.retry_later(docid, 'Error', 1000)
+        queue.requeue(2)
+        self.assertEqual(queue.due(0), [2])
+        queue.requeue()
+        self.assertEqual(queue.due(0), [1, 2, 3])
+        self.assertEqual(list(queue.failed()), [])
+
+
+class Test_queue_text_extraction(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _callFUT(self, context):
+        from karl.content.models.extraction import queue_text_extraction
+        return queue_text_extraction(context)
+
+    def _makeContext(self, setting='true'):
+        from pyramid.interfaces import ISettings
+        from karl.utilities.converters.interfaces import IConverter
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(async_text_extraction=setting),
+            ISettings)
+        karl.testing.registerUtility(DummyConverter('stuff'), IConverter,
+                                     'mimetype')
+        site = testing.DummyModel()
+        site['file'] = context = testing.DummyModel(docid=1,
+                                                    mimetype='mimetype')
+        return context
+
+    def test_not_async(self):
+        context = self._makeContext('false')
+        self.failIf(self._callFUT(context))
+        self.failIf(hasattr(context.__parent__, 'text_extraction_queue'))
+
+    def test_no_docid(self):
+        context = self._makeContext()
+        context.docid = None
+        self.failIf(self._callFUT(context))
+
+    def test_no_converter(self):
+        context = self._makeContext()
+        context.mimetype = 'nonexistent'
+        self.failIf(self._callFUT(context))
+
+    def test_queued(self):
+        context = self._makeContext()
+        self.failUnless(self._callFUT(context))
+        queue = context.__parent__.text_extraction_queue
+        self.assertEqual(queue.due(0), [1])
+
+
+class Test_extract_queued_text(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _callFUT(self, site, **kw):
+        from karl.content.models.extraction import extract_queued_text
+        return extract_queued_text(site, now=lambda: 1000, **kw)
+
+    def _makeSite(self, data='stuff'):
+        from karl.content.models.extraction import TextExtractionQueue
+        from karl.utilities.converters.interfaces import IConverter
+        self.converter = DummyConverter(data)
+        karl.testing.registerUtility(self.converter, IConverter, 'mimetype')
+        site = testing.DummyModel()
+        site.catalog = DummyCatalog({1: '/file1', 2: '/file2', 3: '/file3'})
+        site['file1'] = DummyFile()
+        site['file2'] = DummyFile(blobfile=DummyBlobFile(None))
+        site['file3'] = DummyFile(mimetype='nonexistent')
+        site.text_extraction_queue = queue = TextExtractionQueue()
+        for docid in (1, 2, 3, 4):
+            queue.add(docid)
+        return site
+
+    def test_no_queue(self):
+        site = testing.DummyModel()
+        self.assertEqual(self._callFUT(site), 0)
+
+    def test_it(self):
+        site = self._makeSite()
+        mapped = []
+
+        def map(func, args):
+            mapped.extend(args)
+            return [func(arg) for arg in args]
+
+        self.assertEqual(self._callFUT(site, map=map), 4)
+        self.assertEqual(mapped, [(self.converter, 'blobfile', 'mimetype')])
+        catalog = site.catalog
+        self.assertEqual(catalog.reindexed, [(1, ('texts',), 'stuff')])
+        self.assertEqual(site.extracted_texts.get('hash'), 'stuff')
+        self.failIf(hasattr(site['file1'], '_v_extracted_data'))
+        self.assertEqual(list(site.text_extraction_queue.pending()), [])
+
+    def test_batch_size(self):
+        site = self._makeSite()
+        self.assertEqual(self._callFUT(site, batch_size=2), 2)
+        self.assertEqual(site.text_extraction_queue.due(1000), [3, 4])
+
+    def test_error(self):
+        site = self._makeSite(data=IOError('Boom'))
+        self._callFUT(site)
+        self.assertEqual(site.catalog.reindexed, [])
+        self.assertEqual(list(site.text_extraction_queue.pending()),
+                         [(1, (1, 1060, 'IOError: Boom'))])
+
+
+class DummyConverter:
+    def __init__(self, data):
+        self.data = data
+
+    def convert(self, filename, encoding=None, mimetype=None):
+        if isinstance(self.data, Exception):
+            raise self.data
+        import StringIO
+        return StringIO.StringIO(self.data), 'utf8'
+
+
+class DummyBlobFile:
+    def __init__(self, filename='blobfile'):
+        self.filename = filename
+
+    def _current_filename(self):
+        return self.filename
+
+
+class DummyFile(testing.DummyModel):
+    title = 'Title'
+    mimetype = 'mimetype'
+    content_hash = 'hash'
+
+    def __init__(self, **kw):
+        kw.setdefault('blobfile', DummyBlobFile())
+        testing.DummyModel.__init__(self, **kw)
+
+
+class DummyCatalog(karl.testing.DummyCatalog):
+    def reindex_doc(self, docid, obj, names=None):
+        from karl.content.models.adapters import _extract_and_cache_file_data
+        self.reindexed.append(
+            (docid, names, _extract_and_cache_file_data(obj)))
@@ -209,12 +209,15 @@ class CommunityFileTests(unittest.TestCase):
         verifyObject(ICommunityFile, self._makeOne())
 
     def test_instance_has_valid_construction(self):
+        import hashlib
         instance = self._makeOne()
         self.assertEqual(instance.title, u'title')
         self.assertEqual(instance.creator, u'admin')
         self.assertEqual(instance.modified_by, u'admin')
         self.assertEqual(instance.blobfile.open().read(), 'FAKECONTENT')
         self.assertEqual(instance.size, 11)
+        self.assertEqual(instance.content_hash,
+                         hashlib.sha1('FAKECONTENT').hexdigest())
         self.assertEqual(instance.mimetype, 'text/plain')
         self.assertEqual(instance.filename, 'afile.txt')
         self.failIf(instance.is_image)
@@ -222,6 +225,18 @@ class CommunityFileTests(unittest.TestCase):
         from karl.content.interfaces import IImage
         self.failIf(IImage.providedBy(instance))
 
+    def test_append(self):
+        import hashlib
+        from karl.content.models.adapters import _content_hash
+        instance = self._makeOne()
+        instance.append(DummyFile('MORE'))
+        self.assertEqual(instance.blobfile.open().read(), 'FAKECONTENTMORE')
+        self.assertEqual(instance.size, 15)
+        self.assertEqual(instance.content_hash, None)
+        key = hashlib.sha1('FAKECONTENTMORE').hexdigest()
+        self.assertEqual(_content_hash(instance), key)
+        self.assertEqual(instance.content_hash, key)
+
     def test_jpg(self):
         from karl.content.interfaces import IImage
         from pkg_resources import resource_stream
@@ -250,14 +265,17 @@ class CommunityFileTests(unittest.TestCase):
         from pkg_resources import resource_stream
         stream = resource_stream('karl.content.models.tests', 'test.jpg')
         o = self._makeOne(stream=stream, mimetype='image/jpeg')
-        thumb = o.thumbnail((200, 200))
+        self.assertEqual(o.thumbnail((200, 200)), None)
+        thumb = o.render_thumbnail((200, 200))
         self.assertEqual(thumb.image_size, (137, 200))
+        self.failUnless(o.thumbnail((200, 200)) is thumb)
+        self.failUnless(o.render_thumbnail((200, 200)) is thumb)
 
     def test_thumbnail_larger_than_original(self):
         from pkg_resources import resource_stream
         stream = resource_stream('karl.content.models.tests', 'test.jpg')
         o = self._makeOne(stream=stream, mimetype='image/jpeg')
-        thumb = o.thumbnail((1000, 1000))
+        thumb = o.render_thumbnail((1000, 1000))
         self.assertEqual(thumb.image_size, (390, 569))
 
     def test_non_rgb_thumbnail(self):
@@ -270,7 +288,7 @@ class CommunityFileTests(unittest.TestCase):
         image.save(buf, 'GIF')
         buf.seek(0)
         o = self._makeOne(stream=buf, mimetype='image/jpeg')
-        thumb = o.thumbnail((200, 200))
+        thumb = o.render_thumbnail((200, 200))
         self.assertEqual(thumb.image_size, (137, 200))
 
     def test_revert(self):
@@ -0,0 +1,120 @@
+import unittest
+
+from pyramid import testing
+
+
+class Test_standard_thumbnail_size(unittest.TestCase):
+
+    def _callFUT(self, size):
+        from karl.content.models.thumbnails import standard_thumbnail_size
+        return standard_thumbnail_size(size)
+
+    def test_standard(self):
+        self.assertEqual(self._callFUT((75, 100)), (75, 100))
+        self.assertEqual(self._callFUT((200, 200)), (200, 200))
+
+    def test_bounded(self):
+        self.assertEqual(self._callFUT((80, 80)), (85, 85))
+        self.assertEqual(self._callFUT((300, 200)), (400, 400))
+
+    def test_too_large(self):
+        self.assertEqual(self._callFUT((2000, 10)), (768, 768))
+
+
+class ThumbnailQueueTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from karl.content.models.thumbnails import ThumbnailQueue
+        return ThumbnailQueue()
+
+    def test_it(self):
+        queue = self._makeOne()
+        queue.add('one')
+        queue.add('two')
+        queue.add('three')
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.pop(2), ['one', 'two'])
+        self.assertEqual(queue.pop(2), ['three'])
+        self.assertEqual(queue.pop(2), [])
+
+
+class Test_queue_thumbnails(unittest.TestCase):
+
+    def _callFUT(self, image, event=None):
+        from karl.content.models.thumbnails import queue_thumbnails
+        return queue_thumbnails(image, event)
+
+    def test_it(self):
+        site = testing.DummyModel()
+        site['image'] = image = DummyImage()
+        self._callFUT(image)
+        self._callFUT(image)
+        self.assertEqual(site.thumbnail_queue.pop(10), [image, image])
+
+
+class Test_render_queued_thumbnails(unittest.TestCase):
+
+    def _callFUT(self, site, batch_size=20):
+        from karl.content.models.thumbnails import render_queued_thumbnails
+        return render_queued_thumbnails(site, batch_size)
+
+    def test_no_queue(self):
+        self.assertEqual(self._callFUT(testing.DummyModel()), 0)
+
+    def test_it(self):
+        from karl.content.models.thumbnails import THUMBNAIL_SIZES
+        from karl.content.models.thumbnails import queue_thumbnails
+        site = testing.DummyModel()
+        site['image'] = image = DummyImage()
+        site['broken'] = broken = DummyImage(error=IOError('Boom'))
+        site['file'] = nonimage = DummyImage()
+        nonimage.is_image = False
+        for obj in (image, broken, nonimage, image):
+            queue_thumbnails(obj, None)
+        self.assertEqual(self._callFUT(site, batch_size=3), 3)
+        self.assertEqual(image.rendered, list(THUMBNAIL_SIZES))
+        self.assertEqual(nonimage.rendered, [])
+        self.assertEqual(self._callFUT(site, batch_size=3), 1)
+        self.assertEqual(len(site.thumbnail_queue), 0)
+
+    def test_any_error_drops_image(self):
+        from karl.content.models.thumbnails import THUMBNAIL_SIZES
+        from karl.content.models.thumbnails import queue_thumbnails
+        site = testing.DummyModel()
+        site['bomb'] = bomb = DummyImage(error=DummyDecompressionBomb())
+        site['png'] = png = DummyImage(error=SyntaxError('broken PNG'))
+        site['image'] = image = DummyImage()
+        for obj in (bomb, png, image):
+            queue_thumbnails(obj, None)
+        self.assertEqual(self._callFUT(site), 3)
+        self.assertEqual(image.rendered, list(THUMBNAIL_SIZES))
+        self.assertEqual(len(site.thumbnail_queue), 0)
+
+    def test_conflict_error_propagates(self):
+        from ZODB.POSException import ConflictError
+        from karl.content.models.thumbnails import queue_thumbnails
+        site = testing.DummyModel()
+        site['image'] = image = DummyImage(error=ConflictError())
+        queue_thumbnails(image, None)
+        self.assertRaises(ConflictError, self._callFUT, site)
+
+
+class DummyDecompressionBomb(Exception):
+    # Like PIL.Image.DecompressionBombError, a plain Exception.
+    pass
+
+
+class DummyImage(testing.DummyModel):
+    is_image = True
+    filename = 'image.jpg'
+
+    def __init__(self, error=None):
+        testing.DummyModel.__init__(self)
+        self.error = error
+        self.rendered = []
+
+    def render_thumbnail(self, size):
+        if self.error is not None:
+            raise self.error
+        if size not in self.rendered:
+            self.rendered.append(size)
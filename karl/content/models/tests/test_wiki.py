@@ -59,6 +59,215 @@ class WikiTests(unittest.TestCase):
         self.failUnless(isinstance(wiki['front_page'], DummyContent))
 
 
+class WikiIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _makeOne(self):
+        from repoze.lemonade.interfaces import IContentFactory
+        from karl.content.models.wiki import Wiki
+        from karl.content.models.wiki import WikiPage
+        karl.testing.registerAdapter(lambda *arg, **kw: WikiPage, (None,),
+                                     IContentFactory)
+        return Wiki('creator')
+
+    def _makePage(self, title, text=u''):
+        from karl.content.models.wiki import WikiPage
+        return WikiPage(title, text)
+
+    def test_pages_titled(self):
+        wiki = self._makeOne()
+        wiki['one'] = self._makePage(u'One Page')
+        self.assertEqual(wiki.pages_titled(u'one page!'), [wiki['one']])
+        self.assertEqual(wiki.pages_titled(u'front page'),
+                         [wiki['front_page']])
+        self.assertEqual(wiki.pages_titled(u'two'), [])
+
+    def test_remove_unindexes(self):
+        wiki = self._makeOne()
+        wiki['one'] = self._makePage(u'one', u'((two))')
+        del wiki['one']
+        self.assertEqual(wiki.pages_titled(u'one'), [])
+        self.assertEqual(wiki.backlinks(u'two'), [])
+        self.failIf('one' in wiki._page_keys)
+
+    def test_backlinks(self):
+        wiki = self._makeOne()
+        wiki['one'] = self._makePage(u'one', u'((Two)) and ((<b>three</b>))')
+        wiki['two'] = self._makePage(u'two', u'no links')
+        self.assertEqual(wiki.backlinks(u'two'), [wiki['one']])
+        self.assertEqual(wiki.backlinks(u'three'), [wiki['one']])
+        self.assertEqual(wiki.backlinks(u'one'), [])
+
+    def test_wiki_page_modified_reindexes(self):
+        from karl.content.models.wiki import wiki_page_modified
+        wiki = self._makeOne()
+        page = wiki['one'] = self._makePage(u'one', u'((two))')
+        page.text = u'((three))'
+        page.title = u'uno'
+        wiki_page_modified(page, None)
+        self.assertEqual(wiki.backlinks(u'two'), [])
+        self.assertEqual(wiki.backlinks(u'three'), [page])
+        self.assertEqual(wiki.pages_titled(u'one'), [])
+        self.assertEqual(wiki.pages_titled(u'uno'), [page])
+
+    def test_cook_does_not_scan(self):
+        wiki = self._makeOne()
+        wiki['target'] = self._makePage(u'All Good Men')
+        page = wiki['page'] = self._makePage(u'page', u'((all good men))')
+        wiki.values = None
+        request = testing.DummyRequest()
+        self.assertEqual(page.cook(request),
+                         u'<a href="http://example.com/target/">'
+                         '<span class="wicked_resolved">all good men'
+                         '</span></a>')
+
+    def test_change_title_rewrites_backlinks_only(self):
+        wiki = self._makeOne()
+        page = wiki['page'] = self._makePage(u'replace')
+        one = wiki['one'] = self._makePage(u'one', u'hi ((replace))')
+        two = wiki['two'] = self._makePage(u'two', u'((dontreplace))')
+        two_text = two.text
+        two.text = Unreadable()
+        page.change_title(u'target')
+        two.text = two_text
+        self.assertEqual(one.text, u'hi ((target))')
+        self.assertEqual(wiki.backlinks(u'target'), [one])
+        self.assertEqual(wiki.backlinks(u'replace'), [])
+        self.assertEqual(wiki.pages_titled(u'target'), [page])
+
+    def test_change_title_duptitle(self):
+        wiki = self._makeOne()
+        page = wiki['page'] = self._makePage(u'page')
+        wiki['exists'] = self._makePage(u'exists')
+        self.assertRaises(ValueError, page.change_title, u'exists')
+
+    def test_fix_links(self):
+        wiki = self._makeOne()
+        wiki['one'] = self._makePage(u'One Page')
+        page = wiki['two'] = self._makePage(u'two', u'((one page))')
+        self.assertEqual(page.fix_links(), [(u'one page', u'One Page')])
+        self.assertEqual(wiki.backlinks(u'One Page'), [page])
+
+    def test_unindexed_wiki_scans(self):
+        wiki = self._makeOne()
+        wiki['one'] = self._makePage(u'one', u'((two))')
+        del wiki._titles, wiki._backlinks, wiki._page_keys
+        wiki['two'] = self._makePage(u'two')
+        self.assertEqual(wiki.pages_titled(u'two'), [wiki['two']])
+        self.assertEqual(len(wiki.backlinks(u'two')), 3)
+        wiki.reindex_pages()
+        self.assertEqual(wiki.backlinks(u'two'), [wiki['one']])
+
+
+class CookCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+        from karl.content.models.wiki import cooked_cache
+        cooked_cache.clear()
+
+    def tearDown(self):
+        testing.cleanUp()
+        from karl.content.models.wiki import cooked_cache
+        cooked_cache.clear()
+
+    def _makeWiki(self):
+        from repoze.lemonade.interfaces import IContentFactory
+        from karl.content.models.wiki import Wiki
+        from karl.content.models.wiki import WikiPage
+        karl.testing.registerAdapter(lambda *arg, **kw: WikiPage, (None,),
+                                     IContentFactory)
+        return Wiki('creator')
+
+    def _makePage(self, wiki, name, title, text=u''):
+        from karl.content.models.wiki import WikiPage
+        page = wiki[name] = WikiPage(title, text)
+        page._p_oid = name
+        page._p_serial = '\0' * 8
+        return page
+
+    def _cook(self, page):
+        calls = []
+        cook = page._cook
+        def _cook(chunks, request):
+            calls.append(chunks)
+            return cook(chunks, request)
+        page._cook = _cook
+        return page.cook(testing.DummyRequest()), len(calls)
+
+    def test_cached(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        first, cooked = self._cook(page)
+        self.assertEqual(cooked, 1)
+        second, cooked = self._cook(page)
+        self.assertEqual(cooked, 0)
+        self.assertEqual(first, second)
+
+    def test_not_cached_without_oid(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        page._p_oid = None
+        self._cook(page)
+        text, cooked = self._cook(page)
+        self.assertEqual(cooked, 1)
+
+    def test_text_changed(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        self._cook(page)
+        page.text = u'((two))'
+        page._p_serial = '\0' * 7 + '\1'
+        wiki.index_page(page)
+        text, cooked = self._cook(page)
+        self.assertEqual(cooked, 1)
+        self.failUnless('two' in text)
+
+    def test_linked_page_added_and_removed(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        text, cooked = self._cook(page)
+        self.failUnless('wicked_unresolved' in text)
+
+        self._makePage(wiki, 'one', u'One')
+        text, cooked = self._cook(page)
+        self.assertEqual(cooked, 1)
+        self.failUnless('http://example.com/one/' in text)
+
+        del wiki['one']
+        text, cooked = self._cook(page)
+        self.failUnless('wicked_unresolved' in text)
+
+    def test_linked_page_renamed(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        one = self._makePage(wiki, 'one', u'One')
+        self._cook(page)
+        one.change_title(u'Uno')
+        page._p_serial = '\0' * 7 + '\1'
+        text, cooked = self._cook(page)
+        self.assertEqual(cooked, 1)
+        self.assertEqual(page.text, u'((Uno))')
+
+    def test_unrelated_page_added(self):
+        wiki = self._makeWiki()
+        page = self._makePage(wiki, 'page', u'page', u'((one))')
+        self._cook(page)
+        self._makePage(wiki, 'two', u'Two')
+        text, cooked = self._cook(page)
+        self.assertEqual(cooked, 0)
+
+
+class Unreadable(object):
+    def __getattr__(self, name):
+        raise AssertionError('text of unrelated page was read')
+
+
 class WikiContainerVersionTests(unittest.TestCase):
 
     def _getTargetClass(self):
@@ -428,6 +637,9 @@ class TestWikiToolFactory(unittest.TestCase):
         self.failIf(factory.is_present(context, request))
 
 class DummyContent(object):
+    title = u'Front Page'
+    text = u''
+
     def __init__(self, *arg, **kw):
         pass
 
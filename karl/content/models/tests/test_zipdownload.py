@@ -0,0 +1,192 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyramid import testing
+
+import karl.testing
+
+
+class Test_zip_entries(unittest.TestCase):
+
+    def _callFUT(self, folder, names):
+        from karl.content.models.zipdownload import zip_entries
+        return zip_entries(folder, names)
+
+    def test_it(self):
+        folder = DummyFolder()
+        folder['a.txt'] = DummyFile('/blobs/a', 3)
+        folder['sub'] = sub = DummyFolder()
+        sub['b.jpg'] = DummyFile('/blobs/b', 5, mimetype='image/jpeg')
+        folder['c.txt'] = DummyFile('/blobs/c', 7)
+        entries, size = self._callFUT(folder, ['a.txt', 'sub'])
+        self.assertEqual(size, 8)
+        self.assertEqual([(e.path, e.filename, e.compress) for e in entries],
+                         [('a.txt', '/blobs/a', True),
+                          ('sub/b.jpg', '/blobs/b', False)])
+
+
+class Test_zip_download_key(unittest.TestCase):
+
+    def _callFUT(self, entries):
+        from karl.content.models.zipdownload import zip_download_key
+        return zip_download_key(entries)
+
+    def test_it(self):
+        from karl.utilities.zipstream import ZipEntry
+        key = self._callFUT([ZipEntry(u'caf\xe9', '/blobs/1')])
+        self.assertEqual(key, self._callFUT([ZipEntry(u'caf\xe9', '/blobs/1')]))
+        self.assertNotEqual(key,
+                            self._callFUT([ZipEntry(u'caf\xe9', '/blobs/2')]))
+
+
+class ZipDownloadQueueTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from karl.content.models.zipdownload import ZipDownloadQueue
+        return ZipDownloadQueue()
+
+    def test_it(self):
+        queue = self._makeOne()
+        queue.add('key', '/folder', ['a', 'b'])
+        queue.add('key', '/folder', ['c'])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(list(queue.pending()),
+                         [('key', ('/folder', ('a', 'b')))])
+        queue.done('key')
+        queue.done('key')
+        self.assertEqual(len(queue), 0)
+
+
+class Test_build_queued_zips(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        testing.cleanUp()
+        shutil.rmtree(self.tmpdir)
+
+    def _callFUT(self, site, directory):
+        from karl.content.models.zipdownload import build_queued_zips
+        return build_queued_zips(site, directory)
+
+    def _makeSite(self):
+        from karl.content.models.zipdownload import queue_zip_download
+        from karl.content.models.zipdownload import zip_download_key
+        from karl.content.models.zipdownload import zip_entries
+        blob = os.path.join(self.tmpdir, 'blob')
+        f = open(blob, 'wb')
+        f.write('data')
+        f.close()
+        site = testing.DummyModel()
+        site['folder'] = folder = DummyFolder()
+        folder['a.txt'] = DummyFile(blob, 4)
+        key = zip_download_key(zip_entries(folder, ['a.txt'])[0])
+        queue_zip_download(folder, ['a.txt'], key)
+        queue_zip_download(folder, ['gone'], 'gone')
+        return site, key
+
+    def test_no_queue(self):
+        self.assertEqual(self._callFUT(testing.DummyModel(), self.tmpdir), 0)
+
+    def test_it(self):
+        from zipfile import ZipFile
+        site, key = self._makeSite()
+        directory = os.path.join(self.tmpdir, 'zips')
+        self.assertEqual(self._callFUT(site, directory), 1)
+        self.assertEqual(os.listdir(directory), [key + '.zip'])
+        zipfile = ZipFile(os.path.join(directory, key + '.zip'))
+        self.assertEqual(zipfile.read('a.txt'), 'data')
+        self.assertEqual(len(site.zip_download_queue), 0)
+
+    def test_broken_archive(self):
+        site, key = self._makeSite()
+        folder = site['folder']
+        folder['missing.txt'] = DummyFile(
+            os.path.join(self.tmpdir, 'missing'), 4)
+        folder['broken'] = DummyFile(None, 4)
+        folder['broken'].blobfile = DummyBrokenBlobFile()
+        # Queued ahead of the archive which can be built.
+        queue = site.zip_download_queue
+        queue.add('0', '/folder', ['missing.txt'])
+        queue.add('1', '/folder', ['broken'])
+        directory = os.path.join(self.tmpdir, 'zips')
+        self.assertEqual(self._callFUT(site, directory), 1)
+        self.assertEqual(os.listdir(directory), [key + '.zip'])
+        self.assertEqual(len(queue), 0)
+
+    def test_conflict(self):
+        from ZODB.POSException import ConflictError
+        site, key = self._makeSite()
+        site['folder']['a.txt'].blobfile = DummyBrokenBlobFile(ConflictError)
+        self.assertRaises(ConflictError, self._callFUT, site, self.tmpdir)
+
+    def test_prebuilt_zip(self):
+        from karl.content.models.zipdownload import prebuilt_zip
+        from pyramid.interfaces import ISettings
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(var=self.tmpdir), ISettings)
+        site, key = self._makeSite()
+        self.assertEqual(prebuilt_zip(key), None)
+        self._callFUT(site, os.path.join(self.tmpdir, 'zip_downloads'))
+        self.assertEqual(prebuilt_zip(key), os.path.join(
+            self.tmpdir, 'zip_downloads', key + '.zip'))
+
+
+class Test_remove_old_zips(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _callFUT(self, directory, max_age, now):
+        from karl.content.models.zipdownload import remove_old_zips
+        return remove_old_zips(directory, max_age, lambda: now)
+
+    def test_it(self):
+        for name, mtime in (('old.zip', 1000), ('new.zip', 2000)):
+            filename = os.path.join(self.tmpdir, name)
+            open(filename, 'w').close()
+            os.utime(filename, (mtime, mtime))
+        self._callFUT(self.tmpdir, 500, 2100)
+        self.assertEqual(os.listdir(self.tmpdir), ['new.zip'])
+
+    def test_no_directory(self):
+        self._callFUT(os.path.join(self.tmpdir, 'nonexistent'), 500, 2100)
+
+
+class DummyFolder(testing.DummyModel):
+    def __init__(self):
+        from zope.interface import alsoProvides
+        from karl.content.interfaces import ICommunityFolder
+        testing.DummyModel.__init__(self)
+        alsoProvides(self, ICommunityFolder)
+
+
+class DummyBlobFile:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def committed(self):
+        return self.filename
+
+
+class DummyBrokenBlobFile:
+    def __init__(self, error=IOError):
+        self.error = error
+
+    def committed(self):
+        raise self.error()
+
+
+class DummyFile(testing.DummyModel):
+    def __init__(self, filename, size, mimetype='text/plain'):
+        testing.DummyModel.__init__(self)
+        self.blobfile = DummyBlobFile(filename)
+        self.size = size
+        self.mimetype = mimetype
@@ -0,0 +1,130 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Render image thumbnails outside of the requests that show them.
+
+Adding or changing an image queues it; the ``render_thumbnails`` worker
+renders its thumbnails in the standard sizes.  Views only read
+thumbnails, so showing a gallery never writes to the database.
+"""
+
+import logging
+import time
+
+from BTrees.LOBTree import LOBTree
+from persistent import Persistent
+from ZODB.POSException import ConflictError
+
+from karl.utils import find_site
+
+log = logging.getLogger(__name__)
+
+# The thumbnail sizes used by the UI and the image scales of the editor.
+THUMBNAIL_SIZES = (
+    (32, 32),
+    (50, 50),
+    (75, 100),
+    (85, 85),
+    (100, 100),
+    (128, 128),
+    (200, 200),
+    (400, 400),
+    (768, 768),
+)
+
+
+def standard_thumbnail_size(size):
+    """ Return the smallest standard size bounding ``size``, or the largest
+    standard size if none does.
+    """
+    width, height = size
+    for standard in sorted(THUMBNAIL_SIZES, key=lambda s: s[0] * s[1]):
+        if standard[0] >= width and standard[1] >= height:
+            return standard
+    return max(THUMBNAIL_SIZES, key=lambda s: s[0] * s[1])
+
+
+class ThumbnailQueue(Persistent):
+    """ The images waiting for their thumbnails, oldest first.
+
+    Kept as the ``thumbnail_queue`` attribute of the site.  Images are
+    held by reference, so they are found again after being moved, as
+    images uploaded to the temp folder are.
+    """
+
+    def __init__(self):
+        # microseconds since the epoch -> image
+        self._pending = LOBTree()
+
+    def add(self, image):
+        key = int(time.time() * 1000000)
+        while key in self._pending:
+            key += 1
+        self._pending[key] = image
+
+    def pop(self, limit):
+        images = []
+        for key in list(self._pending.keys()[:limit]):
+            images.append(self._pending.pop(key))
+        return images
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def find_thumbnail_queue(context, create=False):
+    site = find_site(context)
+    queue = getattr(site, 'thumbnail_queue', None)
+    if queue is None and create:
+        queue = site.thumbnail_queue = ThumbnailQueue()
+    return queue
+
+
+def queue_thumbnails(image, event):
+    """ Queue the rendering of the thumbnails of an added or modified image;
+    an IObjectAddedEvent and IObjectModifiedEvent subscriber.
+
+    An image queued twice has its thumbnails rendered once; the second
+    time finds them rendered already.
+    """
+    find_thumbnail_queue(image, create=True).add(image)
+
+
+def render_queued_thumbnails(site, batch_size=20):
+    """ Render the standard thumbnails of a batch of queued images.
+
+    Returns the number of images handled.  The caller commits.  An image
+    whose thumbnails fail to render, for whatever reason, is logged and
+    dropped from the queue, so it cannot hold up the images behind it.
+    """
+    queue = find_thumbnail_queue(site)
+    if queue is None:
+        return 0
+    images = queue.pop(batch_size)
+    for image in images:
+        if not getattr(image, 'is_image', False):
+            # No longer an image.
+            continue
+        try:
+            for size in THUMBNAIL_SIZES:
+                image.render_thumbnail(size)
+        except ConflictError:
+            raise
+        except Exception:
+            log.exception("Error rendering thumbnails of %s",
+                          getattr(image, 'filename', image))
+    return len(images)
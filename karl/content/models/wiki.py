@@ -25,6 +25,8 @@ from repoze.lemonade.content import create_content
 from karl.models.interfaces import IContainerVersion
 from karl.models.interfaces import IObjectVersion
 
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from repoze.folder import Folder
 from zope.interface import implements
 
@@ -32,6 +34,7 @@ from pyramid.url import resource_url
 
 from karl.models.tool import ToolFactory
 from karl.models.interfaces import IToolFactory
+from karl.utilities.lru import LRUCache
 
 from karl.content.models.adapters import extract_text_from_html
 from karl.content.interfaces import IWiki
@@ -41,6 +44,8 @@ from karl.content.interfaces import IWikiPage
 pattern = re.compile(r'\(\(([\w\W]+?)\)\)')  # wicked-style
 WICKED = '((%s))'
 
+COOKED_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
 
 def _ijoin(a, b):
     """yield a0,b0,a1,b1.. if len(a) = len(b)+1"""
@@ -51,12 +56,25 @@ def _ijoin(a, b):
 
 
 class Wiki(Folder):
+    """ A folder of wiki pages.
+
+    The wiki indexes the loosely normalized title of each page (see
+    ``_eq_loose``) and the loosely normalized targets of the links in its
+    text, so that links can be resolved, and the pages linking to a title
+    found, without loading every page.  Wikis created before the indexes
+    existed fall back to scanning their pages until ``reindex_pages`` is
+    called.
+    """
     implements(IWiki)
     title = u'Wiki'
+    _titles = None      # normalized title -> names of pages
+    _backlinks = None   # normalized link target -> names of linking pages
+    _page_keys = None   # name -> (normalized title, normalized targets)
 
     def __init__(self, creator):
         super(Wiki, self).__init__()
         self.creator = creator
+        self.reindex_pages()
         self._create_front_page()
 
     def _create_front_page(self):
@@ -68,11 +86,144 @@ class Wiki(Folder):
             self.creator,
             )
 
+    def add(self, name, other, send_events=True):
+        super(Wiki, self).add(name, other, send_events)
+        self.index_page(other)
+
+    def remove(self, name, send_events=True):
+        self.unindex_page(name)
+        return super(Wiki, self).remove(name, send_events)
+
     def __delitem__(self, name):
         super(Wiki, self).__delitem__(name)
         if name == 'front_page':
             self._create_front_page()
 
+    def reindex_pages(self):
+        """ (Re)build the title and link indexes from scratch. """
+        self._titles = OOBTree()
+        self._backlinks = OOBTree()
+        self._page_keys = OOBTree()
+        for page in self.values():
+            self.index_page(page)
+
+    def index_page(self, page):
+        """ Index the title and links of a page of this wiki.
+
+        Call this whenever the title or text of a page changes.
+        """
+        if self._page_keys is None:
+            return
+        name = getattr(page, '__name__', None)
+        if name is None or self.get(name) is not page:
+            return  # not one of our pages, e.g. a preview
+        self.unindex_page(name)
+        title = _normalize(page.title)
+        links = tuple(_link_keys(getattr(page, 'text', u'')))
+        _insert(self._titles, title, name)
+        for link in links:
+            _insert(self._backlinks, link, name)
+        self._page_keys[name] = (title, links)
+
+    def unindex_page(self, name):
+        if self._page_keys is None:
+            return
+        keys = self._page_keys.get(name)
+        if keys is None:
+            return
+        title, links = keys
+        _remove(self._titles, title, name)
+        for link in links:
+            _remove(self._backlinks, link, name)
+        del self._page_keys[name]
+
+    def pages_titled(self, title):
+        """ Return the pages whose title loosely equals ``title``.
+        """
+        if self._titles is None:
+            return _scan_titled(self, title)
+        names = self._titles.get(_normalize(title), ())
+        return [self[name] for name in names]
+
+    def link_targets(self, page):
+        """ Return the names of the pages the links of ``page`` resolve to.
+
+        The result changes whenever a page is added, renamed or removed
+        whose title matches one of the links.  Returns None if the wiki or
+        the page is not indexed.
+        """
+        if self._page_keys is None:
+            return None
+        keys = self._page_keys.get(page.__name__)
+        if keys is None:
+            return None
+        targets = []
+        for link in keys[1]:
+            names = self._titles.get(link)
+            if names:
+                targets.append(names.minKey())
+            else:
+                targets.append(None)
+        return tuple(targets)
+
+    def backlinks(self, title):
+        """ Return the pages which may link to ``title``.
+
+        Every page with a link loosely equal to ``title`` is returned; the
+        caller still needs to check the links themselves.
+        """
+        if self._backlinks is None:
+            return list(self.values())
+        names = self._backlinks.get(_normalize(title), ())
+        return [self[name] for name in names]
+
+
+def _insert(index, key, name):
+    names = index.get(key)
+    if names is None:
+        names = index[key] = OOTreeSet()
+    names.insert(name)
+
+
+def _remove(index, key, name):
+    names = index.get(key)
+    if names is not None:
+        names.remove(name)
+        if not names:
+            del index[key]
+
+
+def _scan_titled(wiki, title):
+    return [page for page in wiki.values() if _eq_loose(page.title, title)]
+
+
+def _pages_titled(wiki, title):
+    # Other containers (e.g. in tests) have no indexes, so scan them.
+    pages_titled = getattr(wiki, 'pages_titled', None)
+    if pages_titled is None:
+        return _scan_titled(wiki, title)
+    return pages_titled(title)
+
+
+def _backlinks(wiki, title):
+    backlinks = getattr(wiki, 'backlinks', None)
+    if backlinks is None:
+        return list(wiki.values())
+    return backlinks(title)
+
+
+def _link_keys(text):
+    """ Return the normalized targets of the wiki links in ``text``.
+
+    Both the raw link and its text without markup are included, as
+    ``cook`` resolves the latter while ``change_title`` compares the former.
+    """
+    keys = set()
+    for link in pattern.split(text)[1::2]:
+        keys.add(_normalize(link))
+        keys.add(_normalize(extract_text_from_html(link)))
+    return keys
+
 
 _rm_chars = re.compile('[\W]', re.U)
 def _eq_loose(s1, s2):
@@ -80,11 +231,10 @@ def _eq_loose(s1, s2):
     Performs a 'loose' string comparison--case insenstitive, ignoring
     non-alphanumeric characters and unescaping any html entities.
     """
-    s1 = _unescape(s1)
-    s2 = _unescape(s2)
-    s1 = _rm_chars.sub('', s1.lower())
-    s2 = _rm_chars.sub('', s2.lower())
-    return s1 == s2
+    return _normalize(s1) == _normalize(s2)
+
+def _normalize(s):
+    return _rm_chars.sub('', _unescape(s).lower())
 
 def _unescape(text):
     def fixup(m):
@@ -130,13 +280,13 @@ class WikiPage(Folder):
         title = unicode(title)
         if not pattern.match(WICKED % title):
             raise ValueError(title)
-        pages = self.__parent__.values()
+        wiki = self.__parent__
 
-        for page in pages:
+        for page in _pages_titled(wiki, title):
             if page is not self and page.title == title:
                 raise ValueError('Duplicate page title "%s"' % title)
 
-        for page in pages:
+        for page in _backlinks(wiki, self.title):
             subs = []
             chunks = pattern.split(page.text)
             for linked_name in chunks[1::2]:
@@ -145,7 +295,9 @@ class WikiPage(Folder):
                 else:
                     subs.append(WICKED % linked_name)
             page.text = u''.join(_ijoin(chunks[::2], subs))
+            _index_page(page)
         self.title = title
+        _index_page(self)
 
     def cook(self, request):
 
@@ -153,16 +305,44 @@ class WikiPage(Folder):
         if len(chunks) == 1:  # fastpath
             return self.text
 
+        key = self._cook_key(request)
+        if key is not None:
+            cooked = cooked_cache.get(key)
+            if cooked is not None:
+                return cooked
+
+        cooked = self._cook(chunks, request)
+        if key is not None:
+            cooked_cache[key] = cooked
+        return cooked
+
+    def _cook_key(self, request):
+        # Cooked text depends on the text of the page, on which pages its
+        # links resolve to, and on the URL of the wiki.  The text is
+        # versioned by the page's serial, so pages with uncommitted changes
+        # (or never committed, like previews) are not cached.
+        if self._p_oid is None or self._p_changed:
+            return None
+        wiki = self.__parent__
+        link_targets = getattr(wiki, 'link_targets', None)
+        if link_targets is None:
+            return None
+        targets = link_targets(self)
+        if targets is None:
+            return None
+        return (self._p_oid, self._p_serial, resource_url(wiki, request),
+                targets)
+
+    def _cook(self, chunks, request):
         subs = []
 
         # Every other chunk is a wiki link
         for wikilink in chunks[1::2]:
             cleaned = extract_text_from_html(wikilink)
-            for page in self.__parent__.values():
-                if _eq_loose(page.title, cleaned):
-                    url = resource_url(page, request)
-                    subs.append(WIKI_LINK % (url, wikilink))
-                    break
+            pages = _pages_titled(self.__parent__, cleaned)
+            if pages:
+                url = resource_url(pages[0], request)
+                subs.append(WIKI_LINK % (url, wikilink))
             else:
                 quoted = urllib.quote(cleaned.encode('UTF-8'))
                 subs.append(ADD_WIKIPAGE_LINK % (
@@ -183,10 +363,9 @@ class WikiPage(Folder):
             link = old_link.strip()
             page = self.__parent__.get(link)
             if page is None:
-                for page in self.__parent__.values():
-                    if _eq_loose(page.title, link):
-                        link = page.title
-                        break
+                pages = _pages_titled(self.__parent__, link)
+                if pages:
+                    link = pages[0].title
             if link != old_link:
                 changes.append((old_link, link))
             return "((%s))" % link
@@ -194,6 +373,7 @@ class WikiPage(Folder):
         new_text = pattern.sub(replace, self.text)
         if changes:
             self.text = new_text
+            _index_page(self)
         return changes
 
     def get_attachments(self):
@@ -209,6 +389,30 @@ class WikiPage(Folder):
         self.text = version.attrs['text']
         self.creator = version.attrs['creator']
         self.modified_by = version.user
+        _index_page(self)
+
+
+def _index_page(page):
+    wiki = getattr(page, '__parent__', None)
+    index_page = getattr(wiki, 'index_page', None)
+    if index_page is not None:
+        index_page(page)
+
+
+def wiki_page_modified(page, event):
+    """ Reindex the title and links of an edited wiki page; an
+    IObjectModifiedEvent subscriber.
+    """
+    _index_page(page)
+
+
+def _cooked_size(text):
+    return 64 + 2 * len(text)
+
+
+# Cooked text of wiki pages, shared by the threads of this process.
+cooked_cache = LRUCache(2000, maxbytes=COOKED_CACHE_MAX_BYTES,
+                        sizeof=_cooked_size, name='karl.wiki.cooked_cache')
 
 
 FRONT_PAGE_CONTENT = u"""\
@@ -0,0 +1,225 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Zip archives of files and folders for download.
+
+Archives are streamed while the files are read.  Downloads larger than the
+``zip_download_max_size`` setting are refused or, with the
+``zip_download_prebuild`` setting on, queued for the
+``build_zip_downloads`` script, which builds them in the ``zip_downloads``
+directory of ``var`` for a later request to send.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from zipfile import ZIP_DEFLATED
+from zipfile import ZIP_STORED
+from zipfile import ZipFile
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from pyramid.traversal import find_resource
+from ZODB.POSException import ConflictError
+from pyramid.traversal import resource_path
+
+from karl.content.interfaces import ICommunityFolder
+from karl.utilities.zipstream import ZipEntry
+from karl.utils import find_site
+from karl.utils import get_config_setting
+
+log = logging.getLogger(__name__)
+
+MAX_SIZE = 1 << 30
+
+# Formats already compressed, which deflating would only slow down.
+STORED_TYPES = (
+    'image/',
+    'video/',
+    'audio/',
+    'application/zip',
+    'application/x-zip-compressed',
+    'application/x-gzip',
+    'application/x-rar-compressed',
+    'application/x-7z-compressed',
+    'application/vnd.openxmlformats-officedocument.',
+    'application/vnd.oasis.opendocument.',
+)
+
+
+def zip_entries(folder, names):
+    """ Return the entries and total size of the archive of the items named
+    ``names`` in ``folder``.  Folders are added with all their files.
+    """
+    entries = []
+    size = 0
+    for name in names:
+        size += _add_entries(entries, folder[name], '')
+    return entries, size
+
+
+def _add_entries(entries, document, folder):
+    path = '%s%s' % (folder, document.__name__)
+    if ICommunityFolder.providedBy(document):
+        size = 0
+        for item in document.values():
+            size += _add_entries(entries, item, path + '/')
+        return size
+    mimetype = getattr(document, 'mimetype', None) or ''
+    entries.append(ZipEntry(path, document.blobfile.committed(),
+                            getattr(document, 'modified', None),
+                            not mimetype.startswith(STORED_TYPES)))
+    return document.size
+
+
+def zip_download_key(entries):
+    """ Identify the contents of an archive.
+
+    The name of a committed blob file changes with each revision of the
+    file, so the key changes whenever a file of the archive does.
+    """
+    key = hashlib.sha1()
+    for entry in entries:
+        path = entry.path
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        key.update('%s\0%s\0' % (path, entry.filename))
+    return key.hexdigest()
+
+
+def max_zip_size():
+    return int(get_config_setting('zip_download_max_size', MAX_SIZE))
+
+
+def zip_download_dir():
+    return os.path.join(get_config_setting('var'), 'zip_downloads')
+
+
+def prebuilt_zip(key):
+    """ Return the file name of the archive built for ``key``, or None. """
+    filename = os.path.join(zip_download_dir(), key + '.zip')
+    if os.path.exists(filename):
+        return filename
+    return None
+
+
+class ZipDownloadQueue(Persistent):
+    """ The archives waiting to be built, by key.
+
+    Kept as the ``zip_download_queue`` attribute of the site.
+    """
+
+    def __init__(self):
+        # key -> (folder path, names)
+        self._pending = OOBTree()
+
+    def add(self, key, path, names):
+        if key not in self._pending:
+            self._pending[key] = (path, tuple(names))
+
+    def done(self, key):
+        if key in self._pending:
+            del self._pending[key]
+
+    def pending(self):
+        return self._pending.items()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def find_zip_download_queue(context, create=False):
+    site = find_site(context)
+    queue = getattr(site, 'zip_download_queue', None)
+    if queue is None and create:
+        queue = site.zip_download_queue = ZipDownloadQueue()
+    return queue
+
+
+def queue_zip_download(folder, names, key):
+    find_zip_download_queue(folder, create=True).add(
+        key, resource_path(folder), names)
+
+
+def build_queued_zips(site, directory):
+    """ Build the queued archives in ``directory``.
+
+    Returns the number of archives built.  The caller commits.  An archive
+    which fails to build is logged and taken off the queue, so it cannot
+    hold up the archives queued after it.
+    """
+    queue = find_zip_download_queue(site)
+    if queue is None:
+        return 0
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    built = 0
+    for key, (path, names) in list(queue.pending()):
+        queue.done(key)
+        try:
+            folder = find_resource(site, path)
+            entries, size = zip_entries(folder, names)
+        except KeyError:
+            log.warn("Zip download of %s is gone", path)
+            continue
+        except ConflictError:
+            raise
+        except Exception:
+            log.exception("Error listing zip download of %s", path)
+            continue
+        # The files may have changed since the download was queued.
+        key = zip_download_key(entries)
+        filename = os.path.join(directory, key + '.zip')
+        if os.path.exists(filename):
+            continue
+        log.info("Building zip download of %s (%d bytes)", path, size)
+        try:
+            _build_zip(filename, entries)
+        except ConflictError:
+            raise
+        except Exception:
+            log.exception("Error building zip download of %s", path)
+            continue
+        built += 1
+    return built
+
+
+def _build_zip(filename, entries):
+    # Unlike a streamed archive, this one may need Zip64.
+    tmp = filename + '.tmp'
+    try:
+        zipfile = ZipFile(tmp, 'w', allowZip64=True)
+        for entry in entries:
+            zipfile.write(entry.filename, entry.path,
+                          entry.compress and ZIP_DEFLATED or ZIP_STORED)
+        zipfile.close()
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.rename(tmp, filename)
+
+
+def remove_old_zips(directory, max_age, now=time.time):
+    """ Remove archives built more than ``max_age`` seconds ago. """
+    if not os.path.exists(directory):
+        return
+    for name in os.listdir(directory):
+        filename = os.path.join(directory, name)
+        if os.path.getmtime(filename) < now() - max_age:
+            os.remove(filename)
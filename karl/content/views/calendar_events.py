@@ -19,7 +19,6 @@ import calendar
 calendar.setfirstweekday(calendar.SUNDAY)
 import datetime
 import time
-import copy
 
 from urllib import quote
 
@@ -61,7 +60,6 @@ from karl.utilities.interfaces import IAlerts
 from karl.utilities.interfaces import IKarlDates
 from karl.utilities.randomid import unfriendly_random_id
 
-from karl.utils import coarse_datetime_repr
 from karl.utils import find_interface
 from karl.utils import find_community
 
@@ -102,6 +100,7 @@ from karl.content.calendar.presenters.week import WeekEventHorizon
 from karl.content.calendar.presenters.month import MonthViewPresenter
 from karl.content.calendar.presenters.month import MonthEventHorizon
 from karl.content.calendar.presenters.list import ListViewPresenter
+from karl.content.calendar.query import find_layer_events
 from karl.content.calendar.utils import is_all_day_event
 
 
@@ -181,139 +180,30 @@ def _default_dates_requested(context, request):
     return startDate, endDate
 
 
-def _iterate_events_in_layer(layer, searcher, search_params,
-                             docids_seen, docids_all, first_moment,
-                             last_moment, in_list_view=False):
-
-        _total, docids, resolver = searcher(
-            virtual={'query': layer.paths, 'operator': 'or'},
-            **search_params)
-
-        for docid in docids:
-            if docid not in docids_seen:
-
-                # We need to clone the event, because if an event is
-                # shown in multiple layers, then we want to show it multiple
-                # times.
-                # This also means that making the color and title
-                # volatile, serves no purpose any more. It used to serve
-                # a purpose when the same event could only have
-                # been displayed once.
-
-                # It's important to perform a shallow copy of the event. A deep
-                # copy can leak out and try to copy the entire database through
-                # the parent reference
-
-                event = copy.copy(resolver(docid))
-                event._v_layer_color = layer.color.strip()
-                event._v_layer_title = layer.title
-
-                # but... showing an event multiple times, for each
-                # layer it is in,
-                # currently only makes sense for all-day
-                # events. As, for normal events, this would make
-                # them undisplayable.
-                # So we only add the event to the seen ones, if
-                # it is a normal, and not an all-day event.
-                # A special case is list views when we want the normal
-                # events duplicated too.
-                all_day = event.startDate.hour == 0 and \
-                    event.startDate.minute == 0 and \
-                    event.endDate.hour == 0 and \
-                    event.endDate.minute == 0
-                if not in_list_view and not all_day:
-                    docids_seen.add(docid)
-                docids_all.add(docid)
-
-                # A list view, and a multi day event?
-                # Also handle the non-all day, but multi-day events here.
-                multi_day = event.startDate.year != event.endDate.year or \
-                    event.startDate.month != event.endDate.month or \
-                    event.startDate.day != event.endDate.day
-
-                if in_list_view and (all_day or multi_day):
-                    # separate event bubble for each day of the event.
-                    # ... this is quite different from the original spec, and
-                    # possibly quite an inefficient way of doing it.
-                    new_startdate = max(event.startDate, first_moment)
-                    new_enddate = min(event.endDate, last_moment)
-                    plusone = datetime.timedelta(days=1)
-                    followup = False
-                    while new_startdate < new_enddate:
-                        day_event = copy.copy(event)
-                        day_event.startDate = new_startdate
-                        day_event._v_layer_color = layer.color.strip()
-                        day_event._v_layer_title = layer.title
-                        day_event._followup = followup
-                        new_startdate += plusone
-                        new_startdate = datetime.datetime.combine(
-                            new_startdate.date(), datetime.time())   # force to 0:00
-                        followup = True
-                        yield day_event
-
-                else:
-                    yield event
+def _iter_catalog_events(calendar, request,
+                         first_moment, last_moment, layer_name=None,
+                         in_list_view=False):
+    layers = [layer for layer in _get_calendar_layers(calendar)
+              if not layer_name or layer.__name__ == layer_name]
+    return find_layer_events(calendar, request, layers,
+                             first_moment, last_moment,
+                             in_list_view=in_list_view)
 
 
 def _get_catalog_events(calendar, request,
                         first_moment, last_moment, layer_name=None, in_list_view=False):
-
-    searcher = ICatalogSearch(calendar)
-    search_params = dict(
-        allowed={'query': effective_principals(request), 'operator': 'or'},
-        interfaces=[ICalendarEvent],
-        sort_index='start_date',
-        reverse=False,
-        )
-
-    if first_moment:
-        end_date = (coarse_datetime_repr(first_moment), None)
-        search_params['end_date'] = end_date
-
-    if last_moment:
-        start_date = (None, coarse_datetime_repr(last_moment))
-        search_params['start_date'] = start_date
-
-    docids_seen = set()
-    docids_all = set()
-
-    events = []
-
-    this_calendar_layer = None
-    for layer in _get_calendar_layers(calendar):
-        if layer_name and layer.__name__ != layer_name:
-            continue
-        if layer.__name__ == '_default_layer_':
-            # We process this calendar's events in a separate
-            # run, after the whole cycle with the other layers has finished.
-            this_calendar_layer = layer
-            continue
-        events.extend(_iterate_events_in_layer(layer, searcher, search_params,
-                                               docids_seen, docids_all, first_moment,
-                                               last_moment, in_list_view=in_list_view))
-    # Default layer is always processed last
-    # because we do not want to add any event that has already
-    # been added in any other layer in the previous cycle.
-    if this_calendar_layer is not None:
-        events.extend(_iterate_events_in_layer(this_calendar_layer, searcher,
-                                               search_params, docids_all, set(),
-                                               first_moment, last_moment,
-                                               in_list_view=in_list_view))
-
-    # The result set needs to be sorted by start_date.
-    # XXX maybe we can do this directly from the catalog?
-    events.sort(key=lambda event: event.startDate)
-
-    return events
+    return list(_iter_catalog_events(calendar, request,
+                                     first_moment, last_moment, layer_name,
+                                     in_list_view=in_list_view))
 
 
 def _paginate_catalog_events(calendar, request,
                              first_moment, last_moment, layer_name=None,
                              per_page=20, page=1):
 
-    all_events = _get_catalog_events(calendar, request,
-                                     first_moment, last_moment, layer_name,
-                                     in_list_view=True)
+    all_events = _iter_catalog_events(calendar, request,
+                                      first_moment, last_moment, layer_name,
+                                      in_list_view=True)
 
     offset = (page - 1) * per_page
     limit = per_page + 1
@@ -36,6 +36,7 @@ from repoze.workflow import get_workflow
 
 from karl.events import ObjectModifiedEvent
 from karl.events import ObjectWillBeModifiedEvent
+from karl.request import get_request_cache
 from karl.views.api import TemplateAPI
 from karl.utilities.alerts import Alerts
 from karl.utilities.image import relocate_temp_images
@@ -44,7 +45,6 @@ from karl.utilities.interfaces import IAlerts
 from karl.utils import get_layout_provider
 from karl.utils import find_interface
 from karl.utils import support_attachments
-from karl.utils import find_profiles
 
 from repoze.lemonade.content import create_content
 from karl.models.interfaces import IComment
@@ -297,11 +297,11 @@ class EditCommentFormController(object):
 
 def get_comment_data(context, comments_folder, api, request):
     # get comment data to be used to render comments
-    profiles = find_profiles(comments_folder)
+    cache = get_request_cache(request)
     karldates = getUtility(IKarlDates)
     comments = []
     for comment in comments_folder.values():
-        profile = profiles.get(comment.creator)
+        profile = cache.profile(comments_folder, comment.creator)
         author_name = profile.title
         author_url = resource_url(profile, request)
 
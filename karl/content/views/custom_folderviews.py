@@ -78,8 +78,7 @@ def get_catalog_events(context, request,
             first_moment = coarse_datetime_repr(datetime.datetime(year, 1, 1))
             last_moment = coarse_datetime_repr(datetime.datetime(year+1, 1, 1))
 
-        query['start_date'] = (None, last_moment)
-        query['end_date'] = (first_moment, None)
+        query['date_range'] = (first_moment, last_moment)
 
     else:
         # Show either all future or all past events
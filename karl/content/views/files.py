@@ -17,11 +17,10 @@
 
 import datetime
 import logging
-import tempfile
+import os
 import transaction
 from urllib import quote_plus
 from os.path import splitext
-from zipfile import ZipFile
 
 import formish
 import schemaish
@@ -35,7 +34,9 @@ from zope.component import queryUtility
 from zope.interface import alsoProvides
 from zope.interface import noLongerProvides
 
+from pyramid.response import FileIter
 from pyramid.response import Response
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPFound
 
 from pyramid.renderers import render_to_response
@@ -53,12 +54,15 @@ from repoze.lemonade.content import create_content
 
 from karl.utilities.alerts import Alerts
 from karl.utilities.interfaces import IAlerts
+from karl.utilities.zipstream import zip_stream
 
 from karl.views.utils import make_name
 from karl.views.utils import make_unique_name
 from karl.views.utils import make_unique_name_and_postfix
 from karl.views.utils import basename_of_filepath
+from karl.views.utils import blob_response
 from karl.views.utils import convert_to_script
+from karl.views.utils import get_static_url
 from karl.views.tags import get_tags_client_data
 from karl.views.forms import widgets as karlwidgets
 
@@ -68,6 +72,13 @@ from karl.views.resource import delete_resource_view
 from karl.events import ObjectModifiedEvent
 from karl.events import ObjectWillBeModifiedEvent
 
+from karl.content.models.thumbnails import standard_thumbnail_size
+from karl.content.models.zipdownload import max_zip_size
+from karl.content.models.zipdownload import prebuilt_zip
+from karl.content.models.zipdownload import queue_zip_download
+from karl.content.models.zipdownload import zip_download_key
+from karl.content.models.zipdownload import zip_entries
+
 from karl.content.interfaces import ICommunityFile
 from karl.content.interfaces import ICommunityFolder
 from karl.content.interfaces import ICommunityRootFolder
@@ -91,7 +102,9 @@ from karl.content.views.utils import sendalert_default
 
 from karl.security.workflow import get_security_states
 
+from karl.utils import asbool
 from karl.utils import find_community
+from karl.utils import get_config_setting
 from karl.utils import get_folder_addables
 from karl.utils import get_layout_provider
 from karl.utils import find_tempfolder
@@ -109,6 +122,10 @@ from karl.views.forms.filestore import get_filestore
 
 log = logging.getLogger(__name__)
 
+# Thumbnail URLs don't change when an image is replaced, so browsers may
+# show the old thumbnail for this many seconds.
+THUMBNAIL_CACHE_MAX_AGE = 24 * 3600
+
 
 def show_folder_view(context, request):
     page_title = context.title
@@ -584,12 +601,7 @@ def download_file_preview(context, request):
 
 def download_file_view(context, request):
     # To view image-ish files in-line, use thumbnail_view.
-    f = context.blobfile.open()
-    headers = [
-        ('Content-Type', str(context.mimetype)),
-        ('Content-Length', str(context.size)),
-    ]
-
+    headers = []
     if 'save' in request.params:
         fname = context.filename
         if isinstance(fname, unicode):
@@ -599,35 +611,21 @@ def download_file_view(context, request):
             ('Content-Disposition', 'attachment; filename=%s' % fname)
         )
 
-    response = Response(headerlist=headers, app_iter=f)
-    return response
+    return blob_response(context.blobfile, str(context.mimetype),
+                         context.size, headers)
 
 
 def download_zipped(context, request):
     """
     Download a set of files from a folder as a zip archive.
-    """
-    def add_file_to_zip(zipfile, document, folder):
-        """
-        Add a file from the files tool to a zipfile to be downloaded.  If the
-        document is a folder, recurse into that folder and add all of those
-        files too.
-        """
-        path = '%s/%s' % (folder, document.__name__)
-        if ICommunityFolder.providedBy(document):
-            for item in document.values():
-                add_file_to_zip(zipfile, item, path)
-        else:
-            zipfile.write(document.blobfile.committed(), path)
-
-    tmp = tempfile.TemporaryFile()
-    zipfile = ZipFile(tmp, 'w', 8)
-    for name in request.params.getall('filenames[]'):
-        add_file_to_zip(zipfile, context[name], '')
-    zipfile.close()
-    tmp.seek(0)
-    app_iter = iter(lambda: tmp.read(4096), b'')
 
+    The archive is sent while its files are read.  Archives larger than the
+    ``zip_download_max_size`` setting are refused, unless the
+    ``zip_download_prebuild`` setting is on: then they are queued to be
+    built in the background and sent once built.
+    """
+    names = request.params.getall('filenames[]')
+    entries, size = zip_entries(context, names)
     community = find_community(context)
     zip_id = community and community.__name__
     fname = '%s_files' % zip_id.encode('utf-8')
@@ -635,10 +633,30 @@ def download_zipped(context, request):
         ('Content-Type', 'application/zip'),
         ('Content-Disposition', 'attachment; filename=%s.zip' % fname)
     ]
-    return Response(headerlist=headers, app_iter=app_iter)
+
+    if size <= max_zip_size():
+        return Response(headerlist=headers, app_iter=zip_stream(entries))
+
+    if not asbool(get_config_setting('zip_download_prebuild', 'false')):
+        raise HTTPBadRequest(
+            "Maximum download size is %d MB.  Total size for selected files "
+            "is %d MB." % (max_zip_size() / 1000000, size / 1000000))
+    key = zip_download_key(entries)
+    filename = prebuilt_zip(key)
+    if filename is None:
+        queue_zip_download(context, names, key)
+        return Response(
+            "The selected files are being prepared for download.  "
+            "Please try again in a few minutes.",
+            status='202 Accepted', content_type='text/plain')
+    headers.append(('Content-Length', str(os.path.getsize(filename))))
+    return Response(headerlist=headers,
+                    app_iter=FileIter(open(filename, 'rb')))
 
 
 def thumbnail_view(context, request):
+    # Thumbnails are rendered in the background, in the standard sizes
+    # only; until then a placeholder is shown.
     assert IImage.providedBy(context), "Context must be an image."
     if not request.subpath:
         raise NotFound
@@ -647,12 +665,16 @@ def thumbnail_view(context, request):
         size = map(int, filename[:-4].split('x'))
     except:
         raise NotFound
-    thumb = context.thumbnail(tuple(size))
-
-    # XXX Allow browser caching be setting Last-modified and Expires
-    #     and respecting If-Modified-Since requests with 302 responses.
-    data = thumb.blobfile.open().read()
-    return Response(body=data, content_type=thumb.mimetype)
+    if len(size) != 2:
+        raise NotFound
+    thumb = context.thumbnail(standard_thumbnail_size(size))
+    if thumb is None:
+        return HTTPFound(location=get_static_url(request) +
+                         '/images/karl-icon-loading.gif')
+    max_age = int(get_config_setting('thumbnail_cache_max_age',
+                                     THUMBNAIL_CACHE_MAX_AGE))
+    return blob_response(thumb.blobfile, thumb.mimetype, thumb.size,
+                         cache_max_age=max_age)
 
 
 class EditFolderFormController(object):
@@ -1387,17 +1409,7 @@ def ajax_file_upload_view(context, request):
                 raise ErrorResponse(msg, client_id=client_id)
 
             # Append the file to the existing file
-            bufsize = 8192
-            blobf = fileobj.blobfile.open('a')
-            while True:
-                buf = f.file.read(bufsize)
-                if not buf:
-                    break
-                blobf.write(buf)
-            # Need to set the size
-            fileobj.size = blobf.tell()
-            # Close the file
-            blobf.close()
+            fileobj.append(f.file)
 
         payload = dict(
             result='OK',
@@ -51,11 +51,11 @@ from karl.events import ObjectWillBeModifiedEvent
 from karl.models.interfaces import IComment
 from karl.models.interfaces import ICatalogSearch
 
+from karl.request import get_request_cache
 from karl.security.workflow import get_security_states
 
 from karl.utils import get_layout_provider
 from karl.utils import find_interface
-from karl.utils import find_profiles
 from karl.utils import support_attachments
 from karl.content.views.utils import sendalert_default
 from karl.utilities.image import thumb_url
@@ -165,7 +165,7 @@ def show_forum_view(context, request):
     if has_permission('delete', context, request):
         actions.append(('Delete', 'delete.html'))
 
-    profiles = find_profiles(context)
+    cache = get_request_cache(request)
     karldates = getUtility(IKarlDates)
 
     topic_batch = get_topic_batch(context, request)
@@ -174,7 +174,7 @@ def show_forum_view(context, request):
     topics = []
     for topic in topic_entries:
         D = {}
-        profile = profiles.get(topic.creator)
+        profile = cache.profile(context, topic.creator)
         posted_by = getattr(profile, 'title', None)
         date = karldates(topic.created, 'longform')
         D['url'] = resource_url(topic, request)
@@ -387,7 +387,7 @@ class EditForumFormController(object):
 def show_forum_topic_view(context, request):
     post_url = resource_url(context, request, "comments", "add_comment.html")
     karldates = getUtility(IKarlDates)
-    profiles = find_profiles(context)
+    cache = get_request_cache(request)
 
     # Convert comments into a digestable form for the template
     comments = []
@@ -405,7 +405,7 @@ def show_forum_topic_view(context, request):
     api = TemplateAPI(context, request, page_title)
 
     for comment in context['comments'].values():
-        profile = profiles.get(comment.creator)
+        profile = cache.profile(context, comment.creator)
         author_name = profile.title
         author_url = resource_url(profile, request)
 
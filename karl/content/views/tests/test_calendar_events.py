@@ -1371,14 +1371,18 @@ class Test__get_catalog_events(unittest.TestCase):
         results = 1, [1], lambda *arg: event
         search = DummySearchAdapter(results)
         karl.testing.registerAdapter(search, (Interface), ICatalogSearch)
-        event = DummyCalendarEvent('foo')
+        event = DummyCalendarEvent('foo', calendar_category='/foo/bar')
         karl.testing.registerModels({'/foo/bar':event})
+        from karl.content.interfaces import ICalendarEvent
+        from karl.content.models.adapters import CalendarEventCategoryData
+        from karl.models.interfaces import IVirtualData
+        karl.testing.registerAdapter(CalendarEventCategoryData,
+                                     (ICalendarEvent,), IVirtualData)
         result = self._callFUT(calendar, request,
                                first_moment=now,
                                last_moment=now,
                                layer_name=None)
-        # We won't have an equality, as this is a clone.
-        # So, check its dict instead.
+        # We won't have an equality, as this is a per-layer record.
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0].startDate, event.startDate)
         self.assertEqual(result[0].endDate, event.endDate)
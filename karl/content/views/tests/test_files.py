@@ -850,11 +850,10 @@ class TestDownloadFileView(unittest.TestCase):
         context.size = 42
         request = testing.DummyRequest()
         response = self._callFUT(context, request)
-        self.assertEqual(response.headerlist[0],
-                         ('Content-Type', 'x/foo'))
-        self.assertEqual(response.headerlist[1],
-                         ('Content-Length', '42'))
-        self.assertEqual(response.app_iter, blobfile)
+        self.assertEqual(response.headers['Content-Type'], 'x/foo')
+        self.assertEqual(response.headers['Content-Length'], '42')
+        self.assertEqual(response.app_iter.file, blobfile)
+        self.failUnless(response.conditional_response)
 
     def test_mimetype_is_unicode_for_some_reason(self):
         context = testing.DummyModel()
@@ -865,7 +864,7 @@ class TestDownloadFileView(unittest.TestCase):
         context.size = 42
         request = testing.DummyRequest()
         response = self._callFUT(context, request)
-        _, content_type = response.headerlist[0]
+        content_type = response.headers['Content-Type']
         self.assertTrue(isinstance(content_type, str))
 
     def test_save(self):
@@ -877,14 +876,11 @@ class TestDownloadFileView(unittest.TestCase):
         context.size = 42
         request = testing.DummyRequest(params=dict(save=1))
         response = self._callFUT(context, request)
-        self.assertEqual(response.headerlist[0],
-                         ('Content-Type', 'x/foo'))
-        self.assertEqual(response.headerlist[1],
-                         ('Content-Length', '42'))
-        self.assertEqual(response.headerlist[2],
-                         ('Content-Disposition',
-                          'attachment; filename=thefilename'))
-        self.assertEqual(response.app_iter, blobfile)
+        self.assertEqual(response.headers['Content-Type'], 'x/foo')
+        self.assertEqual(response.headers['Content-Length'], '42')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename=thefilename')
+        self.assertEqual(response.app_iter.file, blobfile)
 
     def test_save_filename_has_tabs_and_newlines(self):
         context = testing.DummyModel()
@@ -895,14 +891,88 @@ class TestDownloadFileView(unittest.TestCase):
         context.size = 42
         request = testing.DummyRequest(params=dict(save=1))
         response = self._callFUT(context, request)
-        self.assertEqual(response.headerlist[0],
-                         ('Content-Type', 'x/foo'))
-        self.assertEqual(response.headerlist[1],
-                         ('Content-Length', '42'))
-        self.assertEqual(response.headerlist[2],
-                         ('Content-Disposition',
-                          'attachment; filename=the file name'))
-        self.assertEqual(response.app_iter, blobfile)
+        self.assertEqual(response.headers['Content-Type'], 'x/foo')
+        self.assertEqual(response.headers['Content-Length'], '42')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename=the file name')
+        self.assertEqual(response.app_iter.file, blobfile)
+
+
+class TestDownloadZipped(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        cleanUp()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        cleanUp()
+        shutil.rmtree(self.tmpdir)
+
+    def _callFUT(self, context, request):
+        from karl.content.views.files import download_zipped
+        return download_zipped(context, request)
+
+    def _makeContext(self, **settings):
+        import os
+        from pyramid.interfaces import ISettings
+        settings.setdefault('var', self.tmpdir)
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(**settings), ISettings)
+        filename = os.path.join(self.tmpdir, 'blob')
+        f = open(filename, 'wb')
+        f.write('data')
+        f.close()
+        community = karl.testing.DummyCommunity()
+        community['files'] = context = testing.DummyModel()
+        context['a.txt'] = testing.DummyModel(
+            blobfile=DummyBlobFile(filename), size=4, mimetype='text/plain')
+        return context
+
+    def _makeRequest(self):
+        from webob.multidict import MultiDict
+        request = testing.DummyRequest()
+        request.params = MultiDict([('filenames[]', 'a.txt')])
+        return request
+
+    def test_streamed(self):
+        from StringIO import StringIO
+        from zipfile import ZipFile
+        context = self._makeContext()
+        response = self._callFUT(context, self._makeRequest())
+        self.assertEqual(response.content_type, 'application/zip')
+        self.assertEqual(response.headers['Content-Disposition'],
+                         'attachment; filename=community_files.zip')
+        zipfile = ZipFile(StringIO(''.join(response.app_iter)))
+        self.assertEqual(zipfile.read('a.txt'), 'data')
+
+    def test_too_large(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        context = self._makeContext(zip_download_max_size='3')
+        self.assertRaises(HTTPBadRequest, self._callFUT, context,
+                          self._makeRequest())
+
+    def test_too_large_queued(self):
+        context = self._makeContext(zip_download_max_size='3',
+                                    zip_download_prebuild='true')
+        response = self._callFUT(context, self._makeRequest())
+        self.assertEqual(response.status, '202 Accepted')
+        queue = context.__parent__.__parent__.__parent__.zip_download_queue
+        self.assertEqual(len(queue), 1)
+
+    def test_too_large_prebuilt(self):
+        import os
+        from karl.content.models.zipdownload import build_queued_zips
+        context = self._makeContext(zip_download_max_size='3',
+                                    zip_download_prebuild='true')
+        self._callFUT(context, self._makeRequest())
+        site = context.__parent__.__parent__.__parent__
+        build_queued_zips(site, os.path.join(self.tmpdir, 'zip_downloads'))
+        response = self._callFUT(context, self._makeRequest())
+        self.assertEqual(response.status, '200 OK')
+        self.assertEqual(response.content_type, 'application/zip')
+        body = ''.join(response.app_iter)
+        self.assertEqual(response.headers['Content-Length'], str(len(body)))
 
 
 class TestThumbnailView(unittest.TestCase):
@@ -932,14 +1002,53 @@ class TestThumbnailView(unittest.TestCase):
         import PIL.Image
         from cStringIO import StringIO
         context = self._get_context()
+        context.render_thumbnail((200, 200))
         request = testing.DummyRequest()
-        request.subpath = ('300x200.jpg',)
+        request.subpath = ('200x200.jpg',)
 
         response = self._callFUT(context, request)
         self.assertEqual(response.content_type, 'image/jpeg')
+        self.assertEqual(response.cache_control.max_age, 24 * 3600)
         image = PIL.Image.open(StringIO(response.body))
         self.assertEqual(image.size, (137, 200))
 
+    def test_nonstandard_size(self):
+        import PIL.Image
+        from cStringIO import StringIO
+        context = self._get_context()
+        context.render_thumbnail((200, 200))
+        request = testing.DummyRequest()
+        request.subpath = ('190x150.jpg',)
+
+        response = self._callFUT(context, request)
+        image = PIL.Image.open(StringIO(response.body))
+        self.assertEqual(image.size, (137, 200))
+
+    @mock.patch('karl.content.views.files.get_static_url')
+    def test_not_rendered_yet(self, get_static_url):
+        get_static_url.return_value = 'http://example.com/static'
+        context = self._get_context()
+        request = testing.DummyRequest()
+        request.subpath = ('200x200.jpg',)
+
+        response = self._callFUT(context, request)
+        self.assertEqual(response.location,
+                         'http://example.com/static/images/'
+                         'karl-icon-loading.gif')
+        self.assertEqual(context.thumbnail((200, 200)), None)
+
+    def test_cache_max_age_setting(self):
+        from pyramid.interfaces import ISettings
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(thumbnail_cache_max_age='60'),
+            ISettings)
+        context = self._get_context()
+        context.render_thumbnail((200, 200))
+        request = testing.DummyRequest()
+        request.subpath = ('200x200.jpg',)
+        response = self._callFUT(context, request)
+        self.assertEqual(response.cache_control.max_age, 60)
+
     def test_it_no_subpath(self):
         context = self._get_context()
         request = testing.DummyRequest()
@@ -955,6 +1064,14 @@ class TestThumbnailView(unittest.TestCase):
         from pyramid.exceptions import NotFound
         self.assertRaises(NotFound, self._callFUT, context, request)
 
+    def test_it_bad_number_of_dimensions(self):
+        context = self._get_context()
+        request = testing.DummyRequest()
+        request.subpath = ('1x2x3.jpg',)
+
+        from pyramid.exceptions import NotFound
+        self.assertRaises(NotFound, self._callFUT, context, request)
+
 
 class TestEditFolderFormController(unittest.TestCase):
     def setUp(self):
@@ -1838,6 +1955,27 @@ class TestAjaxFileUploadView(unittest.TestCase):
         self.failUnless(not hasattr(file1, '__chunks__'))
         self.failUnless(not hasattr(file1, '__chunk__'))
 
+    def test_chunks_content_hash(self):
+        import hashlib
+        from karl.content.models.adapters import _content_hash
+        karl.testing.registerDummySecurityPolicy('chris')
+        context = self._make_context()
+        for chunk, data in enumerate(['0' * 1000, '1' * 1000]):
+            request = testing.DummyRequest(
+                params={
+                    'file': DummyUpload(IMAGE_DATA=data),
+                    'client_id': 'ABCDEF',
+                    'chunks': '2',
+                    'chunk': str(chunk),
+                }
+            )
+            self._call_fut(context, request)
+        file1 = context['testfile.txt']
+        data = file1.blobfile.open().read()
+        self.assertEqual(data, '0' * 1000 + '1' * 1000)
+        self.assertEqual(_content_hash(file1), hashlib.sha1(data).hexdigest())
+        self.assertEqual(file1.content_hash, hashlib.sha1(data).hexdigest())
+
     def test_chunking_parameters(self):
         karl.testing.registerDummySecurityPolicy('chris')
         context = self._make_context()
@@ -2590,9 +2728,15 @@ from zope.interface import implements
 
 
 class DummyBlobFile:
+    def __init__(self, filename=None):
+        self.filename = filename
+
     def open(self):
         return self
 
+    def committed(self):
+        return self.filename
+
 
 class DummyCommunityFolder:
     def __init__(self, title, userid):
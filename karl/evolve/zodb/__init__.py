@@ -1,2 +1,2 @@
-VERSION = 56
+VERSION = 64
 NAME = 'Karl'
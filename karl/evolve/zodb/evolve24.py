@@ -1,7 +1,13 @@
+from zope.event import notify
+
+from karl.tagging import TagRemovedEvent
 from karl.utils import find_tags
 
 def evolve(root):
     tags = find_tags(root)
+    if not hasattr(tags, '_tagid_to_obj'):
+        # Already the compact store of evolve61, which has no duplicates.
+        return
     dupe_ids = []
     print "Searching for duplicate tags..."
     seen_tags = set()
@@ -11,5 +17,26 @@ def evolve(root):
         else:
             seen_tags.add(tag)
 
-    tags._delTags(dupe_ids)
-    print "Removed %d duplicate tags" % len(dupe_ids)
\ No newline at end of file
+    # Tags._delTags works on the compact store, so remove the duplicates
+    # from the layout of the time here.
+    for id in dupe_ids:
+        tag = tags._tagid_to_obj[id]
+        for index, key in ((tags._user_to_tagids, tag.user),
+                           (tags._item_to_tagids, tag.item),
+                           (tags._name_to_tagids, tag.name),
+                           (tags._community_to_tagids, tag.community)):
+            index[key].remove(id)
+            if not len(index[key]):
+                del index[key]
+        if tag.community:
+            clouds = (tags._global_cloud,
+                      tags._community_clouds[tag.community])
+        else:
+            clouds = (tags._global_cloud,)
+        for cloud in clouds:
+            cloud[tag.name] -= 1
+            if cloud[tag.name] == 0:
+                del cloud[tag.name]
+        del tags._tagid_to_obj[id]
+        notify(TagRemovedEvent(tag))
+    print "Removed %d duplicate tags" % len(dupe_ids)
@@ -0,0 +1,18 @@
+from karl.models.contentfeeds import SiteEvents
+
+
+def evolve(site):
+    """
+    Move the site events from the old AppendStack into the indexed store.
+    """
+    old = getattr(site, 'events', None)
+    stack = getattr(old, '_stack', None)
+    if stack is None:
+        return
+    events = SiteEvents()
+    count = 0
+    for gen, index, mapping in stack:
+        events._add(gen * stack._max_length + index, mapping)
+        count += 1
+    site.events = events
+    print "Indexed %d site events" % count
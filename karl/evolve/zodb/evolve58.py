@@ -0,0 +1,18 @@
+from pyramid.traversal import resource_path
+
+from karl.content.interfaces import IWiki
+from karl.models.interfaces import ICatalogSearch
+
+
+def evolve(site):
+    """
+    Build the title and link indexes of every wiki.
+    """
+    search = ICatalogSearch(site)
+    cnt, docids, resolver = search(interfaces=[IWiki])
+    for docid in docids:
+        wiki = resolver(docid)
+        if wiki is None:
+            continue  # Work around catalog bug
+        print "Indexing wiki pages of %s" % resource_path(wiki)
+        wiki.reindex_pages()
@@ -0,0 +1,25 @@
+from pyramid.traversal import find_resource
+from karl.utils import find_catalog
+
+def evolve(root):
+    """
+    Add the 'date_range' interval index, which finds the calendar events
+    overlapping a period without intersecting two range searches on the
+    'start_date' and 'end_date' indexes.
+    """
+    print "Adding the 'date_range' index to the catalog."
+    root.update_indexes()
+    catalog = find_catalog(root)
+    index = catalog['date_range']
+    # Only documents with a start date have a date range.
+    docids = list(catalog['start_date']._rev_index.keys())
+    n_docs = len(docids)
+    for n, docid in enumerate(docids):
+        if n % 500 == 0:
+            print "Indexed %d/%d documents" % (n, n_docs)
+        addr = catalog.document_map.address_for_docid(docid)
+        if addr is None:
+            continue
+        doc = find_resource(root, addr)
+        index.index_doc(docid, doc)
+        doc._p_deactivate()
@@ -0,0 +1,19 @@
+from karl.content.interfaces import IImage
+from karl.content.models.thumbnails import find_thumbnail_queue
+from karl.models.interfaces import ICatalogSearch
+
+def evolve(root):
+    """
+    Queue every image for the 'render_thumbnails' worker, which now
+    renders the standard thumbnail sizes that views used to render on
+    demand.
+    """
+    search = ICatalogSearch(root)
+    cnt, docids, resolver = search(interfaces=[IImage])
+    print "Queueing %d images for their thumbnails." % cnt
+    queue = find_thumbnail_queue(root, create=True)
+    for docid in docids:
+        image = resolver(docid)
+        if image is None:
+            continue # Work around catalog bug
+        queue.add(image)
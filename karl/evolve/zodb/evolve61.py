@@ -0,0 +1,36 @@
+from BTrees import IIBTree
+
+from karl.tagging import StringTable
+from karl.utils import find_tags
+
+def evolve(root):
+    """
+    Move tags from one persistent object each into the integer columns
+    and interned strings of the compact tag store.
+    """
+    tags = find_tags(root)
+    if tags is None or not hasattr(tags, '_tagid_to_obj'):
+        return
+    print "Migrating %d tags." % len(tags._tagid_to_obj)
+    migrate(tags)
+
+
+def migrate(tags):
+    tags._tag_items = items = IIBTree.IIBTree()
+    tags._tag_users = users = IIBTree.IIBTree()
+    tags._tag_names = names = IIBTree.IIBTree()
+    tags._tag_communities = communities = IIBTree.IIBTree()
+    tags._users = StringTable()
+    tags._names = StringTable()
+    tags._communities = StringTable()
+    for tagid, tag in tags._tagid_to_obj.items():
+        items[tagid] = tag.item
+        users[tagid] = tags._users.intern(tag.user)
+        names[tagid] = tags._names.intern(tag.name)
+        if tag.community:
+            communities[tagid] = tags._communities.intern(tag.community)
+        else:
+            communities[tagid] = 0
+        if len(items) % 10000 == 0 and tags._p_jar is not None:
+            tags._p_jar.cacheGC()
+    del tags._tagid_to_obj
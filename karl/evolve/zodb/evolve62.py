@@ -0,0 +1,11 @@
+from karl.utils import find_tags
+
+def evolve(root):
+    """
+    Compute the tag co-occurrence now used for related tags.
+    """
+    tags = find_tags(root)
+    if tags is None:
+        return
+    print "Computing the co-occurrence of %d tags." % len(tags)
+    tags._indexRelated()
@@ -0,0 +1,12 @@
+from karl.utils import find_tags
+
+def evolve(root):
+    """
+    Keep the docids of the items tagged with each tag, which the 'tags'
+    catalog index now searches.
+    """
+    tags = find_tags(root)
+    if tags is None:
+        return
+    print "Indexing the items of %d tag names." % tags.tagCount
+    tags._indexNameItems()
@@ -0,0 +1,18 @@
+from BTrees.OOBTree import OOTreeSet
+
+from karl.utils import find_users
+
+def evolve(root):
+    """
+    Keep group membership in OOTreeSets, which resolve concurrent joins and
+    leaves instead of conflicting.
+    """
+    users = find_users(root)
+    print "Converting the groups of %d users." % len(users.data)
+    for group, userids in list(users.groups.items()):
+        if not isinstance(userids, OOTreeSet):
+            users.groups[group] = OOTreeSet(userids)
+    for userid, info in list(users.data.items()):
+        if not isinstance(info['groups'], OOTreeSet):
+            info['groups'] = OOTreeSet(info['groups'])
+            users.data[userid] = info
@@ -27,6 +27,7 @@ from pyramid.security import effective_principals
 from pyramid.traversal import find_interface
 from pyramid.traversal import find_resource
 from pyramid.traversal import resource_path
+from pyramid.traversal import traversal_path
 from pyramid.url import resource_url
 from repoze.lemonade.listitem import get_listitems
 from repoze.sendmail.interfaces import IMailDelivery
@@ -50,10 +51,10 @@ from karl.models.interfaces import IProfiles
 from karl.models.interfaces import ITagQuery
 from karl.models.interfaces import IToolFactory
 from karl.models.site import get_weighted_textrepr
+from karl.request import get_request_cache
 
 from karl.utils import find_catalog
 from karl.utils import find_peopledirectory_catalog
-from karl.utils import find_profiles
 from karl.utils import find_tags
 from karl.utils import get_content_type_name
 from karl.utils import get_setting
@@ -75,18 +76,95 @@ class CatalogSearch(object):
 
     def __call__(self, **kw):
         num, docids = self.catalog.search(**kw)
-        address = self.catalog.document_map.address_for_docid
+        resolver = CatalogResolver(self.context, self.catalog)
+        return num, docids, resolver
+
+
+class CatalogResolver(object):
+    """ Turn catalog docids into content objects.
+
+    Calling the resolver with a docid returns the object, or None if it
+    is missing.  ``resolve_many`` resolves a whole batch at once.
+    """
+
+    def __init__(self, context, catalog):
+        self.context = context
+        self.catalog = catalog
+
+    def __call__(self, docid):
+        path = self.catalog.document_map.address_for_docid(docid)
+        if path is None:
+            return None
+        try:
+            return find_resource(self.context, path)
+        except KeyError:
+            self._missing(path)
+            return None
+
+    def _missing(self, path):
         logger = queryUtility(IDebugLogger)
-        def resolver(docid):
+        logger and logger.warn('Model missing: %s' % path)
+
+    def resolve_many(self, docids, principals=None):
+        """ Resolve a sequence of docids, returning a list of the same
+        length with None in place of missing objects.
+
+        If ``principals`` is passed, docids which the 'allowed' index says
+        none of them may view are dropped (returned as None) without being
+        loaded.  Siblings share a single traversal to their container.
+        """
+        docids = list(docids)
+        if principals is not None:
+            docids = self._allowed(docids, principals)
+        address = self.catalog.document_map.address_for_docid
+        containers = {}
+        result = []
+        for docid in docids:
+            if docid is None:
+                result.append(None)
+                continue
             path = address(docid)
             if path is None:
-                return None
-            try:
-                return find_resource(self.context, path)
-            except KeyError:
-                logger and logger.warn('Model missing: %s' % path)
-                return None
-        return num, docids, resolver
+                result.append(None)
+                continue
+            result.append(self._find(containers, path))
+        return result
+
+    def _allowed(self, docids, principals):
+        index = self.catalog.get('allowed')
+        rev_index = getattr(index, '_rev_index', None)
+        if rev_index is None:
+            return docids
+        principals = set(principals)
+        allowed = []
+        for docid in docids:
+            words = rev_index.get(docid)
+            # Documents not in the index are left for the caller to check.
+            if words is not None and principals.isdisjoint(words):
+                docid = None
+            allowed.append(docid)
+        return allowed
+
+    def _find(self, containers, path):
+        parent_path, _, name = path.rstrip('/').rpartition('/')
+        if name:
+            if parent_path not in containers:
+                try:
+                    containers[parent_path] = find_resource(
+                        self.context, parent_path or '/')
+                except KeyError:
+                    containers[parent_path] = None
+            container = containers[parent_path]
+            if container is not None:
+                try:
+                    return container[traversal_path(name)[0]]
+                except (KeyError, AttributeError, TypeError):
+                    pass
+        try:
+            return find_resource(self.context, path)
+        except KeyError:
+            self._missing(path)
+            return None
 
 
 class PeopleDirectoryCatalogSearch(CatalogSearch):
@@ -107,7 +185,6 @@ class GridEntryInfo(object):
     _created = None
     _creator_title = None
     _creator_url = None
-    _profiles = None
     _profile = None  # profile of creator
     _modified_by_profile = None
 
@@ -159,12 +236,13 @@ class GridEntryInfo(object):
             self._created = self.context.created.strftime("%m/%d/%Y")
         return self._created
 
+    def _get_profile(self, userid):
+        return get_request_cache(self.request).profile(self.context, userid)
+
     @property
     def creator_title(self):
-        if self._profiles is None:
-            self._profiles = find_profiles(self.context)
         if self._profile is None:
-            self._profile = self._profiles.get(self.context.creator, None)
+            self._profile = self._get_profile(self.context.creator)
         if self._creator_title is None:
             self._creator_title = getattr(self._profile, "title",
                                           "no profile title")
@@ -172,10 +250,8 @@ class GridEntryInfo(object):
 
     @property
     def creator_url(self):
-        if self._profiles is None:
-            self._profiles = find_profiles(self.context)
         if self._profile is None:
-            self._profile = self._profiles.get(self.context.creator, None)
+            self._profile = self._get_profile(self.context.creator)
         if self._creator_url is None:
             self._creator_url = resource_url(self._profile, self.request)
         return self._creator_url
@@ -186,9 +262,7 @@ class GridEntryInfo(object):
             modified_by = getattr(self.context, 'modified_by', None)
             if modified_by is None:
                 modified_by = self.context.creator
-            if self._profiles is None:
-                self._profiles = find_profiles(self.context)
-            self._modified_by_profile = self._profiles.get(modified_by, None)
+            self._modified_by_profile = self._get_profile(modified_by)
         return self._modified_by_profile
 
     @property
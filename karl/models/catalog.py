@@ -2,18 +2,26 @@ import os
 import sys
 import time
 import cPickle
+from array import array
 
+import BTrees
 import transaction
 
+from ZODB.POSException import ConflictError
 from zope.event import notify
 from zope.interface import implements
 from zope.component import queryUtility
 from perfmetrics import metricmethod
 from perfmetrics import MetricMod
+from perfmetrics import statsd_client
 
+from pyramid.threadlocal import get_current_request
 from pyramid.traversal import find_resource
 from repoze.catalog import Range
 from repoze.catalog.catalog import Catalog
+from repoze.catalog.catalog import EMPTY_RESULT
+from repoze.catalog.catalog import assertint
+from repoze.catalog.indexes.common import CatalogIndex
 from repoze.catalog.indexes.field import CatalogFieldIndex
 from repoze.catalog.interfaces import ICatalog
 from repoze.catalog.interfaces import ICatalogIndex
@@ -25,8 +33,12 @@ from karl.utilities.lru import LRUCache
 from karl.utils import find_site
 
 from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
 
-LARGE_RESULT_SET = 500
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+ALLOWED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PERMISSION_FILTER_KEY = 'karl.permission_filter'
 
 
 class CachingCatalog(Catalog):
@@ -34,31 +46,49 @@ class CachingCatalog(Catalog):
 
     os = os  # for unit tests
     generation = None  # b/c
+    index_generations = None  # b/c
 
     def __init__(self):
         super(CachingCatalog, self).__init__()
         self.generation = Length(0)
+        self.index_generations = OOBTree()
 
     def clear(self):
         self.invalidate()
         super(CachingCatalog, self).clear()
 
-    def index_doc(self, *arg, **kw):
-        self.invalidate()
-        super(CachingCatalog, self).index_doc(*arg, **kw)
-
-    def unindex_doc(self, *arg, **kw):
-        self.invalidate()
-        super(CachingCatalog, self).unindex_doc(*arg, **kw)
+    def index_doc(self, docid, obj):
+        assertint(docid)
+        for name, index in self.items():
+            before = _docstate(index, docid)
+            index.index_doc(docid, obj)
+            self._invalidate_if_changed(name, index, docid, before)
 
-    def reindex_doc(self, *arg, **kw):
-        self.invalidate()
-        super(CachingCatalog, self).reindex_doc(*arg, **kw)
+    def unindex_doc(self, docid):
+        assertint(docid)
+        for name, index in self.items():
+            before = _docstate(index, docid)
+            index.unindex_doc(docid)
+            self._invalidate_if_changed(name, index, docid, before)
+
+    def reindex_doc(self, docid, obj, names=None):
+        # ``names`` restricts reindexing to the given indexes.
+        assertint(docid)
+        for name, index in self.items():
+            if names is not None and name not in names:
+                continue
+            before = _docstate(index, docid)
+            index.reindex_doc(docid, obj)
+            self._invalidate_if_changed(name, index, docid, before)
 
     def __setitem__(self, *arg, **kw):
         self.invalidate()
         super(CachingCatalog, self).__setitem__(*arg, **kw)
 
+    def _invalidate_if_changed(self, name, index, docid, before):
+        if before is _unknown or _docstate(index, docid) != before:
+            self.invalidate(name)
+
     @MetricMod('CS.%s')
     @metricmethod
     def search(self, *arg, **kw):
@@ -70,11 +100,6 @@ class CachingCatalog(Catalog):
         if 'NO_CATALOG_CACHE' in self.os.environ:
             use_cache = False
 
-        if 'tags' in kw:
-            # The tags index changes without invalidating the catalog,
-            # so don't cache any query involving the tags index.
-            use_cache = False
-
         if not use_cache:
             return self._search(*arg, **kw)
 
@@ -85,47 +110,159 @@ class CachingCatalog(Catalog):
 
         key = cPickle.dumps((arg, kw))
 
+        # A catalog which predates the generation counts as generation 0
+        # until invalidate() first creates it.
         generation = self.generation
+        genval = 0
+        if generation is not None:
+            genval = generation.value
 
-        if generation is None:
-            generation = Length(0)
-
-        genval = generation.value
-
-        if (genval == 0) or (genval > cache.generation):
+        if genval != cache.generation:
             # an update in another process requires that the local cache be
-            # invalidated
+            # invalidated.  (The generation wraps to 0 at sys.maxint, so any
+            # change counts, not only an increase.)
             cache.clear()
             cache.generation = genval
 
-        if cache.get(key) is None:
-            num, docids = self._search(*arg, **kw)
+        # Each cached result is stamped with the generations of the indexes
+        # the query touched; only a change to one of those indexes (made by
+        # this or any other process) makes the entry stale.
+        stamps, dirty = self._index_stamps(_query_index_names(kw))
+
+        cached = cache.get(key)
+        if cached is not None and cached[2] == stamps:
+            return cached[:2]
+
+        num, docids = self._search(*arg, **kw)
+
+        if dirty:
+            # One of the indexes has uncommitted changes in this
+            # transaction; its generation may yet be aborted and reused.
+            return num, docids
 
-            # We don't cache large result sets because the time it takes to
-            # unroll the result set turns out to be far more time than it
-            # takes to run the search. In a particular instance using OSI's
-            # catalog a search that took 0.015s but returned nearly 35,295
-            # results took over 50s to unroll the result set for caching,
-            # significantly slowing search performance.
-            if num > LARGE_RESULT_SET:
-                return num, docids
+        # Results of any size are cached; the cache's byte budget bounds
+        # the memory they use, and a result too large for it is not kept.
+        # Sorted results are a lazy iterator, so unrolling them does the
+        # work of sorting once for every later search.
 
-            # we need to unroll here; a btree-based structure may have
-            # a reference to its connection
-            docids = list(docids)
-            cache[key] = (num, docids)
+        # we need to unroll here; a btree-based structure may have
+        # a reference to its connection
+        docids = array(self._docid_typecode(), docids)
+        cache[key] = (num, docids, stamps)
+
+        return num, docids
+
+    def _index_stamps(self, names):
+        """ Return ``(stamps, dirty)`` for the indexes named in ``names``.
+
+        ``stamps`` is a tuple of ``(name, generation)`` pairs; ``dirty`` is
+        true if any of those generations was changed by the current
+        transaction.
+        """
+        generations = self.index_generations
+        if generations is None:
+            generations = {}
+        stamps = []
+        dirty = False
+        for name in names:
+            generation = generations.get(name)
+            if generation is None:
+                stamps.append((name, 0))
+            else:
+                stamps.append((name, generation.value))
+                dirty = dirty or bool(generation._p_changed)
+        return tuple(stamps), dirty
 
-        return cache.get(key)
+    def _docid_typecode(self):
+        if self.family.maxint > 2147483647:
+            return 'l'
+        return 'i'
 
     @metricmethod
     def _search(self, *arg, **kw):
         start = time.time()
-        res = super(CachingCatalog, self).search(*arg, **kw)
+        principals = _allowed_principals(kw.get('allowed'))
+        if principals is not None and self.get('allowed') is not None:
+            res = self._search_allowed(principals, kw)
+        else:
+            res = super(CachingCatalog, self).search(*arg, **kw)
         duration = time.time() - start
         notify(CatalogQueryEvent(self, kw, duration, res))
         return res
 
-    def invalidate(self):
+    def _search_allowed(self, principals, kw):
+        # Permission filtering: rather than have the 'allowed' index union
+        # the docids of every one of the user's principals on each query,
+        # intersect the rest of the query with the cached set of docids
+        # visible to those principals.
+        query = dict(kw)
+        del query['allowed']
+        options = {}
+        for name in ('sort_index', 'reverse', 'limit', 'sort_type'):
+            if name in query:
+                options[name] = query.pop(name)
+
+        visible = self.allowed_docids(principals)
+        if [name for name in query if name != 'index_query_order']:
+            num, result = super(CachingCatalog, self).search(**query)
+            if result:
+                start = time.time()
+                result = self.family.IF.intersection(result, visible)
+                _record_permission_filter(time.time() - start)
+        else:
+            result = visible
+        if not result:
+            return EMPTY_RESULT
+        return self.sort_result(result, **options)
+
+    @metricmethod
+    def allowed_docids(self, principals):
+        """ Return the set of docids that any of ``principals`` may view.
+
+        The sets are cached per process for each distinct set of
+        principals, until the 'allowed' index changes.
+        """
+        start = time.time()
+        principals = tuple(sorted(set(principals)))
+        key = (self._p_oid or id(self), principals)
+        stamps, dirty = self._index_stamps(['allowed'])
+        generation = self.generation
+        if generation is not None:
+            # a wholesale invalidation, e.g. replacing the index
+            stamps += (generation.value,)
+            dirty = dirty or bool(generation._p_changed)
+        cached = allowed_cache.get(key)
+        if cached is not None and cached[0] == stamps:
+            docids = cached[1]
+        else:
+            docids = self['allowed'].apply(
+                {'query': principals, 'operator': 'or'})
+            if not docids:
+                docids = self.family.IF.Set()
+            if not dirty:
+                allowed_cache[key] = (stamps, docids)
+        _record_permission_filter(time.time() - start)
+        return docids
+
+    def invalidate(self, *names):
+        """ Invalidate cached search results.
+
+        With no arguments every cached result is invalidated.  Otherwise
+        only results of queries that use one of the indexes in ``names``
+        are invalidated.
+        """
+        if names:
+            generations = self.index_generations
+            if generations is None:
+                generations = self.index_generations = OOBTree()
+            for name in names:
+                generation = generations.get(name)
+                if generation is None:
+                    generations[name] = Length(1)
+                else:
+                    _increment(generation)
+            return
+
         # Increment the generation; this tells *another process* that
         # its catalog cache needs to be cleared
         generation = self.generation
@@ -133,11 +270,7 @@ class CachingCatalog(Catalog):
         if generation is None:
             generation = self.generation = Length(0)
 
-        if generation.value >= sys.maxint:
-            # don't keep growing the generation integer; wrap at sys.maxint
-            self.generation.set(0)
-        else:
-            self.generation.change(1)
+        _increment(generation)
 
         # Clear the cache for *this process*
         cache = queryUtility(ICatalogSearchCache)
@@ -145,10 +278,114 @@ class CachingCatalog(Catalog):
             cache.clear()
             cache.generation = self.generation.value
 
+
+def _increment(generation):
+    if generation.value >= sys.maxint:
+        # don't keep growing the generation integer; wrap at sys.maxint
+        generation.set(0)
+    else:
+        generation.change(1)
+
+
+# Keyword arguments to ``Catalog.search`` which are not index names.
+_SEARCH_OPTIONS = ('sort_index', 'reverse', 'limit', 'sort_type',
+                   'index_query_order')
+
+
+def _query_index_names(query):
+    """ Return the sorted names of the indexes a search query reads. """
+    names = set(name for name in query if name not in _SEARCH_OPTIONS)
+    sort_index = query.get('sort_index')
+    if sort_index:
+        names.add(sort_index)
+    return sorted(names)
+
+
+_unknown = object()
+
+
+def _docstate(index, docid):
+    """ Return a comparable snapshot of what ``index`` stores for ``docid``.
+
+    Returns ``_unknown`` for indexes which do not expose their reverse
+    mapping; the catalog assumes such indexes change on every update.
+    """
+    rev_index = getattr(index, '_rev_index', None)  # field, keyword
+    if rev_index is not None:
+        value = rev_index.get(docid)
+        if hasattr(value, 'keys'):
+            value = tuple(value.keys())
+        return value
+
+    docid_to_path = getattr(index, 'docid_to_path', None)  # path2
+    if docid_to_path is not None:
+        return (docid_to_path.get(docid), index.docid_to_attr.get(docid))
+
+    docwords = getattr(getattr(index, 'index', None), '_docwords', None)
+    if docwords is not None:  # text
+        return docwords.get(docid)
+
+    return _unknown
+
+
+def _allowed_principals(query):
+    """ Return the principals of an 'allowed' query of the usual form,
+    ``{'query': principals, 'operator': 'or'}``, else None.
+    """
+    if not isinstance(query, dict) or query.get('operator') != 'or':
+        return None
+    if len(query) != 2:
+        return None
+    principals = query.get('query')
+    if not isinstance(principals, (list, tuple, set, frozenset)):
+        return None
+    return principals
+
+
+def _record_permission_filter(duration):
+    """ Add up the time the current request spends filtering search
+    results by permission; ``report_permission_filter`` reports it.
+    """
+    request = get_current_request()
+    if request is not None:
+        environ = request.environ
+        environ[PERMISSION_FILTER_KEY] = (
+            environ.get(PERMISSION_FILTER_KEY, 0.0) + duration)
+
+
+def report_permission_filter(event):
+    """ NewResponse subscriber reporting the time a request spent on
+    permission filtering of catalog searches.
+    """
+    duration = event.request.environ.get(PERMISSION_FILTER_KEY)
+    if duration is None:
+        return
+    client = statsd_client()
+    if client is not None:
+        client.timing('karl.permission_filter.request', duration * 1000.0)
+
+
+def _cached_size(entry):
+    """ Approximate the memory used by a cached search result. """
+    num, docids, stamps = entry
+    return 256 + docids.itemsize * len(docids)
+
+
+def _allowed_size(entry):
+    """ Approximate the memory used by a cached set of visible docids. """
+    stamps, docids = entry
+    return 256 + 8 * len(docids)
+
+
 # the ICatalogSearchCache component (wired in via ZCML)
-cache = LRUCache(1000)
+cache = LRUCache(10000, maxbytes=CACHE_MAX_BYTES, sizeof=_cached_size,
+                 name='karl.catalog_cache')
 cache.generation = 0
 
+# Docids visible to each set of principals; see allowed_docids.
+allowed_cache = LRUCache(1000, maxbytes=ALLOWED_CACHE_MAX_BYTES,
+                         sizeof=_allowed_size, name='karl.allowed_cache')
+
 
 class CatalogQueryEvent(object):
     implements(ICatalogQueryEvent)
@@ -195,12 +432,228 @@ def reindex_catalog(context, path_re=None, commit_interval=200, dry_run=False,
         else:
             for index in indexes:
                 catalog[index].reindex_doc(docid, model)
+            catalog.invalidate(*indexes)
         if i % commit_interval == 0:
             commit_or_abort()
         i += 1
     commit_or_abort()
 
 
+# Index attributes holding discriminators that parallel reindexing computes
+# in the workers.
+_DISCRIMINATORS = ('discriminator', 'attr_discriminator')
+
+# State of a reindex worker process: its own root and closer.
+_reindex_worker = {}
+
+
+def init_reindex_worker(open_root):
+    """ Initialize a reindex worker process.
+
+    ``open_root`` returns ``(root, closer)``; each worker opens its own
+    database connection.
+    """
+    _reindex_worker['root'], _reindex_worker['closer'] = open_root()
+
+
+def compute_index_values(task):
+    """ Compute the index values of a batch of documents in a worker.
+
+    ``task`` is ``(names, docids)``.  Returns ``(results, seconds)``:
+    ``results`` is a list of ``(docid, values)``, where ``values`` maps
+    ``(index name, discriminator attribute)`` to the computed value, or
+    is None if the document is gone; ``seconds`` maps each index name to
+    the time spent computing its values.
+    """
+    names, docids = task
+    root = _reindex_worker['root']
+    # Start from the latest committed state.
+    transaction.abort()
+    catalog = find_site(root).catalog
+    address_for_docid = catalog.document_map.address_for_docid
+    seconds = dict.fromkeys(names, 0.0)
+    results = []
+    for docid in docids:
+        model = _find_indexed(root, address_for_docid(docid))
+        if model is None:
+            results.append((docid, None))
+            continue
+        values = {}
+        for name in names:
+            index = catalog[name]
+            start = time.time()
+            for attr in _DISCRIMINATORS:
+                discriminator = getattr(index, attr, None)
+                if discriminator is None:
+                    continue
+                if callable(discriminator):
+                    value = discriminator(model, _marker)
+                else:
+                    value = getattr(model, discriminator, _marker)
+                if value is not _marker:
+                    values[(name, attr)] = value
+            seconds[name] += time.time() - start
+        results.append((docid, values))
+        deactivate = getattr(model, '_p_deactivate', None)
+        if deactivate is not None:
+            deactivate()
+    jar = getattr(root, '_p_jar', None)
+    if jar is not None:
+        jar.cacheMinimize()
+    return results, seconds
+
+
+def reindex_catalog_parallel(context, map=map, workers=1, path_re=None,
+                             batch_size=200, dry_run=False, output=None,
+                             transaction=transaction, indexes=None):
+    """ Reindex the catalog, computing index values in worker processes.
+
+    ``map`` runs ``compute_index_values`` over the batches of a round,
+    e.g. the ``map`` of a ``multiprocessing.Pool`` of ``workers`` processes
+    initialized with ``init_reindex_worker``.  Only this process writes
+    to the indexes, one committed batch at a time, so the workers never
+    conflict with each other.  Indexes without a discriminator are
+    reindexed here with the document itself.
+
+    The docids left to reindex are kept on the catalog, so an interrupted
+    run resumes where it stopped.  Finishes with the time spent and the
+    throughput of each index.
+    """
+    def commit_or_abort():
+        if dry_run:
+            output and output('*** aborting ***')
+            transaction.abort()
+        else:
+            output and output('*** committing ***')
+            transaction.commit()
+
+    site = find_site(context)
+    catalog = site.catalog
+
+    todo = getattr(catalog, '_reindex_todo', None)
+    if todo is None:
+        output and output('updating indexes')
+        site.update_indexes()
+        todo = BTrees.family32.IF.TreeSet()
+        for path, docid in catalog.document_map.address_to_docid.items():
+            if path_re is None or path_re.match(path) is not None:
+                todo.insert(docid)
+        catalog._reindex_todo = todo
+        catalog._reindex_indexes = indexes
+        commit_or_abort()
+    else:
+        indexes = catalog._reindex_indexes
+        output and output('resuming reindex of %d documents' % len(todo))
+    if dry_run:
+        # Aborting would forget the progress of a resumed run.
+        todo = BTrees.family32.IF.TreeSet(todo)
+
+    if indexes is not None:
+        output and output('reindexing only indexes %s' % str(indexes))
+        names = list(indexes)
+    else:
+        names = list(catalog.keys())
+    computed = [name for name in names
+                if [attr for attr in _DISCRIMINATORS
+                    if getattr(catalog[name], attr, None) is not None]]
+    other = [name for name in names if name not in computed]
+
+    # index name -> [documents, seconds]
+    stats = dict((name, [0, 0.0]) for name in names)
+    started = time.time()
+    while todo:
+        docids = list(todo.keys()[:batch_size * workers])
+        batches = [docids[i:i + batch_size]
+                   for i in range(0, len(docids), batch_size)]
+        for results, seconds in map(compute_index_values,
+                                    [(computed, batch) for batch in batches]):
+            for name, spent in seconds.items():
+                stats[name][1] += spent
+            for name in computed:
+                _apply_index_values(catalog[name], name, results, stats)
+            if other:
+                _reindex_models(site, catalog, other, results, stats)
+            for docid, values in results:
+                if values is None:
+                    output and output('error: docid %d not found' % docid)
+                todo.remove(docid)
+            catalog.invalidate(*names)
+            output and output('reindexed %d documents, %d left' % (
+                len(results), len(todo)))
+            try:
+                commit_or_abort()
+            except ConflictError:
+                # The batch is still to do; compute it again.
+                output and output('conflict error: retrying')
+                transaction.abort()
+                break
+
+    if not dry_run and getattr(catalog, '_reindex_todo', None) is not None:
+        del catalog._reindex_todo
+        del catalog._reindex_indexes
+        commit_or_abort()
+
+    if output:
+        output('reindexed in %.1f seconds' % (time.time() - started))
+        for name in sorted(names):
+            count, seconds = stats[name]
+            rate = seconds and count / seconds or 0.0
+            output('%-20s %8d documents %8.1f seconds %10.1f per second' % (
+                name, count, seconds, rate))
+
+
+def _find_indexed(root, path):
+    if path is None:
+        return None
+    try:
+        return find_resource(root, path)
+    except KeyError:
+        return None
+
+
+class _Precomputed(object):
+    # Stands in for a discriminator while applying precomputed values.
+    def __init__(self, key):
+        self.key = key
+
+    def __call__(self, values, default):
+        return values.get(self.key, default)
+
+
+def _apply_index_values(index, name, results, stats):
+    saved = {}
+    for attr in _DISCRIMINATORS:
+        if getattr(index, attr, None) is not None:
+            saved[attr] = getattr(index, attr)
+            setattr(index, attr, _Precomputed((name, attr)))
+    start = time.time()
+    try:
+        for docid, values in results:
+            if values is not None:
+                index.reindex_doc(docid, values)
+                stats[name][0] += 1
+    finally:
+        # Restored before committing, so the index is stored unchanged.
+        for attr, discriminator in saved.items():
+            setattr(index, attr, discriminator)
+    stats[name][1] += time.time() - start
+
+
+def _reindex_models(site, catalog, names, results, stats):
+    address_for_docid = catalog.document_map.address_for_docid
+    for docid, values in results:
+        if values is None:
+            continue
+        model = _find_indexed(site, address_for_docid(docid))
+        if model is None:
+            continue
+        for name in names:
+            start = time.time()
+            catalog[name].reindex_doc(docid, model)
+            stats[name][0] += 1
+            stats[name][1] += time.time() - start
+
+
 _marker = object()
 
 
@@ -388,3 +841,163 @@ def convert_to_granular(index, levels=(1000,)):
     g._rev_index.update(index._rev_index)
     g._num_docs.value = index._num_docs()
     return g
+
+
+class IntervalIndex(CatalogIndex, Persistent):
+    """Indexes integer intervals for overlap queries.
+
+    The discriminator returns a ``(start, end)`` tuple.  A query for
+    ``(min, max)`` finds the documents whose interval overlaps that range,
+    inclusive on both ends; either end may be None, making it unbounded.
+
+    Each interval is filed in the bucket of the finest level which holds it
+    whole, keyed by ``start // level``.  Every bucket strictly between the
+    buckets of ``min`` and ``max`` overlaps the query entirely, so only the
+    two boundary buckets of each level are checked interval by interval.
+    Intervals longer than the coarsest level are filed by their end.
+    """
+    implements(
+        ICatalogIndex,
+        IStatistics,
+    )
+
+    def __init__(self, discriminator, levels=(100, 1000, 10000, 100000)):
+        """Create an index.
+
+        levels is an increasing sequence of integer bucket widths.  With
+        ``coarse_datetime_repr`` values, the default is about 3 hours,
+        12 days and 4 months.
+        """
+        super(IntervalIndex, self).__init__(discriminator)
+        self._levels = tuple(sorted(levels))
+        self.clear()
+
+    def clear(self):
+        """Initialize all mappings."""
+        # The reverse index maps a docid to its (start, end) interval
+        self._rev_index = self.family.IO.BTree()
+        # self._buckets: [(level, BTree(start // level -> IFTreeSet))]
+        self._buckets = [(level, self.family.IO.BTree())
+                         for level in self._levels]
+        # Intervals too long for any bucket: BTree(end -> IFTreeSet)
+        self._long = self.family.IO.BTree()
+        self._num_docs = Length(0)
+        self._not_indexed = self.family.IF.Set()
+
+    def documentCount(self):
+        """See interface IStatistics"""
+        return self._num_docs()
+
+    def wordCount(self):
+        """See interface IStatistics"""
+        return len(self._rev_index)
+
+    def _indexed(self):
+        return self._rev_index.keys()
+
+    def index_doc(self, docid, obj):
+        if callable(self.discriminator):
+            value = self.discriminator(obj, _marker)
+        else:
+            value = getattr(obj, self.discriminator, _marker)
+
+        if value is _marker:
+            self.unindex_doc(docid)
+            self._not_indexed.add(docid)
+            return
+
+        start, end = value
+        if end is None:
+            end = start
+        if not isinstance(start, int) or not isinstance(end, int):
+            raise ValueError(
+                'IntervalIndex cannot index non-integer interval %s' %
+                (value,))
+        if end < start:
+            start, end = end, start
+
+        if self._rev_index.get(docid) == (start, end):
+            # There's no need to index the doc; it's already up to date.
+            return
+        self.unindex_doc(docid)
+
+        tree, key = self._locate(start, end)
+        set = tree.get(key)
+        if set is None:
+            set = self.family.IF.TreeSet()
+            tree[key] = set
+        set.insert(docid)
+
+        self._rev_index[docid] = (start, end)
+        self._num_docs.change(1)
+
+    def unindex_doc(self, docid):
+        if docid in self._not_indexed:
+            self._not_indexed.remove(docid)
+
+        interval = self._rev_index.get(docid)
+        if interval is None:
+            return  # not in index
+
+        del self._rev_index[docid]
+        self._num_docs.change(-1)
+
+        tree, key = self._locate(*interval)
+        try:
+            set = tree[key]
+            set.remove(docid)
+            if not set:
+                del tree[key]
+        except KeyError:
+            pass
+
+    def _locate(self, start, end):
+        # Return the tree and key an interval is filed under.
+        for level, tree in self._buckets:
+            if start // level == end // level:
+                return tree, start // level
+        return self._long, end
+
+    def apply(self, query):
+        if isinstance(query, dict):
+            query = query['query']
+        if isinstance(query, Range):
+            query = query.as_tuple()
+        elif not isinstance(query, (tuple, list)):
+            query = (query, query)
+        return self.overlapping(*query)
+
+    def overlapping(self, min, max):
+        """Return an IFSet of the docids whose interval overlaps the
+        range from ``min`` to ``max``, inclusive on both ends.
+
+        min or max can be None, making them unbounded.
+        """
+        family = self.family
+        sets = []
+        candidates = []
+        for level, tree in self._buckets:
+            a = min // level if min is not None else None
+            b = max // level if max is not None else None
+            # The buckets strictly between a and b overlap entirely.
+            sets.extend(tree.values(a, b, excludemin=a is not None,
+                                    excludemax=b is not None))
+            for key in set((a, b)):
+                if key is not None and key in tree:
+                    candidates.append(tree[key])
+        # Long intervals ending before min can't overlap.
+        if max is None:
+            sets.extend(self._long.values(min))
+        else:
+            candidates.extend(self._long.values(min))
+
+        rev_index = self._rev_index
+        matches = []
+        for docids in candidates:
+            for docid in docids:
+                start, end = rev_index[docid]
+                if ((min is None or end >= min) and
+                        (max is None or start <= max)):
+                    matches.append(docid)
+        sets.append(family.IF.Set(matches))
+        return family.IF.multiunion(sets)
@@ -16,10 +16,16 @@
 # 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
 from datetime import datetime
+import heapq
+import random
+import time
 
 _NOW = datetime.utcnow
 
-from appendonly import AppendStack
+from BTrees.Length import Length
+from BTrees.LOBTree import LOBTree
+from BTrees.LLBTree import LLTreeSet
+from BTrees.OOBTree import OOBTree
 from persistent import Persistent
 from persistent.mapping import PersistentMapping
 from pyramid.security import principals_allowed_by_permission
@@ -40,69 +46,218 @@ from karl.models.interfaces import IUserRemovedGroup
 from karl.tagging.interfaces import ITagAddedEvent
 from karl.utils import find_catalog
 from karl.utils import find_community
+from karl.utils import get_config_setting
 from karl.utils import find_events
 from karl.utils import find_interface
 from karl.utils import find_site
 from karl.utils import find_tags
 
 
+# Formerly the shape of the AppendStack holding the events; still used to
+# split event positions into (generation, index) pairs.
 APPENDSTACK_MAX_LAYERS = 20
 APPENDSTACK_MAX_LENGTH = 250
 
 
+def _descending(keys, before=None):
+    """ Yield the keys of a BTree or TreeSet, largest first.
+
+    Only keys less than ``before`` are yielded, if it is not None.  Each
+    key costs one seek, so stopping early does not load the whole tree.
+    """
+    while True:
+        try:
+            if before is None:
+                key = keys.maxKey()
+            else:
+                key = keys.maxKey(before - 1)
+        except ValueError:
+            return
+        yield key
+        before = key
+
+
+def _merged(sets, before=None):
+    """ Yield the union of several TreeSets, largest first, lazily. """
+    heap = []
+    for i, keys in enumerate(sets):
+        iterator = _descending(keys, before)
+        for key in iterator:
+            heap.append((-key, i, iterator))
+            break
+    heapq.heapify(heap)
+    last = None
+    while heap:
+        key, i, iterator = heap[0]
+        for following in iterator:
+            heapq.heapreplace(heap, (-following, i, iterator))
+            break
+        else:
+            heapq.heappop(heap)
+        if key != last:
+            last = key
+            yield -key
+
+
 class SiteEvents(Persistent):
+    """ The event stream, indexed by principal and by user.
+
+    Each event is stored under its position in the stream, from which its
+    (generation, index) pair is derived.  Positions are also indexed by the
+    principals allowed to see the event and by the users who caused it or
+    created its content, so a filtered page of events costs a seek per
+    event yielded rather than a scan of the whole stream.
+
+    Positions come from the clock, with random low bits, rather than from
+    the last position: concurrent pushes insert different keys, which the
+    BTrees resolve.
+
+    All events are kept, so ``older`` reaches back to the first, unless
+    ``max_events`` (by default the ``site_events_max`` setting) caps the
+    stream; then only the newest ``max_events`` events are kept.
+    """
     implements(ISiteEvents)
+    max_events = None
+    _count = None
 
     def __init__(self):
-        self._stack = AppendStack(APPENDSTACK_MAX_LAYERS,
-                                  APPENDSTACK_MAX_LENGTH)
+        self._events = LOBTree()
+        self._allowed = OOBTree()   # principal -> positions
+        self._creators = OOBTree()  # userid -> positions
+        self._count = Length()
 
     def __iter__(self):
         """ See ISiteEvents.
         """
-        for gen, index, mapping in self._stack:
-            yield gen, index, mapping
-        # TODO:  iterate archive?
+        return self._iter(self._positions(None, None))
 
     def checked(self, principals, created_by):
         """ See ISiteEvents.
         """
-        if principals:
-            principals = set(principals)
-        for gen, index, mapping in self._stack:
-            userid = mapping.get('userid', None)
-            created = mapping.get('content_creator', userid)
-            if created_by and created != created_by and userid != created_by:
-                continue
-            allowed = set(mapping.get('allowed', ()))
-            if not principals or allowed & principals:
-                yield gen, index, mapping
-        # TODO:  iterate archive?
+        return self._iter(self._positions(principals, created_by))
 
     def newer(self, latest_gen, latest_index, principals=None, created_by=None):
         """ See ISiteEvents.
         """
-        iterable = self.checked(principals, created_by)
-        for gen, index, mapping in iterable:
-            if (gen, index) > (latest_gen, latest_index):
-                yield gen, index, mapping
-        # TODO:  iterate archive?
+        latest = _position(latest_gen, latest_index)
+        for position in self._positions(principals, created_by):
+            if position <= latest:
+                break
+            yield self._item(position)
 
     def older(self, earliest_gen, earliest_index,
               principals=None, created_by=None):
         """ See ISiteEvents.
         """
-        iterable = self.checked(principals, created_by)
-        for gen, index, mapping in iterable:
-            if (gen, index) < (earliest_gen, earliest_index):
-                yield gen, index, mapping
-        # TODO:  iterate archive?
+        earliest = _position(earliest_gen, earliest_index)
+        return self._iter(self._positions(principals, created_by, earliest))
 
     def push(self, **kw):
         """ See ISiteEvents.
         """
-        # TODO:  pruner=???
-        self._stack.push(PersistentMapping(kw))
+        position = self._new_position()
+        while position in self._events:
+            position += 1
+        self._add(position, PersistentMapping(kw))
+        max_events = self._max_events()
+        if max_events and self._count() > max_events + APPENDSTACK_MAX_LENGTH:
+            self._prune(max_events)
+
+    def update(self, gen, index, **kw):
+        """ See ISiteEvents.
+        """
+        position = _position(gen, index)
+        mapping = self._events[position]
+        self._unindex(position, mapping)
+        mapping.update(kw)
+        self._index(position, mapping)
+
+    def _new_position(self):
+        return (int(time.time() * 1000000) << 8) | random.randrange(256)
+
+    def _add(self, position, mapping):
+        if self._count is None:
+            self._count = Length(len(self._events))
+        self._events[position] = mapping
+        self._index(position, mapping)
+        self._count.change(1)
+
+    def _max_events(self):
+        max_events = self.max_events
+        if max_events is None:
+            max_events = get_config_setting('site_events_max', None)
+        if max_events:
+            return int(max_events)
+        return None
+
+    def _prune(self, max_events):
+        excess = self._count() - max_events
+        for position in list(self._events.keys()[:excess]):
+            self._unindex(position, self._events.pop(position))
+        self._count.change(-excess)
+
+    def _index(self, position, mapping):
+        for principal in mapping.get('allowed', ()):
+            _insert(self._allowed, principal, position)
+        for userid in _creators(mapping):
+            _insert(self._creators, userid, position)
+
+    def _unindex(self, position, mapping):
+        for principal in mapping.get('allowed', ()):
+            _remove(self._allowed, principal, position)
+        for userid in _creators(mapping):
+            _remove(self._creators, userid, position)
+
+    def _positions(self, principals, created_by, before=None):
+        if created_by:
+            created = self._creators.get(created_by)
+            if created is None:
+                return iter(())
+            positions = _descending(created, before)
+            if principals:
+                allowed = [self._allowed[principal] for principal in
+                           set(principals) if principal in self._allowed]
+                positions = (position for position in positions
+                             if any(position in x for x in allowed))
+            return positions
+        if principals:
+            return _merged([self._allowed[principal] for principal in
+                            set(principals) if principal in self._allowed],
+                           before)
+        return _descending(self._events, before)
+
+    def _item(self, position):
+        gen, index = divmod(position, APPENDSTACK_MAX_LENGTH)
+        return gen, index, self._events[position]
+
+    def _iter(self, positions):
+        for position in positions:
+            yield self._item(position)
+
+
+def _position(gen, index):
+    return gen * APPENDSTACK_MAX_LENGTH + index
+
+
+def _creators(mapping):
+    userid = mapping.get('userid', None)
+    created = mapping.get('content_creator', userid)
+    return set(x for x in (userid, created) if x is not None)
+
+
+def _insert(index, key, position):
+    positions = index.get(key)
+    if positions is None:
+        positions = index[key] = LLTreeSet()
+    positions.insert(position)
+
+
+def _remove(index, key, position):
+    positions = index.get(key)
+    if positions is not None:
+        positions.remove(position)
+        if not positions:
+            del index[key]
 
 #
 #   Event subscribers
@@ -677,6 +677,13 @@ class ISiteEvents(Interface):
         """ Append an mapping to the stack.
         """
 
+    def update(gen, index, **kw):
+        """ Update the mapping at (`gen`, `index`) with the given values.
+
+        Use this rather than changing the mapping in place, so that the
+        event is reindexed.
+        """
+
 
 class IUsers(Interface):
     """ The user source """
@@ -108,7 +108,10 @@ def get_groups(obj, default):
     users = find_users(obj)
     user = users.get_by_id(obj.__name__)
     if user:
-        return user.get('groups', default)
+        groups = user.get('groups')
+        if groups is None:
+            return default
+        return set(groups)
     return default
 
 
@@ -0,0 +1,282 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""A catalog search cache shared by all processes on a node.
+
+The default ``ICatalogSearchCache`` is an in-memory LRU cache private to
+each process.  This module provides an implementation backed by a sqlite
+database file, so every worker using the same file shares cached results
+and a restarted worker starts warm.  To use it, override the utility in a
+customization package::
+
+  <utility
+    provides="karl.models.interfaces.ICatalogSearchCache"
+    component="karl.models.sharedcache.cache"
+  />
+
+The database file is taken from the ``catalog_cache_path`` setting in the
+application config, defaulting to ``catalog_cache.db`` in the ``var``
+directory.  Each site needs its own file.  A file not owned by the user
+running the application is refused.
+"""
+
+from array import array
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from zope.interface import implements
+
+from repoze.catalog.catalog import ResultSetSize
+
+from karl.models.interfaces import ICatalogSearchCache
+from karl.utils import get_config_setting
+
+log = logging.getLogger(__name__)
+
+DEFAULT_NAME = 'catalog_cache.db'
+
+# Access times are only rewritten when older than this many seconds, so
+# that most cache hits do not write to the database.
+ATIME_RESOLUTION = 30
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS entries ("
+    " key BLOB PRIMARY KEY,"
+    " value BLOB NOT NULL,"
+    " size INTEGER NOT NULL,"
+    " atime REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)",
+    "CREATE TABLE IF NOT EXISTS meta ("
+    " name TEXT PRIMARY KEY,"
+    " value INTEGER NOT NULL)",
+)
+
+
+class CacheUnavailable(sqlite3.Error):
+    """ The database file may not be used. """
+
+
+_warned = False
+
+
+def _unavailable():
+    # Called while handling the error.  A cache which can't be used fails
+    # on every lookup, so only the first failure in a process is logged.
+    global _warned
+    if not _warned:
+        _warned = True
+        log.warning('catalog cache unavailable', exc_info=True)
+
+
+def _dumps(entry):
+    """ Serialize a cached search result, ``(num, docids, stamps)``.
+
+    The docids are stored as the raw bytes of their array and the rest as
+    JSON, so reading an entry back never runs code, as unpickling could.
+    """
+    num, docids, stamps = entry
+    header = json.dumps([int(num), getattr(num, 'total', None),
+                         docids.typecode, stamps])
+    return header + '\n' + docids.tostring()
+
+
+def _loads(data):
+    header, docids = data.split('\n', 1)
+    num, total, typecode, stamps = json.loads(header)
+    if total is not None:
+        num = ResultSetSize(num, total)
+    docids = array(str(typecode), docids)
+    stamps = tuple(tuple(stamp) for stamp in stamps)
+    return num, docids, stamps
+
+
+def _default_path():
+    path = get_config_setting('catalog_cache_path')
+    if path:
+        return path
+    var = get_config_setting('var')
+    if not var:
+        raise CacheUnavailable('Set catalog_cache_path or var')
+    return os.path.join(var, DEFAULT_NAME)
+
+
+def _check_owner(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return  # sqlite creates it
+    if st.st_uid != os.getuid():
+        raise CacheUnavailable('%s is not owned by this user' % path)
+
+
+class SQLiteCatalogSearchCache(object):
+    """ An ``ICatalogSearchCache`` stored in a sqlite database file.
+
+    Cached values are serialized by ``_dumps``.  The least recently used
+    entries are evicted to keep their total size at or below ``maxbytes``.
+    Errors from sqlite (e.g. a locked database) are logged and treated as
+    cache misses rather than failing the search.
+    """
+    implements(ICatalogSearchCache)
+
+    time = time  # for unit tests
+
+    def __init__(self, path=None, maxbytes=64 * 1024 * 1024, timeout=1.0):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections may not be shared between threads or carried
+        # across a fork, so each thread of each process opens its own.
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, 'pid', None) != pid:
+            path = self.path
+            if path is None:
+                path = _default_path()
+            _check_owner(path)
+            conn = sqlite3.connect(path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            local.conn = conn
+            local.pid = pid
+        return local.conn
+
+    def _get_meta(self, conn, name):
+        row = conn.execute(
+            'SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def _set_meta(self, conn, name, value):
+        conn.execute(
+            'INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+            (name, value))
+
+    @property
+    def size(self):
+        """ The total size in bytes of the cached values. """
+        return self._get_meta(self._connection(), 'bytes')
+
+    def _get_generation(self):
+        try:
+            return self._get_meta(self._connection(), 'generation')
+        except sqlite3.Error:
+            _unavailable()
+            return 0
+
+    def _set_generation(self, value):
+        try:
+            self._set_meta(self._connection(), 'generation', value)
+        except sqlite3.Error:
+            _unavailable()
+
+    generation = property(_get_generation, _set_generation)
+
+    def clear(self):
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM entries')
+                self._set_meta(conn, 'bytes', 0)
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            _unavailable()
+
+    def get(self, key, default=None):
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                'SELECT value, atime FROM entries WHERE key = ?',
+                (buffer(key),)).fetchone()
+            if row is None:
+                return default
+            value, atime = row
+            now = self.time.time()
+            if now - atime > ATIME_RESOLUTION:
+                conn.execute('UPDATE entries SET atime = ? WHERE key = ?',
+                             (now, buffer(key)))
+        except sqlite3.Error:
+            _unavailable()
+            return default
+        try:
+            return _loads(str(value))
+        except (ValueError, TypeError):
+            log.warning('corrupt catalog cache entry', exc_info=True)
+            return default
+
+    def __setitem__(self, key, val):
+        data = _dumps(val)
+        size = len(data)
+        if size > self.maxbytes:
+            return
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._store(conn, buffer(key), buffer(data), size)
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            _unavailable()
+
+    def _store(self, conn, key, data, size):
+        total = self._get_meta(conn, 'bytes')
+        row = conn.execute(
+            'SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            total -= row[0]
+        conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, size, atime) '
+            'VALUES (?, ?, ?, ?)', (key, data, size, self.time.time()))
+        total += size
+
+        if total > self.maxbytes:
+            # evict the least recently used entries
+            victims = []
+            excess = total - self.maxbytes
+            for victim, victim_size in conn.execute(
+                    'SELECT key, size FROM entries WHERE key != ? '
+                    'ORDER BY atime', (key,)):
+                if excess <= 0:
+                    break
+                victims.append((victim,))
+                excess -= victim_size
+                total -= victim_size
+            conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+
+        self._set_meta(conn, 'bytes', total)
+
+
+# Alternate ICatalogSearchCache component; see the module docstring.
+cache = SQLiteCatalogSearchCache()
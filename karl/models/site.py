@@ -50,6 +50,7 @@ from karl.content.interfaces import IPhoto
 from karl.content.models.adapters import FlexibleTextIndexData
 from karl.models.catalog import CachingCatalog
 from karl.models.catalog import GranularIndex
+from karl.models.catalog import IntervalIndex
 from karl.models.interfaces import IInvitationsFolder
 from karl.models.interfaces import ICommunities
 from karl.models.interfaces import IIndexFactory
@@ -330,6 +331,15 @@ def get_end_date(object, default):
     return _get_date_or_datetime(object, 'endDate', default)
 
 
+def get_date_range(object, default):
+    # For finding the calendar events overlapping a period
+    start = _get_date_or_datetime(object, 'startDate', None)
+    if start is None:
+        return default
+    end = _get_date_or_datetime(object, 'endDate', None)
+    return (start, end)
+
+
 def get_publication_date(object, default):
     return _get_date_or_datetime(object, 'publication_date', default)
 
@@ -522,6 +532,7 @@ class Site(Folder):
             'content_modified': GranularIndex(get_content_modified_date),
             'start_date': GranularIndex(get_start_date),
             'end_date': GranularIndex(get_end_date),
+            'date_range': IntervalIndex(get_date_range),
             'publication_date': GranularIndex(get_publication_date),
             'mimetype': CatalogFieldIndex(get_mimetype),
             'creator': CatalogFieldIndex(get_creator),
@@ -38,6 +38,7 @@ from karl.models.interfaces import ILetterManager
 from karl.models.interfaces import IObjectVersion
 from karl.models.interfaces import IProfile
 from karl.models.peopledirectory import reindex_peopledirectory
+from karl.security.cache import invalidate_acl
 from karl.utils import find_catalog
 from karl.utils import find_peopledirectory_catalog
 from karl.utils import find_profiles
@@ -112,6 +113,13 @@ def handle_content_removed(obj, event):
         cleanup_content_tags(obj, docids)
 
 
+def invalidate_acl_cache(obj, event):
+    """ Forget the cached ACLs of content being removed, so nothing later
+    added at the same path inherits them.
+    """
+    invalidate_acl(obj)
+
+
 def reindex_content(obj, event):
     """ Reindex a single piece of content (non-recursive); an
     IObjectModifed event subscriber """
@@ -141,6 +141,76 @@ class TestCatalogSearch(unittest.TestCase):
         self.assertEqual(resolver(123), None)
 
 
+class TestCatalogResolver(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _getTargetClass(self):
+        from karl.models.adapters import CatalogResolver
+        return CatalogResolver
+
+    def _makeOne(self, context, catalog):
+        return self._getTargetClass()(context, catalog)
+
+    def _makeSite(self):
+        site = testing.DummyModel()
+        site['a'] = CountingFolder()
+        site['a']['x'] = testing.DummyModel()
+        site['a']['y z'] = testing.DummyModel()
+        site['b'] = testing.DummyModel()
+        return site
+
+    def test_call(self):
+        site = self._makeSite()
+        catalog = karltesting.DummyCatalog({1: '/a/x'})
+        resolver = self._makeOne(site, catalog)
+        self.assertEqual(resolver(1), site['a']['x'])
+        self.assertEqual(resolver(2), None)
+
+    def test_resolve_many(self):
+        site = self._makeSite()
+        catalog = karltesting.DummyCatalog(
+            {1: '/a/x', 2: '/a/y%20z', 3: '/b', 4: '/a/missing', 5: '/'})
+        resolver = self._makeOne(site, catalog)
+        result = resolver.resolve_many([3, 2, 1, 4, 6, 5])
+        lookups = list(site['a'].lookups)
+        self.assertEqual(result, [site['b'], site['a']['y z'],
+                                  site['a']['x'], None, None, site])
+        # siblings share one traversal to their container; the missing
+        # one is retried by path
+        self.assertEqual(lookups, ['y z', 'x', 'missing', 'missing'])
+
+    def test_resolve_many_principals(self):
+        from BTrees.IOBTree import IOBTree
+        from BTrees.OOBTree import OOSet
+        site = self._makeSite()
+        catalog = karltesting.DummyCatalog(
+            {1: '/a/x', 2: '/a/y%20z', 3: '/b'})
+        catalog['allowed'] = allowed = testing.DummyModel()
+        allowed._rev_index = IOBTree({1: OOSet(['fred', 'group.staff']),
+                                      2: OOSet(['barney'])})
+        resolver = self._makeOne(site, catalog)
+        result = resolver.resolve_many([1, 2, 3],
+                                       principals=['group.staff'])
+        lookups = list(site['a'].lookups)
+        self.assertEqual(result, [site['a']['x'], None, site['b']])
+        self.assertEqual(lookups, ['x'])
+
+
+class CountingFolder(testing.DummyModel):
+    def __init__(self):
+        testing.DummyModel.__init__(self)
+        self.lookups = []
+
+    def __getitem__(self, name):
+        self.lookups.append(name)
+        return testing.DummyModel.__getitem__(self, name)
+
+
 class TestPeopleDirectoryCatalogSearch(unittest.TestCase):
 
     def setUp(self):
@@ -291,6 +361,24 @@ class TestGridEntryInfo(unittest.TestCase):
         self.assertEqual(adapter.creator_url,
                          'http://example.com/profiles/creator/')
 
+    def test_creator_profile_shared_within_request(self):
+        from karl.request import get_request_cache
+        request = testing.DummyRequest()
+        context = testing.DummyModel()
+        from karl.models.interfaces import ISite
+        from zope.interface import directlyProvides
+        directlyProvides(context, ISite)
+        creator = testing.DummyModel(title='Dummy creator')
+        context['profiles'] = profiles = testing.DummyModel()
+        profiles['creator'] = creator
+        context['a'] = a = testing.DummyModel(creator='creator')
+        context['b'] = b = testing.DummyModel(creator='creator')
+        self.assertEqual(self._makeOne(a, request).creator_title,
+                         'Dummy creator')
+        self.assertEqual(self._makeOne(b, request).creator_title,
+                         'Dummy creator')
+        self.assertEqual(get_request_cache(request).saved, {'profiles': 1})
+
     def test_modified_by_title_falls_back_to_creator(self):
         request = testing.DummyRequest()
         context = testing.DummyModel()
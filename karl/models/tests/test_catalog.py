@@ -1,4 +1,5 @@
 import unittest
+from array import array
 
 from pyramid import testing
 
@@ -44,22 +45,53 @@ class TestCachingCatalog(unittest.TestCase):
         cache = DummyCache({1:1})
         self._registerCache(cache)
         catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        generation = catalog.generation.value
         catalog.index_doc(1,1)
-        self.assertEqual(cache, {})
+        self.assertEqual(catalog.generation.value, generation)
+        self.assertEqual(catalog.index_generations['dummy'].value, 1)
+
+    def test_index_doc_unchanged_does_not_invalidate(self):
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyFieldIndex()
+        catalog['other'] = DummyFieldIndex()
+        catalog.index_doc(1, 1)
+        self.assertEqual(catalog.index_generations['dummy'].value, 1)
+        self.assertEqual(catalog.index_generations['other'].value, 1)
+        catalog['other'].discriminator = lambda obj, default: 2
+        catalog.reindex_doc(1, 1)
+        self.assertEqual(catalog.index_generations['dummy'].value, 1)
+        self.assertEqual(catalog.index_generations['other'].value, 2)
+
+    def test_index_doc_non_integer_docid(self):
+        catalog = self._makeOne()
+        self.assertRaises(ValueError, catalog.index_doc, 'a', 1)
 
     def test_reindex_doc(self):
         cache = DummyCache({1:1})
         self._registerCache(cache)
         catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
         catalog.reindex_doc(1,1)
-        self.assertEqual(cache, {})
+        self.assertEqual(catalog.index_generations['dummy'].value, 1)
+
+    def test_reindex_doc_names(self):
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog['other'] = DummyIndex()
+        catalog.reindex_doc(1, 1, names=('other',))
+        self.assertEqual(catalog['dummy'].indexed, {})
+        self.assertEqual(catalog['other'].indexed, {1: 1})
+        self.failIf('dummy' in catalog.index_generations)
 
     def test_unindex_doc(self):
-        cache = DummyCache({1:1})
-        self._registerCache(cache)
         catalog = self._makeOne()
+        catalog['dummy'] = DummyFieldIndex()
         catalog.unindex_doc(1)
-        self.assertEqual(cache, {})
+        self.failIf('dummy' in catalog.index_generations)
+        catalog.index_doc(1, 1)
+        catalog.unindex_doc(1)
+        self.assertEqual(catalog.index_generations['dummy'].value, 2)
 
     def test_setitem(self):
         cache = DummyCache({1:1})
@@ -76,15 +108,112 @@ class TestCachingCatalog(unittest.TestCase):
         catalog.index_doc(1,1)
         self.assertEqual(cache, {})
         result = catalog.search(dummy=1)
-        self.assertEqual(result, (3, [1,2,3]))
+        self.assertEqual(result, (3, array('i', [1,2,3])))
         self.assertEqual(len(cache), 1)
         import cPickle
         key = cPickle.dumps(((), {'dummy':1}))
         self.failUnless(key in cache)
+        self.assertEqual(cache[key], (3, array('i', [1,2,3]), (('dummy', 1),)))
         result = catalog.search(dummy=1)
-        self.assertEqual(result, (3, [1,2,3]))
+        self.assertEqual(result, (3, array('i', [1,2,3])))
         self.failUnless(key in cache)
 
+    def test_search_cached(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog.index_doc(1,1)
+        catalog.search(dummy=1)
+        catalog._search = None  # must not be called
+        result = catalog.search(dummy=1)
+        self.assertEqual(result, (3, array('i', [1,2,3])))
+
+    def test_search_tags_cached_until_tags_change(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['tags'] = DummyIndex()
+        catalog.search(tags=['a'])
+        searched = []
+        catalog._search = lambda **kw: searched.append(kw) or (0, [])
+        catalog.search(tags=['a'])
+        self.assertEqual(searched, [])
+        catalog.invalidate('tags')
+        catalog.search(tags=['a'])
+        self.assertEqual(searched, [{'tags': ['a']}])
+
+    def test_search_stale_after_index_change(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog['other'] = DummyIndex()
+        catalog.search(dummy=1)
+        catalog.invalidate('other')
+        self.assertEqual(len(cache), 1)
+        searched = []
+        catalog._search = lambda **kw: searched.append(kw) or (0, [])
+        catalog.search(dummy=1)
+        self.assertEqual(searched, [])
+        catalog.invalidate('dummy')
+        result = catalog.search(dummy=1)
+        self.assertEqual(result, (0, array('i', [])))
+        self.assertEqual(searched, [{'dummy': 1}])
+
+    def test_search_stale_after_sort_index_change(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog['other'] = DummyIndex()
+        catalog._search = lambda **kw: (0, [])
+        catalog.search(dummy=1, sort_index='other', limit=5)
+        import cPickle
+        key = cPickle.dumps(((), {'dummy':1, 'sort_index':'other',
+                                  'limit':5}))
+        self.assertEqual(cache[key][2], (('dummy', 0), ('other', 0)))
+        catalog.invalidate('other')
+        catalog.search(dummy=1, sort_index='other', limit=5)
+        self.assertEqual(cache[key][2], (('dummy', 0), ('other', 1)))
+
+    def test_search_large_unsorted_result_cached(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        docids = catalog.family.IF.Set(range(5001))
+        catalog._search = lambda **kw: (len(docids), docids)
+        num, result = catalog.search(dummy=1)
+        self.assertEqual(num, 5001)
+        self.assertEqual(result, array('i', docids))
+        self.assertEqual(len(cache), 1)
+
+    def test_search_large_sorted_result_cached(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        docids = iter(range(5000, -1, -1))
+        catalog._search = lambda **kw: (5001, docids)
+        num, result = catalog.search(dummy=1, sort_index='dummy')
+        self.assertEqual(result, array('i', range(5000, -1, -1)))
+        self.assertEqual(len(cache), 1)
+        catalog._search = None  # must not be called
+        self.assertEqual(catalog.search(dummy=1, sort_index='dummy'),
+                         (num, result))
+
+    def test_search_dirty_generation_not_cached(self):
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog.index_doc(1,1)
+        catalog.index_generations['dummy'] = DummyLength(2, True)
+        result = catalog.search(dummy=1)
+        self.assertEqual(result, (3, [1,2,3]))
+        self.assertEqual(len(cache), 0)
+
     def test_search_no_catalog_cache_in_environ(self):
         cache = DummyCache({})
         self._registerCache(cache)
@@ -124,8 +253,38 @@ class TestCachingCatalog(unittest.TestCase):
         catalog['dummy'] = DummyIndex()
         catalog.index_doc(1,1)
         catalog.generation = None
+        cache.generation = 0
         result = catalog.search(dummy=1)
-        self.assertEqual(result, (3, [1,2,3]))
+        self.assertEqual(result, (3, array('i', [1,2,3])))
+        self.assertEqual(cache.generation, 0)
+        catalog._search = None  # must not be called
+        self.assertEqual(catalog.search(dummy=1), result)
+        catalog.invalidate()
+        self.assertEqual(catalog.generation.value, 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_search_generation_0_does_not_clear(self):
+        from BTrees.Length import Length
+        cache = DummyCache({})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        catalog.index_doc(1,1)
+        catalog.generation = Length(0)
+        cache.generation = 0
+        result = catalog.search(dummy=1)
+        catalog._search = None  # must not be called
+        self.assertEqual(catalog.search(dummy=1), result)
+
+    def test_search_generation_wrapped(self):
+        cache = DummyCache({'stale': 1})
+        self._registerCache(cache)
+        catalog = self._makeOne()
+        catalog['dummy'] = DummyIndex()
+        cache.generation = 5
+        catalog.generation.set(0)
+        catalog.search(dummy=1)
+        self.failIf('stale' in cache)
         self.assertEqual(cache.generation, 0)
 
     def test_search_generation_gt_cachegen(self):
@@ -136,10 +295,11 @@ class TestCachingCatalog(unittest.TestCase):
         catalog = self._makeOne()
         catalog['dummy'] = DummyIndex()
         catalog.index_doc(1,1)
+        cache.generation = -1
         catalog.generation = Length(1)
         result = catalog.search(dummy=1)
-        self.assertEqual(result, (3, [1,2,3]))
-        self.assertEqual(cache.generation, 2)
+        self.assertEqual(result, (3, array('i', [1,2,3])))
+        self.assertEqual(cache.generation, 1)
 
     def test_search_returns_generator(self):
         cache = DummyCache({})
@@ -151,7 +311,7 @@ class TestCachingCatalog(unittest.TestCase):
             return (1, gen())
         catalog._search = dummy
         result = catalog.search(dummy=1)
-        self.assertEqual(result, (1, [1]))
+        self.assertEqual(result, (1, array('i', [1])))
         self.assertEqual(len(cache), 1)
 
     def test_invalidate_generation_is_None(self):
@@ -163,6 +323,24 @@ class TestCachingCatalog(unittest.TestCase):
         self.assertEqual(catalog.generation.value, 1)
         self.assertEqual(cache.generation, 1)
 
+    def test_invalidate_names(self):
+        cache = DummyCache({1:1})
+        catalog = self._makeOne()
+        self._registerCache(cache)
+        generation = catalog.generation.value
+        catalog.invalidate('a', 'b')
+        catalog.invalidate('a')
+        self.assertEqual(catalog.generation.value, generation)
+        self.assertEqual(catalog.index_generations['a'].value, 2)
+        self.assertEqual(catalog.index_generations['b'].value, 1)
+        self.assertEqual(cache, {1:1})
+
+    def test_invalidate_names_index_generations_is_None(self):
+        catalog = self._makeOne()
+        catalog.index_generations = None
+        catalog.invalidate('a')
+        self.assertEqual(catalog.index_generations['a'].value, 1)
+
     def test_invalidate_generation_gt_sys_maxint(self):
         from BTrees.Length import Length
         import sys
@@ -200,6 +378,129 @@ class TestCachingCatalog(unittest.TestCase):
         self.assertEqual(result, (3, [1,2,3]))
         self.assertEqual(len(cache), 0)
 
+class TestCachingCatalogAllowed(unittest.TestCase):
+    def setUp(self):
+        from karl.models.catalog import allowed_cache
+        testing.cleanUp()
+        allowed_cache.clear()
+
+    def tearDown(self):
+        from karl.models.catalog import allowed_cache
+        testing.cleanUp()
+        allowed_cache.clear()
+
+    def _makeOne(self):
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from repoze.catalog.indexes.keyword import CatalogKeywordIndex
+        from karl.models.catalog import CachingCatalog
+        catalog = CachingCatalog()
+        catalog['allowed'] = CatalogKeywordIndex(
+            lambda obj, default: obj['allowed'])
+        catalog['name'] = CatalogFieldIndex(lambda obj, default: obj['name'])
+        for docid, name, allowed in [(1, 'c', ['fred']),
+                                     (2, 'b', ['fred', 'group.a']),
+                                     (3, 'a', ['group.b']),
+                                     (4, 'b', ['group.b'])]:
+            catalog.index_doc(docid, {'name': name, 'allowed': allowed})
+        return catalog
+
+    def _allowed(self, *principals):
+        return {'query': list(principals), 'operator': 'or'}
+
+    def test_search(self):
+        catalog = self._makeOne()
+        num, docids = catalog.search(allowed=self._allowed('fred', 'group.b'),
+                                     name='b', use_cache=False)
+        self.assertEqual(list(docids), [2, 4])
+        num, docids = catalog.search(allowed=self._allowed('group.a'),
+                                     name='c', use_cache=False)
+        self.assertEqual(num, 0)
+        self.assertEqual(list(docids), [])
+
+    def test_search_sorted(self):
+        catalog = self._makeOne()
+        num, docids = catalog.search(allowed=self._allowed('fred', 'group.b'),
+                                     sort_index='name', limit=3,
+                                     use_cache=False)
+        self.assertEqual(num.total, 4)
+        self.assertEqual(list(docids), [3, 2, 4])
+
+    def test_search_and_operator_not_cached(self):
+        catalog = self._makeOne()
+        num, docids = catalog.search(
+            allowed={'query': ['fred', 'group.a'], 'operator': 'and'},
+            use_cache=False)
+        self.assertEqual(list(docids), [2])
+        self.assertEqual(catalog.allowed_docids(['fred']).keys(), [1, 2])
+
+    def test_allowed_docids_cached(self):
+        catalog = self._makeOne()
+        docids = catalog.allowed_docids(['group.b', 'fred'])
+        self.assertEqual(list(docids), [1, 2, 3, 4])
+        catalog['allowed'].apply = None  # must not be called
+        self.failUnless(catalog.allowed_docids(['fred', 'group.b'])
+                        is docids)
+
+    def test_allowed_docids_invalidated(self):
+        catalog = self._makeOne()
+        self.assertEqual(list(catalog.allowed_docids(['fred'])), [1, 2])
+        catalog.reindex_doc(3, {'name': 'a', 'allowed': ['fred']})
+        self.assertEqual(list(catalog.allowed_docids(['fred'])), [1, 2, 3])
+        catalog.invalidate()
+        catalog['allowed'].apply = lambda query: catalog.family.IF.Set([9])
+        self.assertEqual(list(catalog.allowed_docids(['fred'])), [9])
+
+    def test_permission_filter_time(self):
+        from perfmetrics import set_statsd_client
+        from karl.models.catalog import PERMISSION_FILTER_KEY
+        from karl.models.catalog import report_permission_filter
+        request = testing.DummyRequest()
+        testing.setUp(request=request)
+        client = DummyStatsdClient()
+        set_statsd_client(client)
+        try:
+            catalog = self._makeOne()
+            catalog.search(allowed=self._allowed('fred'), name='b',
+                           use_cache=False)
+            report_permission_filter(DummyEvent(request))
+        finally:
+            set_statsd_client(None)
+        self.failUnless(request.environ[PERMISSION_FILTER_KEY] >= 0)
+        names = [name for name, value in client.timings]
+        self.failUnless(
+            'CS.karl.models.catalog.CachingCatalog.allowed_docids.t' in names)
+        self.assertEqual(names[-1], 'karl.permission_filter.request')
+
+    def test_permission_filter_time_excludes_search(self):
+        import mock
+        from karl.models.catalog import PERMISSION_FILTER_KEY
+        request = testing.DummyRequest()
+        testing.setUp(request=request)
+        catalog = self._makeOne()
+        clock = [0.0]
+        apply = catalog['name'].apply
+        def slow_apply(query):
+            clock[0] += 100
+            return apply(query)
+        catalog['name'].apply = slow_apply
+        with mock.patch('time.time', lambda: clock[0]):
+            num, docids = catalog.search(allowed=self._allowed('fred'),
+                                         name='b', use_cache=False)
+        self.assertEqual(list(docids), [2])
+        self.assertEqual(clock[0], 100)
+        self.assertEqual(request.environ[PERMISSION_FILTER_KEY], 0.0)
+
+
+class Test_cached_size(unittest.TestCase):
+    def _callFUT(self, entry):
+        from karl.models.catalog import _cached_size
+        return _cached_size(entry)
+
+    def test_it(self):
+        small = self._callFUT((1, array('i', [1]), ()))
+        large = self._callFUT((1001, array('i', range(1001)), ()))
+        self.assertEqual(large - small, 4000)
+
 class TestReindexCatalog(unittest.TestCase):
     def _callFUT(self, context, **kw):
         from karl.models.catalog import reindex_catalog
@@ -306,10 +607,157 @@ class TestReindexCatalog(unittest.TestCase):
                           '*** committing ***'])
         self.assertEqual(transaction.committed, 2)
         self.assertEqual(catalog.index.indexed, {1:a})
+        self.assertEqual(catalog.invalidated, ('index',))
 
 from repoze.catalog.interfaces import ICatalogIndex
 from zope.interface import implements
 
+class TestReindexCatalogParallel(unittest.TestCase):
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        from karl.models.catalog import _reindex_worker
+        _reindex_worker.clear()
+        testing.cleanUp()
+
+    def _callFUT(self, context, **kw):
+        from karl.models.catalog import reindex_catalog_parallel
+        return reindex_catalog_parallel(context, **kw)
+
+    def _makeSite(self):
+        from repoze.catalog.document import DocumentMap
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from zope.interface import directlyProvides
+        from karl.models.catalog import CachingCatalog
+        from karl.models.catalog import init_reindex_worker
+        from karl.models.interfaces import ISite
+        site = testing.DummyModel()
+        directlyProvides(site, ISite)
+        site.updated = 0
+
+        def update_indexes():
+            site.updated += 1
+        site.update_indexes = update_indexes
+        site['a'] = testing.DummyModel(title='A')
+        site['b'] = testing.DummyModel(title='B')
+        site.catalog = catalog = CachingCatalog()
+        catalog.document_map = DocumentMap()
+        self.a = catalog.document_map.add('/a')
+        self.b = catalog.document_map.add('/b')
+        catalog['title'] = CatalogFieldIndex('title')
+        catalog['other'] = DummyIndex()
+        init_reindex_worker(lambda: (site, None))
+        return site
+
+    def test_it(self):
+        site = self._makeSite()
+        catalog = site.catalog
+        tasks = []
+
+        def map(func, args):
+            tasks.extend(args)
+            return [func(arg) for arg in args]
+        L = []
+        transaction = DummyTransaction()
+        self._callFUT(site, map=map, workers=2, batch_size=1,
+                      output=L.append, transaction=transaction)
+        self.assertEqual(site.updated, 1)
+        self.assertEqual(sorted(tasks),
+                         [(['title'], [self.a]), (['title'], [self.b])])
+        title = catalog['title']
+        self.assertEqual(title.discriminator, 'title')
+        self.assertEqual(dict(title._rev_index),
+                         {self.a: 'A', self.b: 'B'})
+        self.assertEqual(catalog['other'].indexed,
+                         {self.a: site['a'], self.b: site['b']})
+        self.failIf(hasattr(catalog, '_reindex_todo'))
+        self.assertEqual(transaction.committed, 4)
+        self.assertEqual(L[0], 'updating indexes')
+        self.failUnless('reindexed 1 documents, 0 left' in L)
+        self.failUnless(L[-1].startswith('title'))
+        self.failUnless(L[-2].startswith('other'))
+
+    def test_with_indexes(self):
+        site = self._makeSite()
+        L = []
+        self._callFUT(site, output=L.append, transaction=DummyTransaction(),
+                      indexes=('title',))
+        self.assertEqual(len(site.catalog['title']._rev_index), 2)
+        self.assertEqual(site.catalog['other'].indexed, {})
+        self.failUnless("reindexing only indexes ('title',)" in L)
+
+    def test_pathre(self):
+        import re
+        site = self._makeSite()
+        self._callFUT(site, transaction=DummyTransaction(),
+                      path_re=re.compile('/a'))
+        self.assertEqual(dict(site.catalog['title']._rev_index),
+                         {self.a: 'A'})
+
+    def test_resume(self):
+        from BTrees.IFBTree import IFTreeSet
+        site = self._makeSite()
+        catalog = site.catalog
+        catalog._reindex_todo = IFTreeSet([self.b])
+        catalog._reindex_indexes = ('title',)
+        L = []
+        self._callFUT(site, output=L.append, transaction=DummyTransaction())
+        self.assertEqual(site.updated, 0)
+        self.assertEqual(dict(catalog['title']._rev_index), {self.b: 'B'})
+        self.assertEqual(catalog['other'].indexed, {})
+        self.assertEqual(L[0], 'resuming reindex of 1 documents')
+
+    def test_dryrun_keeps_checkpoint(self):
+        from BTrees.IFBTree import IFTreeSet
+        site = self._makeSite()
+        catalog = site.catalog
+        catalog._reindex_todo = todo = IFTreeSet([self.a, self.b])
+        catalog._reindex_indexes = None
+        transaction = DummyTransaction()
+        self._callFUT(site, dry_run=True, transaction=transaction)
+        self.assertEqual(transaction.committed, 0)
+        self.assertEqual(list(todo), [self.a, self.b])
+
+    def test_dryrun_with_database(self):
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        site = self._makeSite()
+        db = DB(MappingStorage())
+        tm = transaction.TransactionManager()
+        conn = db.open(transaction_manager=tm)
+        conn.root()['catalog'] = site.catalog
+        tm.commit()
+        L = []
+        self._callFUT(site, dry_run=True, output=L.append, transaction=tm,
+                      workers=2, batch_size=1)
+        self.failUnless('reindexed 1 documents, 0 left' in L)
+        self.failIf(hasattr(site.catalog, '_reindex_todo'))
+        self.assertEqual(dict(site.catalog['title']._rev_index), {})
+        conn.close()
+        db.close()
+
+    def test_missing_document(self):
+        site = self._makeSite()
+        del site['b']
+        L = []
+        self._callFUT(site, output=L.append, transaction=DummyTransaction())
+        self.failUnless('error: docid %d not found' % self.b in L)
+        self.assertEqual(dict(site.catalog['title']._rev_index),
+                         {self.a: 'A'})
+
+    def test_conflict_retries_batch(self):
+        site = self._makeSite()
+        transaction = ConflictingTransaction(conflicts=1)
+        L = []
+        self._callFUT(site, batch_size=1, output=L.append,
+                      transaction=transaction, indexes=('title',))
+        self.failUnless('conflict error: retrying' in L)
+        self.assertEqual(transaction.aborted, 1)
+        self.assertEqual(transaction.committed, 3)
+        self.failIf(hasattr(site.catalog, '_reindex_todo'))
+
 class DummyCatalog(object):
     def __init__(self, address_to_docid):
         self.document_map = testing.DummyModel()
@@ -322,6 +770,9 @@ class DummyCatalog(object):
     def reindex_doc(self, docid, model):
         self.reindexed.append(docid)
 
+    def invalidate(self, *names):
+        self.invalidated = names
+
 class DummyTransaction(object):
     def __init__(self):
         self.committed = 0
@@ -334,6 +785,19 @@ class DummyTransaction(object):
         self.aborted += 1
         
 
+class ConflictingTransaction(DummyTransaction):
+    # Raises ConflictError from the commits after the first one.
+    def __init__(self, conflicts):
+        DummyTransaction.__init__(self)
+        self.conflicts = conflicts
+
+    def commit(self):
+        from ZODB.POSException import ConflictError
+        if self.committed and self.conflicts:
+            self.conflicts -= 1
+            raise ConflictError
+        DummyTransaction.commit(self)
+
 class DummyIndex:
     implements(ICatalogIndex)
     def __init__(self):
@@ -347,6 +811,43 @@ class DummyIndex:
     def apply(self, *arg, **kw):
         return [1,2,3]
 
+class DummyFieldIndex(DummyIndex):
+    def __init__(self):
+        self._rev_index = {}
+        self.discriminator = lambda obj, default: obj
+
+    def index_doc(self, docid, obj):
+        self._rev_index[docid] = self.discriminator(obj, None)
+
+    reindex_doc = index_doc
+
+    def unindex_doc(self, docid):
+        self._rev_index.pop(docid, None)
+
+class DummyLength(object):
+    def __init__(self, value, changed=False):
+        self.value = value
+        self._p_changed = changed
+
+class DummyStatsdClient(object):
+    def __init__(self):
+        self.timings = []
+
+    def timing(self, stat, value, rate=1, **kw):
+        self.timings.append((stat, value))
+
+    def incr(self, stat, count=1, rate=1, **kw):
+        pass
+
+    def sendbuf(self, buf):
+        pass
+
+
+class DummyEvent(object):
+    def __init__(self, request):
+        self.request = request
+
+
 class DummyCache(dict):
     generation = 0
 
@@ -721,3 +1222,124 @@ class Test_convert_to_granular(unittest.TestCase):
         self.assertEqual(sorted(ndx[9]), [5, 6, 7])
         self.assertEqual(sorted(ndx[11]), [8])
         self.assertEqual(obj._num_docs(), 4)
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def _class(self):
+        from karl.models.catalog import IntervalIndex
+        return IntervalIndex
+
+    def _make(self, levels=(10, 100)):
+        def discriminator(value, default):
+            if value is None:
+                return default
+            return value
+
+        return self._class()(discriminator, levels=levels)
+
+    def test_verifyImplements_ICatalogIndex(self):
+        from zope.interface.verify import verifyClass
+        from repoze.catalog.interfaces import ICatalogIndex
+        verifyClass(ICatalogIndex, self._class())
+
+    def test_verifyProvides_ICatalogIndex(self):
+        from zope.interface.verify import verifyObject
+        from repoze.catalog.interfaces import ICatalogIndex
+        verifyObject(ICatalogIndex, self._make())
+
+    def test_verifyProvides_IStatistics(self):
+        from zope.interface.verify import verifyObject
+        from zope.index.interfaces import IStatistics
+        verifyObject(IStatistics, self._make())
+
+    def test_index_doc_filing(self):
+        obj = self._make()
+        obj.index_doc(1, (12, 15))      # fits a 10 bucket
+        obj.index_doc(2, (15, 25))      # fits a 100 bucket
+        obj.index_doc(3, (50, 250))     # too long
+        obj.index_doc(4, (30, None))    # a point
+        self.assertEqual(obj.documentCount(), 4)
+        self.assertEqual(obj._rev_index[4], (30, 30))
+        def contents(tree):
+            return dict((key, list(docids)) for key, docids in tree.items())
+        self.assertEqual(contents(obj._buckets[0][1]), {1: [1], 3: [4]})
+        self.assertEqual(contents(obj._buckets[1][1]), {0: [2]})
+        self.assertEqual(contents(obj._long), {250: [3]})
+
+    def test_index_doc_non_integer(self):
+        obj = self._make()
+        self.assertRaises(ValueError, obj.index_doc, 1, ('a', 'b'))
+
+    def test_index_doc_reversed(self):
+        obj = self._make()
+        obj.index_doc(1, (15, 12))
+        self.assertEqual(obj._rev_index[1], (12, 15))
+
+    def test_index_doc_unchanged(self):
+        obj = self._make()
+        obj.index_doc(1, (12, 15))
+        tree = obj._buckets[0][1][1]
+        obj.index_doc(1, (12, 15))
+        self.failUnless(obj._buckets[0][1][1] is tree)
+        self.assertEqual(obj.documentCount(), 1)
+
+    def test_reindex_moves_doc(self):
+        obj = self._make()
+        obj.index_doc(1, (12, 15))
+        obj.index_doc(1, (50, 250))
+        self.assertEqual(obj.documentCount(), 1)
+        self.assertEqual(len(obj._buckets[0][1]), 0)
+        self.assertEqual(list(obj._long[250]), [1])
+
+    def test_index_doc_missing_value(self):
+        obj = self._make()
+        obj.index_doc(1, (12, 15))
+        obj.index_doc(1, None)
+        self.assertEqual(obj.documentCount(), 0)
+        self.assertEqual(len(obj._buckets[0][1]), 0)
+        self.assertEqual(list(obj._not_indexed), [1])
+        self.assertEqual(list(obj.docids()), [1])
+        obj.unindex_doc(1)
+        self.assertEqual(list(obj.docids()), [])
+
+    def test_unindex_doc_not_indexed(self):
+        obj = self._make()
+        obj.unindex_doc(1)
+        self.assertEqual(obj.documentCount(), 0)
+
+    def test_apply_matches_brute_force(self):
+        import random
+        rnd = random.Random(42)
+        obj = self._make()
+        intervals = {}
+        for docid in range(300):
+            start = rnd.randint(0, 1000)
+            end = start + rnd.choice([0, 3, 30, 300])
+            intervals[docid] = (start, end)
+            obj.index_doc(docid, (start, end))
+        for i in range(200):
+            lo = rnd.choice([None, rnd.randint(-10, 1010)])
+            hi = rnd.choice([None, rnd.randint(-10, 1010)])
+            expected = [docid for docid, (start, end) in
+                        sorted(intervals.items())
+                        if (lo is None or end >= lo) and
+                        (hi is None or start <= hi)]
+            self.assertEqual(list(obj.apply((lo, hi))), expected,
+                             (lo, hi))
+
+    def test_apply_query_forms(self):
+        from repoze.catalog import Range
+        obj = self._make()
+        obj.index_doc(1, (12, 15))
+        obj.index_doc(2, (20, 30))
+        self.assertEqual(list(obj.apply(14)), [1])
+        self.assertEqual(list(obj.apply({'query': (15, 20)})), [1, 2])
+        self.assertEqual(list(obj.apply(Range(16, 19))), [])
+
+    def test_apply_intersect(self):
+        obj = self._make()
+        obj.index_doc(1, (12, 15))
+        obj.index_doc(2, (20, 30))
+        docids = obj.family.IF.Set([2, 3])
+        self.assertEqual(list(obj.apply_intersect((None, None), docids)), [2])
@@ -10,7 +10,11 @@ class SiteEventsTests(unittest.TestCase):
         return SiteEvents
 
     def _makeOne(self):
-        return self._getTargetClass()()
+        from itertools import count
+        events = self._getTargetClass()()
+        # Number events 0, 1, 2... rather than by the clock.
+        events._new_position = count().next
+        return events
 
     def test_class_conforms_to_ISiteEvents(self):
         from zope.interface.verify import verifyClass
@@ -387,6 +391,155 @@ class SiteEventsTests(unittest.TestCase):
         self.assertEqual(found[1], {'foo': 'baz'})
         self.assertEqual(found[2], {'foo': 'bar'})
 
+    def test_push_across_generations(self):
+        from karl.models.contentfeeds import APPENDSTACK_MAX_LENGTH
+        stack = self._makeOne()
+        for i in range(APPENDSTACK_MAX_LENGTH + 1):
+            stack.push(foo=i)
+
+        found = [(g, i, x['foo']) for g, i, x in stack]
+
+        self.assertEqual(found[0], (1, 0, APPENDSTACK_MAX_LENGTH))
+        self.assertEqual(found[1],
+                         (0, APPENDSTACK_MAX_LENGTH - 1,
+                          APPENDSTACK_MAX_LENGTH - 1))
+        self.assertEqual(found[-1], (0, 0, 0))
+
+    def test_push_keeps_all_events_by_default(self):
+        stack = self._makeOne()
+        self.assertEqual(stack._max_events(), None)
+        stack._prune = None  # must not be called
+        for i in range(300):
+            stack.push(foo=i)
+        self.assertEqual(len(list(stack)), 300)
+
+    def test_max_events_setting(self):
+        from pyramid import testing
+        from pyramid.interfaces import ISettings
+        from karl.testing import DummySettings
+        testing.setUp()
+        self.addCleanup(testing.tearDown)
+        registerUtility(DummySettings(site_events_max='20'), ISettings)
+        self.assertEqual(self._makeOne()._max_events(), 20)
+
+    def test_push_prunes_oldest_events(self):
+        from itertools import islice
+        from karl.models.contentfeeds import APPENDSTACK_MAX_LENGTH
+        stack = self._makeOne()
+        stack.max_events = 20
+        count = 20 + APPENDSTACK_MAX_LENGTH + 1
+        for i in range(count):
+            stack.push(foo=i, allowed=['phred'], userid='phred')
+
+        seen = []
+        gen, index = divmod(count, APPENDSTACK_MAX_LENGTH)
+        while True:
+            page = list(islice(stack.older(gen, index, ['phred']), 7))
+            if not page:
+                break
+            seen.extend(x['foo'] for g, i, x in page)
+            gen, index = page[-1][:2]
+
+        self.assertEqual(seen, range(count - 1, count - 21, -1))
+        self.assertEqual(stack._count(), 20)
+        self.assertEqual(len(stack._allowed['phred']), 20)
+        self.assertEqual(len(stack._creators['phred']), 20)
+
+    def test_push_positions_from_clock(self):
+        stack = self._getTargetClass()()
+        stack.push(foo='bar')
+        stack.push(foo='baz')
+        positions = list(stack._events.keys())
+        self.assertEqual(len(positions), 2)
+        self.failUnless(positions[0] > 1 << 58)
+
+    def test_push_skips_taken_position(self):
+        stack = self._getTargetClass()()
+        stack._new_position = lambda: 5
+        stack.push(foo='bar')
+        stack.push(foo='baz')
+        self.assertEqual([(g, i, x['foo']) for g, i, x in stack],
+                         [(0, 6, 'baz'), (0, 5, 'bar')])
+
+    def test_concurrent_pushes_dont_conflict(self):
+        import os
+        import shutil
+        import tempfile
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        events = conn1.root()['events'] = self._getTargetClass()()
+        events.push(foo='bar', allowed=['system.Authenticated'])
+        tm1.commit()
+        conn2 = db.open(transaction_manager=tm2)
+        conn2.root()['events'].push(foo='baz',
+                                    allowed=['system.Authenticated'])
+        events.push(foo='qux', allowed=['system.Authenticated'])
+        tm2.commit()
+        tm1.commit()
+        conn2.close()
+        tm1.begin()
+        found = [x['foo'] for g, i, x in
+                 events.checked(['system.Authenticated'], None)]
+        self.assertEqual(sorted(found), ['bar', 'baz', 'qux'])
+        self.assertEqual(events._count(), 3)
+        conn1.close()
+        db.close()
+
+    def test_checked_principals_merged_without_duplicates(self):
+        stack = self._makeOne()
+        stack.push(foo='bar', allowed=['phred', 'bharney'])
+        stack.push(foo='baz', allowed=['wilma'])
+        stack.push(foo='bam', allowed=['bharney'])
+        stack.push(foo='bat', allowed=['phred'])
+
+        found = [x['foo'] for g, i, x in
+                 stack.checked(['phred', 'bharney', 'phred'], None)]
+
+        self.assertEqual(found, ['bat', 'bam', 'bar'])
+
+    def test_checked_is_lazy(self):
+        stack = self._makeOne()
+        for i in range(10):
+            stack.push(foo=i, allowed=['phred'])
+        events = stack._events = DummyEventsTree(stack._events)
+
+        found = stack.checked(['phred'], None)
+        self.assertEqual(found.next()[2]['foo'], 9)
+        self.assertEqual(found.next()[2]['foo'], 8)
+
+        self.assertEqual(events.loaded, [9, 8])
+
+    def test_update(self):
+        stack = self._makeOne()
+        stack.push(foo='bar', userid='phred', allowed=['phred'])
+        stack.push(foo='baz', userid='bharney', allowed=['phred'])
+
+        stack.update(0, 0, userid='wilma', foo='qux')
+
+        self.assertEqual(list(stack.checked(None, 'phred')), [])
+        found = [dict(x) for g, i, x in stack.checked(['phred'], 'wilma')]
+        self.assertEqual(found,
+                         [{'foo': 'qux', 'userid': 'wilma',
+                           'allowed': ['phred']}])
+        self.failIf('phred' in stack._creators)
+
+
+class DummyEventsTree(object):
+    def __init__(self, tree):
+        self.tree = tree
+        self.loaded = []
+
+    def __getitem__(self, key):
+        self.loaded.append(key)
+        return self.tree[key]
+
 
 class _EventSubscriberTestsBase:
 
@@ -96,7 +96,7 @@ class TestDiscriminatorFunctions(unittest.TestCase):
         site['testuser'] = obj
         site.users = DummyUsers()
         site.users.add('testuser', 'testuser', '', ['group1'])
-        self.assertEqual(get_groups(obj, 0), ['group1'])
+        self.assertEqual(get_groups(obj, 0), set(['group1']))
 
     def test_get_groups_for_non_profile(self):
         from karl.models.peopledirectory import get_groups
@@ -0,0 +1,200 @@
+import unittest
+
+
+class TestSQLiteCatalogSearchCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from karl.models import sharedcache
+        self.tmpdir = tempfile.mkdtemp()
+        sharedcache._warned = False
+
+    def tearDown(self):
+        import shutil
+        from karl.models import sharedcache
+        shutil.rmtree(self.tmpdir)
+        sharedcache._warned = False
+
+    def _getTargetClass(self):
+        from karl.models.sharedcache import SQLiteCatalogSearchCache
+        return SQLiteCatalogSearchCache
+
+    def _makeOne(self, **kw):
+        import os
+        path = os.path.join(self.tmpdir, 'cache.db')
+        return self._getTargetClass()(path, **kw)
+
+    def test_class_conforms_to_ICatalogSearchCache(self):
+        from zope.interface.verify import verifyClass
+        from karl.models.interfaces import ICatalogSearchCache
+        verifyClass(ICatalogSearchCache, self._getTargetClass())
+
+    def test_get_miss(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 1), 1)
+
+    def test_set_and_get(self):
+        from array import array
+        from repoze.catalog.catalog import ResultSetSize
+        cache = self._makeOne()
+        value = (ResultSetSize(3, 10), array('i', [1, 2, 3]), (('a', 1),))
+        cache['a'] = value
+        result = cache.get('a')
+        self.assertEqual(result, value)
+        self.assertEqual(result[0].total, 10)
+
+    def test_set_and_get_plain_count(self):
+        from array import array
+        cache = self._makeOne()
+        value = (3, array('L', [1, 2, 3]), ())
+        cache['a'] = value
+        self.assertEqual(cache.get('a'), value)
+
+    def test_corrupt_entry(self):
+        cache = self._makeOne()
+        cache['a'] = _entry(1)
+        cache._connection().execute(
+            "UPDATE entries SET value = ?", (buffer('garbage'),))
+        self.assertEqual(cache.get('a'), None)
+
+    def test_shared_between_instances(self):
+        cache = self._makeOne()
+        other = self._makeOne()
+        cache['a'] = _entry(1)
+        cache.generation = 5
+        self.assertEqual(other.get('a'), _entry(1))
+        self.assertEqual(other.generation, 5)
+        other.clear()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_generation_default(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.generation, 0)
+
+    def test_replace_keeps_size(self):
+        cache = self._makeOne()
+        cache['a'] = _entry(100)
+        size = cache.size
+        cache['a'] = _entry(100, 2)
+        self.assertEqual(cache.size, size)
+        self.assertEqual(cache.get('a'), _entry(100, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = self._makeOne(maxbytes=1000)
+        cache.time = DummyTime(1000)
+        cache['a'] = _entry(100, 1)
+        cache.time.now = 1100
+        cache['b'] = _entry(100, 2)
+        cache.time.now = 1200
+        self.assertEqual(cache.get('a'), _entry(100, 1))  # refreshes atime
+        cache.time.now = 1300
+        cache['c'] = _entry(100, 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), _entry(100, 1))
+        self.assertEqual(cache.get('c'), _entry(100, 3))
+        self.failUnless(cache.size <= 1000)
+
+    def test_value_too_large(self):
+        cache = self._makeOne(maxbytes=50)
+        cache['a'] = _entry(100)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_unavailable_database(self):
+        import os
+        path = os.path.join(self.tmpdir, 'missing', 'cache.db')
+        cache = self._getTargetClass()(path)
+        self.assertEqual(cache.get('a'), None)
+        cache['a'] = _entry(1)
+        cache.clear()
+        cache.generation = 1
+        self.assertEqual(cache.generation, 0)
+
+    def test_path_from_config_setting(self):
+        import os
+        from pyramid import testing
+        import karl.testing
+        path = os.path.join(self.tmpdir, 'configured.db')
+        testing.setUp()
+        try:
+            karl.testing.registerSettings(catalog_cache_path=path)
+            cache = self._getTargetClass()()
+            cache['a'] = _entry(1)
+        finally:
+            testing.tearDown()
+        self.failUnless(os.path.exists(path))
+
+    def test_path_in_var(self):
+        import os
+        from pyramid import testing
+        import karl.testing
+        testing.setUp()
+        try:
+            karl.testing.registerSettings(var=self.tmpdir)
+            cache = self._getTargetClass()()
+            cache['a'] = _entry(1)
+        finally:
+            testing.tearDown()
+        self.failUnless(
+            os.path.exists(os.path.join(self.tmpdir, 'catalog_cache.db')))
+
+    def test_no_path_configured(self):
+        from pyramid import testing
+        testing.setUp()
+        try:
+            cache = self._getTargetClass()()
+            cache['a'] = _entry(1)
+            self.assertEqual(cache.get('a'), None)
+        finally:
+            testing.tearDown()
+
+    def test_refuses_file_of_other_user(self):
+        import os
+        cache = self._makeOne()
+        cache['a'] = _entry(1)
+        other = self._makeOne()
+        getuid = os.getuid
+        os.getuid = lambda: getuid() + 1
+        try:
+            self.assertEqual(other.get('a'), None)
+            other['b'] = _entry(1)
+        finally:
+            os.getuid = getuid
+        self.assertEqual(cache.get('b'), None)
+
+
+    def test_unavailable_logged_once(self):
+        import logging
+        from pyramid import testing
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        log = logging.getLogger('karl.models.sharedcache')
+        log.addHandler(handler)
+        testing.setUp()
+        try:
+            cache = self._getTargetClass()()
+            cache.get('a')
+            cache['a'] = _entry(1)
+            cache.get('a')
+        finally:
+            testing.tearDown()
+            log.removeHandler(handler)
+        self.assertEqual(len(records), 1)
+        self.failUnless(records[0].exc_info)
+
+
+def _entry(size, first=0):
+    from array import array
+    from repoze.catalog.catalog import ResultSetSize
+    return (ResultSetSize(size, size), array('i', range(first, first + size)),
+            (('name', 1),))
+
+
+class DummyTime(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
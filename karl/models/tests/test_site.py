@@ -177,6 +177,7 @@ class SiteTests(unittest.TestCase):
                                       ('publication_date', 'GranularIndex'),
                                       ('start_date', 'GranularIndex'),
                                       ('end_date', 'GranularIndex'),
+                                      ('date_range', 'IntervalIndex'),
                                       ('mimetype', 'CatalogFieldIndex'),
                                       ('email', 'CatalogFieldIndex')):
             index = site.catalog[index_name]
@@ -555,6 +556,34 @@ class TestGetEndDate(unittest.TestCase, _TestGetDate):
         context.endDate = val
 
 
+class TestGetDateRange(unittest.TestCase):
+    def _callFUT(self, object, default):
+        from karl.models.site import get_date_range
+        return get_date_range(object, default)
+
+    def test_not_set(self):
+        context = testing.DummyModel()
+        self.assertEqual(self._callFUT(context, None), None)
+
+    def test_w_start_and_end(self):
+        import datetime
+        from karl.utils import coarse_datetime_repr
+        context = testing.DummyModel()
+        context.startDate = datetime.datetime(2010, 1, 1, 10)
+        context.endDate = datetime.datetime(2010, 1, 2, 10)
+        self.assertEqual(self._callFUT(context, None),
+                         (coarse_datetime_repr(context.startDate),
+                          coarse_datetime_repr(context.endDate)))
+
+    def test_wo_end(self):
+        import datetime
+        from karl.utils import coarse_datetime_repr
+        context = testing.DummyModel()
+        context.startDate = datetime.date(2010, 1, 1)
+        self.assertEqual(self._callFUT(context, None),
+                         (coarse_datetime_repr(context.startDate), None))
+
+
 class TestGetPublicationDate(unittest.TestCase, _TestGetDate):
     def _callFUT(self, object, default):
         from karl.models.site import get_publication_date
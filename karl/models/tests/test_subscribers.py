@@ -228,6 +228,24 @@ class TestHandleContentRemoved(unittest.TestCase):
         self.assertEqual(tags._delete_called_with[1], (2, None, None))
         self.assertEqual(tags._delete_called_with[2], (3, None, None))
 
+class Test_invalidate_acl_cache(unittest.TestCase):
+    def _callFUT(self, obj, event):
+        from karl.models.subscribers import invalidate_acl_cache
+        return invalidate_acl_cache(obj, event)
+
+    def test_it(self):
+        from pyramid.security import Allow
+        from karl.security.cache import cache
+        root = testing.DummyModel()
+        root['a'] = a = testing.DummyModel()
+        a.__acl__ = [(Allow, 'fred', 'view')]
+        cache.lookup(a)
+        a.__acl__ = [(Allow, 'barney', 'view')]
+        self._callFUT(a, None)
+        self.assertEqual(cache.lookup(a), [(Allow, 'barney', 'view')])
+        cache.clear()
+
+
 class TestReindexContent(unittest.TestCase):
     def setUp(self):
         testing.cleanUp()
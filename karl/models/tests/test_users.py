@@ -34,14 +34,17 @@ class UsersTests(unittest.TestCase):
             'login': 'login',
             'salt': user['salt'],
             'password': pbkdf2('password', user['salt']),
-            'groups': set(['group.foo']),
             }
         self.assertEqual(users.logins[u'login'], u'id')
-        self.assertEqual(users.data[u'id'], expected)
+        info = dict(users.data[u'id'])
+        self.assertEqual(list(info.pop('groups')), ['group.foo'])
+        self.assertEqual(info, expected)
+        self.assertEqual(list(users.groups['group.foo']), ['id'])
 
         users.remove('id')
         self.assertEqual(users.data.get('id'), None)
         self.assertEqual(users.logins.get(u'login'), None)
+        self.assertEqual(list(users.groups['group.foo']), [])
 
     def test_add_conflicting_userid(self):
         users = self._makeOne()
@@ -121,19 +124,19 @@ class UsersTests(unittest.TestCase):
         users = self._makeOne()
         users.add('id', 'login', 'password', groups=['group.foo'])
         users.add_user_to_group('id', 'another')
-        self.assertEqual(users.get('id')['groups'],
+        self.assertEqual(set(users.get('id')['groups']),
                          set(['group.foo', 'another']))
         # Password should not have changed!
         self._verifyPassword(users, 'id', 'password')
-        self.assertEqual(users.groups['another'], set(['id']))
+        self.assertEqual(set(users.groups['another']), set(['id']))
 
     def test_delete_group(self):
         users = self._makeOne()
         users.add('id', 'login', 'password', groups=['group.foo', 'group.bar'])
         users.add('id2', 'login2', 'password2', groups=['group.foo'])
         users.delete_group('group.foo')
-        self.assertEqual(users.get('id')['groups'], set(['group.bar']))
-        self.assertEqual(users.get('id2')['groups'], set([]))
+        self.assertEqual(set(users.get('id')['groups']), set(['group.bar']))
+        self.assertEqual(set(users.get('id2')['groups']), set([]))
         self.failIf('group.foo' in users.groups)
         # Passwords should not have changed!
         self._verifyPassword(users, 'id', 'password')
@@ -143,8 +146,8 @@ class UsersTests(unittest.TestCase):
         users = self._makeOne()
         users.add('id', 'login', 'password', groups=['group.foo'])
         users.remove_user_from_group('id', 'group.foo')
-        self.assertEqual(users.get('id')['groups'], set())
-        self.assertEqual(users.groups['group.foo'], set([]))
+        self.assertEqual(set(users.get('id')['groups']), set())
+        self.assertEqual(set(users.groups['group.foo']), set([]))
         # Password should not have changed!
         self._verifyPassword(users, 'id', 'password')
 
@@ -152,7 +155,7 @@ class UsersTests(unittest.TestCase):
         users = self._makeOne()
         users.add('id', 'login', 'password', groups=[])
         users.remove_user_from_group('id', 'group.foo')
-        self.assertEqual(users.get('id')['groups'], set())
+        self.assertEqual(set(users.get('id')['groups']), set())
         # Password should not have changed!
         self._verifyPassword(users, 'id', 'password')
 
@@ -161,7 +164,7 @@ class UsersTests(unittest.TestCase):
         users.add('id', 'login', 'password', groups=['abc'])
         users.groups['abc'].remove('id')
         users.remove_user_from_group('id', 'abc')
-        self.assertEqual(users.get('id')['groups'], set())
+        self.assertEqual(set(users.get('id')['groups']), set())
 
     def test_member_of_group(self):
         users = self._makeOne()
@@ -174,11 +177,60 @@ class UsersTests(unittest.TestCase):
         users.add('id1', 'login1', 'password', groups=['group.foo'])
         users.add('id2', 'login2', 'password', groups=['group.foo'])
         users.add('id3', 'login3', 'password', groups=['group.none'])
-        self.assertEqual(users.users_in_group('group.foo'), set(['id1', 'id2']))
+        self.assertEqual(set(users.users_in_group('group.foo')), set(['id1', 'id2']))
+
+    def test_group_changes_dont_rewrite_user_info(self):
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        conn = db.open()
+        users = conn.root()['users'] = self._makeOne()
+        users.add('id', 'login', 'password', groups=['group.foo'])
+        users.add('id2', 'login2', 'password', groups=['group.bar'])
+        transaction.commit()
+        users.add_user_to_group('id', 'group.bar')
+        users.remove_user_from_group('id', 'group.foo')
+        self.failIf(users.data._p_changed)
+        self.failIf(users.groups._p_changed)
+        self.assertEqual(set(users.get('id')['groups']), set(['group.bar']))
+        transaction.abort()
+        db.close()
+
+    def test_concurrent_joins_dont_conflict(self):
+        import os
+        import shutil
+        import tempfile
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        # FileStorage resolves conflicts; MappingStorage does not.
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        users = conn1.root()['users'] = self._makeOne()
+        users.add('id1', 'login1', 'password', groups=['group.foo'])
+        users.add('id2', 'login2', 'password')
+        users.add('id3', 'login3', 'password')
+        tm1.commit()
+        conn2 = db.open(transaction_manager=tm2)
+        conn2.root()['users'].add_user_to_group('id2', 'group.foo')
+        users.add_user_to_group('id3', 'group.foo')
+        tm2.commit()
+        tm1.commit()
+        conn2.close()
+        tm1.begin()
+        self.assertEqual(set(users.users_in_group('group.foo')),
+                         set(['id1', 'id2', 'id3']))
+        conn1.close()
+        db.close()
 
     def test_users_in_group_empty_group(self):
         users = self._makeOne()
-        self.assertEqual(users.users_in_group('group.foo'), set())
+        self.assertEqual(set(users.users_in_group('group.foo')), set())
 
     def test_upgrade(self):
         from BTrees.OOBTree import OOBTree
@@ -200,24 +252,26 @@ class UsersTests(unittest.TestCase):
 
         self.assertEqual(len(users.data), 2)
 
+        info = dict(users.data[u'id1'])
+        self.assertEqual(set(info.pop('groups')),
+                         set([u'group.foo', u'group.bar']))
         self.assertEqual(
-            users.data[u'id1'],
+            info,
             {'id': 'id1',
              'login': 'login1',
              'salt': users.data[u'id1']['salt'],
-             'password': pbkdf2('password1', users.data[u'id1']['salt']),
-             'groups': set([u'group.foo',
-                            u'group.bar'])}
+             'password': pbkdf2('password1', users.data[u'id1']['salt'])}
             )
 
+        info = dict(users.data[u'id2'])
+        self.assertEqual(set(info.pop('groups')),
+                         set([u'group.biz', u'group.baz']))
         self.assertEqual(
-            users.data[u'id2'],
+            info,
             {'id': 'id2',
              'login': 'login2',
              'salt': users.data[u'id2']['salt'],
-             'password': pbkdf2('password2', users.data[u'id2']['salt']),
-             'groups': set([u'group.biz',
-                            u'group.baz'])}
+             'password': pbkdf2('password2', users.data[u'id2']['salt'])}
             )
 
         self.assertEqual(len(users.logins), 2)
@@ -225,10 +279,10 @@ class UsersTests(unittest.TestCase):
         self.assertEqual(users.logins[u'login2'], u'id2')
 
         self.assertEqual(len(users.groups), 4)
-        self.assertEqual(users.groups[u'group.foo'], set([u'id1']))
-        self.assertEqual(users.groups[u'group.bar'], set([u'id1']))
-        self.assertEqual(users.groups[u'group.biz'], set([u'id2']))
-        self.assertEqual(users.groups[u'group.baz'], set([u'id2']))
+        self.assertEqual(set(users.groups[u'group.foo']), set([u'id1']))
+        self.assertEqual(set(users.groups[u'group.bar']), set([u'id1']))
+        self.assertEqual(set(users.groups[u'group.biz']), set([u'id2']))
+        self.assertEqual(set(users.groups[u'group.baz']), set([u'id2']))
 
 
 class DummyUsers:
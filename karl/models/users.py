@@ -5,6 +5,7 @@ from zope.interface import implements
 from hashlib import sha1
 import binascii
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from karl.models.interfaces import IUsers
 from karl.utils import get_random_string
 from karl.utils import strings_same
@@ -32,6 +33,14 @@ def get_sha_password(password):
 
 
 class Users(Persistent):
+    """ The users of the site, their logins and their groups.
+
+    Group membership is kept both ways, in ``OOTreeSet``s: ``groups`` maps
+    each group to its userids, and the ``groups`` of each user's info is
+    the set of the user's groups.  Joining or leaving a group changes one
+    bucket of each set, and concurrent changes to the same group resolve
+    instead of conflicting.
+    """
     implements(IUsers)
     data = None
 
@@ -41,6 +50,12 @@ class Users(Persistent):
         self.logins = OOBTree()
         self.groups = OOBTree()
 
+    def _members(self, group):
+        userids = self.groups.get(group)
+        if userids is None:
+            userids = self.groups[group] = OOTreeSet()
+        return userids
+
     def _convert(self, s):
         if isinstance(s, basestring):
             if not isinstance(s, unicode):
@@ -60,12 +75,13 @@ class Users(Persistent):
                 login = self._convert(login)
                 userid = self._convert(info['id'])
                 self.logins[login] = userid
-                groups = info['groups']
-                for group in groups:
+                groups = OOTreeSet()
+                for group in info['groups']:
                     group = self._convert(group)
-                    groupset = self.groups.setdefault(group, set())
-                    groupset.add(userid)
-                    self.groups[group] = groupset
+                    groups.insert(group)
+                    self._members(group).insert(userid)
+                info['groups'] = groups
+                self.data[userid] = info
             del self.bylogin
 
     def get_by_login(self, login):
@@ -100,10 +116,10 @@ class Users(Persistent):
         encrypted_password = pbkdf2(cleartext_password, salt)
         if groups is None:
             groups = []
-        newgroups = set()
+        newgroups = OOTreeSet()
         for group in groups:
             group = self._convert(group)
-            newgroups.add(group)
+            newgroups.insert(group)
         userid = self._convert(userid)
         login = self._convert(login)
         info = {
@@ -120,9 +136,7 @@ class Users(Persistent):
         self.data[userid] = info
 
         for group in newgroups:
-            userids = self.groups.get(group, set())
-            self.groups[group] = userids  # trigger persistence
-            userids.add(userid)
+            self._members(group).insert(userid)
 
     def remove(self, userid):
         self._upgrade()
@@ -131,9 +145,8 @@ class Users(Persistent):
         login = info['login']
         del self.logins[login]
         for group in info['groups']:
-            userids = self.groups.get(group, [])
-            if userid in userids:
-                self.groups[group] = userids  # trigger persistence
+            userids = self.groups.get(group)
+            if userids is not None and userid in userids:
                 userids.remove(userid)
         del self.data[userid]
 
@@ -167,11 +180,8 @@ class Users(Persistent):
         userid = self._convert(userid)
         group = self._convert(group)
         info = self.data[userid]
-        self.data[userid] = info  # trigger persistence
-        info['groups'].add(group)
-        userids = self.groups.setdefault(group, set())
-        self.groups[group] = userids  # trigger persistence
-        userids.add(userid)
+        info['groups'].insert(group)
+        self._members(group).insert(userid)
 
     add_group = add_user_to_group
 
@@ -182,12 +192,10 @@ class Users(Persistent):
         info = self.data[userid]
         groups = info['groups']
         if group in groups:
-            self.data[userid] = info  # trigger persistence
             groups.remove(group)
         userids = self.groups.get(group)
         if userids is not None:
             if userid in userids:
-                self.groups[group] = userids  # trigger persistence
                 userids.remove(userid)
 
     remove_group = remove_user_from_group
@@ -196,8 +204,8 @@ class Users(Persistent):
         self._upgrade()
         userid = self._convert(userid)
         group = self._convert(group)
-        userids = self.groups.get(group, set())
-        return userid in userids
+        userids = self.groups.get(group)
+        return userids is not None and userid in userids
 
     in_group = member_of_group
 
@@ -212,12 +220,14 @@ class Users(Persistent):
                 if info is not None:
                     infogroups = info['groups']
                     if group in infogroups:
-                        self.data[userid] = info  # trigger persistence
                         infogroups.remove(group)
 
     def users_in_group(self, group):
         self._upgrade()
-        return self.groups.get(group, set())
+        userids = self.groups.get(self._convert(group))
+        if userids is None:
+            return OOTreeSet()
+        return userids
 
     def check_password(self, password, userid=None, login=None):
         if userid is None and login is None:
@@ -1,5 +1,108 @@
+from pyramid.decorator import reify
 from pyramid.request import Request as BaseRequest
+from pyramid.security import authenticated_userid
+from pyramid.security import effective_principals
+
+from karl.utils import find_profiles
+
+try:
+    from perfmetrics import statsd_client
+except ImportError:
+    statsd_client = lambda: None
+
+REQUEST_CACHE_KEY = 'karl.request_cache'
+
+_marker = object()
+
+
+class RequestCache(object):
+    """ The identity and profiles looked up while serving one request.
+
+    Views, templates and adapters ask for the same principals and the same
+    profiles many times per page.  Each is looked up once; ``saved``
+    counts, by kind, the lookups answered from here instead.
+    """
+    _userid = _marker
+    _principals = None
+
+    def __init__(self, request):
+        self.request = request
+        self.saved = {}
+        self._profiles = {}
+
+    def _hit(self, kind):
+        self.saved[kind] = self.saved.get(kind, 0) + 1
+
+    @property
+    def saved_lookups(self):
+        return sum(self.saved.values())
+
+    @property
+    def userid(self):
+        if self._userid is _marker:
+            self._userid = authenticated_userid(self.request)
+        else:
+            self._hit('userid')
+        return self._userid
+
+    @property
+    def principals(self):
+        if self._principals is None:
+            self._principals = effective_principals(self.request)
+        else:
+            self._hit('principals')
+        return self._principals
+
+    def in_group(self, group):
+        return group in self.principals
+
+    @property
+    def is_staff(self):
+        return self.in_group('group.KarlStaff')
+
+    @property
+    def is_admin(self):
+        return self.in_group('group.KarlAdmin')
+
+    def profile(self, context, userid):
+        """ Return the profile of ``userid``, or None. """
+        if userid in self._profiles:
+            self._hit('profiles')
+            return self._profiles[userid]
+        profiles = find_profiles(context)
+        profile = None
+        if profiles is not None and userid is not None:
+            profile = profiles.get(userid, None)
+        self._profiles[userid] = profile
+        return profile
+
+    def current_profile(self, context):
+        """ Return the profile of the authenticated user, or None. """
+        return self.profile(context, self.userid)
+
+
+def get_request_cache(request):
+    cache = request.environ.get(REQUEST_CACHE_KEY)
+    if cache is None:
+        cache = request.environ[REQUEST_CACHE_KEY] = RequestCache(request)
+    return cache
+
+
+def report_request_cache(event):
+    """ NewResponse subscriber reporting the lookups the request cache
+    saved.
+    """
+    cache = event.request.environ.get(REQUEST_CACHE_KEY)
+    if cache is None:
+        return
+    client = statsd_client()
+    if client is not None:
+        for kind, count in cache.saved.items():
+            client.incr('karl.request_cache.%s' % kind, count)
 
 
 class Request(BaseRequest):
-    pass
\ No newline at end of file
+
+    @reify
+    def karl_cache(self):
+        return get_request_cache(self)
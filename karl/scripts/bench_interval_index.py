@@ -0,0 +1,125 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Compare the ways of finding the calendar events overlapping a period.
+
+Indexes a synthetic history of calendar events in both the 'start_date'
+and 'end_date' granular indexes and the 'date_range' interval index, then
+times month-long overlap queries against each and checks they agree.
+"""
+from optparse import OptionParser
+import random
+import time
+
+# coarse_datetime_repr units per day and per year
+DAY = 864
+YEAR = 365 * DAY
+
+
+def make_events(count, years, seed):
+    """Generate ``count`` (start, end) intervals spread over ``years``.
+
+    Most events last an hour or two; some run for days, and a few for
+    months, as conferences and long-running projects do.
+    """
+    rnd = random.Random(seed)
+    for _ in xrange(count):
+        start = rnd.randint(0, years * YEAR)
+        kind = rnd.random()
+        if kind < 0.85:
+            length = rnd.randint(18, 72)
+        elif kind < 0.98:
+            length = rnd.randint(1, 7) * DAY
+        else:
+            length = rnd.randint(30, 180) * DAY
+        yield start, start + length
+
+
+def build(events):
+    from karl.models.catalog import GranularIndex
+    from karl.models.catalog import IntervalIndex
+
+    start_date = GranularIndex(lambda obj, default: obj[0])
+    end_date = GranularIndex(lambda obj, default: obj[1])
+    date_range = IntervalIndex(lambda obj, default: obj)
+    for docid, interval in enumerate(events):
+        start_date.index_doc(docid, interval)
+        end_date.index_doc(docid, interval)
+        date_range.index_doc(docid, interval)
+    return start_date, end_date, date_range
+
+
+def two_indexes(start_date, end_date, first, last):
+    # What the catalog does for start_date=(None, last), end_date=(first,
+    # None): search both indexes and intersect the results.
+    family = start_date.family
+    starts = start_date.apply((None, last))
+    ends = end_date.apply((first, None))
+    return family.IF.intersection(starts, ends)
+
+
+def main(argv=None):
+    parser = OptionParser(description=__doc__)
+    parser.add_option('-n', '--events', dest='events', type='int',
+        default=100000, help="Number of events (default 100000)")
+    parser.add_option('-y', '--years', dest='years', type='int',
+        default=10, help="Years of history (default 10)")
+    parser.add_option('-q', '--queries', dest='queries', type='int',
+        default=200, help="Month-long queries to time (default 200)")
+
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error("Too many parameters: %s" % repr(args))
+
+    def output(msg):
+        print msg
+
+    events = list(make_events(options.events, options.years, 0))
+    output('Indexing %d events over %d years...' % (
+        len(events), options.years))
+    start_date, end_date, date_range = build(events)
+
+    rnd = random.Random(1)
+    queries = []
+    for _ in xrange(options.queries):
+        first = rnd.randint(0, options.years * YEAR)
+        queries.append((first, first + 31 * DAY))
+
+    searches = (
+        ('start_date + end_date', lambda first, last: two_indexes(
+            start_date, end_date, first, last)),
+        ('date_range', lambda first, last: date_range.apply((first, last))),
+    )
+    results = {}
+    for name, search in searches:
+        start = time.time()
+        found = 0
+        results[name] = []
+        for first, last in queries:
+            result = search(first, last)
+            found += len(result)
+            results[name].append(list(result))
+        elapsed = time.time() - start
+        output('  %-22s %.2f ms/query, %d events/query' % (
+            name, 1000 * elapsed / len(queries), found / len(queries)))
+
+    if results['date_range'] != results['start_date + end_date']:
+        output('Results differ!')
+        return 1
+
+if __name__ == '__main__':
+    main()
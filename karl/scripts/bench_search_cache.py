@@ -0,0 +1,131 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Compare catalog search cache hit rates across worker processes.
+
+Each worker replays the same skewed stream of queries against either a
+per-process LRU cache (the default ``ICatalogSearchCache``) or the sqlite
+cache shared between processes, and reports its hit rate.
+"""
+from array import array
+from optparse import OptionParser
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def query_stream(count, distinct, seed):
+    """Generate ``count`` query keys drawn from ``distinct`` queries.
+
+    Query popularity follows a Zipf-like distribution, as real traffic
+    does: a few listings are requested far more often than the rest.
+    """
+    rnd = random.Random(seed)
+    weights = [1.0 / rank for rank in range(1, distinct + 1)]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    from bisect import bisect_left
+    for _ in xrange(count):
+        yield 'query-%d' % bisect_left(cumulative, rnd.random())
+
+
+def make_cache(kind, options):
+    if kind == 'local':
+        from karl.models.catalog import _cached_size
+        from karl.utilities.lru import LRUCache
+        return LRUCache(options.size, maxbytes=options.maxbytes,
+                        sizeof=_cached_size)
+    from karl.models.sharedcache import SQLiteCatalogSearchCache
+    return SQLiteCatalogSearchCache(options.path, maxbytes=options.maxbytes)
+
+
+def run_worker(args):
+    kind, worker, options = args
+    cache = make_cache(kind, options)
+    hits = misses = 0
+    start = time.time()
+    for key in query_stream(options.queries, options.distinct, worker):
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            misses += 1
+            docids = array('i', xrange(options.results))
+            cache[key] = (len(docids), docids, ())
+    return worker, hits, misses, time.time() - start
+
+
+def run(kind, options, output):
+    pool = multiprocessing.Pool(options.workers)
+    try:
+        results = pool.map(
+            run_worker,
+            [(kind, worker, options) for worker in range(options.workers)])
+    finally:
+        pool.close()
+        pool.join()
+    total_hits = total_misses = 0
+    for worker, hits, misses, elapsed in results:
+        total_hits += hits
+        total_misses += misses
+        output('  worker %d: %5.1f%% hits (%d/%d) in %.2fs' % (
+            worker, 100.0 * hits / (hits + misses), hits, hits + misses,
+            elapsed))
+    output('  all workers: %5.1f%% hits, %d searches computed' % (
+        100.0 * total_hits / (total_hits + total_misses), total_misses))
+
+
+def main(argv=None):
+    parser = OptionParser(description=__doc__)
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+        default=4, help="Number of worker processes (default 4)")
+    parser.add_option('-q', '--queries', dest='queries', type='int',
+        default=5000, help="Queries replayed by each worker (default 5000)")
+    parser.add_option('-d', '--distinct', dest='distinct', type='int',
+        default=2000, help="Number of distinct queries (default 2000)")
+    parser.add_option('-r', '--results', dest='results', type='int',
+        default=200, help="Docids returned by each query (default 200)")
+    parser.add_option('-s', '--size', dest='size', type='int',
+        default=10000, help="Entries in each local cache (default 10000)")
+    parser.add_option('-m', '--maxbytes', dest='maxbytes', type='int',
+        default=64 * 1024 * 1024, help="Memory budget of each cache")
+
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error("Too many parameters: %s" % repr(args))
+
+    def output(msg):
+        print msg
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        options.path = os.path.join(tmpdir, 'cache.db')
+        output('Per-process LRU cache:')
+        run('local', options, output)
+        output('Shared sqlite cache:')
+        run('shared', options, output)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Compare tag queries on the old and the compact tag store.
+
+Stores a synthetic set of tags in a temporary FileStorage with one
+persistent object per tag, as the tagging engine used to, and times user
+tag clouds, tag listings of a page of items, related tags and related
+items with a cold cache.  It then migrates the tags to the compact store
+and computes their co-occurrence, as the evolve steps do, and times the
+same queries again.
+"""
+from bisect import bisect_left
+from optparse import OptionParser
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+def zipf_chooser(distinct, rnd):
+    weights = [1.0 / rank for rank in range(1, distinct + 1)]
+    total = sum(weights)
+    cumulative = []
+    acc = 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    return lambda: min(bisect_left(cumulative, rnd.random()), distinct - 1)
+
+
+def make_tags(items, users, names, communities, seed):
+    """Generate (item, user, name, community) tags.
+
+    Each item is tagged by one to three users with one to five names.
+    Tag names and users follow a Zipf-like distribution, as real tags
+    do; one item in ten is outside any community.
+    """
+    rnd = random.Random(seed)
+    user = zipf_chooser(users, rnd)
+    name = zipf_chooser(names, rnd)
+    for item in xrange(1, items + 1):
+        if rnd.random() < 0.1:
+            community = None
+        else:
+            community = u'community-%d' % rnd.randrange(communities)
+        userids = set(u'user-%d' % user() for _ in range(rnd.randint(1, 3)))
+        for userid in userids:
+            tagged = set(u'tag-%d' % name() for _ in range(rnd.randint(1, 5)))
+            for tagname in tagged:
+                yield item, userid, tagname, community
+
+
+def build_legacy(tags, rows):
+    """Store ``rows`` in ``tags`` the way the tagging engine used to."""
+    from BTrees import IOBTree
+    from karl.evolve.zodb.evolve46 import update_clouds
+    from karl.tagging import Tag
+
+    for name in ('_tag_items', '_tag_users', '_tag_names',
+                 '_tag_communities', '_users', '_names', '_communities',
+                 '_global_related', '_related', '_name_to_items'):
+        delattr(tags, name)
+    tags._tagid_to_obj = IOBTree.IOBTree()
+    for tagid, (item, user, name, community) in enumerate(rows):
+        tag = Tag(item, user, name, community)
+        tag._id = tagid
+        tags._tagid_to_obj[tagid] = tag
+        for index, key in ((tags._item_to_tagids, item),
+                           (tags._user_to_tagids, user),
+                           (tags._name_to_tagids, name),
+                           (tags._community_to_tagids, community)):
+            ids = index.get(key)
+            if ids is None:
+                index[key] = ids = IOBTree.IOSet()
+            ids.insert(tagid)
+        update_clouds(tags, tag)
+
+
+# The queries as the tagging engine used to run them.
+
+def legacy_tag_objects(tags, items=None, users=None, tags_=None):
+    ids = tags._getTagIds(items, users, tags_)
+    return set([tags._tagid_to_obj[id] for id in ids])
+
+
+def legacy_cloud(tags, user):
+    d = {}
+    for tag in legacy_tag_objects(tags, users=[user]):
+        d[tag.name] = d.get(tag.name, 0) + 1
+    return set(d.items())
+
+
+def legacy_related_tags(tags, name):
+    result = set()
+    for tagid in tags._name_to_tagids.get(name, ()):
+        tag = tags._tagid_to_obj[tagid]
+        result.update([t.name for t in legacy_tag_objects(
+            tags, items=(tag.item,), users=(tag.user,))])
+    result.discard(name)
+    return result
+
+
+def legacy_related_items(tags, item):
+    names = set([t.name for t in legacy_tag_objects(tags, items=[item])])
+    items = set([t.item for t in legacy_tag_objects(tags, tags_=names)])
+    items.discard(item)
+    result = []
+    for other in items:
+        other_names = set([t.name for t in legacy_tag_objects(
+            tags, items=[other])])
+        result.append((other, len(names.intersection(other_names))))
+    return sorted(result, key=lambda i: i[1], reverse=True)
+
+
+def tag_values(tags):
+    return set([(tag.item, tag.user, tag.name, tag.community)
+                for tag in tags])
+
+
+LEGACY_QUERIES = (
+    ('user cloud', legacy_cloud),
+    ('item listing', lambda tags, items: tag_values(
+        legacy_tag_objects(tags, items))),
+    ('related tags', legacy_related_tags),
+    # Items with as many tags in common come in no particular order.
+    ('related items', lambda tags, item: sorted(
+        legacy_related_items(tags, item))),
+)
+
+QUERIES = (
+    ('user cloud', lambda tags, user: tags.getCloud(users=[user])),
+    ('item listing', lambda tags, items: tag_values(
+        tags.getTagObjects(items=items))),
+    ('related tags', lambda tags, name: tags.getRelatedTags(name)),
+    ('related items', lambda tags, item: sorted(
+        tags.getRelatedItems(item))),
+)
+
+
+def make_queries(options, seed):
+    rnd = random.Random(seed)
+    user = zipf_chooser(options.users, rnd)
+    name = zipf_chooser(options.names, rnd)
+    queries = {'user cloud': [], 'item listing': [], 'related tags': [],
+               'related items': []}
+    for _ in xrange(options.queries):
+        queries['user cloud'].append(u'user-%d' % user())
+        first = rnd.randint(1, max(1, options.items - 20))
+        queries['item listing'].append(range(first, first + 20))
+        queries['related tags'].append(u'tag-%d' % name())
+        queries['related items'].append(rnd.randint(1, options.items))
+    return queries
+
+
+def time_queries(conn, tags, searches, queries, output):
+    """Run each query with a cold cache; return the results."""
+    results = {}
+    for name, search in searches:
+        results[name] = []
+        elapsed = 0.0
+        conn.getTransferCounts(True)
+        for arg in queries[name]:
+            conn.cacheMinimize()
+            start = time.time()
+            results[name].append(search(tags, arg))
+            elapsed += time.time() - start
+        loads = conn.getTransferCounts(True)[0]
+        output('  %-15s %8.2f ms/query, %8.1f loads/query' % (
+            name, 1000 * elapsed / len(queries[name]),
+            float(loads) / len(queries[name])))
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(description=__doc__)
+    parser.add_option('-i', '--items', dest='items', type='int',
+        default=20000, help="Number of tagged items (default 20000)")
+    parser.add_option('-u', '--users', dest='users', type='int',
+        default=2000, help="Number of users (default 2000)")
+    parser.add_option('-n', '--names', dest='names', type='int',
+        default=5000, help="Number of distinct tags (default 5000)")
+    parser.add_option('-c', '--communities', dest='communities', type='int',
+        default=200, help="Number of communities (default 200)")
+    parser.add_option('-q', '--queries', dest='queries', type='int',
+        default=100, help="Queries of each kind to time (default 100)")
+
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error("Too many parameters: %s" % repr(args))
+
+    def output(msg):
+        print msg
+
+    import transaction
+    from ZODB.DB import DB
+    from ZODB.FileStorage import FileStorage
+    from karl.evolve.zodb.evolve61 import migrate
+    from karl.tagging import Tags
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        conn = db.open()
+        root = conn.root()
+        root['tags'] = tags = Tags(None)
+        rows = make_tags(options.items, options.users, options.names,
+                         options.communities, 0)
+        build_legacy(tags, rows)
+        transaction.commit()
+        output('Stored %d tags on %d items.' % (
+            len(tags._tagid_to_obj), options.items))
+        queries = make_queries(options, 1)
+
+        output('One object per tag:')
+        before = time_queries(conn, tags, LEGACY_QUERIES, queries, output)
+
+        migrate(tags)
+        tags._indexRelated()
+        tags._indexNameItems()
+        transaction.commit()
+        db.pack()
+        output('Compact tag store:')
+        after = time_queries(conn, tags, QUERIES, queries, output)
+
+        differ = before != after
+        conn.close()
+        db.close()
+        if differ:
+            output('Results differ!')
+            return 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
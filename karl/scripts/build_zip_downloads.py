@@ -0,0 +1,55 @@
+"""Build the zip downloads too large to be streamed in a request.
+
+Used with the ``zip_download_prebuild`` setting.  Archives built more than
+``--max-age`` hours ago are removed.
+"""
+import logging
+import sys
+
+import transaction
+
+from karl.content.models.zipdownload import build_queued_zips
+from karl.content.models.zipdownload import remove_old_zips
+from karl.content.models.zipdownload import zip_download_dir
+from karl.scripting import create_karl_argparser
+from karl.scripting import daemonize_function
+from karl.scripting import only_one
+
+log = logging.getLogger(__name__)
+
+
+def build_zip_downloads(root, max_age):
+    directory = zip_download_dir()
+    remove_old_zips(directory, max_age * 3600)
+    transaction.begin()
+    try:
+        count = build_queued_zips(root, directory)
+        transaction.commit()
+    except:
+        transaction.abort()
+        raise
+    if count:
+        log.info("Built %d zip downloads", count)
+
+
+def main(argv=sys.argv):
+    parser = create_karl_argparser(
+        description='Build queued zip downloads.'
+        )
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help="Run in daemon mode.")
+    parser.add_argument('-i', '--interval', type=int, default=60,
+                        help="Interval in seconds between executions in "
+                        "daemon mode.  Default is 60.")
+    parser.add_argument('-m', '--max-age', type=int, default=24,
+                        help="Hours to keep built archives.  Default is 24.")
+    args = parser.parse_args(argv[1:])
+    env = args.bootstrap(args.config_uri)
+    root, closer, registry = env['root'], env['closer'], env['registry']
+    if args.daemon:
+        f = daemonize_function(build_zip_downloads, args.interval)
+        only_one(f, registry, 'build_zip_downloads')(root, args.max_age)
+    else:
+        only_one(build_zip_downloads, registry, 'build_zip_downloads')(
+            root, args.max_age)
+    closer()
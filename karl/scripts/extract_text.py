@@ -0,0 +1,72 @@
+"""Extract the text of queued uploaded files and index it.
+
+Used with the ``async_text_extraction`` setting, which makes uploads
+queue their text extraction instead of running converters in the request.
+"""
+import logging
+import sys
+from multiprocessing.pool import ThreadPool
+
+import transaction
+
+from karl.content.models.extraction import extract_queued_text
+from karl.scripting import create_karl_argparser
+from karl.scripting import daemonize_function
+from karl.scripting import only_one
+from karl.utilities.converters.baseconverter import BaseConverter
+
+log = logging.getLogger(__name__)
+
+
+def extract_text(root, pool, batch_size):
+    # Converters run external programs, so the threads of the pool run
+    # that many converter processes in parallel.
+    while True:
+        transaction.begin()
+        try:
+            count = extract_queued_text(root, pool.map, batch_size)
+            transaction.commit()
+        except:
+            transaction.abort()
+            raise
+        if count:
+            log.info("Extracted the text of %d files", count)
+        if count < batch_size:
+            break
+
+
+def main(argv=sys.argv):
+    parser = create_karl_argparser(
+        description='Extract the text of queued files.'
+        )
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help="Run in daemon mode.")
+    parser.add_argument('-i', '--interval', type=int, default=10,
+                        help="Interval in seconds between executions in "
+                        "daemon mode.  Default is 10.")
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help="Number of converters to run in parallel.  "
+                        "Default is 4.")
+    parser.add_argument('-b', '--batch-size', type=int, default=20,
+                        help="Number of files indexed per transaction.  "
+                        "Default is 20.")
+    parser.add_argument('-t', '--timeout', type=int, default=60,
+                        help="Timeout in seconds for each converter.  "
+                        "Default is 60.")
+    args = parser.parse_args(argv[1:])
+    env = args.bootstrap(args.config_uri)
+    root, closer, registry = env['root'], env['closer'], env['registry']
+    # Not in a request, so converters can take their time.
+    BaseConverter.timeout = args.timeout
+    pool = ThreadPool(args.workers)
+    try:
+        if args.daemon:
+            f = daemonize_function(extract_text, args.interval)
+            only_one(f, registry, 'extract_text')(
+                root, pool, args.batch_size)
+        else:
+            only_one(extract_text, registry, 'extract_text')(
+                root, pool, args.batch_size)
+    finally:
+        pool.close()
+    closer()
@@ -19,7 +19,11 @@
 
 from karl.scripting import get_default_config
 from karl.scripting import open_root
+from karl.models.catalog import init_reindex_worker
 from karl.models.catalog import reindex_catalog
+from karl.models.catalog import reindex_catalog_parallel
+from functools import partial
+from multiprocessing import Pool
 from optparse import OptionParser
 import re
 
@@ -41,6 +45,10 @@ def main():
         help="Reindex only objects whose path matches a regular expression")
     parser.add_option('-n', '--index', dest='indexes',
         action="append", help="Reindex only the given index (can be repeated)")
+    parser.add_option('-w', '--workers', dest='workers',
+        action="store", type="int", default=0,
+        help="Compute index values in N worker processes.  An interrupted "
+             "parallel reindex resumes where it stopped when run again.")
 
     options, args = parser.parse_args()
     if args:
@@ -55,6 +63,12 @@ def main():
     config = options.config
     if config is None:
         config = get_default_config()
+    pool = None
+    if options.workers:
+        # Start the workers before opening the database, so that they
+        # don't share its connection.
+        pool = Pool(options.workers, init_reindex_worker,
+                    (partial(open_root, config),))
     root, closer = open_root(config)
 
     def output(msg):
@@ -64,8 +78,19 @@ def main():
     if options.indexes:
         kw['indexes'] = options.indexes
 
-    reindex_catalog(root, path_re=path_re, commit_interval=commit_interval,
-                    dry_run=options.dry_run, output=output, **kw)
+    if pool is None:
+        reindex_catalog(root, path_re=path_re,
+                        commit_interval=commit_interval,
+                        dry_run=options.dry_run, output=output, **kw)
+    else:
+        try:
+            reindex_catalog_parallel(root, pool.map, options.workers,
+                                     path_re=path_re,
+                                     batch_size=commit_interval,
+                                     dry_run=options.dry_run,
+                                     output=output, **kw)
+        finally:
+            pool.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,55 @@
+"""Render the thumbnails of queued images.
+
+Images are queued when they are added or changed; views only show the
+thumbnails rendered here, or a placeholder until they are.
+"""
+import logging
+import sys
+
+import transaction
+
+from karl.content.models.thumbnails import render_queued_thumbnails
+from karl.scripting import create_karl_argparser
+from karl.scripting import daemonize_function
+from karl.scripting import only_one
+
+log = logging.getLogger(__name__)
+
+
+def render_thumbnails(root, batch_size):
+    while True:
+        transaction.begin()
+        try:
+            count = render_queued_thumbnails(root, batch_size)
+            transaction.commit()
+        except:
+            transaction.abort()
+            raise
+        if count:
+            log.info("Rendered the thumbnails of %d images", count)
+        if count < batch_size:
+            break
+
+
+def main(argv=sys.argv):
+    parser = create_karl_argparser(
+        description='Render the thumbnails of queued images.'
+        )
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help="Run in daemon mode.")
+    parser.add_argument('-i', '--interval', type=int, default=10,
+                        help="Interval in seconds between executions in "
+                        "daemon mode.  Default is 10.")
+    parser.add_argument('-b', '--batch-size', type=int, default=20,
+                        help="Number of images rendered per transaction.  "
+                        "Default is 20.")
+    args = parser.parse_args(argv[1:])
+    env = args.bootstrap(args.config_uri)
+    root, closer, registry = env['root'], env['closer'], env['registry']
+    if args.daemon:
+        f = daemonize_function(render_thumbnails, args.interval)
+        only_one(f, registry, 'render_thumbnails')(root, args.batch_size)
+    else:
+        only_one(render_thumbnails, registry, 'render_thumbnails')(
+            root, args.batch_size)
+    closer()
@@ -0,0 +1,42 @@
+import unittest
+
+
+class Test_query_stream(unittest.TestCase):
+    def _callFUT(self, count, distinct, seed):
+        from karl.scripts.bench_search_cache import query_stream
+        return list(query_stream(count, distinct, seed))
+
+    def test_it(self):
+        keys = self._callFUT(1000, 10, 0)
+        self.assertEqual(len(keys), 1000)
+        self.failUnless(set(keys) <= set('query-%d' % i for i in range(10)))
+        self.failUnless(keys.count('query-0') > keys.count('query-9'))
+        self.assertEqual(keys, self._callFUT(1000, 10, 0))
+
+
+class Test_run_worker(unittest.TestCase):
+    def _callFUT(self, args):
+        from karl.scripts.bench_search_cache import run_worker
+        return run_worker(args)
+
+    def test_local(self):
+        options = DummyOptions()
+        worker, hits, misses, elapsed = self._callFUT(('local', 3, options))
+        self.assertEqual(worker, 3)
+        self.assertEqual(hits + misses, 100)
+        self.failUnless(misses >= len(set(DummyOptions.keys(3))))
+        self.failUnless(hits)
+
+
+class DummyOptions(object):
+    queries = 100
+    distinct = 20
+    results = 10
+    size = 100
+    maxbytes = 1024 * 1024
+    path = None
+
+    @classmethod
+    def keys(cls, seed):
+        from karl.scripts.bench_search_cache import query_stream
+        return query_stream(cls.queries, cls.distinct, seed)
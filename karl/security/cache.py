@@ -1,8 +1,23 @@
+import threading
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
 from zope.interface import Interface
 from zope.interface import implements
 from pyramid.location import lineage
 from pyramid.security import Everyone
-from karl.security.policy import AllPermissionsList
+from pyramid.traversal import find_root
+
+from karl.utils import asbool
+from karl.utils import get_config_setting
+
+_marker = object()
+
+# Changes are counted for the subtree at this depth containing them,
+# e.g. a community or a profile, so the number of counters stays bounded.
+INVALIDATION_DEPTH = 2
+
 
 class IACLPathCache(Interface):
     """ Utility:  maps an object's path to the nodes "above" it having ACLs.
@@ -32,55 +47,248 @@ class IACLPathCache(Interface):
         o Populate the cache as we search.
         """
 
+
+class _Node(object):
+    """ A node of the ACL cache trie, one per path segment. """
+    __slots__ = ('children', 'acl', 'aces')
+
+    def __init__(self):
+        self.children = {}
+        self.acl = _marker   # ACL of the object at this path, if looked up
+        self.aces = {}       # permission -> ACEs of the object's lineage
+
+
 class ACLPathCache(object):
+    """ An IACLPathCache storing ACLs in a trie keyed by path segments.
+
+    Clearing a subtree detaches a single trie node, so its cost depends
+    on the depth of the path, not on the size of the cache.  Each node
+    also remembers the ACEs of its whole lineage for each permission
+    looked up, so siblings share the work of their common ancestors.
+
+    One instance is shared by every thread of a process.  When the root
+    of a model's lineage has an ``acl_invalidations`` log (see
+    ``invalidate_acl``), the cache clears the subtrees changed by other
+    processes before answering, and does not store anything read from a
+    database view older or newer than the one it has caught up with.
+    """
     implements(IACLPathCache)
+
     def __init__(self):
-        self._index = {}
+        self._lock = threading.RLock()
+        self._root = _Node()
+        self._seen = 0
+        self._counts = {}
 
     def _getPath(self, model):
-        rpath = []
-        for location in lineage(model):
-            if location.__name__ is None:
-                break
-            rpath.insert(0, location.__name__)
-        return tuple(rpath)
+        # The path is memoized on the model along with its parent's path
+        # tuple, which stays the same object for as long as the parent's
+        # own memo is valid; a moved model or ancestor is recomputed.
+        name = getattr(model, '__name__', None)
+        if name is None:
+            return ()
+        parent = getattr(model, '__parent__', None)
+        if parent is None:
+            parent_path = ()
+        else:
+            parent_path = self._getPath(parent)
+        memo = getattr(model, '_v_acl_path', None)
+        if (memo is not None and memo[0] is parent_path and
+                memo[1] == name):
+            return memo[2]
+        path = parent_path + (name,)
+        try:
+            model._v_acl_path = (parent_path, name, path)
+        except AttributeError:
+            pass
+        return path
+
+    def _find(self, path, create=False):
+        node = self._root
+        for name in path:
+            child = node.children.get(name)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[name] = _Node()
+            node = child
+        return node
+
+    def _clear(self, path):
+        if not path:
+            self._root = _Node()
+            return
+        parent = self._find(path[:-1])
+        if parent is not None:
+            parent.children.pop(path[-1], None)
 
     def clear(self, model=None):
         """ See IACLPathCache.
         """
-        if model is None:
-            self._index.clear()
-            return
-        path = self._getPath(model)
-        lpath = len(path)
-        purged = [x for x in self._index.keys() if x[:lpath] == path]
-        for key in purged:
-            del self._index[key]
+        with self._lock:
+            if model is None:
+                self._root = _Node()
+            else:
+                self._clear(self._getPath(model))
 
     def index(self, model):
         """ See IACLPathCache.
         """
-        for obj in lineage(model):
-            acl = getattr(obj, '__acl__', None)
-            if acl is not None:
-                self._index[self._getPath(obj)] = acl[:]
+        with self._lock:
+            for obj in lineage(model):
+                acl = getattr(obj, '__acl__', None)
+                if acl is not None:
+                    node = self._find(self._getPath(obj), create=True)
+                    node.acl = acl[:]
+                    node.aces.clear()
 
     def lookup(self, model, permission=None):
         """ See IACLPathCache.
         """
-        aces = []
-        for obj in lineage(model):
-            path = self._getPath(obj)
-            acl = self._index.get(path)
-            if acl is None:
-                acl = getattr(obj, '__acl__', ())
-                if acl:
-                    self._index[path] = acl
+        locations = []
+        for location in lineage(model):
+            locations.append(location)
+            if location.__name__ is None:
+                break
+        locations.reverse()
+
+        with self._lock:
+            store = self._sync(locations[0])
+            node = self._root
+            aces = []
+            last = len(locations) - 1
+            for i, location in enumerate(locations):
+                name = location.__name__
+                if name is not None:
+                    child = node.children.get(name)
+                    if child is None:
+                        child = _Node()
+                        # Don't grow the trie for leaves without an ACL;
+                        # listings look up many of those.
+                        if store and (i < last or
+                                      getattr(location, '__acl__', None)):
+                            node.children[name] = child
+                    node = child
+                aces = self._aces(node, location, permission, aces, store)
+            return list(aces)
+
+    def _aces(self, node, location, permission, inherited, store):
+        aces = node.aces.get(permission) if store else None
+        if aces is not None:
+            return aces
+        acl = node.acl
+        if acl is _marker or not store:
+            acl = getattr(location, '__acl__', None)
+            if acl:
+                acl = list(acl)
+            else:
+                acl = None
+            if store:
+                node.acl = acl
+        if not acl:
+            aces = inherited
+        else:
             if permission is not None:
-                acl = [x for x in acl
-                        if x[2] == permission
-                            or isinstance(x[2], AllPermissionsList)]
-            aces.extend(acl)
+                acl = [x for x in acl if _matches(x, permission)]
             if [x for x in acl if x[1] is Everyone]:
-                break
+                aces = acl
+            else:
+                aces = acl + list(inherited)
+        if store:
+            node.aces[permission] = aces
         return aces
+
+    def _sync(self, root):
+        """ Clear the subtrees whose ACLs other processes changed.
+
+        Returns False if the database view of the caller differs from
+        the one the cache reflects, in which case nothing may be stored.
+        """
+        log = getattr(root, 'acl_invalidations', None)
+        if log is None:
+            return self._seen == 0
+        generation = log.generation()
+        if generation == self._seen:
+            return True
+        if generation < self._seen:
+            # an older view, e.g. a thread which hasn't synced yet
+            return False
+        counts = log.counts()
+        for path, count in counts.items():
+            if count != self._counts.get(path, 0):
+                self._clear(path)
+        if log.dirty():
+            # Our own uncommitted changes: they may still be aborted.
+            return False
+        self._seen = generation
+        self._counts = counts
+        return True
+
+
+def _matches(ace, permission):
+    permissions = ace[2]
+    if isinstance(permissions, basestring):
+        return permissions == permission
+    # sequences of permissions, and AllPermissionsList
+    return permission in permissions
+
+
+class ACLInvalidations(Persistent):
+    """ Counts of the ACL changes in each subtree of the site.
+
+    Kept as the ``acl_invalidations`` attribute of the site, it lets the
+    ACL cache of every process clear just the subtrees changed by others.
+    The counters are ``Length``s, one per subtree and one in all, so
+    transactions changing ACLs at the same time add up their changes
+    instead of conflicting.
+    """
+
+    def __init__(self):
+        self._generation = Length(0)
+        self._subtrees = OOBTree()  # path -> Length
+
+    def generation(self):
+        """ The number of changes logged in all. """
+        return self._generation.value
+
+    def dirty(self):
+        """ Has the log been changed by the current transaction? """
+        if self._p_jar is None:
+            return True  # not committed yet
+        return bool(self._generation._p_changed)
+
+    def add(self, path):
+        path = tuple(path)[:INVALIDATION_DEPTH]
+        counter = self._subtrees.get(path)
+        if counter is None:
+            counter = self._subtrees[path] = Length(0)
+        counter.change(1)
+        self._generation.change(1)
+
+    def counts(self):
+        """ Return a dict of the number of changes logged by subtree. """
+        return dict((path, counter.value)
+                    for path, counter in self._subtrees.items())
+
+
+# The ACL cache shared by the threads of this process.
+cache = ACLPathCache()
+
+
+def invalidate_acl(context, cache=cache):
+    """ Tell ACL caches that the ACLs of ``context`` or its subobjects
+    changed, or that it is going away.
+
+    Other processes are only told when the ``acl_cache`` setting is on.
+    """
+    cache.clear(context)
+    if getattr(context, '_p_jar', None) is None:
+        # Not committed yet, so no other process can have cached it.
+        return
+    if not asbool(get_config_setting('acl_cache', 'false')):
+        return
+    root = find_root(context)
+    log = getattr(root, 'acl_invalidations', None)
+    if log is None:
+        log = root.acl_invalidations = ACLInvalidations()
+    log.add(cache._getPath(context))
@@ -1,8 +1,13 @@
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.security import ACLAllowed
+from pyramid.security import ACLDenied
 from pyramid.security import Allow  # noqa
 from pyramid.security import Deny
 from pyramid.security import Everyone
 from pyramid.security import AllPermissionsList
 
+from karl.security.cache import cache as acl_cache
+
 VIEW = 'view'
 EDIT = 'edit'
 CREATE = 'create'
@@ -25,3 +30,29 @@ NO_INHERIT = (Deny, Everyone, ALL)
 def get_groups(identity, request):
     if 'groups' in identity:
         return identity['groups']
+
+
+class CachingACLAuthorizationPolicy(ACLAuthorizationPolicy):
+    """ An ACL authorization policy reading ACLs through an ACL cache.
+
+    Enabled by the ``acl_cache`` setting.  Permission checks on objects
+    in the same folder share the ACEs cached for their ancestors, instead
+    of each walking and filtering the ACLs of the whole lineage.
+    """
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = acl_cache
+        self.cache = cache
+
+    def permits(self, context, principals, permission):
+        aces = self.cache.lookup(context, permission)
+        for ace in aces:
+            ace_action, ace_principal, ace_permissions = ace
+            if ace_principal in principals:
+                if ace_action == Allow:
+                    return ACLAllowed(ace, aces, permission, principals,
+                                      context)
+                return ACLDenied(ace, aces, permission, principals, context)
+        return ACLDenied('<default deny>', aces, permission, principals,
+                         context)
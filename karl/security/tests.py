@@ -35,6 +35,19 @@ class TestACLPathCache(unittest.TestCase):
             model.__acl__ = [self._makeACE(principal=x) for x in principals]
         return model
 
+    def _cachedPaths(self, cache):
+        # paths of the objects whose ACLs are cached
+        from karl.security.cache import _marker
+        paths = []
+        stack = [((), cache._root)]
+        while stack:
+            path, node = stack.pop()
+            if node.acl is not _marker and node.acl is not None:
+                paths.append(path)
+            for name, child in node.children.items():
+                stack.append((path + (name,), child))
+        return sorted(paths)
+
     def test_class_conforms_to_IACLPathCache(self):
         from zope.interface.verify import verifyClass
         from karl.security.cache import IACLPathCache
@@ -47,15 +60,15 @@ class TestACLPathCache(unittest.TestCase):
 
     def test_ctor(self):
         cache = self._makeOne()
-        self.assertEqual(len(cache._index), 0)
+        self.assertEqual(len(self._cachedPaths(cache)), 0)
 
     def test_clear_default(self):
         cache = self._makeOne()
         root = self._makeModel()
         cache.index(root)
-        self.assertEqual(len(cache._index), 1)
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
         cache.clear()
-        self.assertEqual(len(cache._index), 0)
+        self.assertEqual(len(self._cachedPaths(cache)), 0)
 
     def test_clear_nondefault(self):
         cache = self._makeOne()
@@ -63,10 +76,10 @@ class TestACLPathCache(unittest.TestCase):
         cache.index(root)
         child = self._makeModel(name='child', parent=root, principals=('bob',))
         cache.index(child)
-        self.assertEqual(len(cache._index), 2)
+        self.assertEqual(len(self._cachedPaths(cache)), 2)
         cache.clear(child)
-        self.assertEqual(len(cache._index), 1)
-        self.assertEqual(cache._index.keys()[0], ())
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
+        self.assertEqual(self._cachedPaths(cache)[0], ())
 
     def test_clear_intermediate(self):
         cache = self._makeOne()
@@ -76,10 +89,10 @@ class TestACLPathCache(unittest.TestCase):
         cache.index(child)
         grand = self._makeModel('grand', child, principals=('alice',))
         cache.index(grand)
-        self.assertEqual(len(cache._index), 3)
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
         cache.clear(child)
-        self.assertEqual(len(cache._index), 1)
-        self.assertEqual(cache._index.keys()[0], ())
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
+        self.assertEqual(self._cachedPaths(cache)[0], ())
 
     def test_index_no_acl(self):
         cache = self._makeOne()
@@ -87,8 +100,8 @@ class TestACLPathCache(unittest.TestCase):
         cache.index(root)
         child = self._makeModel('child', root, principals=())
         cache.index(child)
-        self.assertEqual(len(cache._index), 1)
-        self.assertEqual(cache._index.keys()[0], ())
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
+        self.assertEqual(self._cachedPaths(cache)[0], ())
 
     def test_lookup_root_uncached_no_acl_no_permission(self):
         cache = self._makeOne()
@@ -96,7 +109,7 @@ class TestACLPathCache(unittest.TestCase):
 
         aces = cache.lookup(root)
         self.assertEqual(len(aces), 0)
-        self.assertEqual(len(cache._index), 0)
+        self.assertEqual(len(self._cachedPaths(cache)), 0)
 
     def test_lookup_root_uncached_w_acl_no_permission(self):
         from pyramid.security import Allow
@@ -106,7 +119,7 @@ class TestACLPathCache(unittest.TestCase):
         aces = cache.lookup(root)
         self.assertEqual(len(aces), 1)
         self.assertEqual(aces[0], (Allow, 'phreddy', 'testing'))
-        self.assertEqual(len(cache._index), 1)
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
 
     def test_lookup_root_cached_w_acl_no_permission(self):
         from pyramid.security import Allow
@@ -118,7 +131,7 @@ class TestACLPathCache(unittest.TestCase):
         aces = cache.lookup(root)
         self.assertEqual(len(aces), 1, aces)
         self.assertEqual(aces[0], (Allow, 'phreddy', 'testing'))
-        self.assertEqual(len(cache._index), 1)
+        self.assertEqual(len(self._cachedPaths(cache)), 1)
 
     def test_lookup_nonroot(self):
         from pyramid.security import Allow
@@ -132,7 +145,7 @@ class TestACLPathCache(unittest.TestCase):
         self.assertEqual(aces[0], (Allow, 'alice', 'testing'))
         self.assertEqual(aces[1], (Allow, 'bob', 'testing'))
         self.assertEqual(aces[2], (Allow, 'phreddy', 'testing'))
-        self.assertEqual(len(cache._index), 3)
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
 
     def test_lookup_nonroot_w_permission(self):
         cache = self._makeOne()
@@ -142,7 +155,7 @@ class TestACLPathCache(unittest.TestCase):
 
         aces = cache.lookup(grand, 'view')
         self.assertEqual(len(aces), 0)
-        self.assertEqual(len(cache._index), 3)
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
 
     def test_lookup_nonroot_sparse(self):
         from pyramid.security import Allow
@@ -155,7 +168,7 @@ class TestACLPathCache(unittest.TestCase):
         self.assertEqual(len(aces), 2)
         self.assertEqual(aces[0], (Allow, 'bob', 'testing'))
         self.assertEqual(aces[1], (Allow, 'phreddy', 'testing'))
-        self.assertEqual(len(cache._index), 2)
+        self.assertEqual(len(self._cachedPaths(cache)), 2)
 
     def test_lookup_nonroot_sparse_w_permission(self):
         cache = self._makeOne()
@@ -165,7 +178,7 @@ class TestACLPathCache(unittest.TestCase):
 
         aces = cache.lookup(grand, 'view')
         self.assertEqual(len(aces), 0)
-        self.assertEqual(len(cache._index), 2)
+        self.assertEqual(len(self._cachedPaths(cache)), 2)
 
     def test_lookup_nonroot_sparse_w_permission_w_all(self):
         from pyramid.security import Allow
@@ -179,7 +192,7 @@ class TestACLPathCache(unittest.TestCase):
         aces = cache.lookup(grand, 'view')
         self.assertEqual(len(aces), 1)
         self.assertEqual(aces[0], (Allow, 'alice', ALL))
-        self.assertEqual(len(cache._index), 3)
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
 
     def test_lookup_nonroot_sparse_w_allow_everyone(self):
         from pyramid.security import Allow
@@ -194,7 +207,8 @@ class TestACLPathCache(unittest.TestCase):
         self.assertEqual(len(aces), 2)
         self.assertEqual(aces[0], (Allow, 'alice', 'testing'))
         self.assertEqual(aces[1], (Allow, Everyone, 'testing'))
-        self.assertEqual(len(cache._index), 2)
+        # the root's ACL is cached too, though not needed here
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
 
     def test_lookup_nonroot_sparse_w_deny_everyone(self):
         from pyramid.security import Allow
@@ -212,7 +226,252 @@ class TestACLPathCache(unittest.TestCase):
         self.assertEqual(aces[0], (Allow, 'alice', 'testing'))
         self.assertEqual(aces[1], (Allow, 'bob', 'testing'))
         self.assertEqual(aces[2], (Deny, Everyone, 'testing'))
-        self.assertEqual(len(cache._index), 2)
+        # the root's ACL is cached too, though not needed here
+        self.assertEqual(len(self._cachedPaths(cache)), 3)
+
+    def test_lookup_w_permission_sequence(self):
+        from pyramid.security import Allow
+        cache = self._makeOne()
+        root = self._makeModel()
+        root.__acl__ = [(Allow, 'bob', ('view', 'edit')),
+                        (Allow, 'alice', ('edit',))]
+        self.assertEqual(cache.lookup(root, 'view'),
+                         [(Allow, 'bob', ('view', 'edit'))])
+
+    def test_lookup_cached(self):
+        from pyramid.security import Allow
+        cache = self._makeOne()
+        root = self._makeModel()
+        child = self._makeModel('child', root, principals=('bob',))
+        cache.lookup(child, 'testing')
+        root.__acl__ = []
+        child.__acl__ = []
+        self.assertEqual(cache.lookup(child, 'testing'),
+                         [(Allow, 'bob', 'testing'),
+                          (Allow, 'phreddy', 'testing')])
+
+    def test_lookup_leaf_without_acl_not_stored(self):
+        cache = self._makeOne()
+        root = self._makeModel()
+        child = self._makeModel('child', root, principals=())
+        cache.lookup(child)
+        self.assertEqual(cache._root.children, {})
+
+    def test_clear_subtree_only(self):
+        from pyramid.security import Allow
+        cache = self._makeOne()
+        root = self._makeModel()
+        one = self._makeModel('one', root, principals=('bob',))
+        two = self._makeModel('two', root, principals=('alice',))
+        cache.lookup(one)
+        cache.lookup(two)
+        one.__acl__ = [self._makeACE(principal='fred')]
+        two.__acl__ = []
+        cache.clear(one)
+        self.assertEqual(cache.lookup(one)[0], (Allow, 'fred', 'testing'))
+        self.assertEqual(cache.lookup(two)[0], (Allow, 'alice', 'testing'))
+
+    def test_getPath_memoized(self):
+        cache = self._makeOne()
+        root = self._makeModel()
+        child = self._makeModel('child', root)
+        grand = self._makeModel('grand', child)
+        path = cache._getPath(grand)
+        self.assertEqual(path, ('child', 'grand'))
+        self.failUnless(cache._getPath(grand) is path)
+        child.__name__ = 'moved'
+        self.assertEqual(cache._getPath(grand), ('moved', 'grand'))
+
+    def test_lookup_replays_invalidations(self):
+        from pyramid.security import Allow
+        cache = self._makeOne()
+        root = self._makeModel()
+        one = self._makeModel('one', root, principals=('bob',))
+        two = self._makeModel('two', root, principals=('alice',))
+        root.acl_invalidations = log = DummyInvalidations()
+        cache.lookup(one)
+        cache.lookup(two)
+        one.__acl__ = [self._makeACE(principal='fred')]
+        two.__acl__ = [self._makeACE(principal='fred')]
+        # another process changed one's ACL
+        log.add(('one',))
+        self.assertEqual(cache.lookup(one)[0], (Allow, 'fred', 'testing'))
+        self.assertEqual(cache.lookup(two)[0], (Allow, 'alice', 'testing'))
+        self.assertEqual(cache._seen, 1)
+        # and then two's
+        log.add(('two',))
+        self.assertEqual(cache.lookup(two)[0], (Allow, 'fred', 'testing'))
+        self.assertEqual(cache._counts, {('one',): 1, ('two',): 1})
+
+    def test_lookup_does_not_store_from_other_views(self):
+        from pyramid.security import Allow
+        cache = self._makeOne()
+        root = self._makeModel()
+        root.acl_invalidations = log = DummyInvalidations()
+        log.add(('one',))
+        log.dirty_ = True
+        cache.lookup(root)
+        self.assertEqual(self._cachedPaths(cache), [])
+        self.assertEqual(cache._seen, 0)
+        log.dirty_ = False
+        cache.lookup(root)
+        self.assertEqual(cache._seen, 1)
+        log.counts_.clear()  # an older view
+        root.__acl__ = [self._makeACE(principal='fred')]
+        self.assertEqual(cache.lookup(root), [(Allow, 'fred', 'testing')])
+        self.assertEqual(cache.lookup(root), [(Allow, 'fred', 'testing')])
+        self.assertEqual(len(cache._root.aces), 1)  # from the earlier view
+
+
+class TestACLInvalidations(unittest.TestCase):
+    def _makeOne(self):
+        from karl.security.cache import ACLInvalidations
+        return ACLInvalidations()
+
+    def test_it(self):
+        log = self._makeOne()
+        self.assertEqual(log.generation(), 0)
+        self.assertEqual(log.counts(), {})
+        log.add(['communities', 'a'])
+        log.add(('communities', 'b', 'files', 'c'))
+        log.add(('communities', 'b'))
+        self.assertEqual(log.generation(), 3)
+        self.assertEqual(log.counts(), {('communities', 'a'): 1,
+                                        ('communities', 'b'): 2})
+        self.failUnless(log.dirty())  # not in a database
+
+    def test_concurrent_changes_dont_conflict(self):
+        import os
+        import shutil
+        import tempfile
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        log = conn1.root()['log'] = self._makeOne()
+        log.add(('communities', 'a'))
+        tm1.commit()
+        conn2 = db.open(transaction_manager=tm2)
+        conn2.root()['log'].add(('communities', 'a', 'files'))
+        log.add(('communities', 'a', 'wiki'))
+        tm2.commit()
+        tm1.commit()
+        conn2.close()
+        tm1.begin()
+        self.assertEqual(log.generation(), 3)
+        self.assertEqual(log.counts(), {('communities', 'a'): 3})
+        conn1.close()
+        db.close()
+
+
+class Test_invalidate_acl(unittest.TestCase):
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _callFUT(self, context, cache):
+        from karl.security.cache import invalidate_acl
+        return invalidate_acl(context, cache)
+
+    def _registerSettings(self, acl_cache='true'):
+        from pyramid.interfaces import ISettings
+        from karl.testing import registerUtility
+        registerUtility({'acl_cache': acl_cache}, ISettings)
+
+    def test_not_in_database(self):
+        self._registerSettings()
+        cache = DummyACLCache()
+        root = testing.DummyModel()
+        root['a'] = context = testing.DummyModel()
+        self._callFUT(context, cache)
+        self.assertEqual(cache.cleared, [context])
+        self.failIf(hasattr(root, 'acl_invalidations'))
+
+    def test_acl_cache_off(self):
+        self._registerSettings('false')
+        cache = DummyACLCache()
+        root = testing.DummyModel()
+        root['a'] = context = testing.DummyModel()
+        context._p_jar = object()
+        self._callFUT(context, cache)
+        self.assertEqual(cache.cleared, [context])
+        self.failIf(hasattr(root, 'acl_invalidations'))
+
+    def test_in_database(self):
+        from karl.security.cache import ACLPathCache
+        self._registerSettings()
+        cache = ACLPathCache()
+        root = testing.DummyModel()
+        root['a'] = context = testing.DummyModel()
+        context._p_jar = object()
+        self._callFUT(context, cache)
+        self.assertEqual(root.acl_invalidations.counts(), {('a',): 1})
+        self._callFUT(context, cache)
+        self.assertEqual(root.acl_invalidations.generation(), 2)
+
+
+class TestCachingACLAuthorizationPolicy(unittest.TestCase):
+    def _makeOne(self):
+        from karl.security.cache import ACLPathCache
+        from karl.security.policy import CachingACLAuthorizationPolicy
+        return CachingACLAuthorizationPolicy(ACLPathCache())
+
+    def test_permits(self):
+        from pyramid.security import Allow
+        from pyramid.security import Deny
+        from pyramid.security import Everyone
+        from karl.security.policy import MEMBER_PERMS
+        from karl.security.policy import NO_INHERIT
+        policy = self._makeOne()
+        root = testing.DummyModel()
+        root.__acl__ = [(Allow, Everyone, ('view',))]
+        root['a'] = a = testing.DummyModel()
+        a.__acl__ = [(Deny, 'fred', ('view',)),
+                     (Allow, 'group.a', MEMBER_PERMS), NO_INHERIT]
+        a['b'] = b = testing.DummyModel()
+        self.failUnless(policy.permits(root, [Everyone, 'fred'], 'view'))
+        self.failIf(policy.permits(b, [Everyone, 'fred', 'group.a'], 'view'))
+        self.failUnless(policy.permits(b, [Everyone, 'group.a'], 'edit'))
+        denied = policy.permits(b, [Everyone, 'barney'], 'view')
+        self.failIf(denied)
+        self.assertEqual(denied.ace, NO_INHERIT)
+        denied = policy.permits(root, [Everyone, 'fred'], 'edit')
+        self.failIf(denied)
+        self.assertEqual(denied.ace, '<default deny>')
+
+
+class DummyInvalidations(object):
+    dirty_ = False
+
+    def __init__(self):
+        self.counts_ = {}
+
+    def add(self, path):
+        self.counts_[path] = self.counts_.get(path, 0) + 1
+
+    def generation(self):
+        return sum(self.counts_.values())
+
+    def counts(self):
+        return dict(self.counts_)
+
+    def dirty(self):
+        return self.dirty_
+
+
+class DummyACLCache(object):
+    def __init__(self):
+        self.cleared = []
+
+    def clear(self, model=None):
+        self.cleared.append(model)
 
 
 class TestSecuredStateMachine(unittest.TestCase):
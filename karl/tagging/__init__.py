@@ -15,10 +15,14 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+import heapq
 import itertools
 import random
 
+import BTrees
+from BTrees import IIBTree
 from BTrees import IOBTree
+from BTrees import OIBTree
 from BTrees import OOBTree
 from persistent import Persistent
 from persistent.mapping import PersistentMapping
@@ -28,6 +32,7 @@ from zope.interface import implements
 from pyramid.traversal import find_resource
 
 from karl.utils import find_catalog
+from karl.utils import get_config_setting
 from karl.utils import find_community
 from karl.tagging.interfaces import ITag
 from karl.tagging.interfaces import ITagAddedEvent
@@ -36,6 +41,10 @@ from karl.tagging.interfaces import ITaggingEngine
 from karl.tagging.interfaces import ITaggingStatistics
 from karl.tagging.interfaces import ITagRemovedEvent
 
+# The deepest getRelatedTags searches, unless the
+# ``related_tags_max_degree`` setting says otherwise.
+MAX_RELATED_DEGREE = 3
+
 
 class _TagEventBase(Persistent):
 
@@ -66,6 +75,10 @@ class TagRemovedEvent(_TagEventBase):
 
 class Tag(Persistent):
     """ Simple implementation of a tag.
+
+    The tagging engine hands out tags as values built from its columns;
+    they are persistent only because tags used to be stored one record
+    each.
     """
     implements(ITag)
     _id = None
@@ -104,9 +117,63 @@ class Tag(Persistent):
             self.community)
 
 
+class StringTable(Persistent):
+    """ Interned strings, each stored once and known by an integer.
+
+    Ids are never 0, so 0 can stand for no string at all.  As with tag
+    ids, each process allocates them sequentially from a random start, so
+    concurrent transactions interning new strings don't insert the same
+    id.
+    """
+    _v_nextid = None
+
+    def __init__(self):
+        self._ids = OIBTree.OIBTree()
+        self._strings = IOBTree.IOBTree()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, id):
+        return self._strings[id]
+
+    def get_id(self, string):
+        return self._ids.get(string)
+
+    def intern(self, string):
+        id = self._ids.get(string)
+        if id is None:
+            id = self._generate_id()
+            self._ids[string] = id
+            self._strings[id] = string
+        return id
+
+    def _generate_id(self):
+        while True:
+            if self._v_nextid is None or self._v_nextid >= 2**31:
+                self._v_nextid = random.randrange(1, 2**31)
+            id = self._v_nextid
+            self._v_nextid += 1
+            if id not in self._strings:
+                return id
+
+    def release(self, string):
+        id = self._ids.pop(string, None)
+        if id is not None:
+            del self._strings[id]
+
+    def rename(self, old, new):
+        """ Give the id of ``old`` to ``new``, which must not be interned.
+        """
+        id = self._ids.pop(old)
+        self._ids[new] = id
+        self._strings[id] = new
+
+
 class Tags(Persistent):
     implements(ITaggingEngine, ITaggingStatistics)
 
+    family = BTrees.family32
     _v_nextid = None
 
     def __init__(self, site):
@@ -115,7 +182,7 @@ class Tags(Persistent):
 
     # ITaggingStatistics attributes
     def __len__(self):
-        return len(self._tagid_to_obj)
+        return len(self._tag_items)
 
     @property
     def tagCount(self):
@@ -146,14 +213,14 @@ class Tags(Persistent):
             # shortcut
             return set(self._name_to_tagids.keys())
 
-        result = self.getTagObjects(items, users, community=community)
-        return set([tag.name for tag in result])
+        ids = self._getTagIds(items, users, None, community)
+        return self._strings(self._names, self._tag_names, ids)
 
     def getTagObjects(self, items=None, users=None, tags=None, community=None):
         """ See ITaggingEngine.
         """
         ids = self._getTagIds(items, users, tags, community)
-        return set([self._tagid_to_obj[id] for id in ids])
+        return set([self._getTag(id) for id in ids])
 
     def getCloud(self, items=None, users=None, community=None):
         """ See ITaggingEngine.
@@ -171,14 +238,17 @@ class Tags(Persistent):
                 d = self._community_clouds.get(community, {})
         else:
             # Compute cloud data
-            tags = self.getTagObjects(items=items, users=users,
-                                      community=community)
-            d = {}
-            for tag in tags:
-                if d.has_key(tag.name):
-                    d[tag.name] += 1
-                else:
-                    d[tag.name] = 1
+            # Identical tags count once.
+            ids = self._getTagIds(items=items, users=users,
+                                  community=community)
+            rows = set([(self._tag_items[id], self._tag_users[id],
+                         self._tag_names[id], self._tag_communities[id])
+                        for id in ids])
+            counts = {}
+            for row in rows:
+                counts[row[2]] = counts.get(row[2], 0) + 1
+            d = dict((self._names[name_id], count)
+                     for name_id, count in counts.items())
 
         return set(d.items())
 
@@ -187,23 +257,69 @@ class Tags(Persistent):
         """
         uids = self._getTagIds(items=None, users=users, tags=tags,
                                community=community)
-        res = set()
-        for uid in uids:
-            o = self._tagid_to_obj.get(uid)
-            if o is not None:
-                res.add(o.item)
-        return res
+        tag_items = self._tag_items
+        return set([tag_items[uid] for uid in uids])
+
+    def getItemSet(self, tag, users=None, community=None):
+        """ See ITaggingEngine.
+        """
+        if users is None and community is None:
+            items = self._name_to_items.get(tag)
+            if items is None:
+                items = self.family.IF.Set()
+            return items
+        return self.family.IF.Set(
+            self.getItems(tags=(tag,), users=users, community=community))
 
     def getUsers(self, tags=None, items=None, community=None):
         """ See ITaggingEngine.
         """
         ids = self._getTagIds(items=items, users=None, tags=tags,
                               community=community)
-        return set([self._tagid_to_obj[id].user for id in ids])
+        return self._strings(self._users, self._tag_users, ids)
 
-    def getRelatedTags(self, tag, degree=1, community=None, user=None):
+    def getRelatedTags(self, tag, degree=1, community=None, user=None,
+                       limit=None):
         """ See ITaggingEngine.
         """
+        degree = min(degree, int(get_config_setting(
+            'related_tags_max_degree', MAX_RELATED_DEGREE)))
+        if user is not None:
+            return self._getRelatedTagsOfUser(tag, degree, community, user)
+        if community is None:
+            related = self._global_related
+        else:
+            related = self._related.get(
+                self._communities.get_id(community) or -1)
+        name_id = self._names.get_id(tag)
+        if related is None or name_id is None:
+            return set()
+        # Walk the co-occurrence matrix one degree at a time, adding up
+        # how often each tag was given together with those of the
+        # previous degree.
+        scores = {}
+        previous_degree_tags = set([name_id])
+        for degree_counter in range(degree):
+            degree_tags = set()
+            for cur_id in previous_degree_tags:
+                for other_id, count in related.get(cur_id, {}).items():
+                    scores[other_id] = scores.get(other_id, 0) + count
+                    degree_tags.add(other_id)
+            previous_degree_tags = degree_tags
+        # Make sure the original is not included
+        scores.pop(name_id, None)
+        if limit is not None:
+            scores = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+        else:
+            scores = scores.items()
+        return set([self._names[other_id] for other_id, count in scores])
+
+    def _getRelatedTagsOfUser(self, tag, degree, community, user):
+        # The co-occurrence matrix counts the tags of every user, so
+        # follow the user's own tags instead.
+        if community is not None:
+            community_id = self._communities.get_id(community)
+        user_id = self._users.get_id(user)
         result = set()
         degree_counter = 1
         previous_degree_tags = set([tag])
@@ -212,16 +328,16 @@ class Tags(Persistent):
             for cur_name in previous_degree_tags:
                 tagids = self._name_to_tagids.get(cur_name, ())
                 for tagid in tagids:
-                    tag_obj = self._tagid_to_obj[tagid]
-                    if community and tag_obj.community != community:
+                    if (community is not None and
+                        self._tag_communities[tagid] != community_id):
                         continue
-                    if user and tag_obj.user != user:
+                    if self._tag_users[tagid] != user_id:
                         continue
                     degree_tags.update(self.getTags(
-                                                items=(tag_obj.item,),
-                                                users=(tag_obj.user,),
-                                                community=community,
-                                                ))
+                        items=(self._tag_items[tagid],),
+                        users=(user,),
+                        community=community,
+                        ))
             # After all the related tags of this degree were found, update the
             # result set and clean up the variables for the next round.
             result.update(degree_tags)
@@ -233,34 +349,51 @@ class Tags(Persistent):
             result.remove(tag)
         return result
 
-    def getRelatedItems(self, item, community=None, user=None):
+    def getRelatedItems(self, item, community=None, user=None, limit=None):
         """ See ITaggingEngine.
         """
         if user is None:
             tags = self.getTags([item], community=community)
-            items = self.getItems(tags, community=community)
         else:
             tags = self.getTags([item], community=community, users=(user,))
-            items = self.getItems(tags, community=community, users=(user,))
-        if item in items:
-            items.remove(item)
-        result = []
-        for otherItem in items:
-            otherTags = self.getTags([otherItem], community=community)
-            result.append((otherItem, len(tags.intersection(otherTags))))
-        return sorted(result, key=lambda i: i[1], reverse=True)
-
-    def getRelatedUsers(self, user, community=None):
+        # Count, for each item sharing a tag, the tags it shares.
+        if user is not None:
+            user_id = self._users.get_id(user)
+        counts = {}
+        items = set()
+        for name in tags:
+            ids = self._getTagIds(tags=[name], community=community)
+            shared = set()
+            for id in ids:
+                other = self._tag_items[id]
+                shared.add(other)
+                if user is None or self._tag_users[id] == user_id:
+                    items.add(other)
+            for other in shared:
+                counts[other] = counts.get(other, 0) + 1
+        items.discard(item)
+        return self._ranked(items, counts, limit)
+
+    def getRelatedUsers(self, user, community=None, limit=None):
         """ See ITaggingEngine.
         """
         tags = self.getTags(users=[user], community=community)
-        users = self.getUsers(tags, community=community)
-        if user in users:
-            users.remove(user)
-        result = []
-        for otherUser in users:
-            otherTags = self.getTags(users=[otherUser], community=community)
-            result.append((otherUser, len(tags.intersection(otherTags))))
+        counts = {}
+        for name in tags:
+            ids = self._getTagIds(tags=[name], community=community)
+            for user_id in set([self._tag_users[id] for id in ids]):
+                counts[user_id] = counts.get(user_id, 0) + 1
+        users = self._users
+        counts = dict((users[user_id], count)
+                      for user_id, count in counts.items())
+        others = set(counts)
+        others.discard(user)
+        return self._ranked(others, counts, limit)
+
+    def _ranked(self, candidates, counts, limit):
+        result = [(candidate, counts[candidate]) for candidate in candidates]
+        if limit is not None:
+            return heapq.nlargest(limit, result, key=lambda i: i[1])
         return sorted(result, key=lambda i: i[1], reverse=True)
 
     def getFrequency(self, tags=None, community=None, user=None):
@@ -274,11 +407,15 @@ class Tags(Persistent):
             result = {}
         else:
             result = dict((x, 0) for x in tags)
-        for tag_id in self._getTagIds(users=users,
-                                      tags=tags,
-                                      community=community):
-            tag_obj = self._tagid_to_obj[tag_id]
-            result[tag_obj.name] = result.setdefault(tag_obj.name, 0) + 1
+        ids = self._getTagIds(users=users, tags=tags, community=community)
+        names = self._names
+        counts = {}
+        tag_names = self._tag_names
+        for id in ids:
+            name_id = tag_names[id]
+            counts[name_id] = counts.get(name_id, 0) + 1
+        for name_id, count in counts.items():
+            result[names[name_id]] = count
         return sorted(result.items(), key=lambda x: x[1])
 
     def update(self, item, user, tags):
@@ -291,7 +428,7 @@ class Tags(Persistent):
         tags_user = set(self._user_to_tagids.get(user, ()))
         tags_user_item = tags_item.intersection(tags_user)
 
-        old_tags = set([self._tagid_to_obj[id] for id in tags_user_item])
+        old_tags = set([self._getTag(id) for id in tags_user_item])
 
         new_tags = set([Tag(item, user, tagName, community)
                             for tagName in tags])
@@ -321,6 +458,13 @@ class Tags(Persistent):
             else:
                 ids.insert(id)
 
+            items = self._name_to_items.get(tagObj.name)
+            if items is None:
+                self._name_to_items[tagObj.name] = self.family.IF.TreeSet(
+                    (item,))
+            else:
+                items.insert(item)
+
             ids = self._community_to_tagids.get(tagObj.community)
             if ids is None:
                 self._community_to_tagids[tagObj.community] = \
@@ -328,6 +472,8 @@ class Tags(Persistent):
             else:
                 ids.insert(id)
 
+            self._relateTag(id, 1)
+
             # Update cloud counts
             if tagObj.community:
                 community_cloud = self._community_clouds.get(tagObj.community)
@@ -347,6 +493,8 @@ class Tags(Persistent):
 
         del_tag_ids = [x._id for x in remove_tags]
         self._delTags(del_tag_ids)
+        if add_tags or remove_tags:
+            self._invalidate()
 
     def delete(self, item=None, user=None, tag=None):
         if item is None and user is None and tag is None:
@@ -367,6 +515,8 @@ class Tags(Persistent):
             else:
                 tags = name_tags
         self._delTags(tags)
+        if tags:
+            self._invalidate()
         return len(tags)
 
     def rename(self, old, new):
@@ -377,20 +527,37 @@ class Tags(Persistent):
         if not isinstance(new, unicode):
             new = new.decode('utf-8')
         tagIds = set(self._name_to_tagids.get(old, ()))
-        for tagId in tagIds:
-            tagObj = self._tagid_to_obj[tagId]
-            notify(TagRemovedEvent(tagObj._clone()))
-            tagObj.name = new
-            notify(TagAddedEvent(tagObj))
-        newTagIds = IOBTree.IOSet(self._name_to_tagids.get(new, ()))
-        newTagIds.update(tagIds)
-        self._name_to_tagids[new] = newTagIds
+        oldTags = [self._getTag(tagId) for tagId in tagIds]
+        if tagIds:
+            if new in self._name_to_tagids:
+                name_id = self._names.get_id(new)
+                for tagId in tagIds:
+                    self._relateTag(tagId, -1)
+                    self._tag_names[tagId] = name_id
+                    self._relateTag(tagId, 1)
+                self._names.release(old)
+            else:
+                # The tags keep their name id; only the string changes.
+                self._names.rename(old, new)
+        for tagObj in oldTags:
+            notify(TagRemovedEvent(tagObj))
+            notify(TagAddedEvent(self._getTag(tagObj._id)))
         if tagIds:
+            newTagIds = IOBTree.IOSet(self._name_to_tagids.get(new, ()))
+            newTagIds.update(tagIds)
+            self._name_to_tagids[new] = newTagIds
             del self._name_to_tagids[old]
+            items = self._name_to_items.pop(old)
+            newItems = self._name_to_items.get(new)
+            if newItems is None:
+                self._name_to_items[new] = items
+            else:
+                newItems.update(items)
+            self._invalidate()
         for cloud in itertools.chain((self._global_cloud,),
                                      self._community_clouds.values()):
             if old in cloud:
-                cloud[new] = cloud[old]
+                cloud[new] = cloud.get(new, 0) + cloud[old]
                 del cloud[old]
         return len(tagIds)
 
@@ -398,19 +565,27 @@ class Tags(Persistent):
         """ See ITaggingEngine.
         """
         old_ids = self._user_to_tagids[olduser]
+        oldTags = [self._getTag(tagid) for tagid in old_ids]
+        newuser = unicode(newuser)
         if newuser in self._user_to_tagids:
             # XXX This potentially leaves dupes in the tree.
             self._user_to_tagids[newuser].update(old_ids)
+            user_id = self._users.get_id(newuser)
+            for tagid in old_ids:
+                self._relateTag(tagid, -1)
+                self._tag_users[tagid] = user_id
+                self._relateTag(tagid, 1)
+            self._users.release(olduser)
         else:
             self._user_to_tagids[newuser] = old_ids
+            self._users.rename(olduser, newuser)
         del self._user_to_tagids[olduser]
-        for tagid in old_ids:
-            tagobj = self._tagid_to_obj[tagid]
-            notify(TagRemovedEvent(tagobj._clone()))
-            tagobj.user = unicode(newuser)
+        for tagobj in oldTags:
+            notify(TagRemovedEvent(tagobj))
             # XXX Ideally, we would filter events for already-existing
             #     identical tags by the new user.
-            notify(TagAddedEvent(tagobj))
+            notify(TagAddedEvent(self._getTag(tagobj._id)))
+        self._invalidate()
 
     def normalize(self, normalizer=None):
         """ See ITaggingEngine.
@@ -426,8 +601,22 @@ class Tags(Persistent):
         return count
 
     def _reset(self):
-        # Map tagid to tag object
-        self._tagid_to_obj = IOBTree.IOBTree()
+        # The tags themselves, one column per attribute, keyed by tagid.
+        # Users, names and communities are interned; a community id of 0
+        # means no community.  Reading a tag loads the buckets holding its
+        # row rather than an object of its own.
+        self._tag_items = IIBTree.IIBTree()
+        self._tag_users = IIBTree.IIBTree()
+        self._tag_names = IIBTree.IIBTree()
+        self._tag_communities = IIBTree.IIBTree()
+        self._users = StringTable()
+        self._names = StringTable()
+        self._communities = StringTable()
+
+        # Tag co-occurrence: name id -> other name id -> how many times
+        # a user gave an item both tags, over all tags and by community id.
+        self._global_related = IOBTree.IOBTree()
+        self._related = IOBTree.IOBTree()
 
         # Indexes
         self._user_to_tagids = OOBTree.OOBTree()
@@ -435,6 +624,9 @@ class Tags(Persistent):
         self._name_to_tagids = OOBTree.OOBTree()
         self._community_to_tagids = OOBTree.OOBTree()
 
+        # Tag name -> the docids of the items tagged with it, for TagIndex
+        self._name_to_items = OOBTree.OOBTree()
+
         # Precomputed cloud data
         self._global_cloud = PersistentMapping()
         self._community_clouds = OOBTree.OOBTree()
@@ -451,23 +643,132 @@ class Tags(Persistent):
                 self._v_nextid = random.randrange(0, 2**31)
             uid = self._v_nextid
             self._v_nextid += 1
-            if uid not in self._tagid_to_obj:
+            if uid not in self._tag_items:
                 return uid
             #self._v_nextid = None
 
     def _add(self, tagObj):
         uid = self._generateId()
-        self._tagid_to_obj[uid] = tagObj
+        self._tag_items[uid] = tagObj.item
+        self._tag_users[uid] = self._users.intern(tagObj.user)
+        self._tag_names[uid] = self._names.intern(tagObj.name)
+        if tagObj.community:
+            community_id = self._communities.intern(tagObj.community)
+        else:
+            community_id = 0
+        self._tag_communities[uid] = community_id
         tagObj._id = uid
         return uid
 
+    def _getTag(self, id):
+        community_id = self._tag_communities[id]
+        if community_id:
+            community = self._communities[community_id]
+        else:
+            community = None
+        tag = Tag(self._tag_items[id],
+                  self._users[self._tag_users[id]],
+                  self._names[self._tag_names[id]],
+                  community)
+        tag._id = id
+        return tag
+
+    def _relateTag(self, id, delta, candidates=None):
+        # Count tag ``id`` in (delta 1) or out (delta -1) of the
+        # co-occurrence of its name with the other tags its user gave its
+        # item.
+        user_id = self._tag_users[id]
+        name_id = self._tag_names[id]
+        community_id = self._tag_communities[id]
+        if candidates is None:
+            candidates = self._item_to_tagids.get(self._tag_items[id], ())
+        others = []
+        for other in candidates:
+            if (other != id and
+                self._tag_users[other] == user_id and
+                self._tag_names[other] != name_id and
+                self._tag_communities[other] == community_id):
+                others.append(self._tag_names[other])
+        if not others:
+            return
+        related = self._related.get(community_id)
+        if related is None:
+            related = self._related[community_id] = IOBTree.IOBTree()
+        for table in (self._global_related, related):
+            for other_id in others:
+                for a, b in ((name_id, other_id), (other_id, name_id)):
+                    row = table.get(a)
+                    if row is None:
+                        row = table[a] = IIBTree.IIBTree()
+                    count = row.get(b, 0) + delta
+                    if count:
+                        row[b] = count
+                    else:
+                        del row[b]
+                        if not row:
+                            del table[a]
+        if not related:
+            del self._related[community_id]
+
+    def _removeNameItem(self, tagObj):
+        # Take the item of ``tagObj`` out of the items of its name, unless
+        # another user gave it the same tag.  Called with the tag removed
+        # from _item_to_tagids but still in the columns.
+        item = tagObj.item
+        name_id = self._tag_names[tagObj._id]
+        others = self._item_to_tagids[item]
+        for other in others:
+            if self._tag_names[other] == name_id:
+                break
+        else:
+            items = self._name_to_items[tagObj.name]
+            items.remove(item)
+            if not items:
+                del self._name_to_items[tagObj.name]
+        if not others:
+            del self._item_to_tagids[item]
+
+    def _indexNameItems(self):
+        """ Compute the items of each tag name afresh.
+        """
+        self._name_to_items = OOBTree.OOBTree()
+        tag_items = self._tag_items
+        for name, ids in self._name_to_tagids.items():
+            self._name_to_items[name] = self.family.IF.TreeSet(
+                [tag_items[id] for id in ids])
+
+    def _invalidate(self):
+        # Tell the catalog that the results of queries of the 'tags' index
+        # have changed.
+        if self.site is None:
+            return
+        catalog = find_catalog(self.site)
+        invalidate = getattr(catalog, 'invalidate', None)
+        if invalidate is not None:
+            invalidate('tags')
+
+    def _indexRelated(self):
+        """ Compute the tag co-occurrence of all tags afresh.
+        """
+        self._global_related = IOBTree.IOBTree()
+        self._related = IOBTree.IOBTree()
+        for ids in self._item_to_tagids.values():
+            # Relate each tag to those before it, counting pairs once.
+            seen = []
+            for id in ids:
+                self._relateTag(id, 1, seen)
+                seen.append(id)
+
+    def _strings(self, table, column, ids):
+        # The distinct strings ``ids`` refer to in ``column``.
+        string_ids = set([column[id] for id in ids])
+        return set([table[string_id] for string_id in string_ids])
+
     def _getTagIds(self, items=None, users=None, tags=None, community=None):
         if (items is None and users is None and
             tags is None and community is None):
             # get them all
-            result = set()
-            for v in self._item_to_tagids.values():
-                result.update(v)
+            result = set(self._tag_items.keys())
         else:
             if community is not None:
                 communities = [community]
@@ -494,24 +795,29 @@ class Tags(Persistent):
     def _delTags(self, del_tag_ids):
         """deletes tags in iterable"""
         for id in del_tag_ids:
-            tagObj = self._tagid_to_obj[id]
+            tagObj = self._getTag(id)
+            self._relateTag(id, -1)
 
             # Remove tag from indices
             self._user_to_tagids[tagObj.user].remove(id)
             if not len(self._user_to_tagids[tagObj.user]):
                 del self._user_to_tagids[tagObj.user]
+                self._users.release(tagObj.user)
 
             self._item_to_tagids[tagObj.item].remove(id)
-            if not len(self._item_to_tagids[tagObj.item]):
-                del self._item_to_tagids[tagObj.item]
 
             self._name_to_tagids[tagObj.name].remove(id)
             if not len(self._name_to_tagids[tagObj.name]):
                 del self._name_to_tagids[tagObj.name]
+                self._names.release(tagObj.name)
+
+            self._removeNameItem(tagObj)
 
             self._community_to_tagids[tagObj.community].remove(id)
             if not len(self._community_to_tagids[tagObj.community]):
                 del self._community_to_tagids[tagObj.community]
+                if tagObj.community:
+                    self._communities.release(tagObj.community)
 
             # Adjust cloud counts
             if tagObj.community:
@@ -524,7 +830,10 @@ class Tags(Persistent):
                 if cloud[tagObj.name] == 0:
                     del cloud[tagObj.name]
 
-            del self._tagid_to_obj[id]
+            del self._tag_items[id]
+            del self._tag_users[id]
+            del self._tag_names[id]
+            del self._tag_communities[id]
             notify(TagRemovedEvent(tagObj))
 
 
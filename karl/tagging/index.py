@@ -23,9 +23,11 @@ from repoze.catalog.interfaces import ICatalogIndex
 class TagIndex(object):
     """An index that defers to the tagging engine.
 
-    This index does not actually store anything.  It queries the
-    site tagging engine.  It relies on the fact that the catalog and
-    tagging engine use the same document map, so the docids match.
+    This index does not actually store anything.  It combines the sets
+    of docids the site tagging engine keeps for each tag.  It relies on
+    the fact that the catalog and tagging engine use the same document
+    map, so the docids match.  The tagging engine invalidates the
+    catalog's cached results of 'tags' queries when tags change.
     """
     implements(ICatalogIndex)
     family = BTrees.family32
@@ -67,20 +69,28 @@ class TagIndex(object):
         if isinstance(query, basestring):
             query = [query]
 
+        tags = self.site.tags
+        sets = [tags.getItemSet(tag, users=users, community=community)
+                for tag in query]
+        IF = self.family.IF
         if operator == 'or':
-            res = self.site.tags.getItems(
-                tags=query, users=users, community=community)
+            res = IF.multiunion(sets)
         elif operator == 'and':
-            sets = []
-            for tag in query:
-                sets.append(self.site.tags.getItems(
-                    tags=[tag], users=users, community=community))
             if sets:
-                res = reduce(set.intersection, sets)
+                # Start from the smallest set, and stop once nothing is
+                # left.
+                sets.sort(key=len)
+                res = sets[0]
+                for items in sets[1:]:
+                    if not res:
+                        break
+                    res = IF.intersection(res, items)
+                # Don't hand out the tagging engine's own set.
+                res = IF.Set(res)
             else:
-                res = set()
+                res = IF.Set()
         else:
             raise TypeError('Tag index only supports `and` and `or` '
                 'operators, not `%s`.' % operator)
 
-        return self.family.IF.Set(res)
+        return res
@@ -138,6 +138,17 @@ class ITaggingEngine(Interface):
         o Return a set of item ids (integer docids).
         """
 
+    def getItemSet(tag, users=None, community=None):
+        """ Look up the items tagged with 'tag', as a BTrees IF set.
+
+        o If 'users' is not None, match only tags given by those users.
+
+        o If 'community' is not None, return only items within the
+          given community.
+
+        o The set may belong to the engine; don't modify it.
+        """
+
     def getUsers(tags=None, items=None, community=None):
         """ Look up all users matching the specified tags and items.
 
@@ -151,7 +162,7 @@ class ITaggingEngine(Interface):
         o Return a set of strings (login names).
         """
 
-    def getRelatedTags(tag, degree=1, community=None, user=None):
+    def getRelatedTags(tag, degree=1, community=None, user=None, limit=None):
         """ Look up tags related to a given tag.
 
         o 'tag' is the source tag.
@@ -162,10 +173,14 @@ class ITaggingEngine(Interface):
         o If 'user' is not None, restrict matches to tags on items
           tagged by the given user.
 
-        o 'degree' specifies the search depth.
+        o 'degree' specifies the search depth, up to the
+          'related_tags_max_degree' setting.
+
+        o If 'limit' is not None, return only the 'limit' tags most often
+          given together with the source tag.
         """
 
-    def getRelatedItems(item, community=None, user=None):
+    def getRelatedItems(item, community=None, user=None, limit=None):
         """ Look up a list of items related to a given item
 
         o Items are related if they have a least one tag in common with
@@ -181,9 +196,11 @@ class ITaggingEngine(Interface):
           'numTags' is the number of tags in common.
 
         o Sort the result in descending order by the numTags.
+
+        o If 'limit' is not None, return only the first 'limit' items.
         """
 
-    def getRelatedUsers(user, community=None):
+    def getRelatedUsers(user, community=None, limit=None):
         """ Look up a list of users related a given user.
 
         o Users are related if they have a least one tag in common with
@@ -193,6 +210,8 @@ class ITaggingEngine(Interface):
           numTags is the number of tags in common.
 
         o Sort the result in descending order by the numTags.
+
+        o If 'limit' is not None, return only the first 'limit' users.
         """
 
     def getFrequency(tags=None, community=None, user=None):
@@ -523,6 +523,77 @@ class TagsTests(unittest.TestCase):
         related = engine.getRelatedTags('bar', user='bharney')
         self.assertEqual(len(related), 0)
 
+    def test_getRelatedTags_w_degree_gt_1(self):
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar'))
+        engine.update(14, 'bharney', ('bar', 'baz'))
+        engine.update(15, 'phred', ('baz', 'qux'))
+        self.assertEqual(engine.getRelatedTags('foo'), set(['bar']))
+        self.assertEqual(engine.getRelatedTags('foo', degree=2),
+                         set(['bar', 'baz']))
+        self.assertEqual(engine.getRelatedTags('foo', degree=3),
+                         set(['bar', 'baz', 'qux']))
+
+    def test_getRelatedTags_degree_limit(self):
+        from pyramid.interfaces import ISettings
+        karl.testing.registerUtility(
+            karl.testing.DummySettings(related_tags_max_degree='2'),
+            ISettings)
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar'))
+        engine.update(14, 'bharney', ('bar', 'baz'))
+        engine.update(15, 'phred', ('baz', 'qux'))
+        self.assertEqual(engine.getRelatedTags('foo', degree=3),
+                         set(['bar', 'baz']))
+
+    def test_getRelatedTags_w_limit(self):
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar', 'baz'))
+        engine.update(14, 'bharney', ('foo', 'bar'))
+        engine.update(15, 'wylma', ('foo', 'bar', 'qux'))
+        self.assertEqual(engine.getRelatedTags('foo', limit=1), set(['bar']))
+
+    def test_getRelatedTags_by_community(self):
+        from zope.interface import Interface
+        from karl.tagging.interfaces import ITagCommunityFinder
+        def _factory(context):
+            return lambda item: item == 13 and 'one' or 'two'
+        karl.testing.registerAdapter(_factory, Interface, ITagCommunityFinder)
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar'))
+        engine.update(14, 'phred', ('foo', 'baz'))
+        self.assertEqual(engine.getRelatedTags('foo', community='one'),
+                         set(['bar']))
+        self.assertEqual(engine.getRelatedTags('foo', community='two'),
+                         set(['baz']))
+        self.assertEqual(engine.getRelatedTags('foo'), set(['bar', 'baz']))
+
+    def test_related_maintained_incrementally(self):
+        self._registerCommunityFinder()
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar', 'baz'))
+        engine.update(13, 'bharney', ('foo', 'Bar'))
+        engine.update(14, 'phred', ('bar', 'qux'))
+        engine.update(14, 'wylma', ('qux', 'foo', 'baz'))
+        engine.update(13, 'phred', ('foo', 'qux'))
+        engine.delete(item=14, tag='foo')
+        engine.rename('qux', 'quux')
+        engine.normalize()
+        engine.reassign('bharney', 'phred')
+        engine.reassign('wylma', 'betty')
+        related = (_related(engine._global_related),
+                   dict((k, _related(v)) for k, v in engine._related.items()))
+        engine._indexRelated()
+        self.assertEqual(related,
+                         (_related(engine._global_related),
+                          dict((k, _related(v))
+                               for k, v in engine._related.items())))
+        self.assertEqual(engine.getRelatedTags('foo'), set(['quux', 'bar']))
+        engine.delete(user='phred')
+        engine.delete(user='betty')
+        self.assertEqual(len(engine._global_related), 0)
+        self.assertEqual(len(engine._related), 0)
+
     def test_getRelatedItems_defaults(self):
         engine = self._makeOne()
         engine.update(13, 'phred', ('foo', 'bar', 'baz'))
@@ -573,6 +644,61 @@ class TagsTests(unittest.TestCase):
         related = engine.getRelatedItems(15, user='bharney')
         self.assertEqual(len(related), 0)
 
+    def test_getItemSet(self):
+        self._registerCommunityFinder()
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar'))
+        engine.update(14, 'bharney', ('foo',))
+        self.assertEqual(list(engine.getItemSet('foo')), [13, 14])
+        self.assertEqual(list(engine.getItemSet('foo', users=['phred'])),
+                         [13])
+        self.assertEqual(list(engine.getItemSet('foo', community='nonesuch')),
+                         [])
+        self.assertEqual(list(engine.getItemSet('nonesuch')), [])
+
+    def test_item_sets_maintained_incrementally(self):
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar', 'baz'))
+        engine.update(13, 'bharney', ('foo', 'Bar'))
+        engine.update(14, 'phred', ('bar', 'qux'))
+        engine.update(14, 'wylma', ('qux', 'foo', 'baz'))
+        engine.update(13, 'phred', ('foo', 'qux'))
+        engine.delete(item=14, tag='foo')
+        engine.rename('qux', 'quux')
+        engine.normalize()
+        engine.reassign('bharney', 'phred')
+        items = dict((k, list(v)) for k, v in engine._name_to_items.items())
+        self.assertEqual(items, {'bar': [13, 14], 'baz': [14],
+                                 'foo': [13], 'quux': [13, 14]})
+        engine._indexNameItems()
+        self.assertEqual(
+            items, dict((k, list(v)) for k, v in engine._name_to_items.items()))
+        engine.delete(item=13)
+        engine.delete(item=14)
+        self.assertEqual(len(engine._name_to_items), 0)
+        self.assertEqual(len(engine._item_to_tagids), 0)
+
+    def test_changes_invalidate_catalog(self):
+        site = testing.DummyModel()
+        site.catalog = DummyCatalog()
+        engine = self._makeOne(site)
+        engine.update(13, 'phred', ('foo',))
+        engine.update(13, 'phred', ('foo',))
+        engine.rename('nonesuch', 'bar')
+        engine.delete(tag='nonesuch')
+        self.assertEqual(site.catalog.invalidated, [('tags',)])
+        engine.rename('foo', 'bar')
+        engine.reassign('phred', 'bharney')
+        engine.delete(tag='bar')
+        self.assertEqual(len(site.catalog.invalidated), 4)
+
+    def test_getRelatedItems_w_limit(self):
+        engine = self._makeOne()
+        engine.update(13, 'phred', ('foo', 'bar', 'baz'))
+        engine.update(14, 'bharney', ('qux', 'bar'))
+        engine.update(15, 'phred', ('bar', 'baz'))
+        self.assertEqual(engine.getRelatedItems(15, limit=1), [(13, 2)])
+
     def test_getRelatedUsers_wo_community(self):
         engine = self._makeOne()
         engine.update(13, 'phred', ('foo', 'bar'))
@@ -1041,6 +1167,43 @@ class TagsTests(unittest.TestCase):
         self.failIf('bedrock' in engine.getTags())
         self.failUnless('Bedrock' in engine.getTags())
 
+    def test_rename_to_existing(self):
+        engine = self._makeOne()
+        self._populate(engine)
+        count = engine.rename('dinosaur', 'neighbor')
+        self.assertEqual(count, 1)
+        self.assertEqual(sorted(engine.getTags(items=[13], users=['phred'])),
+                         ['bedrock', 'neighbor'])
+        self.assertEqual(engine.getItems(['neighbor']), set([13, 42]))
+        self.assertEqual(engine._names.get_id('dinosaur'), None)
+        self.assertEqual(len(engine._names), 2)
+        self.assertEqual(dict(engine.getCloud()),
+                         {'bedrock': 3, 'neighbor': 2})
+
+    def test_rename_keeps_name_id(self):
+        engine = self._makeOne()
+        self._populate(engine)
+        name_id = engine._names.get_id('bedrock')
+        engine.rename('bedrock', 'Bedrock')
+        self.assertEqual(engine._names.get_id('Bedrock'), name_id)
+        self.assertEqual(engine._names.get_id('bedrock'), None)
+        self.assertEqual(sorted(engine.getTags(items=[42])),
+                         ['Bedrock', 'neighbor'])
+
+    def test_delete_releases_strings(self):
+        engine = self._makeOne()
+        self._registerCommunityFinder()
+        self._populate(engine)
+        engine.delete(user='bharney')
+        self.assertEqual(engine._users.get_id('bharney'), None)
+        self.assertEqual(engine._names.get_id('neighbor'), None)
+        self.assertEqual(len(engine._names), 2)
+        engine.delete(user='phred')
+        self.assertEqual(len(engine), 0)
+        self.assertEqual(len(engine._users), 0)
+        self.assertEqual(len(engine._names), 0)
+        self.assertEqual(len(engine._communities), 0)
+
     def test_reassign_to_new_user(self):
         from karl.tagging import Tag
         from karl.tagging import TagAddedEvent
@@ -1101,6 +1264,16 @@ class TagsTests(unittest.TestCase):
         self.assertTrue('phred' in engine.getUsers())
         self.assertFalse('phony' in engine.getUsers())
         self.assertFalse('bharney' in engine.getUsers())
+        self.assertEqual(engine._users.get_id('bharney'), None)
+        self.assertEqual(engine.getTags(users=['phred'], items=[42]),
+                         set(['neighbor', 'bedrock']))
+
+    def test_getCloud_after_reassign_counts_dupes_once(self):
+        engine = self._makeOne()
+        self._populate(engine)
+        engine.reassign('bharney', 'phred')
+        cloud = dict(engine.getCloud(users='phred'))
+        self.assertEqual(cloud, {'bedrock': 2, 'dinosaur': 1, 'neighbor': 1})
 
     def test_normalize_default(self):
         from karl.tagging import Tag
@@ -1195,6 +1368,89 @@ class TagsTests(unittest.TestCase):
         self.assertEqual(found[0], 'bambam')
         self.assertEqual(found[1], 'bedrock')
 
+def _related(table):
+    return dict((k, dict(v.items())) for k, v in table.items())
+
+
+class StringTableTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from karl.tagging import StringTable
+        table = StringTable()
+        table._v_nextid = 1
+        return table
+
+    def test_intern(self):
+        table = self._makeOne()
+        self.assertEqual(table.intern(u'foo'), 1)
+        self.assertEqual(table.intern(u'bar'), 2)
+        self.assertEqual(table.intern(u'foo'), 1)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table[2], u'bar')
+        self.assertEqual(table.get_id(u'bar'), 2)
+        self.assertEqual(table.get_id(u'baz'), None)
+
+    def test_intern_random_start(self):
+        from karl.tagging import StringTable
+        table = StringTable()
+        id = table.intern(u'foo')
+        self.failUnless(0 < id < 2**31)
+        self.assertEqual(table.intern(u'bar'), id + 1)
+
+    def test_intern_skips_taken_ids(self):
+        table = self._makeOne()
+        table.intern(u'foo')
+        table._v_nextid = 1
+        self.assertEqual(table.intern(u'bar'), 2)
+        table._v_nextid = 2**31
+        self.failUnless(table.intern(u'baz') > 0)
+
+    def test_concurrent_interns_dont_conflict(self):
+        import os
+        import shutil
+        import tempfile
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.FileStorage import FileStorage
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        table = conn1.root()['table'] = self._makeOne()
+        table.intern(u'foo')
+        tm1.commit()
+        conn2 = db.open(transaction_manager=tm2)
+        conn2.root()['table'].intern(u'bar')
+        table.intern(u'baz')
+        tm2.commit()
+        tm1.commit()
+        conn2.close()
+        tm1.begin()
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table[table.get_id(u'bar')], u'bar')
+        self.assertEqual(table[table.get_id(u'baz')], u'baz')
+        conn1.close()
+        db.close()
+
+    def test_release(self):
+        table = self._makeOne()
+        table.intern(u'foo')
+        table.release(u'foo')
+        table.release(u'nonesuch')
+        self.assertEqual(len(table), 0)
+        self.assertRaises(KeyError, table.__getitem__, 1)
+
+    def test_rename(self):
+        table = self._makeOne()
+        table.intern(u'foo')
+        table.rename(u'foo', u'bar')
+        self.assertEqual(table.get_id(u'foo'), None)
+        self.assertEqual(table.get_id(u'bar'), 1)
+        self.assertEqual(table[1], u'bar')
+
+
 class TagCommunityFinderTests(unittest.TestCase):
 
     def setUp(self):
@@ -1369,17 +1625,45 @@ class TagIndexTests(unittest.TestCase):
         self.assertRaises(TypeError, index.apply,
             dict(query=[], operator='foo'))
 
+    def test_apply_and_nonesuch(self):
+        index = self._makeOne()
+        res = index.apply(dict(query=['a', 'nonesuch', 'b'], operator='and'))
+        self.assertEquals(set(res), set())
+
+    def test_apply_and_copies_engine_set(self):
+        index = self._makeOne()
+        res = index.apply(dict(query=['a'], operator='and'))
+        res.insert(5)
+        self.assertEquals(set(index.apply(dict(query=['a']))), set([1, 2]))
+
+    def test_apply_w_engine(self):
+        from karl.tagging import Tags
+        site = testing.DummyModel()
+        site.tags = Tags(site)
+        site.tags.update(1, 'phred', ('a',))
+        site.tags.update(2, 'phred', ('a', 'b'))
+        site.tags.update(2, 'bharney', ('b',))
+        site.tags.update(3, 'bharney', ('b',))
+        index = self._makeOne(site)
+        self.assertEquals(list(index.apply(dict(query=['a', 'b']))), [2])
+        self.assertEquals(list(index.apply(dict(query=['a', 'b'],
+                                                operator='or'))), [1, 2, 3])
+        self.assertEquals(list(index.apply(dict(query=['b'],
+                                                users=['bharney']))), [2, 3])
+
+
+class DummyCatalog:
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, *names):
+        self.invalidated.append(names)
+
 
 class DummyTaggingEngine:
-    def getItems(self, tags, users=None, community=None):
-        res = set()
-        if 'a' in tags:
-            res.add(1)
-            res.add(2)
-        if 'b' in tags:
-            res.add(2)
-            res.add(3)
-        return res
+    def getItemSet(self, tag, users=None, community=None):
+        from BTrees.IFBTree import IFTreeSet
+        return IFTreeSet({'a': (1, 2), 'b': (2, 3)}.get(tag, ()))
 
 
 class DummyDocumentMap:
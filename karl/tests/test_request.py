@@ -0,0 +1,114 @@
+import unittest
+
+from pyramid import testing
+
+import karl.testing
+
+
+class RequestCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _makeOne(self, request=None):
+        from karl.request import get_request_cache
+        if request is None:
+            request = testing.DummyRequest()
+        return get_request_cache(request)
+
+    def _makeSite(self):
+        from zope.interface import directlyProvides
+        from karl.models.interfaces import ISite
+        site = testing.DummyModel()
+        directlyProvides(site, ISite)
+        site['profiles'] = profiles = testing.DummyModel()
+        profiles['fred'] = karl.testing.DummyProfile()
+        return site
+
+    def test_one_per_request(self):
+        request = testing.DummyRequest()
+        self.failUnless(self._makeOne(request) is self._makeOne(request))
+        self.failIf(self._makeOne() is self._makeOne(request))
+
+    def test_principals(self):
+        karl.testing.registerDummySecurityPolicy(
+            'fred', ['group.KarlStaff'])
+        cache = self._makeOne()
+        self.assertEqual(cache.userid, 'fred')
+        self.failUnless(cache.is_staff)
+        self.failIf(cache.is_admin)
+        self.failUnless(cache.in_group('fred'))
+        self.assertEqual(cache.saved, {'principals': 2})
+
+    def test_anonymous(self):
+        karl.testing.registerDummySecurityPolicy()
+        cache = self._makeOne()
+        self.assertEqual(cache.userid, None)
+        self.assertEqual(cache.userid, None)
+        self.assertEqual(cache.current_profile(self._makeSite()), None)
+        self.failIf(cache.is_staff)
+        self.assertEqual(cache.saved, {'userid': 2})
+
+    def test_profiles(self):
+        karl.testing.registerDummySecurityPolicy('fred')
+        site = self._makeSite()
+        cache = self._makeOne()
+        fred = site['profiles']['fred']
+        self.failUnless(cache.current_profile(site) is fred)
+        self.failUnless(cache.profile(site, 'fred') is fred)
+        del site['profiles']['fred']
+        self.failUnless(cache.profile(site, 'fred') is fred)
+        self.assertEqual(cache.profile(site, 'barney'), None)
+        self.assertEqual(cache.profile(site, 'barney'), None)
+        self.assertEqual(cache.saved, {'profiles': 3})
+        self.assertEqual(cache.saved_lookups, 3)
+
+    def test_no_profiles_folder(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.profile(testing.DummyModel(), 'fred'), None)
+
+    def test_request_property(self):
+        from karl.request import Request
+        request = Request.blank('/')
+        self.failUnless(request.karl_cache is self._makeOne(request))
+
+
+class Test_report_request_cache(unittest.TestCase):
+
+    def _callFUT(self, event):
+        from karl.request import report_request_cache
+        return report_request_cache(event)
+
+    def test_no_cache(self):
+        self._callFUT(DummyEvent(testing.DummyRequest()))
+
+    def test_it(self):
+        from perfmetrics import set_statsd_client
+        from karl.request import get_request_cache
+        request = testing.DummyRequest()
+        get_request_cache(request).saved.update(profiles=3, principals=2)
+        client = DummyStatsdClient()
+        set_statsd_client(client)
+        try:
+            self._callFUT(DummyEvent(request))
+        finally:
+            set_statsd_client(None)
+        self.assertEqual(sorted(client.counts),
+                         [('karl.request_cache.principals', 2),
+                          ('karl.request_cache.profiles', 3)])
+
+
+class DummyEvent(object):
+    def __init__(self, request):
+        self.request = request
+
+
+class DummyStatsdClient(object):
+    def __init__(self):
+        self.counts = []
+
+    def incr(self, stat, count=1, rate=1, **kw):
+        self.counts.append((stat, count))
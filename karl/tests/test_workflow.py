@@ -46,7 +46,7 @@ class Test_content_to_inherits(unittest.TestCase):  # noqa
     def test_it_no_acl(self):
         ob = testing.DummyModel()
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         self._callFUT(ob, None)
         # doesn't blow up
@@ -58,7 +58,7 @@ class Test_content_to_inherits(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         self._callFUT(ob, None)
         self.failIf(hasattr(ob, '__acl__'))
@@ -75,7 +75,7 @@ class Test_content_to_private(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         from zope.interface import directlyProvides
         directlyProvides(ob, ICommunity)
@@ -139,6 +139,7 @@ class Test_to_profile_active(unittest.TestCase):  # noqa
         self.assertEqual(ob.catalog['path'].indexed, {1234: ob})
         self.assertEqual(ob.catalog['allowed'].indexed, {1234: ob})
         self.assertEqual(ob.catalog['texts'].indexed, {1234: ob})
+        self.assertEqual(ob.catalog.invalidated, ('path', 'texts', 'allowed'))
         self.assertEqual(people.catalog.reindexed, {12345: ob})
 
 
@@ -176,6 +177,7 @@ class Test_to_profile_inactive(unittest.TestCase):  # noqa
         self.assertEqual(ob.catalog['path'].indexed, {1234: ob})
         self.assertEqual(ob.catalog['allowed'].indexed, {1234: ob})
         self.assertEqual(ob.catalog['texts'].indexed, {1234: ob})
+        self.assertEqual(ob.catalog.invalidated, ('path', 'texts', 'allowed'))
         self.assertEqual(people.catalog.reindexed, {12345: ob})
 
 
@@ -195,7 +197,7 @@ class Test_comment_to_inherits(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.creator = 'creator'
         ob.docid = 1234
         directlyProvides(ob, ICommunity)
@@ -225,7 +227,7 @@ class Test_forum_topic_to_inherits(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.creator = 'creator'
         ob.docid = 1234
         directlyProvides(ob, ICommunity)
@@ -252,7 +254,7 @@ class Test_forum_to_inherits(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.creator = 'creator'
         ob.docid = 1234
         directlyProvides(ob, ICommunity)
@@ -278,7 +280,7 @@ class Test_community_to_private(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         directlyProvides(ob, ICommunity)
         ob.moderators_group_name = 'moderators'
@@ -308,7 +310,7 @@ class Test_community_to_public(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         directlyProvides(ob, ICommunity)
         ob.moderators_group_name = 'moderators'
@@ -341,7 +343,7 @@ class Test_blogentry_to_inherits(unittest.TestCase):  # noqa
         ob.docid = 1234
         ob.creator = 'dummyUser'
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         self._callFUT(ob, None)
         acl = ob.__acl__
         self.assertEqual(len(acl), 3)
@@ -362,7 +364,7 @@ class Test_blogentry_to_inherits(unittest.TestCase):  # noqa
         ob.creator = 'dummyUser'
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         self._callFUT(ob, None)
 
         acl = ob.__acl__
@@ -393,7 +395,7 @@ class Test_blogentry_to_private(unittest.TestCase):  # noqa
         ob = testing.DummyModel()
         ob.__acl__ = []
         index = DummyIndex()
-        ob.catalog = {'path': index}
+        ob.catalog = DummyIndexCatalog({'path': index})
         ob.docid = 1234
         ob.creator = 'b'
         directlyProvides(ob, ICommunity)
@@ -418,7 +420,7 @@ class TestReindex(unittest.TestCase):
         from repoze.folder.interfaces import IFolder
         from zope.interface import directlyProvides
         root = testing.DummyModel()
-        root.catalog = {}
+        root.catalog = DummyIndexCatalog()
         root.docid = 0
         path = root.catalog['path'] = DummyIndex()
         allowed = root.catalog['allowed'] = DummyIndex()
@@ -432,12 +434,13 @@ class TestReindex(unittest.TestCase):
         self._callFUT(root)
         self.failUnless(path.indexed.keys(), [0])
         self.assertEqual(sorted(allowed.indexed.keys()), [0, 1, 2])
+        self.assertEqual(root.catalog.invalidated, ('path', 'allowed'))
 
     def test_with_allowed_index_missing(self):
         from repoze.folder.interfaces import IFolder
         from zope.interface import directlyProvides
         root = testing.DummyModel()
-        root.catalog = {}
+        root.catalog = DummyIndexCatalog()
         root.docid = 0
         path = root.catalog['path'] = DummyIndex()
         one = testing.DummyModel()
@@ -537,10 +540,20 @@ class DummyCatalog(dict):
     def reindex_doc(self, docid, obj):  # pragma: no cover
         assert 0, "don't go here"
 
+    def invalidate(self, *names):
+        self.invalidated = names
+
     def docid_for_address(self, path):
         return 12345
 
 
+class DummyIndexCatalog(dict):
+    invalidated = None
+
+    def invalidate(self, *names):
+        self.invalidated = names
+
+
 class DummyPeopleCatalog(dict):
     def __init__(self):
         super(DummyPeopleCatalog, self).__init__()
@@ -15,87 +15,243 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 
+from array import array
 import threading
+import time
+
+try:
+    from perfmetrics import statsd_client
+except ImportError:  # pragma NO COVERAGE
+    statsd_client = lambda: None
 
 _marker = object()
 
 
-class LRUCache(object):
-    """ Implements a pseudo-LRU algorithm (CLOCK) """
-    lock = threading.Lock()
+class _Shard(object):
+    """ One independently locked CLOCK ring of an ``LRUCache``.
+
+    Slots are allocated on demand up to ``size``.  Per-slot state is kept
+    in parallel arrays indexed by slot number; ``index`` maps keys to
+    slots.
+    """
     def __init__(self, size):
+        self.lock = threading.Lock()
         self.size = size
-        self.maxpos = size - 1
-        self.clear()
+        self.keys = []
+        self.values = []
+        self.refs = bytearray()
+        self.sizes = array('l')
+        self.expires = array('d')
+        self.index = {}
+        self.free = []
+        self.hand = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def clear(self):
-        lock = self.lock
-        lock.acquire()
+    def release(self, slot):
+        del self.index[self.keys[slot]]
+        self.bytes -= self.sizes[slot]
+        self.keys[slot] = _marker
+        self.values[slot] = None
+        self.refs[slot] = 0
+        self.sizes[slot] = 0
+        self.free.append(slot)
+
+    def victim(self, keep=None):
+        """ Advance the clock hand to an unreferenced slot and return it. """
+        keys = self.keys
+        refs = self.refs
+        nslots = len(keys)
+        hand = self.hand
+        while 1:
+            slot = hand
+            hand += 1
+            if hand >= nslots:
+                hand = 0
+            if keys[slot] is _marker or slot == keep:
+                continue
+            if refs[slot]:
+                refs[slot] = 0
+            else:
+                self.hand = hand
+                return slot
+
+    def allocate(self):
+        if self.free:
+            return self.free.pop()
+        if len(self.keys) < self.size:
+            self.keys.append(_marker)
+            self.values.append(None)
+            self.refs.append(0)
+            self.sizes.append(0)
+            self.expires.append(0.0)
+            return len(self.keys) - 1
+        slot = self.victim()
+        self.release(slot)
+        self.evictions += 1
+        return self.free.pop()
+
+
+class LRUCache(object):
+    """ A thread safe pseudo-LRU cache (CLOCK).
+
+    ``size`` is the maximum number of entries.  Keys are spread over
+    ``shards`` independently locked CLOCK rings so that threads rarely
+    contend for the same lock.
+
+    If ``maxbytes`` is given, ``sizeof(value)`` is used to keep the total
+    size of cached values at or below ``maxbytes``; a value too large for
+    its shard's share of the budget is not cached.  If ``ttl`` is given,
+    entries expire that many seconds after they were set.
+
+    Hit, miss and eviction counts are available from ``stats()``; if
+    ``name`` is given they are also sent to statsd (via perfmetrics) as
+    ``<name>.hits``, ``<name>.misses`` and ``<name>.evictions``.  The
+    counts are added up and sent at most once every ``report_interval``
+    seconds, not once per lookup.
+    """
+    time = time  # for unit tests
+    report_interval = 10
+
+    def __init__(self, size, maxbytes=None, sizeof=None, ttl=None,
+                 shards=8, name=None):
+        if size < 1:
+            raise ValueError('size must be >= 1')
+        if maxbytes is not None and sizeof is None:
+            raise ValueError('maxbytes requires sizeof')
+        self.size = size
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.name = name
+        self.nshards = min(shards, size)
+        self._totals = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._reported = dict(self._totals)
+        self._report_lock = threading.Lock()
+        self._next_report = 0
+        self._shards = self._make_shards()
+
+    def _make_shards(self):
+        nshards = self.nshards
+        sizes = [self.size // nshards] * nshards
+        for i in range(self.size % nshards):
+            sizes[i] += 1
+        return [_Shard(size) for size in sizes]
+
+    def _shard(self, key):
+        shards = self._shards
+        return shards[hash(key) % len(shards)]
+
+    def _maybe_report(self):
+        if self.name is not None and self.time.time() >= self._next_report:
+            self.report()
+
+    def report(self):
+        """ Send the counts added up since the last report to statsd. """
+        if not self._report_lock.acquire(False):
+            return  # another thread is reporting
         try:
-            size = self.size
-            if size < 1:
-                raise ValueError('size must be >1')
-            self.clock = []
-            for i in xrange(0, size):
-                self.clock.append({'key': _marker, 'ref': False})
-            self.hand = 0
-            self.data = {}
+            self._next_report = self.time.time() + self.report_interval
+            client = statsd_client()
+            if self.name is None or client is None:
+                return
+            stats = self.stats()
+            reported = self._reported
+            for stat in ('hits', 'misses', 'evictions'):
+                count = stats[stat] - reported[stat]
+                if count > 0:
+                    client.incr('%s.%s' % (self.name, stat), count)
+                    reported[stat] = stats[stat]
         finally:
-            lock.release()
+            self._report_lock.release()
+
+    def clear(self):
+        """ Discard all entries.
+
+        The shards are replaced wholesale rather than emptied, so this
+        does not depend on the number of entries.
+        """
+        shards, self._shards = self._shards, self._make_shards()
+        totals = self._totals
+        for shard in shards:
+            totals['hits'] += shard.hits
+            totals['misses'] += shard.misses
+            totals['evictions'] += shard.evictions
 
     def get(self, key, default=None):
-        lock = self.lock
+        shard = self._shard(key)
+        lock = shard.lock
         lock.acquire()
         try:
-            try:
-                datum = self.data[key]
-            except KeyError:
-                return default
-            pos, val = datum
-            self.clock[pos]['ref'] = True
-            hand = pos + 1
-            if hand > self.maxpos:
-                hand = 0
-            self.hand = hand
-            return val
+            slot = shard.index.get(key)
+            if slot is not None and self.ttl is not None:
+                if shard.expires[slot] <= self.time.time():
+                    shard.release(slot)
+                    slot = None
+            if slot is None:
+                shard.misses += 1
+                value = default
+            else:
+                shard.hits += 1
+                shard.refs[slot] = 1
+                value = shard.values[slot]
         finally:
             lock.release()
+        self._maybe_report()
+        return value
 
-    def __setitem__(self, key, val, _marker=_marker):
-        lock = self.lock
+    def __setitem__(self, key, val):
+        shard = self._shard(key)
+        maxbytes = self.maxbytes
+        nbytes = 0
+        if maxbytes is not None:
+            maxbytes = maxbytes // len(self._shards)
+            nbytes = self.sizeof(val)
+            if nbytes > maxbytes:
+                return
+
+        lock = shard.lock
         lock.acquire()
         try:
-            hand = self.hand
-            maxpos = self.maxpos
-            clock = self.clock
-            data = self.data
-
-            end = hand - 1
-            if end < 0:
-                end = maxpos
-
-            while 1:
-                current = clock[hand]
-                ref = current['ref']
-                if ref is True:
-                    current['ref'] = False
-                    hand = hand + 1
-                    if hand > maxpos:
-                        hand = 0
-                elif ref is False or hand == end:
-                    oldkey = current['key']
-                    if oldkey is not _marker:
-                        try:
-                            del data[oldkey]
-                        except KeyError:
-                            pass
-                    current['key'] = key
-                    current['ref'] = True
-                    data[key] = (hand, val)
-                    hand += 1
-                    if hand > maxpos:
-                        hand = 0
-                    self.hand = hand
-                    break
+            slot = shard.index.get(key)
+            if slot is None:
+                slot = shard.allocate()
+                shard.keys[slot] = key
+                shard.index[key] = slot
+            else:
+                shard.bytes -= shard.sizes[slot]
+            shard.values[slot] = val
+            shard.sizes[slot] = nbytes
+            shard.bytes += nbytes
+            if self.ttl is not None:
+                shard.expires[slot] = self.time.time() + self.ttl
+
+            if maxbytes is not None:
+                while shard.bytes > maxbytes:
+                    shard.release(shard.victim(keep=slot))
+                    shard.evictions += 1
         finally:
             lock.release()
+        self._maybe_report()
+
+    def __len__(self):
+        return sum(len(shard.index) for shard in self._shards)
+
+    @property
+    def bytes(self):
+        """ The total ``sizeof`` of the cached values. """
+        return sum(shard.bytes for shard in self._shards)
+
+    def stats(self):
+        """ Return a dict of hit, miss and eviction counts since creation,
+        plus the current number of entries and bytes. """
+        stats = dict(self._totals)
+        for shard in self._shards:
+            stats['hits'] += shard.hits
+            stats['misses'] += shard.misses
+            stats['evictions'] += shard.evictions
+        stats['entries'] = len(self)
+        stats['bytes'] = self.bytes
+        return stats
@@ -47,6 +47,7 @@ from karl.models.peopledirectory import PeopleReportMailingList
 from karl.models.peopledirectory import PeopleSection
 from karl.models.peopledirectory import PeopleSectionColumn
 from karl.models.peopledirectory import reindex_peopledirectory
+from karl.security.cache import invalidate_acl
 from karl.security.policy import NO_INHERIT
 from karl.utils import find_site
 
@@ -69,6 +70,7 @@ def _update_acl_info(item, info):
     if info['inherit'] == False:
         acl.append(DENY_ALL)
     item.__acl__ = acl
+    invalidate_acl(item)
 
 
 def _section_info(item, request):
@@ -525,6 +527,7 @@ def set_acl(obj, obj_elem):
             raise ParseError("Unrecognized element", e)
         acl.append(ace)
     obj.__acl__ = acl
+    invalidate_acl(obj)
 
 
 def parse_report(people, elem):
@@ -86,10 +86,12 @@ def rename_user(context, old_name, new_name, merge=False, out=None):
 
     content_feed = find_events(context)
     if content_feed:
-        for gen, index, event in content_feed.checked(None, old_name):
+        for gen, index, event in list(content_feed.checked(None, old_name)):
+            changes = {}
             for key, value in event.items():
                 if isinstance(value, basestring):
                     if old_name in value:
-                        event[key] = value.replace(old_name, new_name)
+                        changes[key] = value.replace(old_name, new_name)
                     if new_title and old_title in value:
-                        event[key] = value.replace(old_title, new_title)
+                        changes[key] = value.replace(old_title, new_title)
+            content_feed.update(gen, index, **changes)
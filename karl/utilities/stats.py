@@ -16,6 +16,7 @@ from karl.utils import find_profiles
 from karl.utils import find_tags
 from karl.utils import find_users
 
+from pyramid.traversal import resource_path
 from repoze.lemonade.content import get_content_type
 from repoze.lemonade.content import is_content
 from repoze.workflow import get_workflow
@@ -39,6 +40,15 @@ COMMUNITY_COLUMNS = [
     'percent_engaged',
 ]
 
+# Content counted by collect_community_stats, by column.
+COUNTED_TYPES = [
+    ('wiki_pages', IWikiPage),
+    ('blog_entries', IBlogEntry),
+    ('comments', IComment),
+    ('files', ICommunityFile),
+    ('calendar_events', ICalendarEvent),
+]
+
 def collect_community_stats(context):
     """
     Returns an iterator of dicts where for each community in the site a dict
@@ -64,6 +74,22 @@ def collect_community_stats(context):
         contributed 2 items or more in the last 30 days.
     """
     now = datetime.datetime.now()
+    catalog = find_catalog(context)
+    family = catalog.family
+
+    # Sets of docids by content type, and created in the last thirty days,
+    # are looked up once for the whole site; each community's counts are
+    # then intersections with the docids under that community.
+    interfaces = catalog['interfaces']
+    type_docids = []
+    for key, iface in COUNTED_TYPES:
+        type_docids.append(
+            (key, interfaces.apply({'query': [iface], 'operator': 'or'})))
+    begin = coarse_datetime_repr(now - THIRTY_DAYS)
+    recent = catalog['creation_date'].apply((begin, None))
+    creators = catalog['creator']._rev_index
+
+    tags = find_tags(context)
     communities = find_communities(context)
     for community in communities.values():
         stats = dict(
@@ -73,47 +99,19 @@ def collect_community_stats(context):
             moderators=len(community.moderator_names),
             last_activity=community.content_modified,
             create_date=community.created,
-            wiki_pages=0,
-            blog_entries=0,
-            comments=0,
-            files=0,
-            calendar_events=0,
         )
 
-        active_users = {}
-
-        def count(node):
-            from pyramid.traversal import resource_path
-            if IWikiPage.providedBy(node):
-                stats['wiki_pages'] += 1
-            elif IBlogEntry.providedBy(node):
-                stats['blog_entries'] += 1
-            elif IComment.providedBy(node):
-                stats['comments'] += 1
-            elif ICommunityFile.providedBy(node):
-                stats['files'] += 1
-            elif ICalendarEvent.providedBy(node):
-                stats['calendar_events'] += 1
+        docids = catalog['path'].apply(
+            {'query': resource_path(community), 'include_path': True})
+        for key, docs in type_docids:
+            stats[key] = len(family.IF.intersection(docids, docs))
 
-            created = getattr(node, 'created', None)
-            if created is not None and now - created < THIRTY_DAYS:
-                creator = getattr(node, 'creator', None)
-                if creator is not None:
-                    if creator not in active_users:
-                        active_users[creator] = 1
-                    else:
-                        active_users[creator] += 1
-
-            if hasattr(node, '__getitem__') and hasattr(node, 'values'):
-                for child in node.values():
-                    count(child)
-
-            if hasattr(node, '_p_deactivate'):
-                node._p_deactivate()
-
-        count(community)
+        active_users = {}
+        for docid in family.IF.intersection(docids, recent):
+            creator = creators.get(docid)
+            if creator is not None:
+                active_users[creator] = active_users.get(creator, 0) + 1
 
-        tags = find_tags(context)
         stats['community_tags'] = len(tags.getTags(
             community=community.__name__
         ))
@@ -130,6 +128,9 @@ def collect_community_stats(context):
         else:
             stats['percent_engaged'] = 0
 
+        if hasattr(community, '_p_deactivate'):
+            community._p_deactivate()
+
         yield stats
 
 PROFILE_COLUMNS = [
@@ -171,6 +172,8 @@ def collect_profile_stats(context):
     search = ICatalogSearch(context)
     profiles = find_profiles(context)
     users = find_users(context)
+    tags = find_tags(context)
+    begin = coarse_datetime_repr(datetime.datetime.now() - THIRTY_DAYS)
 
     # Collect community membership
     membership = {}
@@ -210,13 +213,11 @@ def collect_profile_stats(context):
         count, docids, resolver = search(creator=name)
         stats['num_documents'] = count
 
-        begin = coarse_datetime_repr(datetime.datetime.now() - THIRTY_DAYS)
         count, docids, resolver = search(
             creator=name, creation_date=(begin, None),
         )
         stats['documents_this_month'] = count
 
-        tags = find_tags(context)
         stats['num_tags'] = len(tags.getTags(users=(name,)))
 
         yield stats
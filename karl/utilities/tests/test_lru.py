@@ -5,49 +5,171 @@ class LRUCacheTests(unittest.TestCase):
         from karl.utilities.lru import LRUCache
         return LRUCache
 
-    def _makeOne(self, size):
-        return self._getTargetClass()(size)
+    def _makeOne(self, size, **kw):
+        return self._getTargetClass()(size, **kw)
 
     def test_size_lessthan_1(self):
         self.assertRaises(ValueError, self._makeOne, 0)
 
     def test_it(self):
-        cache = self._makeOne(3)
+        cache = self._makeOne(3, shards=1)
         self.assertEqual(cache.get('a'), None)
         cache['a'] = '1'
-        pos, value = cache.data.get('a')
-        self.assertEqual(cache.clock[pos]['ref'], True)
-        self.assertEqual(cache.clock[pos]['key'], 'a')
-        self.assertEqual(value, '1')
         self.assertEqual(cache.get('a'), '1')
-        self.assertEqual(cache.hand, pos+1)
-        pos, value = cache.data.get('a')
-        self.assertEqual(cache.clock[pos]['ref'], True)
-        self.assertEqual(cache.hand, pos+1)
-        self.assertEqual(len(cache.data), 1)
+        self.assertEqual(len(cache), 1)
         cache['b'] = '2'
-        pos, value = cache.data.get('b')
-        self.assertEqual(cache.clock[pos]['ref'], True)
-        self.assertEqual(cache.clock[pos]['key'], 'b')
-        self.assertEqual(len(cache.data), 2)
+        self.assertEqual(len(cache), 2)
         cache['c'] = '3'
-        pos, value = cache.data.get('c')
-        self.assertEqual(cache.clock[pos]['ref'], True)
-        self.assertEqual(cache.clock[pos]['key'], 'c')
-        self.assertEqual(len(cache.data), 3)
-        pos, value = cache.data.get('a')
-        self.assertEqual(cache.clock[pos]['ref'], True)
+        self.assertEqual(len(cache), 3)
         cache.get('a')
         cache['d'] = '4'
-        self.assertEqual(len(cache.data), 3)
-        self.assertEqual(cache.data.get('b'), None)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('b'), None)
         cache['e'] =  '5'
-        self.assertEqual(len(cache.data), 3)
-        self.assertEqual(cache.data.get('c'), None)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get('c'), None)
         self.assertEqual(cache.get('d'), '4')
         self.assertEqual(cache.get('e'), '5')
         self.assertEqual(cache.get('a'), '1')
         self.assertEqual(cache.get('b'), None)
         self.assertEqual(cache.get('c'), None)
-                         
-   
+
+    def test_shards(self):
+        cache = self._makeOne(10, shards=4)
+        self.assertEqual([shard.size for shard in cache._shards],
+                         [3, 3, 2, 2])
+        for i in range(100):
+            cache[i] = i
+        self.assertEqual(len(cache), 10)
+        for shard in cache._shards:
+            self.assertEqual(len(shard.index), shard.size)
+
+    def test_shards_more_than_size(self):
+        cache = self._makeOne(2, shards=8)
+        self.assertEqual(len(cache._shards), 2)
+
+    def test_clear(self):
+        cache = self._makeOne(3)
+        cache['a'] = '1'
+        cache.get('a')
+        shards = cache._shards
+        cache.clear()
+        self.failIf(cache._shards is shards)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_replace_existing_key(self):
+        cache = self._makeOne(3, shards=1)
+        cache['a'] = '1'
+        cache['a'] = '2'
+        self.assertEqual(cache.get('a'), '2')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache._shards[0].keys.count('a'), 1)
+
+    def test_maxbytes_without_sizeof(self):
+        self.assertRaises(ValueError, self._makeOne, 3, maxbytes=10)
+
+    def test_maxbytes(self):
+        cache = self._makeOne(10, maxbytes=10, sizeof=len, shards=1)
+        cache['a'] = 'xxxx'
+        cache['b'] = 'xxxx'
+        self.assertEqual(cache.bytes, 8)
+        cache['c'] = 'xxxx'
+        self.assertEqual(cache.bytes, 8)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('c'), 'xxxx')
+        cache['a'] = 'xx'
+        cache['a'] = 'xxx'
+        self.assertTrue(cache.bytes <= 10)
+        self.assertEqual(cache.get('a'), 'xxx')
+        cache.clear()
+        self.assertEqual(cache.bytes, 0)
+
+    def test_maxbytes_value_too_large(self):
+        cache = self._makeOne(10, maxbytes=10, sizeof=len)
+        cache['a'] = 'x' * 11
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.bytes, 0)
+
+    def test_ttl(self):
+        cache = self._makeOne(3, ttl=10)
+        cache.time = DummyTime(100)
+        cache['a'] = '1'
+        cache.time.now = 109
+        self.assertEqual(cache.get('a'), '1')
+        cache.time.now = 110
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+        cache['a'] = '2'
+        self.assertEqual(cache.get('a'), '2')
+
+    def test_stats(self):
+        cache = self._makeOne(1)
+        cache.get('a')
+        cache['a'] = '1'
+        cache.get('a')
+        cache['b'] = '2'
+        self.assertEqual(cache.stats(),
+                         {'hits': 1, 'misses': 1, 'evictions': 1,
+                          'entries': 1, 'bytes': 0})
+
+    def test_statsd(self):
+        from perfmetrics import set_statsd_client
+        client = DummyStatsdClient()
+        set_statsd_client(client)
+        try:
+            cache = self._makeOne(1, name='karl.test')
+            cache.time = DummyTime(100)
+            cache.get('a')
+            cache['a'] = '1'
+            cache.get('a')
+            cache['b'] = '2'
+            cache.get('b')
+            self.assertEqual(client.incremented, [('karl.test.misses', 1)])
+            cache.time.now = 110
+            cache.get('b')
+            cache.time.now = 115
+            cache.get('c')
+            unnamed = self._makeOne(1)
+            unnamed.get('a')
+        finally:
+            set_statsd_client(None)
+        self.assertEqual(client.incremented,
+                         [('karl.test.misses', 1),
+                          ('karl.test.hits', 3),
+                          ('karl.test.evictions', 1)])
+
+    def test_report(self):
+        from perfmetrics import set_statsd_client
+        client = DummyStatsdClient()
+        set_statsd_client(client)
+        try:
+            cache = self._makeOne(1, name='karl.test')
+            cache.time = DummyTime(100)
+            cache.report()
+            cache.get('a')
+            cache.get('a')
+            cache.report()
+            cache.report()
+        finally:
+            set_statsd_client(None)
+        self.assertEqual(client.incremented, [('karl.test.misses', 2)])
+
+
+class DummyTime(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class DummyStatsdClient(object):
+    def __init__(self):
+        self.incremented = []
+
+    def incr(self, stat, count=1):
+        self.incremented.append((stat, count))
@@ -92,8 +92,37 @@ class TestCommunityStats(unittest.TestCase):
 
         registerDummyWorkflow('security', DummyWorkflow())
 
+        site.catalog = self._mk_catalog(site)
         return site
 
+    def _mk_catalog(self, site):
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from repoze.catalog.indexes.keyword import CatalogKeywordIndex
+        from repoze.catalog.indexes.path2 import CatalogPathIndex2
+        from karl.models.catalog import CachingCatalog
+        from karl.models.catalog import GranularIndex
+        from karl.models.site import get_acl
+        from karl.models.site import get_creation_date
+        from karl.models.site import get_creator
+        from karl.models.site import get_interfaces
+        from karl.models.site import get_path
+
+        catalog = CachingCatalog()
+        catalog['path'] = CatalogPathIndex2(get_path,
+                                            attr_discriminator=get_acl)
+        catalog['interfaces'] = CatalogKeywordIndex(get_interfaces)
+        catalog['creation_date'] = GranularIndex(get_creation_date)
+        catalog['creator'] = CatalogFieldIndex(get_creator)
+
+        docids = iter(range(1, 100))
+        def index(node):
+            catalog.index_doc(docids.next(), node)
+            for child in node.values():
+                index(child)
+        for community in site['communities'].values():
+            index(community)
+        return catalog
+
     def test_it(self):
         import datetime
         report = list(self._call_fut(self._mk_dummy_site()))
@@ -0,0 +1,83 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class Test_zip_stream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _callFUT(self, entries, chunk_size=4):
+        from karl.utilities.zipstream import zip_stream
+        return zip_stream(entries, chunk_size)
+
+    def _makeEntry(self, path, data, compress=True, modified=None):
+        from karl.utilities.zipstream import ZipEntry
+        filename = os.path.join(self.tmpdir, str(len(os.listdir(self.tmpdir))))
+        f = open(filename, 'wb')
+        f.write(data)
+        f.close()
+        return ZipEntry(path, filename, modified, compress)
+
+    def _read(self, chunks):
+        from StringIO import StringIO
+        from zipfile import ZipFile
+        zipfile = ZipFile(StringIO(''.join(chunks)))
+        self.assertEqual(zipfile.testzip(), None)
+        return zipfile
+
+    def test_empty(self):
+        zipfile = self._read(self._callFUT([]))
+        self.assertEqual(zipfile.namelist(), [])
+
+    def test_it(self):
+        from zipfile import ZIP_DEFLATED
+        from zipfile import ZIP_STORED
+        modified = datetime.datetime(2012, 3, 4, 5, 6, 7)
+        entries = [
+            self._makeEntry('a.txt', 'abc' * 100, modified=modified),
+            self._makeEntry('folder/b.jpg', 'jpeg data', compress=False),
+            self._makeEntry('folder/empty', ''),
+        ]
+        zipfile = self._read(self._callFUT(entries))
+        self.assertEqual(zipfile.namelist(),
+                         ['a.txt', 'folder/b.jpg', 'folder/empty'])
+        self.assertEqual(zipfile.read('a.txt'), 'abc' * 100)
+        self.assertEqual(zipfile.read('folder/b.jpg'), 'jpeg data')
+        self.assertEqual(zipfile.read('folder/empty'), '')
+        a, b, empty = zipfile.infolist()
+        self.assertEqual(a.compress_type, ZIP_DEFLATED)
+        self.failUnless(a.compress_size < a.file_size)
+        self.assertEqual(a.date_time, (2012, 3, 4, 5, 6, 6))
+        self.assertEqual(b.compress_type, ZIP_STORED)
+        self.assertEqual(b.date_time, (1980, 1, 1, 0, 0, 0))
+
+    def test_unicode_name(self):
+        entries = [self._makeEntry(u'caf\xe9.txt', 'data')]
+        zipfile = self._read(self._callFUT(entries))
+        self.assertEqual(zipfile.namelist(), [u'caf\xe9.txt'])
+
+    def test_reads_lazily(self):
+        entries = [self._makeEntry('a.txt', 'a'), self._makeEntry('b.txt', 'b')]
+        os.remove(entries[1].filename)
+        chunks = self._callFUT(entries)
+        chunks.next()
+        chunks.next()
+        self.assertRaises(IOError, list, chunks)
+
+    def test_too_large(self):
+        from zipfile import LargeZipFile
+        import karl.utilities.zipstream as module
+        entries = [self._makeEntry('a.txt', 'abc' * 100, compress=False)]
+        saved = module.ZIP_LIMIT
+        module.ZIP_LIMIT = 100
+        try:
+            self.assertRaises(LargeZipFile, list, self._callFUT(entries))
+        finally:
+            module.ZIP_LIMIT = saved
@@ -0,0 +1,141 @@
+# Copyright (C) 2008-2009 Open Society Institute
+#               Thomas Moroz: tmoroz@sorosny.org
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License Version 2 as published
+# by the Free Software Foundation.  You may not use, modify or distribute
+# this program under any other version of the GNU General Public License.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+"""Write zip archives as a stream, without seeking back.
+
+``zipfile.ZipFile`` goes back to fill in the sizes and checksum of each
+entry once it has been written, so it needs a seekable file.  Here each
+entry is followed by a data descriptor instead, which lets an archive be
+sent to the client while its files are still being read.
+"""
+
+import struct
+import zlib
+from zipfile import LargeZipFile
+
+CHUNK_SIZE = 1 << 16
+
+# The largest size or offset that fits in a zip file without Zip64.
+ZIP_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+_STORED = 0
+_DEFLATED = 8
+_DATA_DESCRIPTOR = 0x08
+_UTF8_NAME = 0x800
+_VERSION = 20
+
+
+class ZipEntry(object):
+    """ A file to add to a zip archive.
+
+    ``filename`` is the file on disk to read; ``compress`` chooses deflate
+    over storing the data as is.
+    """
+    def __init__(self, path, filename, modified=None, compress=True):
+        self.path = path
+        self.filename = filename
+        self.modified = modified
+        self.compress = compress
+
+
+def zip_stream(entries, chunk_size=CHUNK_SIZE):
+    """ Generate the bytes of a zip archive of ``entries``.
+
+    Each file is read only when the previous one has been sent.  Raises
+    ``zipfile.LargeZipFile`` if the archive would need Zip64.
+    """
+    offset = 0
+    directory = []
+    for entry in entries:
+        name, flags = _encode_name(entry.path)
+        flags |= _DATA_DESCRIPTOR
+        method = entry.compress and _DEFLATED or _STORED
+        dostime, dosdate = _dos_datetime(entry.modified)
+        header = struct.pack('<4sHHHHHLLLHH', 'PK\x03\x04', _VERSION, flags,
+                             method, dostime, dosdate, 0, 0, 0, len(name), 0)
+        header_offset = offset
+        yield header + name
+        offset += len(header) + len(name)
+
+        crc = size = compressed_size = 0
+        compressor = None
+        if method == _DEFLATED:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        f = open(entry.filename, 'rb')
+        try:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                if compressor is not None:
+                    data = compressor.compress(data)
+                    if not data:
+                        continue
+                compressed_size += len(data)
+                yield data
+        finally:
+            f.close()
+        if compressor is not None:
+            data = compressor.flush()
+            compressed_size += len(data)
+            yield data
+        crc &= 0xFFFFFFFF
+
+        if size > ZIP_LIMIT or compressed_size > ZIP_LIMIT:
+            raise LargeZipFile("File %s is too large" % entry.path)
+        descriptor = struct.pack('<4sLLL', 'PK\x07\x08', crc,
+                                 compressed_size, size)
+        yield descriptor
+        offset += compressed_size + len(descriptor)
+        if offset > ZIP_LIMIT:
+            raise LargeZipFile("Zip archive is too large")
+
+        directory.append(struct.pack(
+            '<4sHHHHHHLLLHHHHHLL', 'PK\x01\x02', _VERSION, _VERSION, flags,
+            method, dostime, dosdate, crc, compressed_size, size, len(name),
+            0, 0, 0, 0, 0644 << 16, header_offset) + name)
+
+    if len(directory) > ZIP_MAX_ENTRIES:
+        raise LargeZipFile("Too many files in zip archive")
+    size = 0
+    for record in directory:
+        yield record
+        size += len(record)
+    yield struct.pack('<4sHHHHLLH', 'PK\x05\x06', 0, 0, len(directory),
+                      len(directory), size, offset, 0)
+
+
+def _encode_name(path):
+    if isinstance(path, unicode):
+        try:
+            return path.encode('ascii'), 0
+        except UnicodeEncodeError:
+            return path.encode('utf-8'), _UTF8_NAME
+    return path, 0
+
+
+def _dos_datetime(modified):
+    if modified is None or modified.year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    dostime = (modified.hour << 11) | (modified.minute << 5) | (
+        modified.second // 2)
+    dosdate = ((modified.year - 1980) << 9) | (modified.month << 5) | (
+        modified.day)
+    return dostime, dosdate
@@ -26,6 +26,7 @@ from repoze.lemonade.content import get_content_type
 from repoze.lemonade.content import is_content
 from repoze.workflow import get_workflow
 
+from karl.security.cache import invalidate_acl
 from karl.security.policy import NO_INHERIT
 from karl.security.workflow import get_security_states
 from karl.security.workflow import postorder
@@ -104,6 +105,7 @@ def edit_acl_view(context, request):
     if acl != original_acl:
         context.__custom_acl__ = acl  # added so we can find customized obs later
         context.__acl__ = acl
+        invalidate_acl(context)
         catalog = find_catalog(context)
         # Some objects w/ ACLs may not be indexed in the catalog.  E.g.,
         # People Directory entities.  If not, they won't have 'docid'.
@@ -113,7 +115,7 @@ def edit_acl_view(context, request):
             if allowed is not None:
                 for node in postorder(context):
                     allowed.reindex_doc(node.docid, node)
-                catalog.invalidate()
+                catalog.invalidate('allowed')
 
     workflow = get_context_workflow(context)
     if workflow is not None:
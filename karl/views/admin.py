@@ -37,6 +37,7 @@ from repoze.workflow import get_workflow
 from karl.content.interfaces import IBlogEntry
 from karl.content.interfaces import ICalendarEvent
 from karl.content.interfaces import IWikiPage
+from karl.content.models.extraction import find_extraction_queue
 from karl.models.interfaces import ICatalogSearch
 from karl.models.interfaces import ICommunity
 from karl.models.interfaces import ICommunityContent
@@ -55,6 +56,7 @@ from karl.utilities.mailer import ThreadedGeneratorMailDelivery
 from karl.registration import get_access_request_fields
 
 from karl.utils import asbool
+from karl.utils import find_catalog
 from karl.utils import find_communities
 from karl.utils import find_community
 from karl.utils import find_profiles
@@ -1614,6 +1616,47 @@ def debug_converters(request):
             }
 
 
+def text_extraction_view(request):
+    """
+    Show the files waiting for their text to be extracted, and requeue
+    those whose extraction failed.
+    """
+    context = request.context
+    queue = find_extraction_queue(context)
+
+    if queue is not None and request.method == 'POST':
+        for key in request.POST.keys():
+            if key == 'requeue_all':
+                queue.requeue()
+            elif key.startswith('requeue_'):
+                queue.requeue(int(key.split('_')[1]))
+        return HTTPFound(
+            location=resource_url(context, request, request.view_name)
+        )
+
+    address = find_catalog(context).document_map.address_for_docid
+
+    def jobs(items):
+        return [dict(docid=docid, path=address(docid), attempts=attempts,
+                     time=when and datetime.fromtimestamp(when) or None,
+                     error=error)
+                for docid, (attempts, when, error) in items]
+
+    if queue is None:
+        pending = failed = []
+    else:
+        pending = jobs(queue.pending())
+        failed = jobs(queue.failed())
+
+    return dict(
+        api=AdminTemplateAPI(context, request,
+                             'Admin UI: Text Extraction Queue'),
+        menu=_menu_macro(),
+        pending=pending,
+        failed=failed,
+    )
+
+
 def _send_invite(context, request, invitation):
     mailer = getUtility(IMailDelivery)
     body_template = get_renderer(
@@ -26,12 +26,10 @@ from zope.component import getUtility
 
 from pyramid.decorator import reify
 from pyramid.url import resource_url
-from pyramid.security import effective_principals
 
 from pyramid.location import lineage
 from pyramid.traversal import find_resource
 from pyramid.traversal import resource_path
-from pyramid.security import authenticated_userid
 from pyramid.security import has_permission
 from pyramid.renderers import get_renderer
 
@@ -41,7 +39,7 @@ from karl.application import is_normal_mode
 from karl.consts import countries
 from karl.consts import cultures
 from karl.utils import find_site
-from karl.utils import find_profiles
+from karl.request import get_request_cache
 from karl.utils import get_settings
 from karl.utils import get_setting
 from karl.utils import support_attachments
@@ -94,7 +92,8 @@ class TemplateAPI(object):
         self.site = site = find_site(context)
         self.context = context
         self.request = request
-        self.userid = authenticated_userid(request)
+        self.cache = cache = get_request_cache(request)
+        self.userid = cache.userid
         self.app_url = app_url = request.application_url
         self.profile_url = app_url + '/profiles/%s' % self.userid
         self.here_url = self.context_url = resource_url(context, request)
@@ -121,7 +120,7 @@ class TemplateAPI(object):
             self.static_url = full_static_path
         self.page_title = page_title
         self.system_name = self.title = self.settings.get('title', 'KARL')
-        self.user_is_admin = 'group.KarlAdmin' in effective_principals(request)
+        self.user_is_admin = cache.is_admin
         self.can_administer = has_permission('administer', site, request)
         self.can_email = has_permission('email', site, request)
         self.admin_url = resource_url(site, request, 'admin.html')
@@ -138,8 +137,7 @@ class TemplateAPI(object):
             self.error_message = u'Please correct the indicated errors.'
 
         self.site_announcements = getattr(self.site, "site_announcements", [])
-        profiles = find_profiles(self.site)
-        profile = profiles is not None and profiles.get(self.userid, None) or None
+        profile = cache.current_profile(site)
         self.unseen_site_announcements = []
         if profile is not None and hasattr(profile, "_seen_announcements") \
                 and hasattr(site, "site_announcements"):
@@ -182,7 +180,7 @@ class TemplateAPI(object):
 
     @reify
     def user_is_staff(self):
-        return 'group.KarlStaff' in effective_principals(self.request)
+        return self.cache.is_staff
 
     @property
     def should_show_calendar_tab(self):
@@ -223,7 +221,7 @@ class TemplateAPI(object):
             if community is not None:
                 community_path = resource_path(community)
                 search = getAdapter(self.context, ICatalogSearch)
-                principals = effective_principals(self.request)
+                principals = self.cache.principals
                 self._recent_items = []
                 num, docids, resolver = search(
                     limit=10,
@@ -17,7 +17,10 @@
 
 """Catalog results batching functions"""
 
+import base64
 import datetime
+import heapq
+import json
 
 from itertools import islice
 
@@ -25,8 +28,12 @@ from pyramid.security import has_permission
 from pyramid.url import resource_url
 from pyramid.url import urlencode
 from karl.models.interfaces import ICatalogSearch
+from karl.request import get_request_cache
 from karl.utils import find_catalog
 
+_marker = object()
+_KEY_TYPES = ((int, long, float), (str, unicode))
+
 
 def get_catalog_batch(context, request, **kw):
     batch_start = kw.pop('batch_start', 0)
@@ -38,6 +45,8 @@ def get_catalog_batch(context, request, **kw):
     sort_index = request.params.get('sort_index', sort_index)
     reverse = kw.pop('reverse', False)
     reverse = bool(int(request.params.get('reverse', reverse)))
+    batch_cursor = kw.pop('batch_cursor', None)
+    batch_cursor = request.params.get('batch_cursor', batch_cursor)
 
     # XXX Asserting a default 'modified' sort order here is
     # fragrant.  It's unclear which callers depend on the behavior
@@ -46,6 +55,13 @@ def get_catalog_batch(context, request, **kw):
     # instead of embedding this policy here.
     if sort_index is None:
         sort_index = 'modified_date'
+
+    if batch_cursor is not None:
+        info = _get_keyset_batch(context, request, kw, batch_cursor,
+                                 batch_size, sort_index, reverse)
+        if info is not None:
+            return info
+
     kw['sort_index'] = sort_index
     # the reverse parameter is only useful when there's a sort index
     kw['reverse'] = reverse
@@ -63,11 +79,8 @@ def get_catalog_batch(context, request, **kw):
     if total < batch_start:
         batch_start = total
 
-    # Lazily slice a lazy generator for getting models from result set
-    docs = (model for model in
-            (resolver(docid) for docid in docids)
-            if model is not None)
-    batch = list(islice(docs, batch_start, batch_start + batch_size))
+    batch = _resolve_batch(resolver, docids, batch_start, batch_size,
+                           _batch_principals(request, kw))
     batch_end = batch_start + len(batch)
 
     info = {
@@ -84,6 +97,222 @@ def get_catalog_batch(context, request, **kw):
     return info
 
 
+def _batch_principals(request, kw):
+    """ The principals to filter a batch by, or None.
+
+    Only a query filtered by permission has its batches filtered too;
+    otherwise the total would count items the batches leave out.
+    """
+    if 'allowed' in kw:
+        return get_request_cache(request).principals
+    return None
+
+
+def _resolve_batch(resolver, docids, batch_start, batch_size,
+                   principals=None):
+    """ Resolve the models of one batch, skipping any that are missing.
+
+    Resolvers with a ``resolve_many`` method resolve the batch in bulk,
+    skipping without loading them the models none of ``principals`` may
+    view; for others each docid is resolved in turn.
+    """
+    resolve_many = getattr(resolver, 'resolve_many', None)
+    if resolve_many is None:
+        # Lazily slice a lazy generator for getting models from result set
+        docs = (model for model in
+                (resolver(docid) for docid in docids)
+                if model is not None)
+        return list(islice(docs, batch_start, batch_start + batch_size))
+
+    docids = islice(docids, batch_start, None)
+    batch = []
+    while len(batch) < batch_size:
+        # Top up the batch if some of the docids were missing.
+        chunk = list(islice(docids, batch_size - len(batch)))
+        if not chunk:
+            break
+        batch.extend(model for model in resolve_many(chunk, principals)
+                     if model is not None)
+    return batch
+
+
+def _get_keyset_batch(context, request, kw, batch_cursor, batch_size,
+                      sort_index, reverse):
+    """ Batch by position in the sort order rather than by offset.
+
+    ``batch_cursor`` is empty for the first batch, or the ``next_cursor``
+    of the previous batch: the sort value, docid and batch end of its last
+    item.  A large result is batched by walking the sort index from the
+    cursor until the batch is full; a small one by ranking its own sort
+    values.  Only the batch itself is resolved, so deep batches cost no
+    more than the first.
+
+    Returns None if the sort index or the query cannot be batched this
+    way, in which case the caller falls back to ``batch_start``.
+    """
+    catalog = find_catalog(context)
+    if catalog is None or sort_index in kw:
+        return None
+    index = catalog.get(sort_index)
+    fwd_index = getattr(index, '_fwd_index', None)
+    rev_index = getattr(index, '_rev_index', None)
+    if (fwd_index is None or rev_index is None or
+        getattr(index, 'sort', None) is None):
+        return None
+
+    cursor = None
+    batch_start = 0
+    if batch_cursor:
+        cursor = decode_batch_cursor(batch_cursor)
+        if cursor is None:
+            return None
+        value, last_docid, batch_start = cursor
+        if not _same_key_type(value, fwd_index):
+            # A stale or forged cursor; the index can't be searched with it.
+            return None
+        cursor = value, last_docid
+
+    searcher = ICatalogSearch(context)
+    numdocs, docids, resolver = searcher(**kw)
+    total = getattr(numdocs, 'total', numdocs)
+
+    family = catalog.family
+    if not isinstance(docids, (family.IF.Set, family.IF.TreeSet)):
+        docids = family.IF.Set(docids)
+
+    # One more than the batch, to tell whether there is a next batch.
+    limit = batch_size + 1
+    # Walking the sort index visits about limit * indexed / len(docids)
+    # entries to fill the batch; ranking visits each of the docids.
+    if len(docids) ** 2 > limit * index.documentCount():
+        ranked = list(islice(
+            _walk_sort_index(fwd_index, docids, cursor, reverse), limit))
+    else:
+        ranked = _rank_docids(rev_index, docids, cursor, reverse, limit)
+    next_cursor = None
+    if len(ranked) > batch_size:
+        del ranked[batch_size:]
+        value, docid = ranked[-1]
+        next_cursor = encode_batch_cursor(
+            (value, docid, batch_start + batch_size))
+
+    batch = _resolve_batch(
+        resolver, [docid for value, docid in ranked], 0, batch_size,
+        _batch_principals(request, kw))
+
+    info = {
+        'entries': batch,
+        'batch_start': batch_start,
+        'batch_size': batch_size,
+        'batch_end': batch_start + len(ranked),
+        'total': total,
+        'sort_index': sort_index,
+        'reverse': reverse,
+        'batch_cursor': batch_cursor,
+        'next_cursor': next_cursor,
+        }
+
+    _add_link_data(info, context, request)
+    return info
+
+
+def _walk_sort_index(fwd_index, docids, cursor, reverse):
+    """ Generate the (sort value, docid) pairs of ``docids`` past
+    ``cursor``, in sort order.
+
+    The docid breaks ties, so that every item has a unique position for
+    the cursor.
+    """
+    if cursor is None:
+        values = fwd_index.keys()
+    elif reverse:
+        values = fwd_index.keys(max=cursor[0])
+    else:
+        values = fwd_index.keys(min=cursor[0])
+    if reverse:
+        values = reversed(values)
+    for value in values:
+        value_docids = fwd_index[value]
+        if cursor is not None and value == cursor[0]:
+            if reverse:
+                value_docids = value_docids.keys(
+                    max=cursor[1], excludemax=True)
+            else:
+                value_docids = value_docids.keys(
+                    min=cursor[1], excludemin=True)
+        else:
+            value_docids = value_docids.keys()
+        if reverse:
+            value_docids = reversed(value_docids)
+        for docid in value_docids:
+            if docid in docids:
+                yield value, docid
+
+
+def _same_key_type(value, fwd_index):
+    """ Can ``value`` be compared with the keys of ``fwd_index``? """
+    if not fwd_index:
+        return True
+    key = fwd_index.minKey()
+    for types in _KEY_TYPES:
+        if isinstance(key, types):
+            return isinstance(value, types)
+    return type(value) is type(key)
+
+
+def _rank_docids(rev_index, docids, cursor, reverse, limit):
+    """ Return the first ``limit`` (sort value, docid) pairs of ``docids``
+    past ``cursor``, in sort order.
+    """
+    keys = []
+    for docid in docids:
+        value = rev_index.get(docid, _marker)
+        if value is _marker:
+            continue
+        key = value, docid
+        if cursor is not None:
+            if reverse and not key < cursor:
+                continue
+            if not reverse and not key > cursor:
+                continue
+        keys.append(key)
+    if reverse:
+        return heapq.nlargest(limit, keys)
+    return heapq.nsmallest(limit, keys)
+
+
+def encode_batch_cursor(key):
+    """ Encode a (sort value, docid, batch start) triple for use in a URL.
+
+    Returns None for sort values which cannot be represented in JSON.
+    """
+    try:
+        data = json.dumps(list(key))
+    except TypeError:
+        return None
+    return base64.urlsafe_b64encode(data)
+
+
+def decode_batch_cursor(batch_cursor):
+    """ Decode a cursor made by ``encode_batch_cursor``.
+
+    Returns None if the cursor is malformed.
+    """
+    try:
+        value, docid, batch_start = json.loads(
+            base64.urlsafe_b64decode(str(batch_cursor)))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(docid, int) or not isinstance(batch_start, int):
+        return None
+    if isinstance(value, unicode):
+        try:
+            value = str(value)
+        except UnicodeEncodeError:
+            pass
+    return value, docid, batch_start
+
+
 def _add_link_data(batch_info, context, request):
     """
     Add previous_batch, next_batch, and batching_required to batch info.
@@ -92,8 +321,13 @@ def _add_link_data(batch_info, context, request):
     batch_size = batch_info['batch_size']
     total = batch_info['total']
 
-    def batchURL(newquery, batch_start=0):
-        newquery['batch_start'] = batch_start
+    def batchURL(newquery, batch_start=0, batch_cursor=None):
+        if batch_cursor is None:
+            newquery.pop('batch_cursor', None)
+            newquery['batch_start'] = batch_start
+        else:
+            newquery.pop('batch_start', None)
+            newquery['batch_cursor'] = batch_cursor
         newquery['batch_size'] = batch_size
         if batch_info.get('sort_index'):
             newquery['sort_index'] = batch_info['sort_index']
@@ -123,7 +357,8 @@ def _add_link_data(batch_info, context, request):
         size = next_end - next_start
         next_batch_info = {}
         query = dict(request.GET)
-        next_batch_info['url'] = batchURL(query, next_start)
+        next_batch_info['url'] = batchURL(
+            query, next_start, batch_info.get('next_cursor'))
         next_batch_info['name'] = (
             'Next %s entries (%s - %s of about %s)' % (size,
                                                        next_start+1,
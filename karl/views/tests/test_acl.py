@@ -394,7 +394,7 @@ class Test_edit_acl_view(unittest.TestCase):
         self._callFUT(context, request)
 
         self.assertEqual(index._reindexed, (1, context))
-        self.failUnless(catalog._invalidated)
+        self.assertEqual(catalog._invalidated, ('allowed',))
 
     def test_submitted_not_at_root_reindexes_acl(self):
         karl.testing.registerDummyRenderer('templates/edit_acl.pt')
@@ -414,7 +414,7 @@ class Test_edit_acl_view(unittest.TestCase):
         self._callFUT(context, request)
 
         self.assertEqual(index._reindexed, (1, context))
-        self.failUnless(catalog._invalidated)
+        self.assertEqual(catalog._invalidated, ('allowed',))
 
     def test_submitted_sets___custom_acl__(self):
         karl.testing.registerDummyRenderer('templates/edit_acl.pt')
@@ -451,7 +451,7 @@ class Test_edit_acl_view(unittest.TestCase):
         self._callFUT(context, request)
 
         self.assertEqual(index._reindexed, (1, context), (2, child))
-        self.failUnless(catalog._invalidated)
+        self.assertEqual(catalog._invalidated, ('allowed',))
 
     def test_submitted_no_docid_no_indexing(self):
         karl.testing.registerDummyRenderer('templates/edit_acl.pt')
@@ -638,8 +638,8 @@ class Test_acl_tree_view(unittest.TestCase):
 class DummyCatalog(dict):
     _invalidated = False
 
-    def invalidate(self):
-        self._invalidated = True
+    def invalidate(self, *names):
+        self._invalidated = names
 
 class DummyIndex:
     _reindexed = None
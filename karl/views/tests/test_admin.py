@@ -1537,6 +1537,72 @@ class Test_debug_converters(unittest.TestCase):
                            'available': 'yes'}])
 
 
+class Test_text_extraction_view(unittest.TestCase):
+
+    def setUp(self):
+        testing.cleanUp()
+        karltesting.registerDummyRenderer('karl.views:templates/admin/menu.pt')
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _call_fut(self, request):
+        from karl.views.admin import text_extraction_view
+        return text_extraction_view(request)
+
+    def _make_request(self, queue=None, post=None):
+        context = testing.DummyModel()
+        context.catalog = karltesting.DummyCatalog({1: '/file1', 2: '/file2'})
+        if queue is not None:
+            context.text_extraction_queue = queue
+        if post is not None:
+            request = testing.DummyRequest(post=post)
+        else:
+            request = testing.DummyRequest()
+        request.context = context
+        request.view_name = 'text_extraction.html'
+        return request
+
+    def test_wo_queue(self):
+        info = self._call_fut(self._make_request())
+        self.assertEqual(info['pending'], [])
+        self.assertEqual(info['failed'], [])
+
+    def test_w_queue(self):
+        from karl.content.models.extraction import TextExtractionQueue
+        queue = TextExtractionQueue()
+        queue.add(1)
+        queue.add(2)
+        for i in range(5):
+            queue.retry_later(2, 'Error', 1000)
+        info = self._call_fut(self._make_request(queue))
+        self.assertEqual(info['pending'],
+                         [{'docid': 1, 'path': '/file1', 'attempts': 0,
+                           'time': None, 'error': None}])
+        failed = info['failed']
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['path'], '/file2')
+        self.assertEqual(failed[0]['attempts'], 5)
+        self.assertEqual(failed[0]['error'], 'Error')
+
+    def test_requeue(self):
+        from karl.content.models.extraction import TextExtractionQueue
+        queue = TextExtractionQueue()
+        for docid in (1, 2):
+            queue.add(docid)
+            for i in range(5):
+                queue.retry_later(docid, 'Error', 1000)
+        response = self._call_fut(
+            self._make_request(queue, post={'requeue_2': 'Requeue'}))
+        self.assertEqual(response.location,
+                         'http://example.com/text_extraction.html')
+        self.assertEqual([docid for docid, job in queue.pending()], [2])
+        self._call_fut(
+            self._make_request(queue, post={'requeue_all': 'Requeue All'}))
+        self.assertEqual([docid for docid, job in queue.pending()], [1, 2])
+        self.assertEqual(list(queue.failed()), [])
+
+
 class DummyProfiles(testing.DummyModel):
 
     def __setitem__(self, name, other):
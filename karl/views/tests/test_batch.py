@@ -225,6 +225,290 @@ class TestGetCatalogBatch(unittest.TestCase):
         self.assertEqual(info['batching_required'], True)
 
 
+    def test_resolve_many(self):
+        from zope.interface import Interface
+        from karl.models.interfaces import ICatalogSearch
+        chunks = []
+        class DummyResolver:
+            def resolve_many(self, docids, principals=None):
+                chunks.append(docids)
+                return [docid % 2 and docid or None for docid in docids]
+        def dummy_catalog_search(context):
+            def search(**kw):
+                return 10, range(10), DummyResolver()
+            return search
+        karl.testing.registerAdapter(dummy_catalog_search, (Interface),
+                                     ICatalogSearch)
+        context = testing.DummyModel()
+        request = testing.DummyRequest(
+            params=dict(batch_start='2', batch_size='3'))
+        info = self._callFUT(context, request)
+        self.assertEqual(info['entries'], [3, 5, 7])
+        self.assertEqual(chunks, [[2, 3, 4], [5, 6], [7]])
+
+    def test_resolve_many_principals(self):
+        from zope.interface import Interface
+        from karl.models.interfaces import ICatalogSearch
+        passed = []
+        class DummyResolver:
+            def resolve_many(self, docids, principals=None):
+                passed.append(principals)
+                return docids
+        def dummy_catalog_search(context):
+            def search(**kw):
+                return 2, [1, 2], DummyResolver()
+            return search
+        karl.testing.registerAdapter(dummy_catalog_search, (Interface),
+                                     ICatalogSearch)
+        karl.testing.registerDummySecurityPolicy('fred', ['group.a'])
+        context = testing.DummyModel()
+        self._callFUT(context, testing.DummyRequest())
+        self._callFUT(context, testing.DummyRequest(),
+                      allowed={'query': ['fred'], 'operator': 'or'})
+        self.assertEqual(passed[0], None)
+        self.failUnless('group.a' in passed[1])
+
+    def test_resolve_many_allowed_query(self):
+        from repoze.catalog import Range
+        from repoze.catalog.catalog import Catalog
+        from repoze.catalog.document import DocumentMap
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from repoze.catalog.indexes.keyword import CatalogKeywordIndex
+        from zope.interface import Interface
+        from zope.interface import directlyProvides
+        from karl.models.adapters import CatalogSearch
+        from karl.models.interfaces import ICatalogSearch
+        from karl.models.interfaces import ISite
+        karl.testing.registerAdapter(CatalogSearch, (Interface),
+                                     ICatalogSearch)
+        karl.testing.registerDummySecurityPolicy('fred', ['group.a'])
+        site = testing.DummyModel()
+        directlyProvides(site, ISite)
+        site.catalog = catalog = Catalog()
+        catalog.document_map = DocumentMap()
+        catalog['name'] = CatalogFieldIndex(
+            lambda obj, default: obj.__name__)
+        catalog['allowed'] = CatalogKeywordIndex(
+            lambda obj, default: obj.allowed)
+        for name, allowed in (('a', ['fred']), ('b', ['group.b']),
+                              ('c', ['group.a'])):
+            site[name] = doc = testing.DummyModel(allowed=allowed)
+            docid = catalog.document_map.add('/' + name)
+            catalog.index_doc(docid, doc)
+        request = testing.DummyRequest()
+        info = self._callFUT(site, request, sort_index='name',
+                             name={'query': Range('a', 'z')})
+        self.assertEqual(info['total'], 3)
+        self.assertEqual(info['entries'], [site['a'], site['b'], site['c']])
+        info = self._callFUT(site, request, sort_index='name',
+                             name={'query': Range('a', 'z')},
+                             allowed={'query': ['fred', 'group.a'],
+                                      'operator': 'or'})
+        self.assertEqual(info['total'], 2)
+        self.assertEqual(info['entries'], [site['a'], site['c']])
+
+
+class TestGetCatalogBatchKeyset(unittest.TestCase):
+    titles = {1: 'b', 2: 'a', 3: 'c', 4: 'b', 5: 'e', 6: 'd', 7: 'b'}
+
+    def setUp(self):
+        testing.cleanUp()
+
+    def tearDown(self):
+        testing.cleanUp()
+
+    def _callFUT(self, context, request, **kw):
+        from karl.views.batch import get_catalog_batch
+        return get_catalog_batch(context, request, **kw)
+
+    def _makeSite(self):
+        from zope.interface import directlyProvides
+        from repoze.catalog.catalog import Catalog
+        from repoze.catalog.indexes.field import CatalogFieldIndex
+        from karl.models.interfaces import ISite
+        site = testing.DummyModel()
+        directlyProvides(site, ISite)
+        site.catalog = catalog = Catalog()
+        catalog['title'] = CatalogFieldIndex(lambda obj, default: obj)
+        for docid, title in self.titles.items():
+            catalog.index_doc(docid, title)
+        return site
+
+    def _register(self, docids=None):
+        from zope.interface import Interface
+        from karl.models.interfaces import ICatalogSearch
+        searches = []
+        if docids is None:
+            docids = sorted(self.titles)
+        def dummy_catalog_search(context):
+            def resolver(docid):
+                return docid
+            def search(**kw):
+                searches.append(kw)
+                return len(docids), docids, resolver
+            return search
+        karl.testing.registerAdapter(dummy_catalog_search, (Interface),
+                                     ICatalogSearch)
+        return searches
+
+    def _pages(self, site, **params):
+        pages = []
+        params['batch_cursor'] = ''
+        while params['batch_cursor'] is not None:
+            request = testing.DummyRequest(params=params)
+            info = self._callFUT(site, request, sort_index='title')
+            pages.append(info['entries'])
+            params['batch_cursor'] = info['next_cursor']
+        return pages
+
+    def test_forward(self):
+        site = self._makeSite()
+        searches = self._register()
+        pages = self._pages(site, batch_size='3')
+        self.assertEqual(pages, [[2, 1, 4], [7, 3, 6], [5]])
+        self.assertEqual(searches, [{}, {}, {}])
+
+    def test_reverse(self):
+        site = self._makeSite()
+        self._register()
+        pages = self._pages(site, batch_size='3', reverse='1')
+        self.assertEqual(pages, [[5, 6, 3], [7, 4, 1], [2]])
+
+    def test_filtered(self):
+        site = self._makeSite()
+        self._register([1, 3, 5, 6])
+        pages = self._pages(site, batch_size='2')
+        self.assertEqual(pages, [[1, 3], [6, 5]])
+        pages = self._pages(site, batch_size='2', reverse='1')
+        self.assertEqual(pages, [[5, 6], [3, 1]])
+
+    def test_walks_only_the_batch(self):
+        from BTrees.OOBTree import OOBTree
+        site = self._makeSite()
+        self._register()
+        fetched = []
+        class CountingTree(OOBTree):
+            def __getitem__(self, key):
+                fetched.append(key)
+                return OOBTree.__getitem__(self, key)
+        index = site.catalog['title']
+        index._fwd_index = CountingTree(index._fwd_index)
+        request = testing.DummyRequest(
+            params=dict(batch_cursor='', batch_size='2'))
+        info = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(info['entries'], [2, 1])
+        self.assertEqual(fetched, ['a', 'b'])
+        del fetched[:]
+        request = testing.DummyRequest(
+            params=dict(batch_cursor=info['next_cursor'], batch_size='2'))
+        info = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(info['entries'], [4, 7])
+        self.assertEqual(info['batch_start'], 2)
+        self.assertEqual(fetched, ['b', 'c'])
+
+    def test_small_result_skips_walk(self):
+        from BTrees.OOBTree import OOBTree
+        site = self._makeSite()
+        self._register([3, 5])
+        fetched = []
+        class CountingTree(OOBTree):
+            def __getitem__(self, key):
+                fetched.append(key)
+                return OOBTree.__getitem__(self, key)
+        index = site.catalog['title']
+        index._fwd_index = CountingTree(index._fwd_index)
+        pages = self._pages(site, batch_size='1')
+        self.assertEqual(pages, [[3], [5]])
+        self.assertEqual(fetched, [])
+
+    def test_info_and_links(self):
+        import urlparse
+        from cgi import parse_qs
+        from karl.views.batch import decode_batch_cursor
+        site = self._makeSite()
+        self._register()
+        request = testing.DummyRequest(
+            params=dict(batch_cursor='', batch_size='3'))
+        first = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(decode_batch_cursor(first['next_cursor']),
+                         ('b', 4, 3))
+        request = testing.DummyRequest(
+            params=dict(batch_cursor=first['next_cursor'], batch_size='3'))
+        info = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(info['batch_start'], 3)
+        self.assertEqual(info['batch_end'], 6)
+        self.assertEqual(info['total'], 7)
+        next_query = parse_qs(urlparse.urlparse(
+            info['next_batch']['url']).query)
+        self.assertEqual(next_query['batch_cursor'], [info['next_cursor']])
+        self.failIf('batch_start' in next_query)
+        previous_query = parse_qs(urlparse.urlparse(
+            info['previous_batch']['url']).query)
+        self.assertEqual(previous_query['batch_start'], ['0'])
+        self.failIf('batch_cursor' in previous_query)
+
+    def test_bad_cursor_falls_back_to_batch_start(self):
+        site = self._makeSite()
+        searches = self._register()
+        request = testing.DummyRequest(
+            params=dict(batch_cursor='garbage', batch_size='3'))
+        info = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(info['entries'], [1, 2, 3])
+        self.assertEqual(searches[0]['limit'], 3)
+        self.failIf('next_cursor' in info)
+
+    def test_cursor_of_wrong_type_falls_back_to_batch_start(self):
+        from BTrees.IOBTree import IOBTree
+        from karl.views.batch import encode_batch_cursor
+        site = self._makeSite()
+        index = site.catalog['title']
+        index._fwd_index = IOBTree([(1, index._fwd_index['a'])])
+        searches = self._register()
+        request = testing.DummyRequest(params=dict(
+            batch_cursor=encode_batch_cursor(('b', 4, 3)), batch_size='3'))
+        info = self._callFUT(site, request, sort_index='title')
+        self.assertEqual(info['entries'], [1, 2, 3])
+        self.assertEqual(searches[0]['limit'], 3)
+        self.failIf('next_cursor' in info)
+
+    def test_unsortable_index_falls_back_to_batch_start(self):
+        from zope.interface import directlyProvides
+        from karl.models.interfaces import ISite
+        site = testing.DummyModel()
+        directlyProvides(site, ISite)
+        site.catalog = {'title': DummyCreationDateIndex()}
+        searches = self._register()
+        request = testing.DummyRequest(params=dict(batch_cursor=''))
+        self._callFUT(site, request, sort_index='title')
+        self.assertEqual(searches[0]['sort_index'], 'title')
+
+
+class Test_batch_cursor(unittest.TestCase):
+    def test_roundtrip(self):
+        from karl.views.batch import decode_batch_cursor
+        from karl.views.batch import encode_batch_cursor
+        for key in [(1234, 5, 0), ('title', 6, 20), (u'\xe9t\xe9', 7, 40)]:
+            self.assertEqual(decode_batch_cursor(encode_batch_cursor(key)),
+                             key)
+
+    def test_unencodable(self):
+        import datetime
+        from karl.views.batch import encode_batch_cursor
+        self.assertEqual(
+            encode_batch_cursor((datetime.datetime.now(), 1, 0)), None)
+
+    def test_malformed(self):
+        import base64
+        from karl.views.batch import decode_batch_cursor
+        self.assertEqual(decode_batch_cursor('!!'), None)
+        self.assertEqual(
+            decode_batch_cursor(base64.urlsafe_b64encode('["a", 1]')),
+            None)
+        self.assertEqual(
+            decode_batch_cursor(base64.urlsafe_b64encode('["a", "b", 0]')),
+            None)
+
+
 class TestGetCatalogBatchGrid(unittest.TestCase):
     def setUp(self):
         testing.cleanUp()
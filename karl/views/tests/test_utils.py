@@ -618,6 +618,86 @@ class TestFormatMailtoHref(unittest.TestCase):
             )
 
 
+class Test_blob_etag(unittest.TestCase):
+
+    def _callFUT(self, blob):
+        from karl.views.utils import blob_etag
+        return blob_etag(blob)
+
+    def test_committed(self):
+        self.assertEqual(self._callFUT(DummyBlob('data')), '2a-3c5')
+
+    def test_not_committed(self):
+        blob = DummyBlob('data')
+        blob._p_oid = None
+        self.assertEqual(self._callFUT(blob), None)
+
+
+class Test_blob_response(unittest.TestCase):
+
+    def _callFUT(self, blob, **kw):
+        from karl.views.utils import blob_response
+        return blob_response(blob, 'x/foo', len(blob.data), **kw)
+
+    def _get(self, response, **headers):
+        from webob import Request
+        return Request.blank('/', headers=headers).get_response(response)
+
+    def test_it(self):
+        blob = DummyBlob('0123456789')
+        response = self._get(self._callFUT(blob))
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.body, '0123456789')
+        self.assertEqual(response.headers['Content-Type'], 'x/foo')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.etag, '2a-3c5')
+        self.failIf(response.last_modified is None)
+        self.failUnless(response.cache_control.private)
+        self.failUnless(response.cache_control.no_cache)
+
+    def test_not_modified(self):
+        blob = DummyBlob('0123456789')
+        response = self._get(self._callFUT(blob), **{
+            'If-None-Match': '"2a-3c5"'})
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.body, '')
+        self.failUnless(blob.file.closed)
+
+    def test_changed(self):
+        blob = DummyBlob('0123456789')
+        response = self._get(self._callFUT(blob), **{
+            'If-None-Match': '"2a-3c4"'})
+        self.assertEqual(response.status_int, 200)
+
+    def test_range(self):
+        blob = DummyBlob('0123456789')
+        response = self._get(self._callFUT(blob), Range='bytes=3-5')
+        self.assertEqual(response.status_int, 206)
+        self.assertEqual(response.body, '345')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 3-5/10')
+        self.failUnless(blob.file.closed)
+
+    def test_cache_max_age(self):
+        response = self._callFUT(DummyBlob(''), cache_max_age=60,
+                                 headers=[('X-Foo', 'bar')])
+        self.assertEqual(response.cache_control.max_age, 60)
+        self.failIf(response.cache_control.no_cache)
+        self.assertEqual(response.headers['X-Foo'], 'bar')
+
+
+class DummyBlob(object):
+    _p_oid = '\0\0\0\0\0\0\0\x2a'
+    _p_serial = '\0\0\0\0\0\0\x03\xc5'
+
+    def __init__(self, data):
+        self.data = data
+
+    def open(self):
+        from StringIO import StringIO
+        self.file = StringIO(self.data)
+        return self.file
+
+
 class DummyUpload:
     filename = 'test.dat'
     def __init__(self, file, type):
@@ -27,18 +27,23 @@ from os.path import splitext
 
 from zope.interface import alsoProvides
 
+from persistent.TimeStamp import TimeStamp
+from pyramid.response import FileIter
 from pyramid.security import authenticated_userid
 from pyramid.threadlocal import get_current_request
 from pyramid.traversal import traverse
 from repoze.lemonade.content import create_content
+from ZODB.utils import u64
+from ZODB.utils import z64
 
 from karl.utils import find_communities
-from karl.utils import find_profiles
 from karl.utils import find_site
 from karl.utils import find_users
 from karl.utils import get_setting
 from karl.utils import get_egg_rev
 
+from karl.request import get_request_cache
+
 from karl.content.interfaces import ICommunityFile
 from karl.content.interfaces import IPhoto
 
@@ -230,13 +235,12 @@ def _get_user_home_path(context, request):
     """If currently authenticated user has a 'home_path' set, create a response
     redirecting user to that path.  Otherwise return None.
     """
-    userid = authenticated_userid(request)
-    if userid is None:
+    cache = get_request_cache(request)
+    if cache.userid is None:
         return None, None
 
     site = find_site(context)
-    profiles = find_profiles(site)
-    profile =  profiles.get(userid, None)
+    profile = cache.current_profile(site)
     if profile is None:
         return None, None
 
@@ -261,13 +265,11 @@ def _get_user_home_path(context, request):
 def get_user_date_format(context, request):
     default_date_format = get_setting(context, 'date_format', 'en-US')
 
-    userid = authenticated_userid(request)
-    if userid is None:
+    cache = get_request_cache(request)
+    if cache.userid is None:
         return default_date_format
 
-    site = find_site(context)
-    profiles = find_profiles(site)
-    profile = profiles.get(userid, None)
+    profile = cache.current_profile(find_site(context))
     if profile is None:
         return default_date_format
 
@@ -669,6 +671,72 @@ def copy_stream_to_tmpfile_and_iter(stream, blocksize=1<<20):
     return size, stream_iter(f, blocksize)
 
 
+class BlobIter(FileIter):
+    """ Iterate over an open blob file.
+
+    Range requests seek to the start of the range instead of reading
+    through the bytes before it.
+    """
+    def app_iter_range(self, start, stop):
+        self.file.seek(start)
+        return _iter_range(self.file, stop - start, self.block_size)
+
+
+def _iter_range(f, length, blocksize):
+    try:
+        while length > 0:
+            block = f.read(min(length, blocksize))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def blob_etag(blob):
+    """ Return an ETag for a committed blob, made of its oid and the serial
+    of its revision, or None if the blob isn't committed.
+    """
+    activate = getattr(blob, '_p_activate', None)
+    if activate is not None:
+        activate()
+    oid = getattr(blob, '_p_oid', None)
+    serial = getattr(blob, '_p_serial', z64)
+    if oid is None or serial == z64:
+        return None
+    return '%x-%x' % (u64(oid), u64(serial))
+
+
+def blob_response(blob, content_type, size, headers=(), cache_max_age=None):
+    """ Return a response sending the data of ``blob``.
+
+    The response answers conditional requests with 304 Not Modified and
+    range requests with 206 Partial Content, both handled by WebOb.  Browsers
+    revalidate it each time, unless ``cache_max_age`` lets them keep it for
+    that many seconds.
+    """
+    headerlist = [
+        ('Content-Type', content_type),
+        ('Content-Length', str(size)),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    headerlist.extend(headers)
+    response = Response(headerlist=headerlist,
+                        app_iter=BlobIter(blob.open()),
+                        conditional_response=True)
+    etag = blob_etag(blob)
+    if etag is not None:
+        response.etag = etag
+        response.last_modified = TimeStamp(blob._p_serial).timeTime()
+    response.cache_control.private = True
+    if cache_max_age is None:
+        response.cache_control.no_cache = True
+    else:
+        response.cache_control.max_age = cache_max_age
+    return response
+
+
 def format_mailto_href(d):
     # ... We do it ourselves because urlencode uses quote_plus, meaning space -> +
     to = d.pop('to', None)
@@ -14,6 +14,7 @@ from karl.security.policy import MEMBER_PERMS
 from karl.security.policy import CREATE
 from karl.security.policy import VIEW
 from karl.security.policy import NO_INHERIT
+from karl.security.cache import invalidate_acl
 from karl.security.workflow import postorder
 from karl.security.workflow import acl_diff
 from karl.security.workflow import reset_security_workflow
@@ -33,6 +34,7 @@ _marker = object()
 
 
 def _reindex(ob, texts=False):
+    invalidate_acl(ob)
     catalog = find_catalog(ob)
     if catalog is None:
         return  # Will be true for a mailin test trace
@@ -42,12 +44,14 @@ def _reindex(ob, texts=False):
     # code; this is the "old" way of doing security filtering.
     path_index = catalog['path']
     path_index.reindex_doc(ob.docid, ob)
+    invalidate = ['path']
 
     # In some cases changing the workflow state of an object can change its
     # ranking in text search.
     if texts:
         text_index = catalog['texts']
         text_index.reindex_doc(ob.docid, ob)
+        invalidate.append('texts')
 
     # if the object is folderish, we need to reindex it plus all its
     # subobjects' 'allowed' index entries recursively; each object's
@@ -57,6 +61,11 @@ def _reindex(ob, texts=False):
         for node in postorder(ob):
             if hasattr(node, 'docid'):
                 allowed_index.reindex_doc(node.docid, node)
+        invalidate.append('allowed')
+
+    # The indexes were updated directly, bypassing the catalog, so the
+    # catalog's search caches must be told.
+    catalog.invalidate(*invalidate)
 
 
 def _reindex_peopledir(profile):
@@ -147,8 +147,14 @@ setup(name='karl',
       load_peopleconf = karl.scripts.peopleconf:load
       dump_peopleconf = karl.scripts.peopleconf:dump
       reindex_text = karl.scripts.reindex_text:main
+      extract_text = karl.scripts.extract_text:main
+      build_zip_downloads = karl.scripts.build_zip_downloads:main
+      render_thumbnails = karl.scripts.render_thumbnails:main
       reindex_catalog = karl.scripts.reindex_catalog:main
       adduser = karl.scripts.adduser:main
       reindex_peopledir = karl.scripts.reindex_peopledir:main
+      bench_search_cache = karl.scripts.bench_search_cache:main
+      bench_interval_index = karl.scripts.bench_interval_index:main
+      bench_tagging = karl.scripts.bench_tagging:main
       """
       )